@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+Finto Janus SFU per sviluppo e test (solo libreria standard)
+
+Implementa le richieste del plugin videoroom usate da SecureVOX su
+POST /janus/videoroom (create, destroy, list, listparticipants, kick, exists),
+con le stanze in memoria e gli errori nel corpo della risposta come Janus.
+
+Avvio:   python fake_janus_server.py --port 8088 [--delay 0.5]
+         poi JANUS_URL=http://localhost:8088 per il server Django
+
+Nei test:
+    janus = FakeJanusServer(delay=0.2).start()
+    settings.JANUS_SFU['url'] = janus.url
+    ...
+    janus.add_participant(room_id, 1)   # simula un client nella stanza
+    janus.stop()
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import threading
+import time
+
+ERROR_NO_SUCH_ROOM = 426
+ERROR_ROOM_EXISTS = 427
+ERROR_UNAUTHORIZED = 433
+ERROR_INVALID_REQUEST = 499
+
+
+class FakeJanusServer:
+    """Server HTTP in un thread con lo stato delle stanze videoroom"""
+
+    def __init__(self, host='127.0.0.1', port=0, secret=None, delay=0.0):
+        self.secret = secret
+        self.delay = delay
+        self.rooms = {}  # room -> {'description', 'publishers', 'participants': {id: display}}
+        self.requests = []  # richieste ricevute, in ordine (per le verifiche nei test)
+        self.lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='fake-janus', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def add_participant(self, room, participant_id, display=''):
+        with self.lock:
+            self.rooms[room]['participants'][participant_id] = display
+
+    def handle(self, payload):
+        """Esegue una richiesta videoroom e restituisce il corpo della risposta"""
+        request = payload.get('request')
+        with self.lock:
+            self.requests.append(payload)
+            if self.secret is not None and payload.get('secret') != self.secret:
+                return _error(ERROR_UNAUTHORIZED, 'Unauthorized (wrong secret)')
+
+            room = payload.get('room')
+            if request == 'create':
+                if room in self.rooms:
+                    return _error(ERROR_ROOM_EXISTS, f'Room {room} already exists')
+                self.rooms[room] = {
+                    'description': payload.get('description', ''),
+                    'publishers': payload.get('publishers', 3),
+                    'participants': {},
+                }
+                return {'videoroom': 'created', 'room': room, 'permanent': False}
+            if request == 'list':
+                return {'videoroom': 'success', 'list': [
+                    {'room': room_id, 'description': info['description'], 'max_publishers': info['publishers'],
+                     'num_participants': len(info['participants'])}
+                    for room_id, info in self.rooms.items()
+                ]}
+            if request == 'exists':
+                return {'videoroom': 'success', 'room': room, 'exists': room in self.rooms}
+            if request not in ('destroy', 'listparticipants', 'kick'):
+                return _error(ERROR_INVALID_REQUEST, f'Unknown request {request!r}')
+
+            if room not in self.rooms:
+                return _error(ERROR_NO_SUCH_ROOM, f'No such room ({room})')
+            if request == 'destroy':
+                del self.rooms[room]
+                return {'videoroom': 'destroyed', 'room': room}
+            if request == 'listparticipants':
+                return {'videoroom': 'participants', 'room': room, 'participants': [
+                    {'id': participant_id, 'display': display, 'publisher': True}
+                    for participant_id, display in self.rooms[room]['participants'].items()
+                ]}
+            self.rooms[room]['participants'].pop(payload.get('id'), None)
+            return {'videoroom': 'success'}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path.rstrip('/') != '/janus/videoroom':
+                    self.send_error(404)
+                    return
+                try:
+                    payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                except ValueError:
+                    self.send_error(400)
+                    return
+                if server.delay:
+                    time.sleep(server.delay)
+                body = json.dumps(server.handle(payload)).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def _error(code, reason):
+    return {'videoroom': 'event', 'error_code': code, 'error': reason}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Finto Janus SFU (plugin videoroom) per sviluppo e test')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8088)
+    parser.add_argument('--secret', default=None, help='api secret richiesto (default: nessun controllo)')
+    parser.add_argument('--delay', type=float, default=0.0, help='latenza simulata per richiesta (secondi)')
+    args = parser.parse_args()
+
+    janus = FakeJanusServer(args.host, args.port, args.secret, args.delay).start()
+    print(f"🎥 Finto Janus in ascolto su {janus.url}/janus/videoroom")
+    try:
+        janus._thread.join()
+    except KeyboardInterrupt:
+        janus.stop()
@@ -7,16 +7,23 @@ NOTA: Le notifiche sono CIFRATE end-to-end per proteggere i metadati
 """
 
 import asyncio
+import heapq
 import json
+import math
+import os
 import time
 import sqlite3
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Dict, List, Optional
+from itertools import islice
+from typing import Any, Dict, List, Optional, Set, Tuple
 from dataclasses import dataclass, asdict
 from enum import Enum
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 import uvicorn
 
 # Tipi di notifiche supportate
@@ -83,6 +90,10 @@ class NotificationRequest(BaseModel):
     encrypted: bool = False  # Se True, usa encrypted_payload invece di title/body
     encrypted_payload: Optional[Dict] = None  # {ciphertext, iv, mac}
 
+class NotificationBatchRequest(BaseModel):
+    # Validate una per una in /send_batch: una notifica malformata non deve far scartare tutto il batch
+    notifications: List[Dict[str, Any]]
+
 class CallRequest(BaseModel):
     recipient_id: str
     sender_id: str
@@ -110,8 +121,38 @@ class NotificationResponse(BaseModel):
     notifications: List[Dict]
     status: str
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Avvio/arresto: database, ripristino della coda notifiche e task di manutenzione"""
+    # Con uvicorn --reload il blocco __main__ gira solo nel processo supervisore:
+    # il worker che serve le richieste inizializza qui il proprio stato
+    init_database()
+    if not len(registry):
+        load_devices_from_db()
+    
+    if NOTIFICATION_SPILL_ENABLED:
+        notification_store.spill = NotificationSpill()
+        restored = notification_store.restore(notification_store.spill.load(time.time() - NOTIFICATION_TTL_SECONDS))
+        print(f"💾 Ripristinate {restored} notifiche in coda dal database")
+    
+    if not len(call_engine):
+        recovered = call_engine.recover(CallJournal.load())
+        if recovered:
+            print(f"💾 Ripristinate {recovered} chiamate dal journal")
+    
+    if not NOTIFY_SYNC_TOKEN:
+        print("⚠️ NOTIFY_SYNC_TOKEN non configurato: stati delle chiamate non sincronizzati con Django")
+    
+    maintenance_task = asyncio.create_task(notification_maintenance_loop())
+    try:
+        yield
+    finally:
+        maintenance_task.cancel()
+        # Ultimo flush delle scritture differite (last_seen e coda notifiche)
+        write_pending_changes(take_pending_changes())
+
 # Inizializza FastAPI
-app = FastAPI(title="SecureVOX Notify", version="1.0.0")
+app = FastAPI(title="SecureVOX Notify", version="1.0.0", lifespan=lifespan)
 
 # CORS per permettere richieste dal frontend
 app.add_middleware(
@@ -122,60 +163,714 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class DeviceRegistry:
+    """
+    Registro dei dispositivi con indici secondari per utente
+
+    - devices: device_token -> Device
+    - by_user: user_id -> device_token di TUTTI i dispositivi dell'utente
+    - online: user_id -> device_token dei dispositivi online
+    - sockets: user_id -> {device_token: WebSocket} dei dispositivi connessi
+
+    Ogni risoluzione destinatario costa O(1) + O(dispositivi dell'utente),
+    indipendentemente dal numero totale di dispositivi registrati.
+    Gli stati is_online/websocket dei Device vanno modificati SOLO tramite
+    i metodi del registro, così gli indici restano coerenti.
+    """
+
+    def __init__(self):
+        self.devices: Dict[str, Device] = {}
+        self.by_user: Dict[str, Set[str]] = {}
+        self.online: Dict[str, Set[str]] = {}
+        self.sockets: Dict[str, Dict[str, WebSocket]] = {}
+
+    def __len__(self):
+        return len(self.devices)
+
+    def get(self, device_token: str) -> Optional[Device]:
+        return self.devices.get(device_token)
+
+    def register(self, device: Device):
+        """Aggiunge o sostituisce un dispositivo (anche se cambia utente)"""
+        previous = self.devices.get(device.device_token)
+        if previous is not None:
+            if device.websocket is None and previous.user_id == device.user_id:
+                # Nuova registrazione dello stesso dispositivo: il WebSocket aperto resta valido
+                device.websocket = previous.websocket
+            self.remove(device.device_token)
+
+        self.devices[device.device_token] = device
+        self.by_user.setdefault(device.user_id, set()).add(device.device_token)
+        if device.is_online:
+            self.online.setdefault(device.user_id, set()).add(device.device_token)
+        if device.websocket is not None:
+            self.sockets.setdefault(device.user_id, {})[device.device_token] = device.websocket
+
+    def remove(self, device_token: str) -> Optional[Device]:
+        device = self.devices.pop(device_token, None)
+        if device is None:
+            return None
+        self._discard(self.by_user, device.user_id, device_token)
+        self._discard(self.online, device.user_id, device_token)
+        self._discard(self.sockets, device.user_id, device_token)
+        return device
+
+    def resolve_user(self, recipient_id: str) -> Optional[str]:
+        """Accetta un user_id o un device_token e restituisce lo user_id registrato"""
+        if recipient_id in self.by_user:
+            return recipient_id
+        device = self.devices.get(recipient_id)
+        return device.user_id if device else None
+
+    def devices_of(self, user_id: str) -> List[Device]:
+        return [self.devices[token] for token in self.by_user.get(user_id, ())]
+
+    def has_devices(self, user_id: str) -> bool:
+        return bool(self.by_user.get(user_id))
+
+    def is_online(self, user_id: str) -> bool:
+        return bool(self.online.get(user_id))
+
+    def set_online(self, device_token: str, is_online: bool):
+        device = self.devices.get(device_token)
+        if device is None:
+            return
+        device.is_online = is_online
+        if is_online:
+            self.online.setdefault(device.user_id, set()).add(device_token)
+        else:
+            self._discard(self.online, device.user_id, device_token)
+
+    def attach_socket(self, device_token: str, websocket: WebSocket):
+        device = self.devices[device_token]
+        device.websocket = websocket
+        self.sockets.setdefault(device.user_id, {})[device_token] = websocket
+        self.set_online(device_token, True)
+
+    def detach_socket(self, device_token: str, websocket: Optional[WebSocket] = None):
+        """Scollega il WebSocket (solo se è ancora quello indicato: un client può essersi riconnesso)"""
+        device = self.devices.get(device_token)
+        if device is None or (websocket is not None and device.websocket is not websocket):
+            return
+        device.websocket = None
+        self._discard(self.sockets, device.user_id, device_token)
+        self.set_online(device_token, False)
+
+    def sockets_of(self, user_id: str) -> List[Tuple[str, WebSocket]]:
+        return list(self.sockets.get(user_id, {}).items())
+
+    def online_count(self) -> int:
+        return sum(len(tokens) for tokens in self.online.values())
+
+    def connected_count(self) -> int:
+        return sum(len(conns) for conns in self.sockets.values())
+
+    @staticmethod
+    def _discard(index, user_id, device_token):
+        entries = index.get(user_id)
+        if entries is None:
+            return
+        if isinstance(entries, dict):
+            entries.pop(device_token, None)
+        else:
+            entries.discard(device_token)
+        if not entries:
+            del index[user_id]
+
+
+class UserNotificationQueue:
+    """Coda limitata di un utente: le notifiche non consegnate sono sempre le ultime `undelivered`"""
+    __slots__ = ("items", "undelivered")
+
+    def __init__(self, maxlen: int):
+        self.items: deque = deque(maxlen=maxlen)
+        self.undelivered = 0
+
+
+class NotificationStore:
+    """
+    Coda notifiche per utente con scadenza indicizzata
+
+    - add(): append su una deque limitata, O(1) (le più vecchie escono dalla testa)
+    - take_pending(): restituisce solo le non consegnate spostando il cursore, O(k)
+    - expire(): heap ordinato per scadenza, eseguito dal task di manutenzione;
+      tocca solo le notifiche effettivamente scadute
+
+    Se `spill` è impostato, le notifiche non ancora consegnate sono salvate su
+    SQLite (scrittura differita) e sopravvivono al riavvio del servizio.
+    """
+
+    def __init__(self, max_per_user: int, ttl: float):
+        self.max_per_user = max_per_user
+        self.ttl = ttl
+        self.queues: Dict[str, UserNotificationQueue] = {}
+        self.total = 0
+        self.spill: Optional["NotificationSpill"] = None
+        self._expiry: List[Tuple[float, int, str]] = []  # (scadenza, sequenza, user_id)
+        self._seq = 0
+        self._waiters: Dict[str, asyncio.Event] = {}  # long-poll in attesa per utente
+        self._waiting: Dict[str, int] = {}  # numero di long-poll in attesa per utente
+
+    def __len__(self):
+        return self.total
+
+    def add(self, notification: Notification):
+        user_id = notification.recipient_id
+        queue = self.queues.get(user_id)
+        if queue is None:
+            queue = self.queues[user_id] = UserNotificationQueue(self.max_per_user)
+        
+        if len(queue.items) == self.max_per_user:
+            # La deque scarta la più vecchia: va tolta anche dal conteggio e dallo spill
+            self._forget(queue.items[0])
+            self.total -= 1
+        queue.items.append(notification)
+        queue.undelivered = min(queue.undelivered + 1, len(queue.items))
+        self.total += 1
+        
+        self._seq += 1
+        heapq.heappush(self._expiry, (notification.timestamp + self.ttl, self._seq, user_id))
+        if self.spill:
+            self.spill.save(notification)
+        
+        # Risveglia i long-poll dell'utente
+        waiter = self._waiters.pop(user_id, None)
+        if waiter is not None:
+            waiter.set()
+
+    async def wait_for_pending(self, user_id: str, timeout: float) -> bool:
+        """Attende (senza polling) che l'utente abbia notifiche non consegnate"""
+        if self.pending_count(user_id):
+            return True
+        waiter = self._waiters.get(user_id)
+        if waiter is None:
+            waiter = self._waiters[user_id] = asyncio.Event()
+        self._waiting[user_id] = self._waiting.get(user_id, 0) + 1
+        try:
+            await asyncio.wait_for(waiter.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            remaining = self._waiting[user_id] - 1
+            if remaining:
+                self._waiting[user_id] = remaining
+            else:
+                # Ultimo in attesa: l'evento (se non già consumato da add) non serve più
+                del self._waiting[user_id]
+                if self._waiters.get(user_id) is waiter:
+                    del self._waiters[user_id]
+        return self.pending_count(user_id) > 0
+
+    def take_pending(self, user_id: str) -> List[Notification]:
+        """Notifiche non ancora consegnate (in ordine), marcate come consegnate"""
+        queue = self.queues.get(user_id)
+        if queue is None or not queue.undelivered:
+            return []
+        
+        pending = list(islice(reversed(queue.items), queue.undelivered))
+        pending.reverse()
+        queue.undelivered = 0
+        for notification in pending:
+            notification.delivered = True
+            self._forget(notification)
+        return pending
+
+    def pending_count(self, user_id: str) -> int:
+        queue = self.queues.get(user_id)
+        return queue.undelivered if queue else 0
+
+    def list(self, user_id: str) -> List[Notification]:
+        queue = self.queues.get(user_id)
+        return list(queue.items) if queue else []
+
+    def clear(self, user_id: str) -> bool:
+        queue = self.queues.pop(user_id, None)
+        if queue is None:
+            return False
+        for notification in queue.items:
+            self._forget(notification)
+        self.total -= len(queue.items)
+        return True
+
+    def counts_by_user(self) -> Dict[str, int]:
+        return {user_id: len(queue.items) for user_id, queue in self.queues.items()}
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """Rimuove le notifiche scadute; restituisce quante ne ha rimosse"""
+        now = now or time.time()
+        removed = 0
+        while self._expiry and self._expiry[0][0] <= now:
+            _, _, user_id = heapq.heappop(self._expiry)
+            queue = self.queues.get(user_id)
+            if queue is None:
+                continue
+            # Le code sono ordinate per timestamp: le scadute sono sempre in testa
+            while queue.items and queue.items[0].timestamp + self.ttl <= now:
+                self._forget(queue.items.popleft())
+                removed += 1
+            queue.undelivered = min(queue.undelivered, len(queue.items))
+            if not queue.items:
+                del self.queues[user_id]
+        self.total -= removed
+        return removed
+
+    def restore(self, stored: List[Notification]) -> int:
+        """Ricarica notifiche salvate (ordinate per timestamp) senza riscriverle"""
+        spill, self.spill = self.spill, None
+        try:
+            for notification in stored:
+                self.add(notification)
+        finally:
+            self.spill = spill
+        return len(stored)
+
+    def _forget(self, notification: Notification):
+        if self.spill:
+            self.spill.discard(notification.id)
+
+
+class NotificationSpill:
+    """
+    Persistenza opzionale delle notifiche non consegnate (scrittura differita)
+    Le modifiche sono accumulate in memoria e scritte dal task di manutenzione
+    insieme alle altre scritture differite, in un'unica transazione
+    """
+
+    def __init__(self):
+        self._upserts: Dict[str, Tuple[str, str, float, str]] = {}
+        self._deletes: Set[str] = set()
+
+    def save(self, notification: Notification):
+        payload = asdict(notification)
+        payload["notification_type"] = notification.notification_type.value
+        payload["call_status"] = notification.call_status.value if notification.call_status else None
+        self._deletes.discard(notification.id)
+        self._upserts[notification.id] = (
+            notification.id, notification.recipient_id, notification.timestamp, json.dumps(payload)
+        )
+
+    def discard(self, notification_id: str):
+        # Mai scritta su disco: basta dimenticarla
+        if self._upserts.pop(notification_id, None) is None:
+            self._deletes.add(notification_id)
+
+    def take_changes(self):
+        """Preleva le modifiche in sospeso (da chiamare nel thread dell'event loop)"""
+        upserts, deletes = list(self._upserts.values()), list(self._deletes)
+        self._upserts, self._deletes = {}, set()
+        return upserts, deletes
+
+    @staticmethod
+    def apply(conn, upserts, deletes):
+        """Scrive le modifiche (dentro una transazione aperta dal chiamante)"""
+        if deletes:
+            conn.executemany("DELETE FROM queued_notifications WHERE id = ?", [(d,) for d in deletes])
+        if upserts:
+            conn.executemany(
+                "INSERT OR REPLACE INTO queued_notifications (id, recipient_id, timestamp, payload) VALUES (?, ?, ?, ?)",
+                upserts
+            )
+
+    def load(self, not_before: float) -> List[Notification]:
+        conn = get_db()
+        with db_lock, conn:
+            conn.execute("DELETE FROM queued_notifications WHERE timestamp < ?", (not_before,))
+            rows = conn.execute("SELECT payload FROM queued_notifications ORDER BY timestamp").fetchall()
+        stored = []
+        for (payload,) in rows:
+            data = json.loads(payload)
+            data["notification_type"] = NotificationType(data["notification_type"])
+            data["call_status"] = CallStatus(data["call_status"]) if data.get("call_status") else None
+            stored.append(Notification(**data))
+        return stored
+
+
+class DeviceStateBuffer:
+    """
+    Buffer delle modifiche last_seen/is_online dei dispositivi
+
+    Poll e WebSocket aggiornano solo la memoria; il task di manutenzione scrive
+    l'ultimo stato di ogni dispositivo modificato con un solo executemany,
+    invece di una transazione (e un fsync) per ogni poll.
+    """
+
+    def __init__(self):
+        self._dirty: Dict[str, Tuple[float, int]] = {}
+
+    def mark(self, device: Device):
+        self._dirty[device.device_token] = (device.last_seen, 1 if device.is_online else 0)
+
+    def discard(self, device_token: str):
+        self._dirty.pop(device_token, None)
+
+    def take_changes(self) -> List[Tuple[float, int, str]]:
+        changes = [(last_seen, is_online, token) for token, (last_seen, is_online) in self._dirty.items()]
+        self._dirty = {}
+        return changes
+
+    @staticmethod
+    def apply(conn, changes):
+        if changes:
+            conn.executemany("UPDATE devices SET last_seen = ?, is_online = ? WHERE device_token = ?", changes)
+
+
+class TimingWheel:
+    """
+    Timing wheel (hashed) per le scadenze delle chiamate
+
+    Ogni timer finisce nello slot del tick in cui scade (modulo il numero di
+    slot): schedule/cancel costano O(1) e advance() visita solo gli slot dei
+    tick trascorsi, indipendentemente dal numero di chiamate in attesa. Un
+    timer oltre un giro di ruota resta nello slot e scade al giro giusto.
+    Un solo timer per chiave: schedule() sostituisce quello precedente.
+    """
+
+    def __init__(self, tick_seconds: float, slots: int, now: Optional[float] = None):
+        self.tick_seconds = tick_seconds
+        self.slots: List[Dict[str, float]] = [{} for _ in range(slots)]
+        self.current = int((time.time() if now is None else now) // tick_seconds)  # ultimo tick elaborato
+        self._where: Dict[str, int] = {}  # chiave -> slot
+
+    def __len__(self):
+        return len(self._where)
+
+    def schedule(self, key: str, deadline: float):
+        self.cancel(key)
+        # Tick in cui la scadenza è certamente passata, mai uno già elaborato
+        tick = max(math.ceil(deadline / self.tick_seconds), self.current + 1)
+        slot = tick % len(self.slots)
+        self.slots[slot][key] = deadline
+        self._where[key] = slot
+
+    def cancel(self, key: str):
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            self.slots[slot].pop(key, None)
+
+    def advance(self, now: Optional[float] = None) -> List[str]:
+        """Fa avanzare la ruota fino a `now`; restituisce le chiavi scadute"""
+        now = time.time() if now is None else now
+        target = int(now // self.tick_seconds)
+        # Dopo una pausa più lunga di un giro basta visitare ogni slot una volta
+        ticks = range(max(self.current + 1, target - len(self.slots) + 1), target + 1)
+        self.current = max(self.current, target)
+        expired = []
+        for tick in ticks:
+            bucket = self.slots[tick % len(self.slots)]
+            for key, deadline in list(bucket.items()):
+                if deadline <= now:
+                    del bucket[key]
+                    del self._where[key]
+                    expired.append(key)
+        return expired
+
+
+class CallJournal:
+    """
+    Journal append-only delle chiamate (tabella call_journal, scrittura differita)
+
+    Ogni transizione accodata viene scritta dal task di manutenzione nella
+    stessa transazione delle altre scritture differite. All'avvio il journal
+    viene rieseguito per ricostruire le chiamate in corso; le righe di una
+    chiamata sono eliminate quando la chiamata esce dalla memoria (terminata
+    e sincronizzata con Django), quindi la tabella contiene solo le chiamate vive.
+    """
+
+    def __init__(self):
+        self._rows: List[Tuple[str, str, float, str]] = []
+        self._compacted: Set[str] = set()
+
+    def append(self, call_id: str, event: str, payload: Dict):
+        self._rows.append((call_id, event, time.time(), json.dumps(payload)))
+
+    def compact(self, call_id: str):
+        self._compacted.add(call_id)
+
+    def has_changes(self) -> bool:
+        return bool(self._rows or self._compacted)
+
+    def take_changes(self):
+        rows, compacted = self._rows, list(self._compacted)
+        self._rows, self._compacted = [], set()
+        return rows, compacted
+
+    @staticmethod
+    def apply(conn, rows, compacted):
+        if rows:
+            conn.executemany(
+                "INSERT INTO call_journal (call_id, event, timestamp, payload) VALUES (?, ?, ?, ?)", rows
+            )
+        if compacted:
+            conn.executemany("DELETE FROM call_journal WHERE call_id = ?", [(c,) for c in compacted])
+
+    @staticmethod
+    def load() -> List[Tuple[str, str, float, Dict]]:
+        conn = get_db()
+        with db_lock:
+            rows = conn.execute("SELECT call_id, event, timestamp, payload FROM call_journal ORDER BY seq").fetchall()
+        return [(call_id, event, timestamp, json.loads(payload)) for call_id, event, timestamp, payload in rows]
+
+
+class CallEngine:
+    """
+    Stato delle chiamate: macchina a stati, timer sulla timing wheel, journal e sync con Django
+
+    - transizioni ammesse solo secondo TRANSITIONS (incoming → ringing →
+      answered → ended, oppure rejected/missed); una transizione non ammessa
+      restituisce None e non modifica la chiamata
+    - un timer per chiamata: squillo senza risposta → missed, chiamata
+      risposta senza fine entro MAX_CALL_SECONDS → ended, chiamata terminata
+      → eliminata dalla memoria dopo CALL_RETENTION_SECONDS (se sincronizzata)
+    - ogni modifica va nel journal e nella coda di sync verso Django
+      (POST {DJANGO_API_URL}/webrtc/calls/sync/ in batch)
+    """
+
+    TRANSITIONS = {
+        CallStatus.INCOMING: {CallStatus.RINGING, CallStatus.ANSWERED, CallStatus.REJECTED, CallStatus.ENDED, CallStatus.MISSED},
+        CallStatus.RINGING: {CallStatus.ANSWERED, CallStatus.REJECTED, CallStatus.ENDED, CallStatus.MISSED},
+        CallStatus.ANSWERED: {CallStatus.ENDED},
+    }
+    TERMINAL = {CallStatus.REJECTED, CallStatus.ENDED, CallStatus.MISSED}
+
+    def __init__(self, wheel: TimingWheel, journal: CallJournal):
+        self.calls: Dict[str, Dict] = {}
+        self.wheel = wheel
+        self.journal = journal
+        self._unsynced: Dict[str, Dict] = {}  # call_id -> ultimo stato da inviare a Django
+
+    def __len__(self):
+        return len(self.calls)
+
+    def get(self, call_id: str) -> Optional[Dict]:
+        return self.calls.get(call_id)
+
+    def start(self, call_info: Dict, ring_timeout: float) -> Dict:
+        call_info["status"] = CallStatus.INCOMING
+        call_info["ring_timeout"] = ring_timeout
+        self.calls[call_info["call_id"]] = call_info
+        self.journal.append(call_info["call_id"], "start", call_info)
+        self._schedule(call_info)
+        self._queue_sync(call_info)
+        return call_info
+
+    def transition(self, call_id: str, status: CallStatus, **fields) -> Optional[Dict]:
+        """Applica una transizione di stato; None se la chiamata non esiste o la transizione non è ammessa"""
+        call_info = self.calls.get(call_id)
+        if call_info is None or status not in self.TRANSITIONS.get(call_info["status"], ()):
+            return None
+
+        now = time.time()
+        changes = {"status": status, **fields}
+        if status == CallStatus.ANSWERED:
+            changes.setdefault("answer_time", now)
+        elif status in self.TERMINAL:
+            changes["end_time"] = now
+            # Durata della conversazione (0 se non è mai stata risposta)
+            changes["duration"] = int(now - call_info["answer_time"]) if call_info.get("answer_time") else 0
+        call_info.update(changes)
+        self.journal.append(call_id, status.value, changes)
+        self._schedule(call_info)
+        self._queue_sync(call_info)
+        return call_info
+
+    def update(self, call_id: str, **fields):
+        """Modifica campi senza cambiare stato (es. sessione WebRTC, partecipanti)"""
+        call_info = self.calls.get(call_id)
+        if call_info is not None:
+            call_info.update(fields)
+            self.journal.append(call_id, "update", fields)
+
+    def remove(self, call_id: str) -> bool:
+        if self.calls.pop(call_id, None) is None:
+            return False
+        self.wheel.cancel(call_id)
+        self._unsynced.pop(call_id, None)
+        self.journal.compact(call_id)
+        return True
+
+    def expire(self, now: Optional[float] = None) -> List[Dict]:
+        """
+        Timer scaduti: restituisce le chiamate passate a missed/ended per timeout
+        (da notificare), elimina quelle terminate oltre la retention.
+        """
+        timed_out = []
+        for call_id in self.wheel.advance(now):
+            call_info = self.calls.get(call_id)
+            if call_info is None:
+                continue
+            status = call_info["status"]
+            if status in (CallStatus.INCOMING, CallStatus.RINGING):
+                timed_out.append(self.transition(call_id, CallStatus.MISSED, end_reason="no_answer"))
+            elif status == CallStatus.ANSWERED:
+                timed_out.append(self.transition(call_id, CallStatus.ENDED, end_reason="max_duration"))
+            elif call_id in self._unsynced:
+                # Non ancora in Django: resta in memoria (e nel journal) fino al sync
+                self.wheel.schedule(call_id, time.time() + CALL_RETENTION_SECONDS)
+            else:
+                self.remove(call_id)
+        return timed_out
+
+    def take_sync_batch(self, limit: int) -> List[Dict]:
+        return list(islice(self._unsynced.values(), limit))
+
+    def mark_synced(self, batch: List[Dict]):
+        """Stati confermati da Django (solo se non sono cambiati nel frattempo)"""
+        for state in batch:
+            call_id = state["call_id"]
+            if self._unsynced.get(call_id) == state:
+                del self._unsynced[call_id]
+                self.journal.append(call_id, "synced", {"status": state["status"]})
+
+    def pending_sync(self) -> int:
+        return len(self._unsynced)
+
+    def recover(self, rows) -> int:
+        """Ricostruisce le chiamate dal journal (all'avvio, prima di accettare richieste)"""
+        synced_status: Dict[str, str] = {}
+        for call_id, event, _, payload in rows:
+            if event == "start":
+                self.calls[call_id] = payload
+            elif event == "synced":
+                synced_status[call_id] = payload["status"]
+            elif call_id in self.calls:
+                self.calls[call_id].update(payload)
+
+        for call_id, call_info in self.calls.items():
+            call_info["status"] = CallStatus(call_info["status"])
+            self._schedule(call_info)
+            if synced_status.get(call_id) != call_info["status"].value:
+                self._queue_sync(call_info)
+        return len(self.calls)
+
+    def _schedule(self, call_info: Dict):
+        status = call_info["status"]
+        if status in (CallStatus.INCOMING, CallStatus.RINGING):
+            deadline = call_info["start_time"] + call_info["ring_timeout"]
+        elif status == CallStatus.ANSWERED:
+            deadline = call_info["answer_time"] + MAX_CALL_SECONDS
+        else:
+            deadline = call_info["end_time"] + CALL_RETENTION_SECONDS
+        self.wheel.schedule(call_info["call_id"], deadline)
+
+    def _queue_sync(self, call_info: Dict):
+        if not NOTIFY_SYNC_TOKEN:
+            # Sync disabilitato: Django rifiuterebbe il batch e la chiamata resterebbe in memoria
+            return
+        self._unsynced[call_info["call_id"]] = {
+            "call_id": call_info["call_id"],
+            "status": call_info["status"].value,
+            "start_time": call_info["start_time"],
+            "answer_time": call_info.get("answer_time"),
+            "end_time": call_info.get("end_time"),
+            "end_reason": call_info.get("end_reason"),
+        }
+
+
 # Storage in memoria (in produzione usare Redis o database)
-devices: Dict[str, Device] = {}
-notifications: Dict[str, List[Notification]] = {}
-active_calls: Dict[str, Dict] = {}  # call_id -> call_data
+registry = DeviceRegistry()
+devices = registry.devices  # Vista device_token -> Device (endpoint di debug/statistiche)
+device_state = DeviceStateBuffer()
 notification_counter = 0
 call_counter = 0
 
-# Mappature per gestire user_id <-> device_token
-user_to_device: Dict[str, str] = {}  # user_id -> device_token
-device_to_user: Dict[str, str] = {}  # device_token -> user_id
-
 # 💾 DATABASE PERSISTENTE PER DISPOSITIVI
 DB_PATH = "securevox_notify_devices.db"
 
+# Coda notifiche: limite per utente, durata e persistenza opzionale delle non consegnate
+NOTIFICATION_TTL_SECONDS = 3600  # 1 ora
+MAX_NOTIFICATIONS_PER_USER = int(os.getenv("NOTIFY_MAX_NOTIFICATIONS_PER_USER", "500"))
+NOTIFICATION_SPILL_ENABLED = os.getenv("NOTIFY_SPILL_NOTIFICATIONS", "0") == "1"
+MAINTENANCE_INTERVAL_SECONDS = 1.0
+PERSIST_FLUSH_INTERVAL_SECONDS = float(os.getenv("NOTIFY_PERSIST_FLUSH_SECONDS", "5"))
+
+# Long-poll: attesa massima accettata per /poll?wait=N
+MAX_LONG_POLL_SECONDS = 30
+
+# Chiamate: timeout di squillo, durata massima, retention dopo la fine e sync con Django
+CALL_RING_TIMEOUT_SECONDS = 30
+GROUP_CALL_RING_TIMEOUT_SECONDS = 60
+MAX_CALL_SECONDS = int(os.getenv("NOTIFY_MAX_CALL_SECONDS", str(4 * 3600)))
+CALL_RETENTION_SECONDS = 60
+CALL_TIMER_SLOTS = 512  # slot della timing wheel (tick = MAINTENANCE_INTERVAL_SECONDS)
+CALL_SYNC_INTERVAL_SECONDS = float(os.getenv("NOTIFY_CALL_SYNC_SECONDS", "5"))
+CALL_SYNC_BATCH_SIZE = 200
+DJANGO_API_URL = os.getenv("NOTIFY_DJANGO_API_URL", "http://localhost:8000/api")
+NOTIFY_SYNC_TOKEN = os.getenv("NOTIFY_SYNC_TOKEN", "")
+
+notification_store = NotificationStore(MAX_NOTIFICATIONS_PER_USER, NOTIFICATION_TTL_SECONDS)
+call_engine = CallEngine(TimingWheel(MAINTENANCE_INTERVAL_SECONDS, CALL_TIMER_SLOTS), CallJournal())
+active_calls = call_engine.calls  # Vista call_id -> call_data (endpoint di debug/statistiche)
+
+_db_conn: Optional[sqlite3.Connection] = None
+db_lock = threading.Lock()  # serializza l'uso della connessione tra event loop e thread di flush
+
+def get_db() -> sqlite3.Connection:
+    """Connessione SQLite persistente del processo (WAL: i lettori non bloccano lo scrittore)"""
+    global _db_conn
+    if _db_conn is None:
+        _db_conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        _db_conn.execute("PRAGMA journal_mode=WAL")
+        _db_conn.execute("PRAGMA synchronous=NORMAL")
+    return _db_conn
+
 def init_database():
     """Inizializza il database SQLite per salvare i dispositivi"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Crea la tabella dei dispositivi se non esiste
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS devices (
-            device_token TEXT PRIMARY KEY,
-            user_id TEXT NOT NULL,
-            platform TEXT NOT NULL,
-            app_version TEXT NOT NULL,
-            last_seen REAL NOT NULL,
-            is_online INTEGER NOT NULL DEFAULT 1
-        )
-    ''')
-    
-    # Crea indice su user_id per ricerche veloci
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_user_id ON devices(user_id)
-    ''')
-    
-    conn.commit()
-    conn.close()
+    conn = get_db()
+    with db_lock, conn:
+        # Crea la tabella dei dispositivi se non esiste
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS devices (
+                device_token TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                platform TEXT NOT NULL,
+                app_version TEXT NOT NULL,
+                last_seen REAL NOT NULL,
+                is_online INTEGER NOT NULL DEFAULT 1
+            )
+        ''')
+        
+        # Crea indice su user_id per ricerche veloci
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_user_id ON devices(user_id)
+        ''')
+        
+        # Notifiche non consegnate (solo con NOTIFY_SPILL_NOTIFICATIONS=1)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS queued_notifications (
+                id TEXT PRIMARY KEY,
+                recipient_id TEXT NOT NULL,
+                timestamp REAL NOT NULL,
+                payload TEXT NOT NULL
+            )
+        ''')
+        
+        # Journal append-only delle chiamate in corso (CallJournal)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS call_journal (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                call_id TEXT NOT NULL,
+                event TEXT NOT NULL,
+                timestamp REAL NOT NULL,
+                payload TEXT NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_call_journal_call_id ON call_journal(call_id)
+        ''')
     print("💾 Database dispositivi inizializzato")
 
 def save_device_to_db(device: Device):
-    """Salva un dispositivo nel database"""
+    """Salva un dispositivo nel database (registrazione: scrittura immediata)"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO devices (device_token, user_id, platform, app_version, last_seen, is_online)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (device.device_token, device.user_id, device.platform, device.app_version, 
-              device.last_seen, 1 if device.is_online else 0))
-        
-        conn.commit()
-        conn.close()
+        conn = get_db()
+        with db_lock, conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO devices (device_token, user_id, platform, app_version, last_seen, is_online)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (device.device_token, device.user_id, device.platform, device.app_version, 
+                  device.last_seen, 1 if device.is_online else 0))
+        # La riga appena scritta è già aggiornata
+        device_state.discard(device.device_token)
         print(f"💾 Dispositivo salvato nel DB: {device.user_id} ({device.device_token[:20]}...)")
     except Exception as e:
         print(f"❌ Errore salvataggio dispositivo: {e}")
@@ -183,13 +878,11 @@ def save_device_to_db(device: Device):
 def load_devices_from_db():
     """Carica tutti i dispositivi dal database"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT device_token, user_id, platform, app_version, last_seen, is_online FROM devices')
-        rows = cursor.fetchall()
-        
-        conn.close()
+        conn = get_db()
+        with db_lock:
+            rows = conn.execute(
+                'SELECT device_token, user_id, platform, app_version, last_seen, is_online FROM devices'
+            ).fetchall()
         
         loaded_count = 0
         for row in rows:
@@ -205,9 +898,7 @@ def load_devices_from_db():
                 websocket=None
             )
             
-            devices[device_token] = device
-            user_to_device[user_id] = device_token
-            device_to_user[device_token] = user_id
+            registry.register(device)
             loaded_count += 1
         
         print(f"💾 Caricati {loaded_count} dispositivi dal database")
@@ -219,34 +910,42 @@ def load_devices_from_db():
 def remove_device_from_db(device_token: str):
     """Rimuove un dispositivo dal database"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM devices WHERE device_token = ?', (device_token,))
-        
-        conn.commit()
-        conn.close()
+        device_state.discard(device_token)
+        conn = get_db()
+        with db_lock, conn:
+            conn.execute('DELETE FROM devices WHERE device_token = ?', (device_token,))
         print(f"💾 Dispositivo rimosso dal DB: {device_token[:20]}...")
     except Exception as e:
         print(f"❌ Errore rimozione dispositivo: {e}")
 
+def take_pending_changes():
+    """Preleva tutte le scritture differite (nel thread dell'event loop)"""
+    spill = notification_store.spill
+    return (
+        device_state.take_changes(),
+        spill.take_changes() if spill else ([], []),
+        call_engine.journal.take_changes(),
+    )
+
+def write_pending_changes(changes):
+    """Scrive le modifiche differite in UNA transazione (un solo fsync)"""
+    device_changes, (upserts, deletes), (journal_rows, compacted_calls) = changes
+    if not device_changes and not upserts and not deletes and not journal_rows and not compacted_calls:
+        return
+    conn = get_db()
+    with db_lock, conn:
+        DeviceStateBuffer.apply(conn, device_changes)
+        NotificationSpill.apply(conn, upserts, deletes)
+        CallJournal.apply(conn, journal_rows, compacted_calls)
+
 def initialize_mappings():
-    """Inizializza le mappature all'avvio del server"""
-    global user_to_device, device_to_user
-    
+    """Ricostruisce gli indici del registro dai dispositivi esistenti"""
     print("🔄 Inizializzazione mappature...")
-    print(f"📋 Dispositivi registrati: {len(devices)}")
     
-    # Ricarica le mappature dai dispositivi esistenti
-    for device_token, device in devices.items():
-        user_id = device.user_id
-        user_to_device[user_id] = device_token
-        device_to_user[device_token] = user_id
-        print(f"✅ Mappatura: {user_id} -> {device_token[:20]}...")
+    for device in list(registry.devices.values()):
+        registry.register(device)
     
-    print(f"📋 Mappature inizializzate:")
-    print(f"   - user_to_device: {len(user_to_device)} entries")
-    print(f"   - device_to_user: {len(device_to_user)} entries")
+    print(f"📋 Mappature inizializzate: {len(registry.by_user)} utenti, {len(registry)} dispositivi")
 
 def generate_notification_id() -> str:
     global notification_counter
@@ -258,40 +957,6 @@ def generate_call_id() -> str:
     call_counter += 1
     return f"call_{int(time.time() * 1000)}_{call_counter}"
 
-async def auto_timeout_call(call_id: str, timeout_seconds: int):
-    """Timeout automatico per chiamate non risposte"""
-    await asyncio.sleep(timeout_seconds)
-    
-    if call_id in active_calls:
-        call_info = active_calls[call_id]
-        if call_info["status"] == CallStatus.INCOMING:
-            # Chiamata non risposta - imposta come MISSED
-            call_info["status"] = CallStatus.MISSED
-            call_info["end_time"] = time.time()
-            call_info["duration"] = int(call_info["end_time"] - call_info["start_time"])
-            
-            # Notifica il chiamante
-            caller_notification = {
-                "type": "call_status",
-                "call_id": call_id,
-                "status": CallStatus.MISSED.value,
-                "message": "Chiamata non risposta",
-                "timestamp": time.time()
-            }
-            await send_websocket_notification(call_info["sender_id"], caller_notification)
-            
-            # Notifica il destinatario (chiamata persa)
-            missed_notification = {
-                "type": "call_missed",
-                "call_id": call_id,
-                "caller_id": call_info["sender_id"],
-                "call_type": call_info["call_type"],
-                "timestamp": time.time()
-            }
-            await send_websocket_notification(call_info["recipient_id"], missed_notification)
-            
-            print(f"📞 Chiamata {call_id} scaduta per timeout (non risposta)")
-
 async def integrate_with_webrtc_server(call_id: str, action: str, user_data: dict = None):
     """Integra con il server WebRTC Django per gestire le sessioni"""
     try:
@@ -341,30 +1006,124 @@ async def integrate_with_webrtc_server(call_id: str, action: str, user_data: dic
         print(f"❌ Errore integrazione WebRTC per {action}: {e}")
         return None
 
-async def send_websocket_notification(user_id: str, notification_data: Dict):
-    """Invia notifica tramite WebSocket se disponibile"""
-    # Trova il device_token per questo user_id
-    device_token = user_to_device.get(user_id)
-    if device_token:
-        device = devices.get(device_token)
-        if device and device.websocket:
-            try:
-                await device.websocket.send_text(json.dumps(notification_data))
-                print(f"📡 Notifica WebSocket inviata a {user_id}")
-            except Exception as e:
-                print(f"❌ Errore WebSocket per {user_id}: {e}")
-                device.websocket = None
-
-def cleanup_old_notifications():
-    """Rimuove notifiche più vecchie di 1 ora"""
-    current_time = time.time()
-    for user_id in list(notifications.keys()):
-        notifications[user_id] = [
-            notif for notif in notifications[user_id]
-            if current_time - notif.timestamp < 3600  # 1 ora
-        ]
-        if not notifications[user_id]:
-            del notifications[user_id]
+async def send_websocket_notification(user_id: str, notification_data: Dict) -> int:
+    """
+    Invia la notifica a TUTTI i WebSocket connessi dell'utente, in parallelo
+    Restituisce il numero di dispositivi raggiunti
+    """
+    connections = registry.sockets_of(user_id)
+    if not connections:
+        return 0
+    
+    message = json.dumps(notification_data)
+    results = await asyncio.gather(
+        *(websocket.send_text(message) for _, websocket in connections),
+        return_exceptions=True
+    )
+    
+    delivered = 0
+    for (device_token, websocket), result in zip(connections, results):
+        if isinstance(result, Exception):
+            print(f"❌ Errore WebSocket per {user_id} ({device_token[:20]}...): {result}")
+            registry.detach_socket(device_token, websocket)
+            if device_token in registry.devices:
+                device_state.mark(registry.devices[device_token])
+        else:
+            delivered += 1
+    
+    print(f"📡 Notifica WebSocket inviata a {user_id} ({delivered}/{len(connections)} dispositivi)")
+    return delivered
+
+async def send_websocket_notifications(user_ids, notification_data: Dict):
+    """Invia la stessa notifica WebSocket a più utenti in parallelo"""
+    await asyncio.gather(*(send_websocket_notification(user_id, notification_data) for user_id in user_ids))
+
+async def notification_maintenance_loop():
+    """
+    Task di background: scadenza delle notifiche, timer delle chiamate,
+    flush delle scritture differite e sync delle chiamate con Django
+    """
+    last_flush = last_call_sync = time.time()
+    sync_task: Optional[asyncio.Task] = None
+    while True:
+        await asyncio.sleep(MAINTENANCE_INTERVAL_SECONDS)
+        try:
+            expired = notification_store.expire()
+            if expired:
+                print(f"🧹 Rimosse {expired} notifiche scadute")
+            
+            timed_out = call_engine.expire()
+            if timed_out:
+                await notify_call_timeouts(timed_out)
+            
+            # Il journal delle chiamate è scritto a ogni tick (insieme alle altre modifiche)
+            if call_engine.journal.has_changes() or time.time() - last_flush >= PERSIST_FLUSH_INTERVAL_SECONDS:
+                last_flush = time.time()
+                await asyncio.to_thread(write_pending_changes, take_pending_changes())
+            
+            if call_engine.pending_sync() and time.time() - last_call_sync >= CALL_SYNC_INTERVAL_SECONDS \
+                    and (sync_task is None or sync_task.done()):
+                last_call_sync = time.time()
+                sync_task = asyncio.create_task(sync_calls_with_django())
+        except Exception as e:
+            print(f"❌ Errore manutenzione notifiche: {e}")
+
+async def notify_call_timeouts(calls: List[Dict]):
+    """Notifica le chiamate chiuse da un timer (squillo senza risposta o durata massima)"""
+    for call_info in calls:
+        call_id = call_info["call_id"]
+        status_notification = {
+            "type": "call_status",
+            "call_id": call_id,
+            "status": call_info["status"].value,
+            "message": "Chiamata non risposta" if call_info["status"] == CallStatus.MISSED else "Durata massima raggiunta",
+            "timestamp": time.time()
+        }
+        if call_info["status"] == CallStatus.MISSED:
+            await send_websocket_notification(call_info["sender_id"], status_notification)
+            # I destinatari ricevono la chiamata persa
+            missed_notification = {
+                "type": "call_missed",
+                "call_id": call_id,
+                "caller_id": call_info["sender_id"],
+                "call_type": call_info["call_type"],
+                "timestamp": time.time()
+            }
+            await send_websocket_notifications(call_recipients(call_info), missed_notification)
+            print(f"📞 Chiamata {call_id} scaduta per timeout (non risposta)")
+        else:
+            await send_websocket_notifications(call_participants(call_info), status_notification)
+            print(f"📞 Chiamata {call_id} chiusa per durata massima ({call_info['duration']}s)")
+
+def call_recipients(call_info: Dict) -> Set[str]:
+    """Destinatari della chiamata (invitati per le chiamate di gruppo), escluso il chiamante"""
+    if call_info.get("is_group"):
+        recipients = set(call_info.get("online_members") or call_info.get("group_members") or [])
+    else:
+        recipients = {call_info["recipient_id"]}
+    recipients.discard(call_info["sender_id"])
+    return recipients
+
+def call_participants(call_info: Dict) -> Set[str]:
+    return {call_info["sender_id"], *call_recipients(call_info), *call_info.get("group_members", [])}
+
+async def sync_calls_with_django():
+    """Invia a Django gli stati delle chiamate in batch (una richiesta per batch)"""
+    try:
+        import aiohttp
+        headers = {"X-Notify-Token": NOTIFY_SYNC_TOKEN}
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+            while call_engine.pending_sync():
+                batch = call_engine.take_sync_batch(CALL_SYNC_BATCH_SIZE)
+                async with session.post(f"{DJANGO_API_URL}/webrtc/calls/sync/", json={"calls": batch}, headers=headers) as response:
+                    if response.status != 200:
+                        print(f"❌ Sync chiamate con Django: HTTP {response.status}")
+                        return
+                call_engine.mark_synced(batch)
+                print(f"🔄 Sincronizzate {len(batch)} chiamate con Django")
+    except Exception as e:
+        # Gli stati restano in coda (e nel journal) per il prossimo tentativo
+        print(f"❌ Errore sync chiamate con Django: {e}")
 
 @app.post("/register")
 async def register_device(device_data: DeviceRegistration):
@@ -379,20 +1138,15 @@ async def register_device(device_data: DeviceRegistration):
             is_online=True
         )
         
-        devices[device_data.device_token] = device
-        
-        # Aggiorna le mappature user_id <-> device_token
-        user_to_device[device_data.user_id] = device_data.device_token
-        device_to_user[device_data.device_token] = device_data.user_id
+        # Un utente può avere più dispositivi: si aggiunge, non si sostituisce
+        registry.register(device)
         
         # 💾 SALVA NEL DATABASE PERSISTENTE
         save_device_to_db(device)
         
         print(f"🔥 Dispositivo registrato: {device_data.user_id} ({device_data.platform})")
         print(f"🔥 Token: {device_data.device_token[:20]}...")
-        print(f"📋 Mappature aggiornate:")
-        print(f"   - user_to_device: {len(user_to_device)} entries")
-        print(f"   - device_to_user: {len(device_to_user)} entries")
+        print(f"📋 Dispositivi dell'utente: {len(registry.by_user.get(device_data.user_id, ()))}")
         
         return {"status": "success", "message": "Dispositivo registrato"}
         
@@ -404,145 +1158,130 @@ async def register_device(device_data: DeviceRegistration):
 async def send_notification(notification_data: NotificationRequest):
     """Invia una notifica a un destinatario"""
     try:
-        # Trova il dispositivo del destinatario usando le mappature
-        recipient_device = None
-        recipient_user_id = None
-        
-        # Se recipient_id è un user_id, trova il device_token corrispondente
-        print(f"🔍 Cercando recipient_id: {notification_data.recipient_id} (tipo: {type(notification_data.recipient_id)})")
-        print(f"🔍 user_to_device keys: {list(user_to_device.keys())}")
-        print(f"🔍 user_to_device values: {list(user_to_device.values())}")
-        
-        if notification_data.recipient_id in user_to_device:
-            recipient_user_id = notification_data.recipient_id
-            device_token = user_to_device[notification_data.recipient_id]
-            recipient_device = devices.get(device_token)
-            print(f"✅ Trovato dispositivo per user_id {recipient_user_id}: {device_token[:20]}...")
-            print(f"📤 Notifica per user_id: {recipient_user_id} -> device_token: {device_token[:20]}...")
-        
-        # Se recipient_id è un device_token, trova il user_id corrispondente
-        elif notification_data.recipient_id in device_to_user:
-            device_token = notification_data.recipient_id
-            recipient_user_id = device_to_user[notification_data.recipient_id]
-            recipient_device = devices.get(device_token)
-            print(f"📤 Notifica per device_token: {device_token[:20]}... -> user_id: {recipient_user_id}")
-        
-        # Fallback: cerca direttamente nei dispositivi
-        else:
-            print(f"⚠️ Recipient ID non trovato nelle mappature: {notification_data.recipient_id}")
-            print(f"📋 User IDs disponibili: {list(user_to_device.keys())}")
-            print(f"📋 Device tokens disponibili: {list(device_to_user.keys())}")
-            print(f"📋 Dispositivi registrati: {len(devices)}")
-            
-            # Prova a cercare per user_id nei dispositivi
-            for device_token, device in devices.items():
-                print(f"🔍 Controllo dispositivo: {device_token[:20]}... -> user_id: {device.user_id}")
-                if device.user_id == notification_data.recipient_id:
-                    recipient_device = device
-                    recipient_user_id = device.user_id
-                    print(f"✅ Dispositivo trovato per user_id: {device.user_id}")
-                    break
-        
-        if not recipient_device:
-            print(f"❌ Dispositivo destinatario non trovato: {notification_data.recipient_id}")
-            return {"status": "error", "message": "Destinatario non trovato"}
-        
-        # 🔐 E2EE: Gestione notifiche cifrate
-        if notification_data.encrypted and notification_data.encrypted_payload:
-            print(f"🔐 Notifica CIFRATA ricevuta per {notification_data.recipient_id}")
-            # Notifica cifrata: usa placeholder generici
-            title = "🔐 Nuovo messaggio"  # Placeholder generico
-            body = "Hai ricevuto un nuovo messaggio"  # Placeholder generico
-            
-            # Includi payload cifrato nei dati
-            notification_data_dict = {
-                'encrypted': True,
-                'encrypted_payload': notification_data.encrypted_payload,
-                'sender_id': notification_data.sender_id,
-                'notification_type': notification_data.notification_type.value,
-                'timestamp': notification_data.timestamp
-            }
-            print(f"🔐 Payload cifrato: ciphertext={len(notification_data.encrypted_payload.get('ciphertext', ''))} bytes")
-        
-        # Gestione speciale per eliminazione chat
-        elif notification_data.notification_type == NotificationType.CHAT_DELETED:
-            # Per eliminazione chat, usa i dati dal payload
-            title = f"Chat eliminata"
-            body = f"La chat '{notification_data.data.get('chat_name', 'Chat')}' è stata eliminata"
-            notification_data_dict = notification_data.data.copy()
-            notification_data_dict.update({
-                'type': 'chat_deleted',
-                'chat_id': notification_data.data.get('chat_id'),
-                'chat_name': notification_data.data.get('chat_name'),
-                'deleted_by': notification_data.data.get('deleted_by'),
-                'deleted_by_name': notification_data.data.get('deleted_by_name'),
-                'timestamp': notification_data.data.get('timestamp')
-            })
-        else:
-            # Notifica non cifrata (legacy)
-            title = notification_data.title
-            body = notification_data.body
-            notification_data_dict = notification_data.data
-
-        # Crea la notifica usando il recipient_user_id corretto
-        notification = Notification(
-            id=generate_notification_id(),
-            recipient_id=recipient_user_id or notification_data.recipient_id,
-            title=title,
-            body=body,
-            data=notification_data_dict,
-            sender_id=notification_data.sender_id,
-            timestamp=time.time(),
-            notification_type=notification_data.notification_type,
-            delivered=False
-        )
-        
-        # Aggiungi la notifica alla coda del destinatario
-        # CORREZIONE: Usa sempre recipient_user_id per salvare le notifiche
-        if recipient_user_id not in notifications:
-            notifications[recipient_user_id] = []
-        
-        notifications[recipient_user_id].append(notification)
-        
-        # Invia anche tramite WebSocket se disponibile
-        notification_data_ws = {
-            "type": "notification" if notification_data.notification_type != NotificationType.CHAT_DELETED else "chat_deleted",
-            "id": notification.id,
-            "title": notification.title,
-            "body": notification.body,
-            "data": notification.data,
-            "timestamp": notification.timestamp,
-            "notification_type": notification.notification_type.value
-        }
-        await send_websocket_notification(notification_data.recipient_id, notification_data_ws)
-        
-        print(f"📤 Notifica inviata a {notification_data.recipient_id}: {notification_data.title}")
-        print(f"📤 Tipo: {notification_data.notification_type}")
-        print(f"📤 Contenuto: {notification_data.body}")
-        
-        # Pulisci notifiche vecchie
-        cleanup_old_notifications()
-        
-        return {"status": "success", "message": "Notifica inviata", "notification_id": notification.id}
-        
+        return await deliver_notification(notification_data)
     except Exception as e:
         print(f"❌ Errore nell'invio notifica: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/send_batch")
+async def send_notification_batch(batch: NotificationBatchRequest):
+    """
+    Invia più notifiche in una sola richiesta (outbox del backend Django)
+    I risultati sono nello stesso ordine delle notifiche ricevute
+    """
+    results = []
+    for item in batch.notifications:
+        try:
+            notification_data = NotificationRequest.model_validate(item)
+        except ValidationError as e:
+            print(f"❌ Notifica batch non valida per {item.get('recipient_id')}: {e.error_count()} errori")
+            # Errore definitivo: ritentare la stessa notifica darebbe lo stesso risultato
+            results.append({"status": "error", "message": f"Notifica non valida: {e}", "retry": False})
+            continue
+        try:
+            results.append(await deliver_notification(notification_data))
+        except Exception as e:
+            print(f"❌ Errore nell'invio notifica batch a {notification_data.recipient_id}: {e}")
+            # Errore interno: il mittente può ritentare (a differenza di "Destinatario non trovato")
+            results.append({"status": "error", "message": str(e), "retry": True})
+
+    delivered = sum(1 for r in results if r.get("status") == "success")
+    print(f"📦 Batch notifiche: {delivered}/{len(results)} consegnate")
+    return {"status": "success", "results": results}
+
+async def deliver_notification(notification_data: NotificationRequest) -> Dict:
+    """Accoda la notifica per il destinatario e la inoltra via WebSocket se connesso"""
+    # Risolve il destinatario (user_id o device_token) tramite gli indici del registro
+    recipient_user_id = registry.resolve_user(notification_data.recipient_id)
+    if not recipient_user_id:
+        print(f"❌ Dispositivo destinatario non trovato: {notification_data.recipient_id}")
+        return {"status": "error", "message": "Destinatario non trovato"}
+    
+    # 🔐 E2EE: Gestione notifiche cifrate
+    if notification_data.encrypted and notification_data.encrypted_payload:
+        print(f"🔐 Notifica CIFRATA ricevuta per {notification_data.recipient_id}")
+        # Notifica cifrata: usa placeholder generici
+        title = "🔐 Nuovo messaggio"  # Placeholder generico
+        body = "Hai ricevuto un nuovo messaggio"  # Placeholder generico
+        
+        # Includi payload cifrato nei dati
+        notification_data_dict = {
+            'encrypted': True,
+            'encrypted_payload': notification_data.encrypted_payload,
+            'sender_id': notification_data.sender_id,
+            'notification_type': notification_data.notification_type.value,
+            'timestamp': notification_data.timestamp
+        }
+        print(f"🔐 Payload cifrato: ciphertext={len(notification_data.encrypted_payload.get('ciphertext', ''))} bytes")
+    
+    # Gestione speciale per eliminazione chat
+    elif notification_data.notification_type == NotificationType.CHAT_DELETED:
+        # Per eliminazione chat, usa i dati dal payload
+        title = f"Chat eliminata"
+        body = f"La chat '{notification_data.data.get('chat_name', 'Chat')}' è stata eliminata"
+        notification_data_dict = notification_data.data.copy()
+        notification_data_dict.update({
+            'type': 'chat_deleted',
+            'chat_id': notification_data.data.get('chat_id'),
+            'chat_name': notification_data.data.get('chat_name'),
+            'deleted_by': notification_data.data.get('deleted_by'),
+            'deleted_by_name': notification_data.data.get('deleted_by_name'),
+            'timestamp': notification_data.data.get('timestamp')
+        })
+    else:
+        # Notifica non cifrata (legacy)
+        title = notification_data.title
+        body = notification_data.body
+        notification_data_dict = notification_data.data
+
+    # Crea la notifica usando il recipient_user_id corretto
+    notification = Notification(
+        id=generate_notification_id(),
+        recipient_id=recipient_user_id,
+        title=title,
+        body=body,
+        data=notification_data_dict,
+        sender_id=notification_data.sender_id,
+        timestamp=time.time(),
+        notification_type=notification_data.notification_type,
+        delivered=False
+    )
+    
+    # Aggiungi la notifica alla coda del destinatario
+    # CORREZIONE: Usa sempre recipient_user_id per salvare le notifiche
+    notification_store.add(notification)
+    
+    # Invia anche tramite WebSocket se disponibile
+    notification_data_ws = {
+        "type": "notification" if notification_data.notification_type != NotificationType.CHAT_DELETED else "chat_deleted",
+        "id": notification.id,
+        "title": notification.title,
+        "body": notification.body,
+        "data": notification.data,
+        "timestamp": notification.timestamp,
+        "notification_type": notification.notification_type.value
+    }
+    await send_websocket_notification(recipient_user_id, notification_data_ws)
+    
+    print(f"📤 Notifica inviata a {recipient_user_id}: {notification_data.title}")
+    print(f"📤 Tipo: {notification_data.notification_type}")
+    print(f"📤 Contenuto: {notification_data.body}")
+    
+    return {"status": "success", "message": "Notifica inviata", "notification_id": notification.id}
+
 @app.post("/call/start")
 async def start_call(call_data: CallRequest):
     """Inizia una chiamata audio o video"""
     try:
         call_id = call_data.call_id or generate_call_id()
         
-        # Verifica che il destinatario sia online
-        recipient_device = None
-        for device in devices.values():
-            if device.user_id == call_data.recipient_id:
-                recipient_device = device
-                break
+        existing = call_engine.get(call_id)
+        if existing is not None:
+            # Richiesta ripetuta dal client: la chiamata esiste già
+            return CallResponse(call_id=call_id, status=existing["status"], message="Chiamata già avviata")
         
-        if not recipient_device:
+        # Verifica che il destinatario abbia almeno un dispositivo registrato
+        if not registry.has_devices(call_data.recipient_id):
             return CallResponse(
                 call_id=call_id,
                 status=CallStatus.REJECTED,
@@ -566,7 +1305,8 @@ async def start_call(call_data: CallRequest):
             "janus_room_id": None    # ID della stanza Janus per WebRTC
         }
         
-        active_calls[call_id] = call_info
+        # Stato, timer di squillo e journal gestiti dal motore delle chiamate
+        call_engine.start(call_info, CALL_RING_TIMEOUT_SECONDS)
         
         # Crea notifica di chiamata con informazioni WebRTC
         call_title = f"Chiamata {call_data.call_type}" if call_data.call_type == "audio" else f"Videochiamata"
@@ -595,9 +1335,7 @@ async def start_call(call_data: CallRequest):
         )
         
         # Aggiungi alla coda notifiche
-        if call_data.recipient_id not in notifications:
-            notifications[call_data.recipient_id] = []
-        notifications[call_data.recipient_id].append(notification)
+        notification_store.add(notification)
         
         # Invia tramite WebSocket con priorità alta
         call_notification = {
@@ -610,12 +1348,11 @@ async def start_call(call_data: CallRequest):
             "status": CallStatus.INCOMING.value,
             "timestamp": time.time(),
             "priority": "high",
-            "timeout": 30  # Timeout chiamata in secondi
+            "timeout": CALL_RING_TIMEOUT_SECONDS  # Timeout chiamata in secondi
         }
-        await send_websocket_notification(call_data.recipient_id, call_notification)
-        
-        # Programma timeout automatico per chiamata non risposta
-        asyncio.create_task(auto_timeout_call(call_id, 30))
+        if await send_websocket_notification(call_data.recipient_id, call_notification):
+            # Almeno un dispositivo del destinatario sta squillando
+            call_engine.transition(call_id, CallStatus.RINGING)
         
         print(f"📞 Chiamata {call_data.call_type} iniziata: {call_id}")
         print(f"📞 Da: {call_data.sender_id} a: {call_data.recipient_id}")
@@ -638,25 +1375,28 @@ class CallAnswerRequest(BaseModel):
 async def answer_call(call_id: str, request_data: CallAnswerRequest):
     """Risponde a una chiamata e crea sessione WebRTC"""
     try:
-        if call_id not in active_calls:
+        call_info = call_engine.get(call_id)
+        if call_info is None:
             return CallResponse(
                 call_id=call_id,
                 status=CallStatus.REJECTED,
                 message="Chiamata non trovata"
             )
         
-        call_info = active_calls[call_id]
-        
         # Verifica che l'utente sia autorizzato a rispondere
-        if call_info["recipient_id"] != request_data.user_id:
+        if call_info.get("recipient_id") != request_data.user_id:
             return CallResponse(
                 call_id=call_id,
                 status=CallStatus.REJECTED,
                 message="Non autorizzato a rispondere a questa chiamata"
             )
         
-        call_info["status"] = CallStatus.ANSWERED
-        call_info["answer_time"] = time.time()
+        if call_engine.transition(call_id, CallStatus.ANSWERED) is None:
+            return CallResponse(
+                call_id=call_id,
+                status=call_info["status"],
+                message="La chiamata non è più in attesa di risposta"
+            )
         
         # Integra con server WebRTC per creare sessione
         webrtc_session = await integrate_with_webrtc_server(
@@ -670,9 +1410,12 @@ async def answer_call(call_id: str, request_data: CallAnswerRequest):
         )
         
         if webrtc_session:
-            call_info["webrtc_session"] = webrtc_session
-            call_info["janus_room_id"] = webrtc_session.get("room_id")
-            call_info["ice_servers"] = webrtc_session.get("ice_servers")
+            call_engine.update(
+                call_id,
+                webrtc_session=webrtc_session,
+                janus_room_id=webrtc_session.get("room_id"),
+                ice_servers=webrtc_session.get("ice_servers"),
+            )
         
         # Notifica il chiamante con informazioni WebRTC
         caller_notification = {
@@ -711,17 +1454,20 @@ async def answer_call(call_id: str, request_data: CallAnswerRequest):
 async def reject_call(call_id: str, user_id: str):
     """Rifiuta una chiamata"""
     try:
-        if call_id not in active_calls:
+        call_info = call_engine.get(call_id)
+        if call_info is None:
             return CallResponse(
                 call_id=call_id,
                 status=CallStatus.REJECTED,
                 message="Chiamata non trovata"
             )
         
-        call_info = active_calls[call_id]
-        call_info["status"] = CallStatus.REJECTED
-        call_info["end_time"] = time.time()
-        call_info["duration"] = int(call_info["end_time"] - call_info["start_time"])
+        if call_engine.transition(call_id, CallStatus.REJECTED, end_reason="rejected") is None:
+            return CallResponse(
+                call_id=call_id,
+                status=call_info["status"],
+                message="La chiamata non può più essere rifiutata"
+            )
         
         # Notifica il chiamante
         caller_notification = {
@@ -748,33 +1494,37 @@ async def reject_call(call_id: str, user_id: str):
 async def end_call(call_id: str, user_id: str):
     """Termina una chiamata"""
     try:
-        if call_id not in active_calls:
+        call_info = call_engine.get(call_id)
+        if call_info is None:
             return CallResponse(
                 call_id=call_id,
                 status=CallStatus.ENDED,
                 message="Chiamata non trovata"
             )
         
-        call_info = active_calls[call_id]
-        call_info["status"] = CallStatus.ENDED
-        call_info["end_time"] = time.time()
-        call_info["duration"] = int(call_info["end_time"] - call_info["start_time"])
+        if call_engine.transition(call_id, CallStatus.ENDED, end_reason="hangup") is None:
+            # Già terminata (es. timeout o fine dall'altro lato): nessuna nuova notifica
+            return CallResponse(
+                call_id=call_id,
+                status=call_info["status"],
+                message="Chiamata già terminata"
+            )
         
         # Notifica tutti i partecipanti
-        participants = [call_info["sender_id"], call_info["recipient_id"]]
-        if call_info.get("group_members"):
-            participants.extend(call_info["group_members"])
-        
-        for participant in participants:
-            if participant != user_id:  # Non notificare chi ha terminato
-                end_notification = {
-                    "type": "call_status",
-                    "call_id": call_id,
-                    "status": CallStatus.ENDED.value,
-                    "duration": call_info["duration"],
-                    "timestamp": time.time()
-                }
-                await send_websocket_notification(participant, end_notification)
+        participants = call_participants(call_info)
+        
+        end_notification = {
+            "type": "call_status",
+            "call_id": call_id,
+            "status": CallStatus.ENDED.value,
+            "duration": call_info["duration"],
+            "timestamp": time.time()
+        }
+        # Non notificare chi ha terminato
+        await send_websocket_notifications(
+            {participant for participant in participants if participant != user_id},
+            end_notification
+        )
         
         print(f"📞 Chiamata {call_id} terminata da {user_id} (durata: {call_info['duration']}s)")
         
@@ -789,44 +1539,36 @@ async def end_call(call_id: str, user_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/poll/{device_token}")
-async def poll_notifications(device_token: str):
-    """Polling per ottenere notifiche per un dispositivo"""
+async def poll_notifications(device_token: str, wait: float = 0):
+    """
+    Polling per ottenere notifiche per un dispositivo
+    
+    Restituisce solo le notifiche non ancora consegnate (delta rispetto al poll precedente).
+    Con ?wait=N (long-poll, max MAX_LONG_POLL_SECONDS) la richiesta resta in attesa
+    finché arriva una notifica o scade il timeout, invece di tornare subito vuota.
+    """
     try:
-        print(f"🔄 Polling richiesto per device_token: {device_token[:20]}...")
-        print(f"📋 Dispositivi registrati: {len(devices)}")
-        
         # Trova il dispositivo
-        device = devices.get(device_token)
+        device = registry.get(device_token)
         if not device:
             print(f"❌ Dispositivo non trovato: {device_token[:20]}...")
-            print(f"📋 Device tokens disponibili: {list(devices.keys())[:5]}...")
             return {"notifications": [], "status": "device_not_found"}
         
-        print(f"✅ Dispositivo trovato: {device.user_id} ({device.platform})")
-        
-        # Aggiorna last_seen
+        # Aggiorna last_seen (in memoria: il database è aggiornato dal flush periodico)
         device.last_seen = time.time()
-        device.is_online = True
-        
-        # 💾 Aggiorna anche nel database
-        save_device_to_db(device)
+        registry.set_online(device_token, True)
+        device_state.mark(device)
         
-        # Ottieni le notifiche per questo utente
-        user_notifications = notifications.get(device.user_id, [])
-        print(f"🔍 Polling - User ID: {device.user_id}")
-        print(f"🔍 Polling - Notifiche totali per utente: {len(user_notifications)}")
-        print(f"🔍 Polling - Notifiche disponibili: {list(notifications.keys())}")
-        
-        # Filtra solo notifiche non consegnate
-        pending_notifications = [
-            notif for notif in user_notifications 
-            if not notif.delivered
-        ]
-        print(f"🔍 Polling - Notifiche non consegnate: {len(pending_notifications)}")
+        wait = min(max(wait, 0), MAX_LONG_POLL_SECONDS)
+        if wait:
+            await notification_store.wait_for_pending(device.user_id, wait)
         
-        # Marca come consegnate
+        # Solo le notifiche non consegnate, già marcate come consegnate dallo store
+        pending_notifications = notification_store.take_pending(device.user_id)
         for notif in pending_notifications:
-            notif.delivered = True
+            if notif.call_status == CallStatus.INCOMING:
+                # Chiamata consegnata al dispositivo: sta squillando
+                call_engine.transition(notif.data.get("call_id"), CallStatus.RINGING)
         
         # Converti in formato JSON
         notifications_data = []
@@ -882,8 +1624,10 @@ async def initialize_server():
         return {
             "status": "success",
             "message": "Mappature inizializzate",
-            "user_to_device_count": len(user_to_device),
-            "device_to_user_count": len(device_to_user)
+            "users_count": len(registry.by_user),
+            "devices_count": len(registry),
+            "online_devices_count": registry.online_count(),
+            "connected_devices_count": registry.connected_count()
         }
     except Exception as e:
         print(f"❌ Errore inizializzazione: {e}")
@@ -892,7 +1636,7 @@ async def initialize_server():
 @app.get("/notifications/{user_id}")
 async def get_user_notifications(user_id: str):
     """Ottieni tutte le notifiche per un utente (per debug)"""
-    user_notifications = notifications.get(user_id, [])
+    user_notifications = notification_store.list(user_id)
     return {
         "notifications": [asdict(notif) for notif in user_notifications],
         "count": len(user_notifications)
@@ -901,8 +1645,7 @@ async def get_user_notifications(user_id: str):
 @app.delete("/notifications/{user_id}")
 async def clear_user_notifications(user_id: str):
     """Cancella tutte le notifiche per un utente"""
-    if user_id in notifications:
-        del notifications[user_id]
+    if notification_store.clear(user_id):
         return {"status": "success", "message": f"Notifiche cancellate per {user_id}"}
     return {"status": "error", "message": "Utente non trovato"}
 
@@ -913,7 +1656,7 @@ async def health_check():
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
         "devices_count": len(devices),
-        "notifications_count": sum(len(notifs) for notifs in notifications.values())
+        "notifications_count": len(notification_store)
     }
 
 @app.websocket("/ws/{device_token}")
@@ -922,15 +1665,15 @@ async def websocket_endpoint(websocket: WebSocket, device_token: str):
     await websocket.accept()
     
     # Trova il dispositivo
-    device = devices.get(device_token)
+    device = registry.get(device_token)
     if not device:
         await websocket.close(code=1008, reason="Device not found")
         return
     
-    # Aggiorna il WebSocket del dispositivo
-    device.websocket = websocket
-    device.is_online = True
+    # Aggiorna il WebSocket del dispositivo (gli altri dispositivi dell'utente restano connessi)
+    registry.attach_socket(device_token, websocket)
     device.last_seen = time.time()
+    device_state.mark(device)
     
     print(f"📡 WebSocket connesso per {device.user_id} ({device.platform})")
     
@@ -950,7 +1693,7 @@ async def websocket_endpoint(websocket: WebSocket, device_token: str):
                 user_id = device.user_id
                 
                 if action == "answer":
-                    await answer_call(call_id, user_id)
+                    await answer_call(call_id, CallAnswerRequest(user_id=user_id, auth_token=message.get("auth_token")))
                 elif action == "reject":
                     await reject_call(call_id, user_id)
                 elif action == "end":
@@ -958,12 +1701,12 @@ async def websocket_endpoint(websocket: WebSocket, device_token: str):
                     
     except WebSocketDisconnect:
         print(f"📡 WebSocket disconnesso per {device.user_id}")
-        device.websocket = None
-        device.is_online = False
+        registry.detach_socket(device_token, websocket)
+        device_state.mark(device)
     except Exception as e:
         print(f"❌ Errore WebSocket per {device.user_id}: {e}")
-        device.websocket = None
-        device.is_online = False
+        registry.detach_socket(device_token, websocket)
+        device_state.mark(device)
 
 @app.get("/calls/active")
 async def get_active_calls():
@@ -990,18 +1733,19 @@ async def start_group_call(call_data: GroupCallRequest):
     try:
         call_id = call_data.call_id or generate_call_id()
         
+        existing = call_engine.get(call_id)
+        if existing is not None:
+            return CallResponse(call_id=call_id, status=existing["status"], message="Chiamata di gruppo già avviata")
+        
         # Verifica che tutti i membri siano online
         online_members = []
         offline_members = []
         
+        # Una lookup sull'indice online per membro: O(membri), non O(membri × dispositivi)
         for member_id in call_data.group_members:
-            device_found = False
-            for device in devices.values():
-                if device.user_id == member_id and device.is_online:
-                    online_members.append(member_id)
-                    device_found = True
-                    break
-            if not device_found:
+            if registry.is_online(member_id):
+                online_members.append(member_id)
+            else:
                 offline_members.append(member_id)
         
         if not online_members:
@@ -1031,56 +1775,53 @@ async def start_group_call(call_data: GroupCallRequest):
             "participants_joined": []
         }
         
-        active_calls[call_id] = call_info
+        call_engine.start(call_info, GROUP_CALL_RING_TIMEOUT_SECONDS)
         
         # Invia notifiche a tutti i membri online
-        for member_id in online_members:
-            if member_id != call_data.sender_id:  # Non notificare il creatore
-                notification = Notification(
-                    id=generate_notification_id(),
-                    recipient_id=member_id,
-                    title=f"Chiamata di gruppo {call_data.call_type}",
-                    body=f"{call_data.room_name} - Invitato da {call_data.sender_id}",
-                    data={
-                        "call_id": call_id,
-                        "call_type": call_data.call_type,
-                        "is_group": True,
-                        "group_members": call_data.group_members,
-                        "room_name": call_data.room_name,
-                        "sender_id": call_data.sender_id,
-                        "timestamp": time.time(),
-                        "priority": "high"
-                    },
-                    sender_id=call_data.sender_id,
-                    timestamp=time.time(),
-                    notification_type=NotificationType.GROUP_CALL if call_data.call_type == "audio" else NotificationType.GROUP_VIDEO_CALL,
-                    call_status=CallStatus.INCOMING,
-                    delivered=False
-                )
-                
-                # Aggiungi alla coda notifiche
-                if member_id not in notifications:
-                    notifications[member_id] = []
-                notifications[member_id].append(notification)
-                
-                # Invia tramite WebSocket
-                call_notification = {
-                    "type": "group_call",
+        invited_members = [member_id for member_id in online_members if member_id != call_data.sender_id]  # Non notificare il creatore
+        for member_id in invited_members:
+            notification = Notification(
+                id=generate_notification_id(),
+                recipient_id=member_id,
+                title=f"Chiamata di gruppo {call_data.call_type}",
+                body=f"{call_data.room_name} - Invitato da {call_data.sender_id}",
+                data={
                     "call_id": call_id,
                     "call_type": call_data.call_type,
+                    "is_group": True,
+                    "group_members": call_data.group_members,
                     "room_name": call_data.room_name,
                     "sender_id": call_data.sender_id,
-                    "group_members": call_data.group_members,
-                    "online_members": online_members,
-                    "status": CallStatus.INCOMING.value,
                     "timestamp": time.time(),
-                    "priority": "high",
-                    "timeout": 60  # Timeout più lungo per chiamate di gruppo
-                }
-                await send_websocket_notification(member_id, call_notification)
+                    "priority": "high"
+                },
+                sender_id=call_data.sender_id,
+                timestamp=time.time(),
+                notification_type=NotificationType.GROUP_CALL if call_data.call_type == "audio" else NotificationType.GROUP_VIDEO_CALL,
+                call_status=CallStatus.INCOMING,
+                delivered=False
+            )
+            
+            # Aggiungi alla coda notifiche
+            notification_store.add(notification)
         
-        # Programma timeout automatico
-        asyncio.create_task(auto_timeout_call(call_id, 60))
+        # Invia tramite WebSocket a tutti gli invitati in parallelo
+        call_notification = {
+            "type": "group_call",
+            "call_id": call_id,
+            "call_type": call_data.call_type,
+            "room_name": call_data.room_name,
+            "sender_id": call_data.sender_id,
+            "group_members": call_data.group_members,
+            "online_members": online_members,
+            "status": CallStatus.INCOMING.value,
+            "timestamp": time.time(),
+            "priority": "high",
+            "timeout": GROUP_CALL_RING_TIMEOUT_SECONDS  # Timeout più lungo per chiamate di gruppo
+        }
+        await send_websocket_notifications(invited_members, call_notification)
+        if invited_members:
+            call_engine.transition(call_id, CallStatus.RINGING)
         
         print(f"📞 Chiamata di gruppo {call_data.call_type} iniziata: {call_id}")
         print(f"📞 Creatore: {call_data.sender_id}, Membri online: {len(online_members)}")
@@ -1101,15 +1842,14 @@ async def start_group_call(call_data: GroupCallRequest):
 async def join_group_call(call_id: str, request_data: CallAnswerRequest):
     """Partecipa a una chiamata di gruppo"""
     try:
-        if call_id not in active_calls:
+        call_info = call_engine.get(call_id)
+        if call_info is None or call_info["status"] in CallEngine.TERMINAL:
             return CallResponse(
                 call_id=call_id,
                 status=CallStatus.REJECTED,
                 message="Chiamata di gruppo non trovata"
             )
         
-        call_info = active_calls[call_id]
-        
         # Verifica che l'utente sia nei membri del gruppo
         if request_data.user_id not in call_info["group_members"]:
             return CallResponse(
@@ -1120,7 +1860,7 @@ async def join_group_call(call_id: str, request_data: CallAnswerRequest):
         
         # Aggiungi ai partecipanti
         if request_data.user_id not in call_info["participants_joined"]:
-            call_info["participants_joined"].append(request_data.user_id)
+            call_engine.update(call_id, participants_joined=call_info["participants_joined"] + [request_data.user_id])
         
         # Se è il primo a partecipare, crea la sessione WebRTC
         if not call_info["webrtc_session"] and len(call_info["participants_joined"]) == 1:
@@ -1137,21 +1877,19 @@ async def join_group_call(call_id: str, request_data: CallAnswerRequest):
             )
             
             if webrtc_session:
-                call_info["webrtc_session"] = webrtc_session
-                call_info["janus_room_id"] = webrtc_session.get("room_id")
-                call_info["status"] = CallStatus.ANSWERED
+                call_engine.update(call_id, webrtc_session=webrtc_session, janus_room_id=webrtc_session.get("room_id"))
+                call_engine.transition(call_id, CallStatus.ANSWERED)
         
         # Notifica tutti i partecipanti del nuovo membro
-        for member_id in call_info["participants_joined"]:
-            member_notification = {
-                "type": "group_call_member_joined",
-                "call_id": call_id,
-                "joined_member": request_data.user_id,
-                "participants_count": len(call_info["participants_joined"]),
-                "webrtc_session": call_info["webrtc_session"],
-                "timestamp": time.time()
-            }
-            await send_websocket_notification(member_id, member_notification)
+        member_notification = {
+            "type": "group_call_member_joined",
+            "call_id": call_id,
+            "joined_member": request_data.user_id,
+            "participants_count": len(call_info["participants_joined"]),
+            "webrtc_session": call_info["webrtc_session"],
+            "timestamp": time.time()
+        }
+        await send_websocket_notifications(call_info["participants_joined"], member_notification)
         
         print(f"📞 {request_data.user_id} si è unito alla chiamata di gruppo {call_id}")
         print(f"📞 Partecipanti totali: {len(call_info['participants_joined'])}")
@@ -1169,16 +1907,15 @@ async def join_group_call(call_id: str, request_data: CallAnswerRequest):
 @app.delete("/calls/{call_id}")
 async def cleanup_call(call_id: str):
     """Pulisci una chiamata terminata"""
-    if call_id in active_calls:
-        del active_calls[call_id]
+    if call_engine.remove(call_id):
         return {"status": "success", "message": f"Chiamata {call_id} pulita"}
     return {"status": "error", "message": "Chiamata non trovata"}
 
 @app.get("/stats")
 async def get_stats():
     """Statistiche del servizio"""
-    online_devices = sum(1 for device in devices.values() if device.is_online)
-    total_notifications = sum(len(notifs) for notifs in notifications.values())
+    online_devices = registry.online_count()
+    total_notifications = len(notification_store)
     
     return {
         "devices": {
@@ -1188,11 +1925,13 @@ async def get_stats():
         },
         "notifications": {
             "total": total_notifications,
-            "by_user": {user_id: len(notifs) for user_id, notifs in notifications.items()}
+            "by_user": notification_store.counts_by_user()
         },
         "calls": {
             "active": len(active_calls),
-            "total_today": call_counter
+            "total_today": call_counter,
+            "timers": len(call_engine.wheel),
+            "pending_sync": call_engine.pending_sync()
         },
         "platforms": {
             platform: sum(1 for device in devices.values() if device.platform == platform)
@@ -1218,7 +1957,8 @@ async def root():
         "endpoints": [
             "POST /register - Registra dispositivo",
             "POST /send - Invia notifica",
-            "GET /poll/{device_token} - Polling notifiche",
+            "POST /send_batch - Invia più notifiche in una richiesta",
+            "GET /poll/{device_token}?wait=N - Polling notifiche (long-poll opzionale)",
             "WS /ws/{device_token} - WebSocket real-time",
             "POST /call/start - Inizia chiamata 1:1",
             "POST /call/group/start - Inizia chiamata di gruppo",
@@ -0,0 +1,265 @@
+"""
+Aggiornamenti periodici della dashboard admin, condivisi tra tutti i socket
+
+Prima ogni AdminDashboardConsumer aveva un proprio loop: statistiche e
+psutil.cpu_percent(interval=1) (un secondo bloccante) venivano ricalcolati
+per ogni admin connesso e inviati all'intero gruppo, quindi ogni admin
+riceveva N copie dello stesso aggiornamento.
+
+Ora c'è un solo collector per processo, avviato al primo socket admin e
+fermato quando l'ultimo si disconnette:
+- a ogni tick calcola solo ciò che è scaduto (statistiche, salute del
+  sistema, stato dei server) in un thread, senza bloccare l'event loop
+- CPU, memoria e disco vengono dall'ultimo campione del collector metriche
+  (admin_panel.metrics), senza chiamate psutil bloccanti
+- pubblica nel gruppo del channel layer a cui sono iscritti tutti i socket
+- con più processi solo il leader (lease nella cache condivisa) calcola e
+  pubblica; gli altri ricevono gli aggiornamenti dal gruppo
+"""
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.cache import caches, InvalidCacheBackendError
+from django.utils import timezone
+from .dashboard_views import dashboard_stats_payload, system_usage
+from . import metrics
+import asyncio
+import logging
+import os
+import socket
+import time
+
+logger = logging.getLogger('securevox')
+
+GROUP_NAME = 'dashboard_admin_dashboard'
+LEADER_KEY = 'admin-dashboard-broadcast-leader'
+
+KIND_STATS = 'dashboard_stats_update'
+KIND_HEALTH = 'system_health_update'
+KIND_SERVERS = 'server_status_update'
+
+_DEFAULTS = {
+    'STATS_INTERVAL': 10,
+    'HEALTH_INTERVAL': 5,
+    'SERVERS_INTERVAL': 15,
+    'LEADER_LEASE': 30,
+    'LEADER_CACHE_ALIAS': getattr(settings, 'COORDINATION_CACHE_ALIAS', 'coordination'),
+    'SERVICE_CHECK_TIMEOUT': 2,
+}
+BROADCAST_CONFIG = {**_DEFAULTS, **getattr(settings, 'ADMIN_DASHBOARD_BROADCAST', {})}
+
+SERVICE_URLS = {
+    'call_server': 'http://localhost:8003/health',
+    'notification_server': 'http://localhost:8002/health',
+}
+
+TICK_SECONDS = 1
+
+
+class DashboardBroadcaster:
+    """Collector di processo che pubblica gli aggiornamenti nel gruppo admin"""
+
+    def __init__(self):
+        self._subscribers = 0
+        self._task = None
+        self._latest = {}
+        self._instance_id = f"{socket.gethostname()}:{os.getpid()}:{id(self)}"
+
+    def subscribe(self):
+        """Un socket admin in più; avvia il collector se non è attivo"""
+        self._subscribers += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def unsubscribe(self):
+        self._subscribers = max(self._subscribers - 1, 0)
+
+    def remember(self, event):
+        """Ultimo evento per tipo, anche se pubblicato dal leader di un altro processo"""
+        self._latest[event['type']] = event
+
+    async def latest(self, kind):
+        """Ultimo evento del tipo richiesto, calcolato ora se non ancora disponibile"""
+        event = self._latest.get(kind)
+        if event is None:
+            event = await database_sync_to_async(_collect_one, thread_sensitive=False)(kind)
+            self._latest[kind] = event
+        return event
+
+    async def _run(self):
+        channel_layer = get_channel_layer()
+        intervals = {
+            KIND_STATS: BROADCAST_CONFIG['STATS_INTERVAL'],
+            KIND_HEALTH: BROADCAST_CONFIG['HEALTH_INTERVAL'],
+            KIND_SERVERS: BROADCAST_CONFIG['SERVERS_INTERVAL'],
+        }
+        # Il primo giro parte dopo un intervallo: i socket ricevono già i dati iniziali
+        started = time.monotonic()
+        last_run = {kind: started for kind in intervals}
+        logger.info("📡 Collector dashboard admin avviato")
+        try:
+            while self._subscribers > 0:
+                await asyncio.sleep(TICK_SECONDS)
+                now = time.monotonic()
+                due = [kind for kind, interval in intervals.items() if now - last_run[kind] >= interval]
+                if not due:
+                    continue
+                for kind in due:
+                    last_run[kind] = now
+                try:
+                    events = await database_sync_to_async(_collect, thread_sensitive=False)(due, self._instance_id)
+                    for event in events:
+                        self.remember(event)
+                        await channel_layer.group_send(GROUP_NAME, event)
+                except Exception as e:
+                    logger.error(f"Error in dashboard broadcast: {e}")
+        finally:
+            await sync_to_async(_release_leadership, thread_sensitive=False)(self._instance_id)
+            logger.info("📡 Collector dashboard admin fermato (nessun admin connesso)")
+
+
+broadcaster = DashboardBroadcaster()
+
+
+def _collect(kinds, instance_id):
+    """Calcola gli eventi scaduti, solo se questo processo è il leader"""
+    if not _hold_leadership(instance_id):
+        return []
+    return [_collect_one(kind) for kind in kinds]
+
+
+def _collect_one(kind):
+    if kind == KIND_STATS:
+        payload = {'data': dashboard_stats_payload()}
+    elif kind == KIND_HEALTH:
+        payload = {'data': collect_system_health()}
+    else:
+        payload = {'servers': collect_server_status()}
+    return {'type': kind, **payload, 'timestamp': timezone.now().isoformat()}
+
+
+def _leader_cache():
+    try:
+        return caches[BROADCAST_CONFIG['LEADER_CACHE_ALIAS']]
+    except InvalidCacheBackendError:
+        return caches['default']
+
+
+def _hold_leadership(instance_id):
+    cache = _leader_cache()
+    lease = BROADCAST_CONFIG['LEADER_LEASE']
+    if cache.add(LEADER_KEY, instance_id, timeout=lease):
+        return True
+    if cache.get(LEADER_KEY) == instance_id:
+        cache.touch(LEADER_KEY, lease)
+        return True
+    return False
+
+
+def _release_leadership(instance_id):
+    cache = _leader_cache()
+    if cache.get(LEADER_KEY) == instance_id:
+        cache.delete(LEADER_KEY)
+
+
+def collect_system_health():
+    """Salute del sistema senza attese: ultimo campione delle metriche, servizi verificati in parallelo"""
+    with ThreadPoolExecutor(max_workers=len(SERVICE_URLS)) as executor:
+        checks = {name: executor.submit(check_service_health, url) for name, url in SERVICE_URLS.items()}
+        services_status = {
+            'django': True,
+            'call_server': checks['call_server'].result(),
+            'notification_server': checks['notification_server'].result(),
+            'database': True,  # Se arriviamo qui, il DB funziona
+            'redis': True,  # Mock
+        }
+
+    active_services = sum(1 for status in services_status.values() if status)
+    health_score = (active_services / len(services_status)) * 100
+
+    return {
+        'system': {**system_usage(metrics.get_collector().latest()), 'uptime': get_system_uptime()},
+        'services': services_status,
+        'health_score': health_score,
+        'status': 'healthy' if health_score > 80 else 'warning' if health_score > 50 else 'critical'
+    }
+
+
+def collect_server_status():
+    """Ottiene lo stato dei server"""
+    # Mock per ora - implementare con i server reali
+    return [
+        {
+            'id': 'django-server',
+            'name': 'Django Server',
+            'hostname': 'localhost',
+            'ip_address': '127.0.0.1',
+            'port': 8001,
+            'technology': 'Django',
+            'function': 'Web API',
+            'status': 'active',
+            'cpu_usage': 25.0,
+            'memory_usage': 45.0,
+            'disk_usage': 30.0,
+            'uptime': 3600,
+            'last_checked': timezone.now().isoformat(),
+            'alerts': [],
+            'size': '2GB',
+        },
+        {
+            'id': 'call-server',
+            'name': 'Call Server',
+            'hostname': 'localhost',
+            'ip_address': '127.0.0.1',
+            'port': 8003,
+            'technology': 'Node.js',
+            'function': 'WebRTC Calls',
+            'status': 'active',
+            'cpu_usage': 15.0,
+            'memory_usage': 30.0,
+            'disk_usage': 20.0,
+            'uptime': 3600,
+            'last_checked': timezone.now().isoformat(),
+            'alerts': [],
+            'size': '1GB',
+        },
+        {
+            'id': 'notification-server',
+            'name': 'Notification Server',
+            'hostname': 'localhost',
+            'ip_address': '127.0.0.1',
+            'port': 8002,
+            'technology': 'Python',
+            'function': 'Push Notifications',
+            'status': 'active',
+            'cpu_usage': 10.0,
+            'memory_usage': 25.0,
+            'disk_usage': 15.0,
+            'uptime': 3600,
+            'last_checked': timezone.now().isoformat(),
+            'alerts': [],
+            'size': '512MB',
+        }
+    ]
+
+
+def check_service_health(url):
+    """Verifica lo stato di salute di un servizio"""
+    try:
+        import requests
+        response = requests.get(url, timeout=BROADCAST_CONFIG['SERVICE_CHECK_TIMEOUT'])
+        return response.status_code == 200
+    except Exception:
+        return False
+
+
+def get_system_uptime():
+    """Ottiene l'uptime del sistema"""
+    try:
+        with open('/proc/uptime', 'r') as f:
+            uptime_seconds = float(f.readline().split()[0])
+        return int(uptime_seconds)
+    except Exception:
+        return 0
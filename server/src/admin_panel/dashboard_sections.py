@@ -1,11 +1,14 @@
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.contrib.auth.models import User
 from django.db.models import Count, Q, Avg, Sum
 from django.utils import timezone
 from datetime import datetime, timedelta
 import json
+import numpy as np
 
 from crypto.models import Device, Message, Session
+from api.models import MediaObject
+from . import metrics, rollups
 
 
 def get_devices_management(request):
@@ -184,25 +187,32 @@ def get_media_management(request):
     if not request.user.is_superuser:
         return JsonResponse({'error': 'Accesso negato'}, status=403)
     
-    # Statistiche media (approssimative)
-    media_messages = Message.objects.filter(
-        message_type__in=['image', 'video', 'audio', 'file']
-    )
+    # Statistiche media: una sola aggregazione indicizzata sulla mappa degli upload
+    by_kind = {
+        row['kind']: row
+        for row in MediaObject.objects.values('kind').annotate(files=Count('id'), total_bytes=Sum('size'))
+    }
+    
+    def files(kind):
+        return by_kind.get(kind, {}).get('files', 0)
+    
+    def megabytes(*kinds):
+        return round(sum(by_kind.get(kind, {}).get('total_bytes') or 0 for kind in kinds) / (1024 * 1024), 2)
     
     media_stats = {
-        'total_files': media_messages.count(),
+        'total_files': sum(row['files'] for row in by_kind.values()),
         'by_type': {
-            'images': Message.objects.filter(message_type='image').count(),
-            'videos': Message.objects.filter(message_type='video').count(),
-            'audios': Message.objects.filter(message_type='audio').count(),
-            'documents': Message.objects.filter(message_type='file').count(),
+            'images': files(MediaObject.KIND_IMAGE),
+            'videos': files(MediaObject.KIND_VIDEO),
+            'audios': files(MediaObject.KIND_AUDIO),
+            'documents': files(MediaObject.KIND_FILE),
         },
         'storage_usage': {
-            'total_mb': 1024,  # Mock - calcolare da file reali
-            'images_mb': 512,
-            'videos_mb': 256,
-            'audios_mb': 128,
-            'documents_mb': 128,
+            'total_mb': megabytes(*by_kind),
+            'images_mb': megabytes(MediaObject.KIND_IMAGE),
+            'videos_mb': megabytes(MediaObject.KIND_VIDEO),
+            'audios_mb': megabytes(MediaObject.KIND_AUDIO),
+            'documents_mb': megabytes(MediaObject.KIND_FILE),
         },
         'recent_uploads': get_recent_media_uploads(),
     }
@@ -263,28 +273,19 @@ def get_analytics_data(request):
     if not request.user.is_superuser:
         return JsonResponse({'error': 'Accesso negato'}, status=403)
     
-    now = timezone.now()
-    last_30d = now - timedelta(days=30)
+    stats = rollups.get_stats()
     
     # Analisi crescita utenti
-    user_growth = []
-    for i in range(30):
-        date = now - timedelta(days=29-i)
-        count = User.objects.filter(date_joined__date=date.date()).count()
-        user_growth.append({
-            'date': date.strftime('%Y-%m-%d'),
-            'users': count
-        })
+    user_growth = [
+        {'date': day.strftime('%Y-%m-%d'), 'users': count}
+        for day, count in stats.daily('users_joined', 30)
+    ]
     
     # Analisi attività messaggi
-    message_activity = []
-    for i in range(7):
-        date = now - timedelta(days=6-i)
-        count = Message.objects.filter(created_at__date=date.date()).count()
-        message_activity.append({
-            'date': date.strftime('%Y-%m-%d'),
-            'messages': count
-        })
+    message_activity = [
+        {'date': day.strftime('%Y-%m-%d'), 'messages': count}
+        for day, count in stats.daily('messages', 7)
+    ]
     
     # Top utenti per attività
     top_users = User.objects.annotate(
@@ -302,16 +303,14 @@ def get_analytics_data(request):
     
     # Statistiche dispositivi nel tempo
     device_stats = {
-        'growth': Device.objects.filter(created_at__gte=last_30d).count(),
+        'growth': sum(count for _, count in stats.daily('devices_registered', 30)),
         'active_percentage': (
-            Device.objects.filter(is_active=True).count() / 
-            max(Device.objects.count(), 1)
+            stats.gauge('devices_active') /
+            max(stats.gauge('devices_total'), 1)
         ) * 100,
         'platform_distribution': {
-            'android': Device.objects.filter(device_type='android').count(),
-            'ios': Device.objects.filter(device_type='ios').count(),
-            'web': Device.objects.filter(device_type='web').count(),
-            'desktop': Device.objects.filter(device_type='desktop').count(),
+            device_type: stats.gauge('devices_by_type', device_type)
+            for device_type in ('android', 'ios', 'web', 'desktop')
         }
     }
     
@@ -321,16 +320,10 @@ def get_analytics_data(request):
         'top_users': top_users_data,
         'device_stats': device_stats,
         'engagement_metrics': {
-            'daily_active_users': User.objects.filter(
-                last_login__gte=now - timedelta(days=1)
-            ).count(),
-            'weekly_active_users': User.objects.filter(
-                last_login__gte=now - timedelta(days=7)
-            ).count(),
-            'monthly_active_users': User.objects.filter(
-                last_login__gte=now - timedelta(days=30)
-            ).count(),
-            'retention_rate': calculate_retention_rate(),
+            'daily_active_users': stats.gauge('users_active_24h'),
+            'weekly_active_users': stats.gauge('users_active_7d'),
+            'monthly_active_users': stats.gauge('users_active_30d'),
+            'retention_rate': calculate_retention_rate(stats),
         }
     })
 
@@ -340,35 +333,30 @@ def get_monitoring_data(request):
     if not request.user.is_superuser:
         return JsonResponse({'error': 'Accesso negato'}, status=403)
     
-    try:
-        import psutil
-        PSUTIL_AVAILABLE = True
-    except ImportError:
-        PSUTIL_AVAILABLE = False
-    
-    # Metriche sistema
-    if PSUTIL_AVAILABLE:
+    # Metriche sistema: ultimo campione del collector (nessuna chiamata psutil qui)
+    sample = metrics.get_collector().latest()
+    if sample:
         system_metrics = {
             'cpu': {
-                'usage': psutil.cpu_percent(interval=1),
-                'cores': psutil.cpu_count(),
-                'load_avg': list(psutil.getloadavg()) if hasattr(psutil, 'getloadavg') else [0, 0, 0],
+                'usage': sample['cpu']['usage'],
+                'cores': sample['cpu']['cores'],
+                'load_avg': sample['cpu']['load_avg'],
             },
             'memory': {
-                'total': psutil.virtual_memory().total // (1024**3),  # GB
-                'used': psutil.virtual_memory().used // (1024**3),   # GB
-                'percentage': psutil.virtual_memory().percent,
+                'total': sample['memory']['total'] // (1024**3),  # GB
+                'used': sample['memory']['used'] // (1024**3),   # GB
+                'percentage': sample['memory']['percentage'],
             },
             'disk': {
-                'total': psutil.disk_usage('/').total // (1024**3),  # GB
-                'used': psutil.disk_usage('/').used // (1024**3),   # GB
-                'percentage': psutil.disk_usage('/').percent,
+                'total': sample['disk']['total'] // (1024**3),  # GB
+                'used': sample['disk']['used'] // (1024**3),   # GB
+                'percentage': sample['disk']['percentage'],
             },
             'network': {
-                'bytes_sent': psutil.net_io_counters().bytes_sent,
-                'bytes_recv': psutil.net_io_counters().bytes_recv,
-                'packets_sent': psutil.net_io_counters().packets_sent,
-                'packets_recv': psutil.net_io_counters().packets_recv,
+                'bytes_sent': sample['network']['bytes_sent'],
+                'bytes_recv': sample['network']['bytes_recv'],
+                'packets_sent': sample['network']['packets_sent'],
+                'packets_recv': sample['network']['packets_recv'],
             }
         }
     else:
@@ -436,33 +424,85 @@ def get_monitoring_data(request):
     })
 
 
+
+def get_metrics_history(request):
+    """
+    API storico metriche dal ring buffer del collector (nel processo leader)
+    
+    Parametri GET:
+        series: nomi separati da virgola (default: metriche di sistema)
+        range: secondi di storico (default 3600)
+        points: numero massimo di punti, con min/max/media per punto (default 600)
+        format: 'json' (default) oppure 'binary' (float32 little-endian,
+            forma punti × serie × [min, max, media], metadati negli header)
+    """
+    if not (request.user.is_staff or request.user.is_superuser):
+        return JsonResponse({'error': 'Accesso negato'}, status=403)
+    
+    collector = metrics.get_collector()
+    names = [name for name in request.GET.get('series', '').split(',') if name] or list(metrics.SYSTEM_SERIES)
+    unknown = [name for name in names if name not in collector.series]
+    if unknown:
+        return JsonResponse({'error': f"Serie sconosciute: {', '.join(unknown)}", 'available': collector.series}, status=400)
+    try:
+        seconds = max(int(request.GET.get('range', 3600)), 1)
+        points = min(max(int(request.GET.get('points', metrics.METRICS_CONFIG['MAX_POINTS'])), 1), 5000)
+    except ValueError:
+        return JsonResponse({'error': 'range e points devono essere interi'}, status=400)
+    
+    try:
+        result = collector.query_range(names, seconds, points)
+    except metrics.MetricsUnavailable as e:
+        return JsonResponse({'error': f"Metriche non disponibili: {e}"}, status=503)
+    values = result['values']
+    
+    if request.GET.get('format') == 'binary':
+        response = HttpResponse(values.astype('<f4').tobytes(), content_type='application/octet-stream')
+        response['X-Metrics-Series'] = ','.join(names)
+        response['X-Metrics-Stats'] = ','.join(metrics.STATS)
+        response['X-Metrics-Shape'] = ','.join(str(size) for size in values.shape)
+        response['X-Metrics-Start'] = str(result['start'])
+        response['X-Metrics-Step'] = str(result['step'])
+        return response
+    
+    # JSON: NaN (nessun campione) → null, valori arrotondati
+    rounded = values.round(3).astype(object)
+    rounded[np.isnan(values)] = None
+    return JsonResponse({
+        'start': result['start'],
+        'step': result['step'],
+        'points': values.shape[0],
+        'series': {
+            name: {stat: rounded[:, column, position].tolist() for position, stat in enumerate(metrics.STATS)}
+            for column, name in enumerate(names)
+        },
+    })
+
 # Helper functions
 def get_recent_media_uploads():
     """Ottiene i caricamenti media recenti"""
-    recent_media = Message.objects.filter(
-        message_type__in=['image', 'video', 'audio', 'file'],
+    recent_media = MediaObject.objects.filter(
         created_at__gte=timezone.now() - timedelta(hours=24)
-    ).order_by('-created_at')[:10]
+    ).select_related('owner').order_by('-created_at')[:10]
     
     return [
         {
-            'id': str(msg.id),
-            'type': msg.message_type,
-            'sender': msg.sender.user.username,
-            'created_at': msg.created_at.isoformat(),
-            'size_estimate': '1.2 MB',  # Mock
+            'id': str(media.id),
+            'type': media.kind,
+            'sender': media.owner.username if media.owner else None,
+            'created_at': media.created_at.isoformat(),
+            'size_estimate': f"{media.size / (1024 * 1024):.1f} MB",
+            'encrypted': media.encrypted,
         }
-        for msg in recent_media
+        for media in recent_media
     ]
 
 
-def calculate_retention_rate():
+def calculate_retention_rate(stats):
     """Calcola il tasso di retention"""
     # Implementazione semplificata
-    total_users = User.objects.count()
-    active_users = User.objects.filter(
-        last_login__gte=timezone.now() - timedelta(days=30)
-    ).count()
+    total_users = stats.gauge('users_total')
+    active_users = stats.gauge('users_active_30d')
     
     if total_users == 0:
         return 0
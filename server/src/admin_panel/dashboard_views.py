@@ -23,6 +23,7 @@ except ImportError:
 from crypto.models import Device, Message, Session
 from api.models import Chat, ChatMessage, Call
 from .models import UserProfile, AdminAction
+from . import metrics, rollups
 
 
 def is_admin_user(user):
@@ -45,16 +46,8 @@ def get_system_health(request):
         return JsonResponse({'error': 'Accesso negato'}, status=403)
     
     try:
-        # Informazioni sistema
-        if PSUTIL_AVAILABLE:
-            cpu_percent = psutil.cpu_percent(interval=1)
-            memory = psutil.virtual_memory()
-            disk = psutil.disk_usage('/')
-        else:
-            # Valori mock se psutil non è disponibile
-            cpu_percent = 45.0
-            memory = type('obj', (object,), {'percent': 60.0, 'total': 8*1024**3, 'available': 3*1024**3})
-            disk = type('obj', (object,), {'percent': 70.0, 'total': 500*1024**3, 'free': 150*1024**3})
+        # Informazioni sistema: ultimo campione del collector metriche (nessuna attesa)
+        system = system_usage(metrics.get_collector().latest())
         
         # Verifica servizi
         services_status = {
@@ -70,16 +63,7 @@ def get_system_health(request):
         health_score = (active_services / len(services_status)) * 100
         
         return JsonResponse({
-            'system': {
-                'cpu_usage': cpu_percent,
-                'memory_usage': memory.percent,
-                'memory_total': memory.total // (1024**3),  # GB
-                'memory_available': memory.available // (1024**3),  # GB
-                'disk_usage': disk.percent,
-                'disk_total': disk.total // (1024**3),  # GB
-                'disk_free': disk.free // (1024**3),  # GB
-                'uptime': get_system_uptime(),
-            },
+            'system': {**system, 'uptime': get_system_uptime()},
             'services': services_status,
             'health_score': health_score,
             'status': 'healthy' if health_score > 80 else 'warning' if health_score > 50 else 'critical'
@@ -89,6 +73,26 @@ def get_system_health(request):
         return JsonResponse({'error': str(e)}, status=500)
 
 
+def system_usage(sample):
+    """Utilizzo di CPU, memoria e disco (GB) da un campione del collector metriche"""
+    if not sample:
+        # Valori mock se psutil non è disponibile
+        return {
+            'cpu_usage': 45.0, 'memory_usage': 60.0, 'memory_total': 8, 'memory_available': 3,
+            'disk_usage': 70.0, 'disk_total': 500, 'disk_free': 150,
+        }
+    memory, disk = sample['memory'], sample['disk']
+    return {
+        'cpu_usage': sample['cpu']['usage'],
+        'memory_usage': memory['percentage'],
+        'memory_total': memory['total'] // (1024**3),
+        'memory_available': memory['available'] // (1024**3),
+        'disk_usage': disk['percentage'],
+        'disk_total': disk['total'] // (1024**3),
+        'disk_free': disk['free'] // (1024**3),
+    }
+
+
 def get_dashboard_stats_test(request):
     """API test con dati reali per dashboard"""
     try:
@@ -176,76 +180,54 @@ def get_dashboard_stats(request):
     if not (request.user.is_staff or request.user.is_superuser):
         return JsonResponse({'error': 'Permessi insufficienti'}, status=403)
     
+    return JsonResponse(dashboard_stats_payload())
+
+
+def dashboard_stats_payload():
+    """Statistiche della dashboard dai rollup pre-aggregati (vedi admin_panel.rollups)"""
+    stats = rollups.get_stats()
     now = timezone.now()
     last_24h = now - timedelta(hours=24)
     last_7d = now - timedelta(days=7)
-    last_30d = now - timedelta(days=30)
-    
-    # Statistiche utenti
-    total_users = User.objects.count()
-    active_users_24h = User.objects.filter(last_login__gte=last_24h).count()
-    online_users = get_online_users_count()
-    blocked_users = User.objects.filter(is_active=False).count()
-    
-    # Statistiche dispositivi
-    total_devices = Device.objects.count()
-    active_devices = Device.objects.filter(is_active=True).count()
-    compromised_devices = Device.objects.filter(
-        Q(is_rooted=True) | Q(is_jailbroken=True) | Q(is_compromised=True)
-    ).count()
-    
-    # Statistiche messaggi
-    total_messages = Message.objects.count()
-    messages_24h = Message.objects.filter(created_at__gte=last_24h).count()
-    messages_7d = Message.objects.filter(created_at__gte=last_7d).count()
-    
-    # Statistiche chiamate
-    total_calls = Call.objects.count() if hasattr(Call, 'objects') else 0
-    calls_24h = Call.objects.filter(created_at__gte=last_24h).count() if hasattr(Call, 'objects') else 0
     
-    # Statistiche chat
-    total_chats = Chat.objects.count() if hasattr(Chat, 'objects') else 0
-    active_chats = Chat.objects.filter(updated_at__gte=last_7d).count() if hasattr(Chat, 'objects') else 0
-    
-    # Traffico dati (approssimativo)
-    data_usage = calculate_data_usage()
-    
-    return JsonResponse({
+    total_messages = stats.total('messages')
+    return {
         'users': {
-            'total': total_users,
-            'active_24h': active_users_24h,
-            'online': online_users,
-            'blocked': blocked_users,
-            'growth_rate': calculate_user_growth_rate(),
+            'total': stats.gauge('users_total'),
+            'active_24h': stats.gauge('users_active_24h'),
+            'online': stats.gauge('users_online'),
+            'blocked': stats.gauge('users_blocked'),
+            'growth_rate': calculate_user_growth_rate(stats),
         },
         'devices': {
-            'total': total_devices,
-            'active': active_devices,
-            'compromised': compromised_devices,
-            'by_type': get_devices_by_type(),
+            'total': stats.gauge('devices_total'),
+            'active': stats.gauge('devices_active'),
+            'compromised': stats.gauge('devices_compromised'),
+            'by_type': get_devices_by_type(stats),
         },
         'messages': {
             'total': total_messages,
-            'last_24h': messages_24h,
-            'last_7d': messages_7d,
-            'by_type': get_messages_by_type(),
+            'last_24h': stats.since('messages', last_24h),
+            'last_7d': stats.since('messages', last_7d),
+            'by_type': get_messages_by_type(stats),
         },
         'calls': {
-            'total': total_calls,
-            'last_24h': calls_24h,
-            'average_duration': get_average_call_duration(),
+            'total': stats.total('calls'),
+            'last_24h': stats.since('calls', last_24h),
+            'average_duration': get_average_call_duration(stats),
         },
         'chats': {
-            'total': total_chats,
-            'active': active_chats,
+            'total': stats.gauge('chats_total'),
+            'active': stats.gauge('chats_active_7d'),
         },
-        'traffic': data_usage,
+        'traffic': calculate_data_usage(total_messages),
         'security': {
             'failed_logins_24h': get_failed_logins_count(),
             'blocked_ips': get_blocked_ips_count(),
             'suspicious_activity': get_suspicious_activity_count(),
-        }
-    })
+        },
+        'refreshed_at': stats.refreshed_at.isoformat() if stats.refreshed_at else None,
+    }
 
 
 def get_users_management(request):
@@ -441,16 +423,18 @@ def get_real_time_data(request):
     # Simula dati real-time
     import random
     
+    sample = metrics.get_collector().latest()
+    
     return JsonResponse({
         'timestamp': timezone.now().isoformat(),
         'active_connections': random.randint(50, 200),
         'messages_per_minute': random.randint(10, 50),
         'calls_active': random.randint(0, 10),
-        'cpu_usage': psutil.cpu_percent(),
-        'memory_usage': psutil.virtual_memory().percent,
+        'cpu_usage': sample['cpu']['usage'] if sample else None,
+        'memory_usage': sample['memory']['percentage'] if sample else None,
         'network_io': {
-            'bytes_sent': random.randint(1000000, 10000000),
-            'bytes_received': random.randint(1000000, 10000000),
+            'bytes_sent': sample['network']['bytes_sent'] if sample else 0,
+            'bytes_received': sample['network']['bytes_recv'] if sample else 0,
         },
         'alerts': get_active_alerts(),
     })
@@ -494,22 +478,10 @@ def get_system_uptime():
         return 0
 
 
-def get_online_users_count():
-    """Conta utenti online (attivi negli ultimi 5 minuti)"""
-    recent = timezone.now() - timedelta(minutes=5)
-    return User.objects.filter(last_login__gte=recent).count()
-
-
-def calculate_user_growth_rate():
-    """Calcola il tasso di crescita utenti"""
-    now = timezone.now()
-    last_month = now - timedelta(days=30)
-    
-    current_users = User.objects.filter(date_joined__gte=last_month).count()
-    previous_month = User.objects.filter(
-        date_joined__gte=last_month - timedelta(days=30),
-        date_joined__lt=last_month
-    ).count()
+def calculate_user_growth_rate(stats):
+    """Calcola il tasso di crescita utenti (ultimi 30 giorni rispetto ai 30 precedenti)"""
+    joined = [count for _, count in stats.daily('users_joined', 60)]
+    previous_month, current_users = sum(joined[:30]), sum(joined[30:])
     
     if previous_month == 0:
         return 100.0
@@ -517,37 +489,31 @@ def calculate_user_growth_rate():
     return ((current_users - previous_month) / previous_month) * 100
 
 
-def get_devices_by_type():
-    """Ottiene statistiche dispositivi per tipo"""
+def get_devices_by_type(stats):
+    """Ottiene statistiche dispositivi attivi per tipo"""
     return {
-        'android': Device.objects.filter(device_type='android', is_active=True).count(),
-        'ios': Device.objects.filter(device_type='ios', is_active=True).count(),
-        'web': Device.objects.filter(device_type='web', is_active=True).count(),
-        'desktop': Device.objects.filter(device_type='desktop', is_active=True).count(),
+        device_type: stats.gauge('devices_active_by_type', device_type)
+        for device_type in ('android', 'ios', 'web', 'desktop')
     }
 
 
-def get_messages_by_type():
+def get_messages_by_type(stats):
     """Ottiene statistiche messaggi per tipo"""
     return {
-        'text': Message.objects.filter(message_type='text').count(),
-        'image': Message.objects.filter(message_type='image').count(),
-        'video': Message.objects.filter(message_type='video').count(),
-        'audio': Message.objects.filter(message_type='audio').count(),
-        'file': Message.objects.filter(message_type='file').count(),
+        message_type: stats.total('messages', message_type)
+        for message_type in ('text', 'image', 'video', 'audio', 'file')
     }
 
 
-def get_average_call_duration():
-    """Calcola la durata media delle chiamate"""
-    # Implementa quando il modello Call è disponibile
-    return 180  # 3 minuti mock
+def get_average_call_duration(stats):
+    """Durata media (secondi) delle chiamate completate"""
+    completed = stats.total('calls', 'completed')
+    return round(stats.total('call_seconds') / completed) if completed else 0
 
 
-def calculate_data_usage():
+def calculate_data_usage(total_messages):
     """Calcola l'utilizzo dati approssimativo"""
     # Stima basata sui messaggi
-    total_messages = Message.objects.count()
     estimated_mb = total_messages * 0.1  # 0.1 MB per messaggio medio
     
     return {
@@ -633,8 +599,9 @@ def get_active_alerts():
     alerts = []
     
     # Controlla vari parametri di sistema
-    cpu_usage = psutil.cpu_percent()
-    memory_usage = psutil.virtual_memory().percent
+    system = system_usage(metrics.get_collector().latest())
+    cpu_usage = system['cpu_usage']
+    memory_usage = system['memory_usage']
     
     if cpu_usage > 80:
         alerts.append({
@@ -0,0 +1,587 @@
+"""
+Serie storiche delle metriche di sistema in ring buffer NumPy
+
+Le API di monitoraggio non chiamano più psutil a ogni richiesta (prima anche
+tre volte disk_usage('/') per la stessa risposta) e non avevano storico:
+- un solo processo campiona ogni secondo CPU, memoria, disco, rete e le
+  statistiche dei processi dei servizi (SERVICES_CONFIG di server_control):
+  il leader eletto con un lease nella cache condivisa, come il broadcaster
+  della dashboard (admin_panel.dashboard_broadcast)
+- i campioni finiscono in ring buffer a dimensione fissa a 1s / 10s / 60s
+  (METRICS['RESOLUTIONS']); per i livelli aggregati si conservano min, max
+  e media di ogni bucket
+- query_range() restituisce un intervallo alla risoluzione più fine che lo
+  copre, ridotto a max_points con min/max/media per gruppo di bucket
+- latest() restituisce l'ultimo campione completo, letto dalle view al
+  posto di psutil
+
+Il leader espone ultimo campione e intervalli su un piccolo server HTTP
+(indirizzo e token nel valore del lease): gli altri processi lo interrogano
+senza campionare né tenere buffer propri. Se il leader termina, il lease
+scade e un altro processo riparte con buffer vuoti.
+
+Il processo dei servizi (porta in ascolto) viene cercato con una sola
+scansione di net_connections() ogni SERVICE_SCAN_INTERVAL secondi, che
+fornisce anche il numero di connessioni per porta.
+"""
+from django.conf import settings
+from django.core.cache import caches, InvalidCacheBackendError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import atexit
+import json
+import logging
+import math
+import os
+import requests
+import secrets
+import socket
+import threading
+import time
+import warnings
+
+import numpy as np
+
+logger = logging.getLogger('securevox')
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+_DEFAULTS = {
+    'RESOLUTIONS': ((1, 3600), (10, 2160), (60, 1440)),  # (secondi per bucket, bucket conservati)
+    'SERVICE_SCAN_INTERVAL': 10,
+    'MAX_POINTS': 600,
+    'LEADER_LEASE': 15,  # secondi; il leader lo rinnova a ogni terzo di lease
+    'LEADER_CACHE_ALIAS': getattr(settings, 'COORDINATION_CACHE_ALIAS', 'coordination'),
+    'SERVER_HOST': '127.0.0.1',  # interfaccia del server delle serie nel processo leader
+    'REQUEST_TIMEOUT': 2,
+}
+METRICS_CONFIG = {**_DEFAULTS, **getattr(settings, 'METRICS', {})}
+
+LEADER_KEY = 'admin-metrics-collector-leader'
+
+SYSTEM_SERIES = (
+    'cpu_percent',
+    'load_1m',
+    'memory_percent',
+    'memory_used_bytes',
+    'disk_percent',
+    'disk_used_bytes',
+    'net_sent_bytes_per_sec',
+    'net_recv_bytes_per_sec',
+    'net_sent_packets_per_sec',
+    'net_recv_packets_per_sec',
+)
+SERVICE_SERIES = ('up', 'cpu_percent', 'rss_bytes', 'threads', 'connections')
+
+# Statistiche di aggregazione per bucket, nell'ordine dell'ultimo asse dei buffer
+STATS = ('min', 'max', 'avg')
+
+
+class MetricsUnavailable(Exception):
+    """Nessun leader raggiungibile (appena terminato o non ancora eletto)"""
+
+
+def series_names(services):
+    return list(SYSTEM_SERIES) + [
+        f"{service_id}.{name}" for service_id in services for name in SERVICE_SERIES
+    ]
+
+
+class MetricRing:
+    """Ring buffer di bucket a passo fisso: valori (capacità, serie, min/max/media)"""
+
+    def __init__(self, step, capacity, series_count):
+        self.step = step
+        self.capacity = capacity
+        self.values = np.full((capacity, series_count, len(STATS)), np.nan, dtype=np.float32)
+        # Indice assoluto del bucket (timestamp // step) contenuto in ogni slot
+        self.buckets = np.full(capacity, -1, dtype=np.int64)
+
+    def put(self, bucket, minimum, maximum, average):
+        slot = bucket % self.capacity
+        self.buckets[slot] = bucket
+        self.values[slot, :, 0] = minimum
+        self.values[slot, :, 1] = maximum
+        self.values[slot, :, 2] = average
+
+    def read(self, first_bucket, last_bucket):
+        """Bucket da first a last inclusi; quelli mancanti o sovrascritti sono NaN"""
+        wanted = np.arange(first_bucket, last_bucket + 1, dtype=np.int64)
+        slots = wanted % self.capacity
+        values = self.values[slots]
+        values[self.buckets[slots] != wanted] = np.nan
+        return wanted, values
+
+
+class _Accumulator:
+    """Bucket in costruzione per un livello aggregato"""
+
+    def __init__(self, series_count):
+        self.bucket = None
+        self.minimum = np.full(series_count, np.nan)
+        self.maximum = np.full(series_count, np.nan)
+        self.total = np.zeros(series_count)
+        self.count = np.zeros(series_count)
+
+    def add(self, sample):
+        present = ~np.isnan(sample)
+        self.minimum = np.fmin(self.minimum, sample)
+        self.maximum = np.fmax(self.maximum, sample)
+        self.total[present] += sample[present]
+        self.count[present] += 1
+
+    def average(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 0, self.total / self.count, np.nan)
+
+
+class MetricsCollector:
+    """Campionatore con i ring buffer delle serie (solo nel processo leader)"""
+
+    def __init__(self, services):
+        self.services = services
+        self.series = series_names(services)
+        self._index = {name: position for position, name in enumerate(self.series)}
+        self.rings = [MetricRing(step, capacity, len(self.series)) for step, capacity in METRICS_CONFIG['RESOLUTIONS']]
+        self._accumulators = [_Accumulator(len(self.series)) for _ in self.rings]
+        self._lock = threading.Lock()
+        self._thread = None
+        self._latest = None
+        self._ready = threading.Event()
+        self._stopping = threading.Event()
+        self._previous_net = None
+        self._processes = {}
+        self._connections = {}
+        self._last_scan = 0
+
+    def ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='metrics-collector', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+
+    def latest(self):
+        """Ultimo campione completo (None finché il primo non è disponibile)"""
+        # Leader appena eletto: il primo campione arriva entro un secondo
+        self._ready.wait(timeout=2)
+        return self._latest
+
+    def query_range(self, names, seconds, max_points=None):
+        """
+        Serie richieste sull'ultimo intervallo di `seconds` secondi.
+
+        Returns:
+            dict con step (secondi per punto), start (timestamp del primo punto)
+            e values: array NumPy (punti, serie, min/max/media)
+        """
+        max_points = max_points or METRICS_CONFIG['MAX_POINTS']
+        columns = [self._index[name] for name in names]
+        # Risoluzione più fine che copre l'intervallo richiesto
+        ring = next((ring for ring in self.rings if ring.step * ring.capacity >= seconds), self.rings[-1])
+        last_bucket = int(time.time()) // ring.step
+        first_bucket = last_bucket - min(math.ceil(seconds / ring.step), ring.capacity) + 1
+
+        with self._lock:
+            buckets, values = ring.read(first_bucket, last_bucket)
+        values = values[:, columns, :]
+
+        factor = max(math.ceil(len(buckets) / max_points), 1)
+        first = int(buckets[0])
+        if factor > 1:
+            # Il gruppo incompleto è il primo: l'ultimo punto resta allineato al bucket corrente
+            first -= math.ceil(len(buckets) / factor) * factor - len(buckets)
+            values = _downsample(values, factor)
+        return {
+            'step': ring.step * factor,
+            'start': first * ring.step,
+            'values': values,
+        }
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while not self._stopping.is_set():
+            next_tick += 1
+            try:
+                self._sample(time.time())
+            except Exception as e:
+                logger.error(f"❌ Errore campionamento metriche: {e}")
+            self._stopping.wait(max(next_tick - time.monotonic(), 0))
+
+    def _sample(self, now):
+        if not PSUTIL_AVAILABLE:
+            return
+        if now - self._last_scan >= METRICS_CONFIG['SERVICE_SCAN_INTERVAL']:
+            self._scan_services()
+            self._last_scan = now
+
+        sample = np.full(len(self.series), np.nan)
+        cpu = psutil.cpu_percent(interval=None)
+        load = psutil.getloadavg() if hasattr(psutil, 'getloadavg') else (0, 0, 0)
+        memory = psutil.virtual_memory()
+        disk = psutil.disk_usage('/')
+        net = psutil.net_io_counters()
+        rates = self._network_rates(now, net)
+
+        for name, value in (
+            ('cpu_percent', cpu),
+            ('load_1m', load[0]),
+            ('memory_percent', memory.percent),
+            ('memory_used_bytes', memory.used),
+            ('disk_percent', disk.percent),
+            ('disk_used_bytes', disk.used),
+            ('net_sent_bytes_per_sec', rates['bytes_sent']),
+            ('net_recv_bytes_per_sec', rates['bytes_recv']),
+            ('net_sent_packets_per_sec', rates['packets_sent']),
+            ('net_recv_packets_per_sec', rates['packets_recv']),
+        ):
+            sample[self._index[name]] = np.nan if value is None else value
+
+        services = {}
+        for service_id, config in self.services.items():
+            performance = self._process_stats(service_id)
+            connections = self._connections.get(config['port'], [])
+            services[service_id] = {
+                'performance': performance,
+                'network': {'active_connections': len(connections), 'connections': connections[:10]},
+            }
+            prefix = f"{service_id}."
+            sample[self._index[prefix + 'up']] = 1 if performance else 0
+            sample[self._index[prefix + 'connections']] = len(connections)
+            if performance:
+                sample[self._index[prefix + 'cpu_percent']] = performance['cpu_percent']
+                sample[self._index[prefix + 'rss_bytes']] = performance['memory_rss_mb'] * 1024 * 1024
+                sample[self._index[prefix + 'threads']] = performance['num_threads']
+
+        self._latest = {
+            'timestamp': now,
+            'cpu': {
+                'usage': cpu,
+                'cores': psutil.cpu_count(),
+                'load_avg': list(load),
+            },
+            'memory': {
+                'total': memory.total,
+                'used': memory.used,
+                'available': memory.available,
+                'percentage': memory.percent,
+            },
+            'disk': {
+                'total': disk.total,
+                'used': disk.used,
+                'free': disk.free,
+                'percentage': disk.percent,
+            },
+            'network': {
+                'bytes_sent': net.bytes_sent,
+                'bytes_recv': net.bytes_recv,
+                'packets_sent': net.packets_sent,
+                'packets_recv': net.packets_recv,
+                'rates': rates,
+            },
+            'services': services,
+        }
+        self._ready.set()
+        self._record(int(now), sample)
+
+    def _record(self, second, sample):
+        with self._lock:
+            for ring, accumulator in zip(self.rings, self._accumulators):
+                bucket = second // ring.step
+                if accumulator.bucket is not None and accumulator.bucket != bucket:
+                    ring.put(accumulator.bucket, accumulator.minimum, accumulator.maximum, accumulator.average())
+                    accumulator.__init__(len(self.series))
+                accumulator.bucket = bucket
+                accumulator.add(sample)
+                # Il bucket corrente è visibile subito, aggiornato a ogni campione
+                ring.put(bucket, accumulator.minimum, accumulator.maximum, accumulator.average())
+
+    def _network_rates(self, now, net):
+        previous, self._previous_net = self._previous_net, (now, net)
+        rates = dict.fromkeys(('bytes_sent', 'bytes_recv', 'packets_sent', 'packets_recv'))
+        if previous is None or now <= previous[0]:
+            return rates
+        elapsed = now - previous[0]
+        for field in rates:
+            rates[field] = max(getattr(net, field) - getattr(previous[1], field), 0) / elapsed
+        return rates
+
+    def _scan_services(self):
+        """Una sola scansione delle connessioni: PID in ascolto e connessioni per porta"""
+        ports = {config['port']: service_id for service_id, config in self.services.items()}
+        listening, connections = {}, {port: [] for port in ports}
+        try:
+            for conn in psutil.net_connections():
+                if not conn.laddr or conn.laddr.port not in ports:
+                    continue
+                if conn.status == 'LISTEN':
+                    listening[conn.laddr.port] = conn.pid
+                connections[conn.laddr.port].append({
+                    'remote_addr': f"{conn.raddr.ip}:{conn.raddr.port}" if conn.raddr else "N/A",
+                    'status': conn.status,
+                    'type': conn.type.name if hasattr(conn.type, 'name') else str(conn.type),
+                })
+        except (psutil.AccessDenied, OSError) as e:
+            logger.debug(f"Scansione connessioni non disponibile: {e}")
+            return
+
+        processes = {}
+        for port, service_id in ports.items():
+            pid = listening.get(port)
+            current = self._processes.get(service_id)
+            if pid and current is not None and current.pid == pid:
+                processes[service_id] = current
+            elif pid:
+                try:
+                    processes[service_id] = psutil.Process(pid)
+                except psutil.Error:
+                    pass
+        self._processes = processes
+        self._connections = connections
+
+    def _process_stats(self, service_id):
+        process = self._processes.get(service_id)
+        if process is None:
+            return None
+        try:
+            with process.oneshot():
+                memory_info = process.memory_info()
+                cpu_times = process.cpu_times()
+                return {
+                    'pid': process.pid,
+                    'cpu_percent': process.cpu_percent(interval=None),
+                    'memory_rss_mb': memory_info.rss // (1024 * 1024),
+                    'memory_vms_mb': memory_info.vms // (1024 * 1024),
+                    'memory_percent': process.memory_percent(),
+                    'num_threads': process.num_threads(),
+                    'num_fds': process.num_fds() if hasattr(process, 'num_fds') else 0,
+                    'create_time': process.create_time(),
+                    'uptime_seconds': time.time() - process.create_time(),
+                    'cpu_times': {
+                        'user': cpu_times.user,
+                        'system': cpu_times.system,
+                    },
+                    'status': process.status(),
+                    'cmdline': ' '.join(process.cmdline()),
+                }
+        except psutil.Error:
+            # Processo terminato: verrà cercato di nuovo alla prossima scansione
+            self._processes.pop(service_id, None)
+            return None
+
+
+def _downsample(values, factor):
+    """Raggruppa `factor` bucket consecutivi: minimo dei min, massimo dei max, media delle medie"""
+    points = math.ceil(len(values) / factor)
+    padded = np.full((points * factor,) + values.shape[1:], np.nan, dtype=values.dtype)
+    padded[points * factor - len(values):] = values
+    grouped = padded.reshape((points, factor) + values.shape[1:])
+    with warnings.catch_warnings():
+        # Gruppi senza campioni: il risultato NaN è quello voluto
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        return np.stack([
+            np.nanmin(grouped[:, :, :, 0], axis=1),
+            np.nanmax(grouped[:, :, :, 1], axis=1),
+            np.nanmean(grouped[:, :, :, 2], axis=1),
+        ], axis=-1)
+
+
+class MetricsService:
+    """
+    Metriche viste dal processo corrente: il leader legge i propri ring buffer,
+    gli altri processi interrogano il server HTTP del leader
+    """
+
+    def __init__(self, services):
+        self.services = services
+        self.series = series_names(services)
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}:{id(self)}"
+        self._collector = None  # solo nel processo leader
+        self._server = None
+        self._lease = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        """Avvia l'elezione del processo (un thread che prova a prendere o rinnovare il lease)"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='metrics-election', daemon=True)
+                self._thread.start()
+
+    def latest(self):
+        self.ensure_started()
+        collector = self._collector
+        if collector is not None:
+            return collector.latest()
+        try:
+            return self._fetch('latest').json()
+        except MetricsUnavailable as e:
+            logger.debug(f"Metriche non disponibili: {e}")
+            return None
+
+    def query_range(self, names, seconds, max_points=None):
+        """Come MetricsCollector.query_range; MetricsUnavailable se il leader non risponde"""
+        self.ensure_started()
+        collector = self._collector
+        if collector is not None:
+            return collector.query_range(names, seconds, max_points)
+        response = self._fetch('range', {
+            'series': ','.join(names),
+            'seconds': seconds,
+            'points': max_points or METRICS_CONFIG['MAX_POINTS'],
+        })
+        shape = tuple(int(size) for size in response.headers['X-Metrics-Shape'].split(','))
+        return {
+            'step': int(response.headers['X-Metrics-Step']),
+            'start': int(response.headers['X-Metrics-Start']),
+            'values': np.frombuffer(response.content, dtype='<f4').reshape(shape),
+        }
+
+    def _fetch(self, path, params=None):
+        lease = _leader_cache().get(LEADER_KEY)
+        if not lease or not lease.get('url'):
+            raise MetricsUnavailable("nessun leader eletto")
+        try:
+            response = requests.get(
+                f"{lease['url']}/{path}", params=params,
+                headers={'X-Metrics-Token': lease['token']}, timeout=METRICS_CONFIG['REQUEST_TIMEOUT'],
+            )
+        except requests.RequestException as e:
+            raise MetricsUnavailable(f"leader {lease['instance']} non raggiungibile: {e}")
+        if response.status_code != 200:
+            raise MetricsUnavailable(f"leader {lease['instance']}: HTTP {response.status_code}")
+        return response
+
+    # Elezione
+
+    def _run(self):
+        while True:
+            try:
+                if self._hold_leadership():
+                    if self._collector is None:
+                        self._lead()
+                elif self._collector is not None:
+                    self._step_down()
+            except Exception as e:
+                logger.error(f"❌ Errore elezione collector metriche: {e}")
+            time.sleep(METRICS_CONFIG['LEADER_LEASE'] / 3)
+
+    def _hold_leadership(self):
+        cache = _leader_cache()
+        lease = METRICS_CONFIG['LEADER_LEASE']
+        if self._lease is None and cache.add(LEADER_KEY, {'instance': self.instance_id}, timeout=lease):
+            return True
+        current = cache.get(LEADER_KEY)
+        if current and current['instance'] == self.instance_id:
+            cache.touch(LEADER_KEY, lease)
+            return True
+        return False
+
+    def _lead(self):
+        collector = MetricsCollector(self.services)
+        collector.ensure_started()
+        token = secrets.token_hex(16)
+        server = ThreadingHTTPServer((METRICS_CONFIG['SERVER_HOST'], 0), _handler_class(collector, token))
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+        host, port = server.server_address[:2]
+        self._lease = {'instance': self.instance_id, 'url': f"http://{host}:{port}", 'token': token}
+        _leader_cache().set(LEADER_KEY, self._lease, timeout=METRICS_CONFIG['LEADER_LEASE'])
+        self._collector, self._server = collector, server
+        logger.info(f"📈 Collector metriche avviato in questo processo ({self._lease['url']})")
+
+    def _step_down(self):
+        collector, server = self._collector, self._server
+        self._collector = self._server = self._lease = None
+        collector.stop()
+        server.shutdown()
+        server.server_close()
+        logger.info("📈 Collector metriche fermato: leader eletto in un altro processo")
+
+    def _release(self):
+        """Uscita del processo: il lease non deve restare fino alla scadenza"""
+        if self._lease is not None and (_leader_cache().get(LEADER_KEY) or {}).get('instance') == self.instance_id:
+            _leader_cache().delete(LEADER_KEY)
+
+    def _after_fork(self):
+        # Thread e server del padre non esistono nel figlio: si riparte da candidato
+        self._collector = self._server = self._lease = self._thread = None
+        self._lock = threading.Lock()
+
+
+def _handler_class(collector, token):
+    """Server delle serie del leader: /latest (JSON) e /range (float32 come format=binary)"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if not secrets.compare_digest(self.headers.get('X-Metrics-Token', ''), token):
+                self.send_error(403)
+                return
+            url = urlparse(self.path)
+            if url.path == '/latest':
+                self._send(json.dumps(collector.latest()).encode(), 'application/json')
+            elif url.path == '/range':
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                try:
+                    names = params['series'].split(',')
+                    result = collector.query_range(names, int(params['seconds']), int(params['points']))
+                except (KeyError, ValueError):
+                    self.send_error(400)
+                    return
+                values = result['values']
+                self._send(values.astype('<f4').tobytes(), 'application/octet-stream', {
+                    'X-Metrics-Shape': ','.join(str(size) for size in values.shape),
+                    'X-Metrics-Start': str(result['start']),
+                    'X-Metrics-Step': str(result['step']),
+                })
+            else:
+                self.send_error(404)
+
+        def _send(self, body, content_type, headers=None):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def _leader_cache():
+    try:
+        return caches[METRICS_CONFIG['LEADER_CACHE_ALIAS']]
+    except InvalidCacheBackendError:
+        return caches['default']
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_collector():
+    """Metriche del processo (MetricsService): campiona solo il processo leader"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            from .server_control import SERVICES_CONFIG
+            _service = MetricsService(SERVICES_CONFIG)
+            atexit.register(_service._release)
+            os.register_at_fork(after_in_child=_service._after_fork)
+    return _service
+
+
+def start():
+    """Candidatura all'avvio del server (wsgi/asgi), senza attendere la prima richiesta"""
+    get_collector().ensure_started()
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.16 on 2026-10-17 19:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admin_panel', '0002_usergroup_usergroupmembership_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day'), ('total', 'Total'), ('gauge', 'Gauge')], max_length=10)),
+                ('bucket_start', models.DateTimeField()),
+                ('metric', models.CharField(max_length=50)),
+                ('dimension', models.CharField(blank=True, default='', max_length=50)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('period', 'bucket_start', 'metric', 'dimension')},
+            },
+        ),
+    ]
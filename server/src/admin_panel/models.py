@@ -111,3 +111,39 @@ class UserGroupMembership(models.Model):
     
     def __str__(self):
         return f"{self.user.username} in {self.group.name}"
+
+
+class DashboardRollup(models.Model):
+    """
+    Contatore pre-aggregato per le statistiche della dashboard admin
+
+    Una riga per (periodo, bucket, metrica, dimensione), mantenuta da
+    admin_panel.rollups.refresh() (task Celery periodico):
+    - 'hour' / 'day': eventi nel bucket (utenti registrati, messaggi per tipo,
+      chiamate per stato, ...)
+    - 'total': somma di tutti i bucket giornalieri
+    - 'gauge': valori correnti (utenti bloccati, dispositivi attivi per tipo, ...)
+      con bucket_start = istante del calcolo
+    """
+    PERIOD_HOUR = 'hour'
+    PERIOD_DAY = 'day'
+    PERIOD_TOTAL = 'total'
+    PERIOD_GAUGE = 'gauge'
+
+    period = models.CharField(max_length=10, choices=[
+        (PERIOD_HOUR, 'Hour'),
+        (PERIOD_DAY, 'Day'),
+        (PERIOD_TOTAL, 'Total'),
+        (PERIOD_GAUGE, 'Gauge'),
+    ])
+    bucket_start = models.DateTimeField()
+    metric = models.CharField(max_length=50)
+    dimension = models.CharField(max_length=50, blank=True, default='')
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        # Copre anche le letture per (periodo, bucket_start >= ...)
+        unique_together = ['period', 'bucket_start', 'metric', 'dimension']
+
+    def __str__(self):
+        return f"{self.period} {self.bucket_start:%Y-%m-%d %H:%M} {self.metric}[{self.dimension}] = {self.value}"
@@ -0,0 +1,288 @@
+"""
+Statistiche della dashboard admin da tabelle di rollup (DashboardRollup)
+
+Le view e il consumer della dashboard non eseguono più decine di COUNT(*)
+sulle tabelle dei messaggi e delle chiamate a ogni refresh:
+- refresh() (task Celery periodico admin_panel.tasks.refresh_dashboard_rollups)
+  ricalcola con un GROUP BY per sorgente solo le ultime LOOKBACK_HOURS ore
+  (la prima volta tutto lo storico), poi i bucket giornalieri dalle righe
+  orarie e infine i gauge (utenti, dispositivi, chat) e i totali di sempre,
+  con un aggregato per tabella: le righe eliminate escono anche dai totali
+- get_stats() legge tutte le righe utili con una sola query e le tiene in
+  cache per CACHE_SECONDS: il costo non dipende dalla dimensione delle tabelle
+
+Con i task eager (sviluppo, nessun beat) il refresh viene eseguito alla
+lettura quando i rollup sono più vecchi di STALE_SECONDS.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+from crypto.models import Device, Message
+from api.models import Call, Chat, ChatMessage
+from .models import DashboardRollup
+import logging
+
+logger = logging.getLogger('securevox')
+
+HOUR = DashboardRollup.PERIOD_HOUR
+DAY = DashboardRollup.PERIOD_DAY
+TOTAL = DashboardRollup.PERIOD_TOTAL
+GAUGE = DashboardRollup.PERIOD_GAUGE
+
+_DEFAULTS = {
+    'CACHE_SECONDS': 30,
+    'STALE_SECONDS': 300,
+    'LOOKBACK_HOURS': 3,
+    'HOUR_RETENTION_DAYS': 8,
+    'DAY_WINDOW_DAYS': 61,
+}
+ROLLUP_CONFIG = {**_DEFAULTS, **getattr(settings, 'DASHBOARD_ROLLUPS', {})}
+
+CACHE_KEY = 'dashboard-rollups'
+LOCK_KEY = 'dashboard-rollups-refresh'
+
+# Bucket dei totali: le righe 'total' non hanno un istante di riferimento
+TOTAL_BUCKET = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# (metrica, modello, campo temporale, campo dimensione o None)
+EVENT_SOURCES = (
+    ('users_joined', User, 'date_joined', None),
+    ('devices_registered', Device, 'created_at', 'device_type'),
+    ('messages', Message, 'created_at', 'message_type'),
+    ('chat_messages', ChatMessage, 'created_at', 'message_type'),
+    ('chats_created', Chat, 'created_at', None),
+    ('calls', Call, 'created_at', 'status'),
+)
+
+
+def refresh(now=None):
+    """
+    Ricalcola i rollup recenti, i giornalieri, i totali e i gauge.
+
+    Returns:
+        numero di righe orarie riscritte
+    """
+    now = now or timezone.now()
+    last_hour = DashboardRollup.objects.filter(period=HOUR).aggregate(last=Max('bucket_start'))['last']
+    start = None
+    if last_hour is not None:
+        # Le ultime ore vengono riscritte: stati delle chiamate cambiati, righe eliminate
+        start = min(last_hour, _floor_hour(now)) - timedelta(hours=ROLLUP_CONFIG['LOOKBACK_HOURS'])
+
+    hourly = _hourly_rows(start)
+    day_start = _floor_day(start) if start else None
+
+    with transaction.atomic():
+        stale_hours = DashboardRollup.objects.filter(period=HOUR)
+        if start:
+            stale_hours = stale_hours.filter(bucket_start__gte=start)
+        stale_hours.delete()
+        DashboardRollup.objects.bulk_create(hourly, batch_size=500)
+
+        _rebuild_days(day_start)
+        _rebuild_gauges(now)
+
+        DashboardRollup.objects.filter(
+            period=HOUR, bucket_start__lt=now - timedelta(days=ROLLUP_CONFIG['HOUR_RETENTION_DAYS']),
+        ).delete()
+
+    cache.delete(CACHE_KEY)
+    logger.info(f"📊 Rollup dashboard aggiornati: {len(hourly)} righe orarie" +
+                (f" da {start:%Y-%m-%d %H:%M}" if start else " (storico completo)"))
+    return len(hourly)
+
+
+def get_stats():
+    """Statistiche della dashboard dai rollup (una query, in cache)"""
+    stats = cache.get(CACHE_KEY)
+    if stats is not None:
+        return stats
+
+    stats = RollupStats(_load())
+    if _needs_inline_refresh(stats) and cache.add(LOCK_KEY, True, timeout=60):
+        try:
+            refresh()
+        finally:
+            cache.delete(LOCK_KEY)
+        stats = RollupStats(_load())
+    cache.set(CACHE_KEY, stats, ROLLUP_CONFIG['CACHE_SECONDS'])
+    return stats
+
+
+class RollupStats:
+    """Vista in memoria delle righe di rollup caricate da get_stats()"""
+
+    def __init__(self, rows):
+        self.refreshed_at = None
+        self._values = defaultdict(dict)
+        for period, bucket_start, metric, dimension, value in rows:
+            self._values[(period, metric)][(bucket_start, dimension)] = value
+            if period == GAUGE:
+                self.refreshed_at = bucket_start
+
+    def gauge(self, metric, dimension=''):
+        return sum(value for (_, dim), value in self._values[(GAUGE, metric)].items() if dim == dimension)
+
+    def total(self, metric, dimension=None):
+        return self._sum(TOTAL, metric, dimension)
+
+    def since(self, metric, start, dimension=None):
+        """Eventi dalle ore che iniziano da start (arrotondato all'ora) in poi"""
+        return self._sum(HOUR, metric, dimension, _floor_hour(start))
+
+    def by_dimension(self, metric, period=TOTAL, start=None):
+        start = _floor_hour(start) if start else None
+        result = defaultdict(int)
+        for (bucket_start, dimension), value in self._values[(period, metric)].items():
+            if start is None or bucket_start >= start:
+                result[dimension] += value
+        return dict(result)
+
+    def daily(self, metric, days, dimension=None):
+        """Serie giornaliera degli ultimi `days` giorni (oggi incluso), giorni vuoti a 0"""
+        per_day = defaultdict(int)
+        for (bucket_start, dim), value in self._values[(DAY, metric)].items():
+            if dimension is None or dim == dimension:
+                per_day[timezone.localtime(bucket_start).date()] += value
+        today = timezone.localdate()
+        return [(day, per_day.get(day, 0)) for day in (today - timedelta(days=offset) for offset in range(days - 1, -1, -1))]
+
+    def _sum(self, period, metric, dimension, start=None):
+        return sum(
+            value for (bucket_start, dim), value in self._values[(period, metric)].items()
+            if (dimension is None or dim == dimension) and (start is None or bucket_start >= start)
+        )
+
+
+def _load():
+    now = timezone.now()
+    return list(DashboardRollup.objects.filter(
+        Q(period__in=(TOTAL, GAUGE)) |
+        Q(period=DAY, bucket_start__gte=_floor_day(now - timedelta(days=ROLLUP_CONFIG['DAY_WINDOW_DAYS']))) |
+        Q(period=HOUR, bucket_start__gte=now - timedelta(days=ROLLUP_CONFIG['HOUR_RETENTION_DAYS'])),
+    ).values_list('period', 'bucket_start', 'metric', 'dimension', 'value'))
+
+
+def _needs_inline_refresh(stats):
+    if stats.refreshed_at is None:
+        # Mai calcolati (primo avvio): meglio una lettura lenta che una dashboard vuota
+        return True
+    stale = (timezone.now() - stats.refreshed_at).total_seconds() > ROLLUP_CONFIG['STALE_SECONDS']
+    return stale and getattr(settings, 'CELERY_TASK_ALWAYS_EAGER', False)
+
+
+def _hourly_rows(start):
+    rows = []
+    for metric, model, time_field, dimension in EVENT_SOURCES:
+        queryset = model.objects.all()
+        if start:
+            queryset = queryset.filter(**{f"{time_field}__gte": start})
+        fields = ('bucket', dimension) if dimension else ('bucket',)
+        grouped = queryset.annotate(bucket=TruncHour(time_field)).values(*fields).annotate(n=Count('pk')).order_by()
+        rows.extend(
+            DashboardRollup(period=HOUR, bucket_start=row['bucket'], metric=metric,
+                            dimension=(row[dimension] or '') if dimension else '', value=row['n'])
+            for row in grouped
+        )
+
+    # Durata totale delle chiamate (secondi) per la durata media
+    calls = Call.objects.all()
+    if start:
+        calls = calls.filter(created_at__gte=start)
+    for row in calls.annotate(bucket=TruncHour('created_at')).values('bucket').annotate(seconds=Sum('duration')).order_by():
+        if row['seconds']:
+            rows.append(DashboardRollup(period=HOUR, bucket_start=row['bucket'], metric='call_seconds',
+                                        value=int(row['seconds'].total_seconds())))
+    return rows
+
+
+def _rebuild_days(day_start):
+    hours = DashboardRollup.objects.filter(period=HOUR)
+    days = DashboardRollup.objects.filter(period=DAY)
+    if day_start:
+        hours = hours.filter(bucket_start__gte=day_start)
+        days = days.filter(bucket_start__gte=day_start)
+    grouped = hours.annotate(day=TruncDay('bucket_start')).values('day', 'metric', 'dimension').annotate(total=Sum('value')).order_by()
+    days.delete()
+    DashboardRollup.objects.bulk_create([
+        DashboardRollup(period=DAY, bucket_start=row['day'], metric=row['metric'], dimension=row['dimension'], value=row['total'])
+        for row in grouped
+    ], batch_size=500)
+
+
+def _rebuild_gauges(now):
+    """Valori correnti: una query aggregata per tabella (utenti, dispositivi, chat)"""
+    users = User.objects.aggregate(
+        users_total=Count('id'),
+        users_blocked=Count('id', filter=Q(is_active=False)),
+        users_online=Count('id', filter=Q(last_login__gte=now - timedelta(minutes=5))),
+        users_active_24h=Count('id', filter=Q(last_login__gte=now - timedelta(hours=24))),
+        users_active_7d=Count('id', filter=Q(last_login__gte=now - timedelta(days=7))),
+        users_active_30d=Count('id', filter=Q(last_login__gte=now - timedelta(days=30))),
+    )
+    devices = Device.objects.aggregate(
+        devices_total=Count('id'),
+        devices_active=Count('id', filter=Q(is_active=True)),
+        devices_compromised=Count('id', filter=Q(is_rooted=True) | Q(is_jailbroken=True) | Q(is_compromised=True)),
+    )
+    chats = Chat.objects.aggregate(
+        chats_total=Count('id'),
+        chats_active_7d=Count('id', filter=Q(updated_at__gte=now - timedelta(days=7))),
+    )
+
+    rows = [
+        DashboardRollup(period=GAUGE, bucket_start=now, metric=metric, value=value or 0)
+        for metric, value in {**users, **devices, **chats}.items()
+    ]
+    by_type = Device.objects.values('device_type').annotate(
+        n=Count('id'), active=Count('id', filter=Q(is_active=True)),
+    ).order_by()
+    for row in by_type:
+        dimension = row['device_type'] or ''
+        rows.append(DashboardRollup(period=GAUGE, bucket_start=now, metric='devices_by_type', dimension=dimension, value=row['n']))
+        rows.append(DashboardRollup(period=GAUGE, bucket_start=now, metric='devices_active_by_type', dimension=dimension, value=row['active']))
+
+    DashboardRollup.objects.filter(period=GAUGE).delete()
+    DashboardRollup.objects.bulk_create(rows)
+
+    totals = _total_rows()
+    DashboardRollup.objects.filter(period=TOTAL).delete()
+    DashboardRollup.objects.bulk_create(totals, batch_size=500)
+
+
+def _total_rows():
+    """
+    Totali di sempre per sorgente e dimensione, contati sulle tabelle (un GROUP BY
+    ciascuna) e non sommando i contatori di creazione: seguono anche le eliminazioni
+    """
+    totals = defaultdict(int)
+    for metric, model, _, dimension in EVENT_SOURCES:
+        if not dimension:
+            totals[(metric, '')] = model.objects.count()
+            continue
+        grouped = model.objects.values(dimension).annotate(n=Count('pk'))
+        if model is Call:
+            # Durata totale delle chiamate (secondi) nella stessa query, per la durata media
+            grouped = grouped.annotate(seconds=Sum('duration'))
+        for row in grouped.order_by():
+            totals[(metric, row[dimension] or '')] += row['n']
+            if row.get('seconds'):
+                totals[('call_seconds', '')] += int(row['seconds'].total_seconds())
+    return [
+        DashboardRollup(period=TOTAL, bucket_start=TOTAL_BUCKET, metric=metric, dimension=dimension, value=value)
+        for (metric, dimension), value in totals.items()
+    ]
+
+
+def _floor_hour(moment):
+    return timezone.localtime(moment).replace(minute=0, second=0, microsecond=0)
+
+
+def _floor_day(moment):
+    return timezone.localtime(moment).replace(hour=0, minute=0, second=0, microsecond=0)
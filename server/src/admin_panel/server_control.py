@@ -663,77 +663,26 @@ def get_server_performance(request, service_id):
         return JsonResponse({'error': 'Servizio non trovato'}, status=404)
     
     config = SERVICES_CONFIG[service_id]
-    port = config['port']
-    pid = get_process_on_port(port)
     
-    if not pid:
+    # Ultimo campione del collector metriche: nessuna scansione psutil per richiesta
+    from .metrics import get_collector
+    sample = get_collector().latest()
+    service = sample['services'].get(service_id) if sample else None
+    
+    if not service or not service['performance']:
         return JsonResponse({
             'service': config['name'],
             'status': 'stopped',
             'performance': None,
         })
     
-    try:
-        process = psutil.Process(pid)
-        
-        # Metriche dettagliate
-        memory_info = process.memory_info()
-        cpu_times = process.cpu_times()
-        
-        performance = {
-            'cpu_percent': process.cpu_percent(),
-            'memory_rss_mb': memory_info.rss // (1024 * 1024),
-            'memory_vms_mb': memory_info.vms // (1024 * 1024),
-            'memory_percent': process.memory_percent(),
-            'num_threads': process.num_threads(),
-            'num_fds': process.num_fds() if hasattr(process, 'num_fds') else 0,
-            'create_time': process.create_time(),
-            'uptime_seconds': time.time() - process.create_time(),
-            'cpu_times': {
-                'user': cpu_times.user,
-                'system': cpu_times.system,
-            },
-            'status': process.status(),
-            'cmdline': ' '.join(process.cmdline()),
-        }
-        
-        # Statistiche rete per la porta
-        network_stats = get_port_network_stats(port)
-        
-        return JsonResponse({
-            'service': config['name'],
-            'status': 'running',
-            'performance': performance,
-            'network': network_stats,
-            'timestamp': time.time(),
-        })
-        
-    except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
-
-
-def get_port_network_stats(port):
-    """Ottiene statistiche di rete per una porta"""
-    try:
-        # Conta connessioni per porta
-        connections = []
-        for conn in psutil.net_connections():
-            if conn.laddr.port == port:
-                connections.append({
-                    'remote_addr': f"{conn.raddr.ip}:{conn.raddr.port}" if conn.raddr else "N/A",
-                    'status': conn.status,
-                    'type': conn.type.name if hasattr(conn.type, 'name') else str(conn.type),
-                })
-        
-        return {
-            'active_connections': len(connections),
-            'connections': connections[:10],  # Prime 10 connessioni
-        }
-    except:
-        return {
-            'active_connections': 0,
-            'connections': [],
-        }
+    return JsonResponse({
+        'service': config['name'],
+        'status': 'running',
+        'performance': service['performance'],
+        'network': service['network'],
+        'timestamp': sample['timestamp'],
+    })
 
 
 # Funzioni helper per comandi specifici
@@ -0,0 +1,21 @@
+"""
+Task Celery della dashboard amministrativa
+"""
+
+from celery import shared_task
+import logging
+
+logger = logging.getLogger('securevox')
+
+
+@shared_task
+def refresh_dashboard_rollups():
+    """Aggiorna i rollup delle statistiche della dashboard (ultime ore, giorni, totali, gauge)"""
+    from .rollups import refresh
+
+    try:
+        rows = refresh()
+        return f"Rolled up {rows} hourly rows"
+    except Exception as e:
+        logger.error(f"❌ Errore rollup statistiche dashboard: {e}")
+        return f"Error: {e}"
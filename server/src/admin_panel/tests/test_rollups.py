@@ -0,0 +1,50 @@
+"""
+Totali della dashboard dai rollup: seguono anche le eliminazioni
+"""
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+from api.models import Call, Chat, ChatMessage
+from admin_panel import rollups
+
+
+class RollupTotalsTest(TestCase):
+
+    def setUp(self):
+        self.caller = User.objects.create_user(username='rollup_caller')
+        self.callee = User.objects.create_user(username='rollup_callee')
+        self.chat = Chat.objects.create(name='rollup', created_by=self.caller)
+
+    def _stats(self):
+        rollups.refresh()
+        return rollups.RollupStats(rollups._load())
+
+    def _old_call(self, status, seconds):
+        call = Call.objects.create(caller=self.caller, callee=self.callee, status=status,
+                                   duration=timedelta(seconds=seconds))
+        # Fuori dalla finestra LOOKBACK_HOURS dei refresh successivi
+        Call.objects.filter(id=call.id).update(created_at=timezone.now() - timedelta(days=2))
+        return call
+
+    def test_totals_drop_when_old_rows_are_deleted(self):
+        kept = self._old_call('completed', 60)
+        deleted = self._old_call('completed', 120)
+        self._old_call('missed', 0)
+        old_message = ChatMessage.objects.create(chat=self.chat, sender=self.caller, content='vecchio')
+        ChatMessage.objects.filter(id=old_message.id).update(created_at=timezone.now() - timedelta(days=2))
+
+        stats = self._stats()
+        self.assertEqual(stats.total('calls'), 3)
+        self.assertEqual(stats.total('calls', 'completed'), 2)
+        self.assertEqual(stats.total('call_seconds'), 180)
+        self.assertEqual(stats.total('chat_messages'), 1)
+
+        deleted.delete()
+        old_message.delete()
+        stats = self._stats()
+        self.assertEqual(stats.total('calls'), 2)
+        self.assertEqual(stats.total('calls', 'completed'), 1)
+        self.assertEqual(stats.total('call_seconds'), 60)
+        self.assertEqual(stats.total('chat_messages'), 0)
+        self.assertTrue(Call.objects.filter(id=kept.id).exists())
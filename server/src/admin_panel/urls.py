@@ -45,6 +45,7 @@ urlpatterns = [
     path('api/calls-management/', dashboard_sections.get_calls_management, name='api_calls_management'),
     path('api/analytics-data/', dashboard_sections.get_analytics_data, name='api_analytics_data'),
     path('api/monitoring-data/', dashboard_sections.get_monitoring_data, name='api_monitoring_data'),
+    path('api/metrics/', dashboard_sections.get_metrics_history, name='api_metrics_history'),
     
     # API nuove sezioni
     path('api/server-management/', server_management.get_server_management, name='api_server_management'),
@@ -13,6 +13,7 @@ from django.core.validators import validate_email
 from django.utils import timezone
 from datetime import timedelta
 from .models import AuthToken
+from . import principal_cache
 from .password_protection import PasswordProtection, protect_password_modification
 import json
 import logging
@@ -714,6 +715,7 @@ def reset_password(request):
         
         # Elimina tutti i token di autenticazione esistenti (logout forzato)
         AuthToken.objects.filter(user=user, is_active=True).update(is_active=False)
+        principal_cache.invalidate_user(user)
         
         logger.info(f"Password reset successful for user {user.id}")
         
@@ -7,11 +7,13 @@ from django.views.decorators.http import require_http_methods
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
-from .models import Call
+from .models import Call, WebRTCCall
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.utils import timezone
-from datetime import timedelta
-from django.db import models
+from django.utils.crypto import constant_time_compare
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.db import models, transaction
 import logging
 
 logger = logging.getLogger('securevox')
@@ -70,9 +72,12 @@ def cleanup_all_calls(request):
         calls_count = active_calls.count()
         
         # Termina tutte le chiamate
+        # updated_at esplicito: update() non applica auto_now (cronologia per updated_at)
+        now = timezone.now()
         active_calls.update(
             status='ended',
-            ended_at=timezone.now()
+            ended_at=now,
+            updated_at=now
         )
         
         logger.info(f"📞 {calls_count} chiamate terminate automaticamente")
@@ -106,9 +111,12 @@ def cleanup_expired_calls(request):
         calls_count = expired_calls.count()
         
         # Termina chiamate scadute
+        # updated_at esplicito: update() non applica auto_now (cronologia per updated_at)
+        now = timezone.now()
         expired_calls.update(
             status='ended',
-            ended_at=timezone.now()
+            ended_at=now,
+            updated_at=now
         )
         
         logger.info(f"📞 {calls_count} chiamate scadute pulite (più vecchie di {max_minutes} minuti)")
@@ -122,3 +130,86 @@ def cleanup_expired_calls(request):
     except Exception as e:
         logger.error(f"Errore cleanup chiamate scadute: {e}")
         return Response({'error': str(e)}, status=500)
+
+
+# Stati del motore chiamate di SecureVOX Notify → stati dei modelli Django
+CALL_STATUS_FROM_NOTIFY = {
+    'incoming': 'ringing',
+    'ringing': 'ringing',
+    'answered': 'answered',
+    'rejected': 'declined',
+    'ended': 'ended',
+    'missed': 'missed',
+}
+WEBRTC_CALL_STATUS_FROM_NOTIFY = {**CALL_STATUS_FROM_NOTIFY, 'rejected': 'rejected'}
+TERMINAL_CALL_STATUSES = ('completed', 'missed', 'declined', 'cancelled', 'ended', 'rejected', 'failed')
+
+
+def _notify_request_allowed(request):
+    """Richieste da SecureVOX Notify: sempre e solo con il token condiviso (l'IP non conta)"""
+    expected = getattr(settings, 'NOTIFY_SYNC_TOKEN', '')
+    if not expected:
+        logger.warning("⚠️ NOTIFY_SYNC_TOKEN non configurato: sync chiamate da Notify rifiutato")
+        return False
+    return constant_time_compare(request.headers.get('X-Notify-Token', ''), expected)
+
+
+def _from_epoch(value):
+    return datetime.fromtimestamp(value, tz=dt_timezone.utc) if value else None
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def sync_call_states(request):
+    """
+    Stati delle chiamate inviati in batch dal motore chiamate di SecureVOX Notify
+    
+    Body: {"calls": [{call_id, status, start_time, answer_time, end_time, end_reason}]}
+    (istanti in secondi epoch). Le righe Call/WebRTCCall con session_id = call_id
+    vengono aggiornate in una transazione; una chiamata già chiusa in Django non
+    torna mai a uno stato precedente.
+    """
+    if not _notify_request_allowed(request):
+        return Response({'error': 'Non autorizzato'}, status=403)
+    
+    states = request.data.get('calls')
+    if not isinstance(states, list):
+        return Response({'error': 'calls deve essere una lista'}, status=400)
+    
+    updated = 0
+    try:
+        with transaction.atomic():
+            for state in states:
+                call_id = state.get('call_id')
+                notify_status = state.get('status')
+                if not call_id or notify_status not in CALL_STATUS_FROM_NOTIFY:
+                    continue
+                
+                answered_at = _from_epoch(state.get('answer_time'))
+                ended_at = _from_epoch(state.get('end_time'))
+                status = CALL_STATUS_FROM_NOTIFY[notify_status]
+                if notify_status == 'ended' and not answered_at:
+                    # Chiusa prima della risposta: come end_call, è una chiamata persa
+                    status = 'missed'
+                
+                call_fields = {'status': status, 'updated_at': timezone.now()}
+                webrtc_fields = {'status': WEBRTC_CALL_STATUS_FROM_NOTIFY[notify_status]}
+                if answered_at:
+                    webrtc_fields['answered_at'] = answered_at
+                if ended_at:
+                    call_fields['ended_at'] = webrtc_fields['ended_at'] = ended_at
+                    call_fields['duration'] = ended_at - answered_at if answered_at else timedelta(0)
+                    webrtc_fields['end_reason'] = state.get('end_reason') or notify_status
+                
+                updated += Call.objects.filter(session_id=call_id).exclude(
+                    status__in=TERMINAL_CALL_STATUSES,
+                ).update(**call_fields)
+                WebRTCCall.objects.filter(session_id=call_id).exclude(
+                    status__in=TERMINAL_CALL_STATUSES,
+                ).update(**webrtc_fields)
+    except Exception as e:
+        logger.error(f"Errore sync stati chiamate da Notify: {e}")
+        return Response({'error': str(e)}, status=500)
+    
+    logger.info(f"🔄 Sync chiamate da Notify: {len(states)} stati, {updated} chiamate aggiornate")
+    return Response({'success': True, 'received': len(states), 'updated': updated})
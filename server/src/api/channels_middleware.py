@@ -0,0 +1,35 @@
+"""
+Middleware Channels per l'autenticazione a token dei WebSocket
+
+Usa la stessa pipeline delle richieste HTTP (resolve_principal), quindi un
+client già autenticato via REST viene servito dalla cache dei principal.
+Il token può arrivare nell'header Authorization o nel parametro ?token=
+(i client WebSocket mobili non sempre possono impostare header).
+"""
+from urllib.parse import parse_qs
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from .custom_authentication import get_token_from_header, resolve_principal
+
+
+class PrincipalAuthMiddleware(BaseMiddleware):
+    """Imposta scope['user'] e scope['auth_token'] dal token, se presente"""
+
+    async def __call__(self, scope, receive, send):
+        token_key = self._get_token(scope)
+        if token_key:
+            scope = dict(scope)
+            principal = await database_sync_to_async(resolve_principal)(token_key)
+            if principal is not None:
+                scope['user'], scope['auth_token'] = principal
+            scope['principal'] = principal
+        return await super().__call__(scope, receive, send)
+
+    @staticmethod
+    def _get_token(scope):
+        for name, value in scope.get('headers', []):
+            if name == b'authorization':
+                return get_token_from_header(value.decode('latin1'))
+
+        query = parse_qs(scope.get('query_string', b'').decode())
+        return (query.get('token') or [None])[0]
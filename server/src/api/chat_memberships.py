@@ -0,0 +1,61 @@
+"""
+Backfill dello stato per partecipante delle chat (ChatMembership)
+
+Usato dalla migrazione 0019 (con i modelli storici) e dal comando
+backfill_chat_memberships (ricalcolo manuale): riceve le classi dei modelli
+invece di importarle, così la migrazione resta valida anche se i modelli
+cambiano in futuro.
+"""
+from django.db.models import Count, DateTimeField, Exists, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+
+def backfill(Chat, ChatMembership, ChatMessage):
+    """
+    Crea le membership mancanti e ricalcola chat nascoste, non letti e ultimo letto.
+    Va chiamata dentro una transazione.
+
+    Returns:
+        (membership create, membership nascoste, membership ricalcolate)
+    """
+    # 1. Una membership per ogni partecipante esistente
+    Participants = Chat.participants.through
+    pairs = Participants.objects.values_list('chat_id', 'user_id')
+    before = ChatMembership.objects.count()
+    ChatMembership.objects.bulk_create(
+        (ChatMembership(chat_id=chat_id, user_id=user_id) for chat_id, user_id in pairs.iterator()),
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    created = ChatMembership.objects.count() - before
+
+    # 2. Chat eliminate per utente → hidden_at
+    deleted_by = Chat.deleted_by_users.through.objects.filter(
+        chat_id=OuterRef('chat_id'), user_id=OuterRef('user_id')
+    )
+    requested_at = Chat.objects.filter(pk=OuterRef('chat_id')).values('deletion_requested_at')[:1]
+    hidden_count = ChatMembership.objects.filter(
+        Exists(deleted_by), hidden_at__isnull=True
+    ).update(
+        hidden_at=Coalesce(Subquery(requested_at), Value(timezone.now(), output_field=DateTimeField()))
+    )
+
+    # 3. Non letti: messaggi non letti inviati dagli altri partecipanti
+    unread = ChatMessage.objects.filter(
+        chat_id=OuterRef('chat_id'), is_read=False
+    ).exclude(
+        sender_id=OuterRef('user_id')
+    ).order_by().values('chat_id').annotate(total=Count('id')).values('total')
+
+    # 4. Ultimo letto: ultimo messaggio inviato dall'utente o già letto
+    last_read = ChatMessage.objects.filter(
+        Q(sender_id=OuterRef('user_id')) | Q(is_read=True),
+        chat_id=OuterRef('chat_id'),
+    ).order_by('-created_at').values('id')[:1]
+
+    updated = ChatMembership.objects.update(
+        unread_count=Coalesce(Subquery(unread), 0),
+        last_read_message=Subquery(last_read),
+    )
+    return created, hidden_count, updated
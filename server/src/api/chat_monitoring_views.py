@@ -12,6 +12,7 @@ from rest_framework.response import Response
 from rest_framework import status
 
 from .models import User, Chat, ChatMessage, UserStatus, Call
+from . import principal_cache
 
 
 @api_view(['GET'])
@@ -468,6 +469,7 @@ def block_user(request, user_id):
         # Logout forzato: elimina tutti i token
         from .models import AuthToken
         AuthToken.objects.filter(user=user).update(is_active=False)
+        principal_cache.invalidate_user(user)
         
         # Imposta status offline
         try:
@@ -675,6 +677,9 @@ def toggle_user_e2e(request, user_id):
             user_status.e2e_enabled = not force_disabled
             user_status.save()
         
+        # Cambio di policy di sicurezza: forza la rivalidazione delle sessioni in cache
+        principal_cache.invalidate_user(user)
+        
         # NOTA: Manteniamo la chiave pubblica salvata anche quando disabilitiamo E2EE
         # In questo modo l'utente può riabilitare la cifratura istantaneamente
         # L'app mobile controlla e2e_force_disabled per decidere se cifrare o meno
@@ -709,20 +714,20 @@ def dashboard_statistics(request):
         Statistiche su visitatori, chat, chiamate, utenti attivi, traffico server, ecc.
     """
     try:
-        # Calcola il range di oggi
-        today_start = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        from admin_panel import rollups
+        
+        # Rollup pre-aggregati (admin_panel.rollups): nessun COUNT sulle tabelle grandi
+        stats = rollups.get_stats()
+        today_start = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
         
         # Totale utenti (visitatori mensili - approssimazione)
-        total_users = User.objects.filter(is_active=True).count()
+        total_users = stats.gauge('users_total') - stats.gauge('users_blocked')
         
         # Chat create oggi
-        chats_today = Chat.objects.filter(created_at__gte=today_start).count()
+        chats_today = stats.since('chats_created', today_start)
         
         # Chiamate completate oggi
-        calls_today = Call.objects.filter(
-            timestamp__gte=today_start,
-            status='completed'
-        ).count()
+        calls_today = stats.since('calls', today_start, 'completed')
         
         # Utenti attivi (online ora o visti nelle ultime 24h)
         yesterday = timezone.now() - timedelta(hours=24)
@@ -731,33 +736,16 @@ def dashboard_statistics(request):
             Q(last_seen__gte=yesterday)
         ).count()
         
-        # Traffico server per gli ultimi 7 giorni
-        server_traffic = []
-        for i in range(6, -1, -1):
-            day_start = today_start - timedelta(days=i)
-            day_end = day_start + timedelta(days=1)
-            
-            # Conta messaggi + chiamate come "traffico"
-            messages_count = ChatMessage.objects.filter(
-                created_at__gte=day_start,
-                created_at__lt=day_end
-            ).count()
-            
-            calls_count = Call.objects.filter(
-                timestamp__gte=day_start,
-                timestamp__lt=day_end
-            ).count()
-            
-            traffic_value = messages_count + (calls_count * 5)  # Peso maggiore per chiamate
-            
-            # Nome del giorno
-            day_names = ['Lun', 'Mar', 'Mer', 'Gio', 'Ven', 'Sab', 'Dom']
-            day_name = day_names[day_start.weekday()]
-            
-            server_traffic.append({
-                'day': day_name,
-                'value': traffic_value
-            })
+        # Traffico server per gli ultimi 7 giorni: messaggi + chiamate
+        day_names = ['Lun', 'Mar', 'Mer', 'Gio', 'Ven', 'Sab', 'Dom']
+        calls_per_day = dict(stats.daily('calls', 7))
+        server_traffic = [
+            {
+                'day': day_names[day.weekday()],
+                'value': messages_count + calls_per_day[day] * 5,  # Peso maggiore per chiamate
+            }
+            for day, messages_count in stats.daily('chat_messages', 7)
+        ]
         
         # Informazioni server (mock - in futuro da sistema reale)
         servers = [
@@ -0,0 +1,73 @@
+import logging
+from urllib.parse import parse_qs
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.utils import timezone
+from . import presence, realtime
+
+logger = logging.getLogger('securevox')
+
+
+class UserEventsConsumer(AsyncJsonWebsocketConsumer):
+    """
+    WebSocket degli eventi real-time dell'utente autenticato (/ws/events/)
+
+    Alla connessione rimanda gli eventi con sequenza > ?since=, poi inoltra
+    quelli pubblicati da api.realtime. Messaggi dal client:
+    {"type": "ping"} → heartbeat di presenza e {"type": "pong"}
+    """
+
+    async def connect(self):
+        self.user = self.scope.get('user')
+        self.groups_joined = []
+        self.last_seq = 0
+        if self.user is None or not self.user.is_authenticated:
+            await self.close(code=4401)
+            return
+
+        for group in (realtime.user_group(self.user.id), realtime.PRESENCE_GROUP):
+            await self.channel_layer.group_add(group, self.channel_name)
+            self.groups_joined.append(group)
+        await self.accept()
+
+        # I messaggi del gruppo arrivati nel frattempo vengono gestiti dopo il replay
+        # e scartati se già inviati (sequenza <= last_seq)
+        since = self._get_since()
+        events, self.last_seq = await database_sync_to_async(realtime.replay)(self.user.id, since)
+        if events is None:
+            await self.send_json({'type': 'resync_required', 'seq': self.last_seq})
+        else:
+            for event in events:
+                await self.send_json(event)
+        await self.send_json({'type': 'ready', 'seq': self.last_seq, 'timestamp': timezone.now().isoformat()})
+
+        await database_sync_to_async(presence.connect)(self.user)
+        logger.info(f"📡 WebSocket eventi connesso: {self.user.username} (da sequenza {since})")
+
+    async def disconnect(self, close_code):
+        for group in self.groups_joined:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        if self.groups_joined:
+            await database_sync_to_async(presence.disconnect)(self.user)
+            logger.info(f"📡 WebSocket eventi disconnesso: {self.user.username}")
+
+    async def receive_json(self, content):
+        if content.get('type') == 'ping':
+            await database_sync_to_async(presence.heartbeat)(self.user, True)
+            await self.send_json({'type': 'pong', 'seq': self.last_seq})
+
+    async def user_event(self, message):
+        event = message['event']
+        seq = event.get('seq')
+        if seq is not None:
+            if seq <= self.last_seq:
+                return
+            self.last_seq = seq
+        await self.send_json(event)
+
+    def _get_since(self):
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        try:
+            return max(int((query.get('since') or ['0'])[0]), 0)
+        except ValueError:
+            return 0
@@ -1,85 +1,116 @@
-from rest_framework.authentication import BaseAuthentication
+"""
+Pipeline unica di autenticazione a token per SecureVox
+
+resolve_principal() è l'UNICO punto che trasforma un token in chiaro in (user, token):
+1. cache condivisa dei principal (nessuna query, nessuna decifratura)
+2. Token DRF standard (una query indicizzata sulla chiave)
+3. AuthToken cifrato (una query indicizzata sul digest HMAC + una decifratura)
+
+Il principal viene risolto UNA volta per richiesta da AuthTokenMiddleware (HTTP)
+o da PrincipalAuthMiddleware (Channels) e riusato da DRF tramite le classi qui sotto.
+"""
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
 from rest_framework.exceptions import AuthenticationFailed
-from django.contrib.auth.models import AnonymousUser
 from .models import AuthToken
+from . import principal_cache
 from django.utils import timezone
-from django.core.cache import cache
 import logging
-import hashlib
+import time
 
 logger = logging.getLogger('securevox')
 
+TOKEN_KEYWORD = 'Token'
+
+
+def get_token_from_header(auth_header):
+    """Estrae il token in chiaro da un header Authorization ('Token <key>'), altrimenti None"""
+    parts = (auth_header or '').split()
+    if len(parts) != 2 or parts[0] != TOKEN_KEYWORD:
+        return None
+    return parts[1]
+
+
+def resolve_principal(token_key):
+    """
+    Risolve (user, token) per un token in chiaro.
+
+    Returns:
+        (user, token) se il token è valido e l'utente attivo, altrimenti None
+    """
+    principal = principal_cache.get_principal(token_key)
+    if principal:
+        return principal
+
+    # Istante precedente alla lettura dal DB: un'invalidazione successiva scarta la voce in cache
+    validated_at = time.time()
+    principal = _resolve_drf_token(token_key, validated_at) or _resolve_auth_token(token_key, validated_at)
+    if principal is None:
+        logger.warning(f"TokenAuth - Token non valido: {token_key[:8]}...")
+    return principal
+
+
+def _resolve_drf_token(token_key, validated_at):
+    try:
+        token = Token.objects.select_related('user').get(key=token_key)
+    except Token.DoesNotExist:
+        return None
+
+    if not token.user.is_active:
+        return None
+
+    principal_cache.set_principal(token_key, token.user, token, validated_at)
+    return (token.user, token)
+
+
+def _resolve_auth_token(token_key, validated_at):
+    try:
+        # Ricerca indicizzata sul digest HMAC: una query, nessuna decifratura per riga
+        token = AuthToken.get_by_raw_token(token_key)
+    except AuthToken.DoesNotExist:
+        return None
+
+    # Verifica se il token è valido (non scaduto e integro) con una sola decifratura
+    deadline = token.get_integrity_deadline()
+    if token.is_expired() or deadline is None or timezone.now() > deadline:
+        # Disattiva il token non valido
+        token.is_active = False
+        token.save(update_fields=['is_active'])
+        logger.info(f"TokenAuth - AuthToken non valido per utente {token.user.username}")
+        return None
+
+    if not token.user.is_active:
+        return None
+
+    # Salva il principal validato fino alla scadenza effettiva del token
+    principal_cache.set_principal(
+        token_key, token.user, token, validated_at,
+        valid_until=min(token.expires_at, deadline),
+    )
+    logger.info(f"TokenAuth - Autenticazione riuscita per: {token.user.username}")
+    return (token.user, token)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Autenticazione DRF a token basata sulla pipeline unica (Token DRF e AuthToken)"""
 
-class CustomTokenAuthentication(BaseAuthentication):
-    """Autenticazione personalizzata con token con durata 24 ore"""
-    
     def authenticate(self, request):
-        """Autentica l'utente usando il token personalizzato con caching"""
-        auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-        
-        if not auth_header.startswith('Token '):
-            return None
-        
-        token_key = auth_header.split(' ')[1]
-        
-        # Crea una chiave di cache basata sull'hash del token per sicurezza
-        token_hash = hashlib.sha256(token_key.encode()).hexdigest()[:16]
-        cache_key = f"auth_token_{token_hash}"
-        
-        # Prova a ottenere il token dalla cache
-        cached_result = cache.get(cache_key)
-        if cached_result:
-            user_id, token_id = cached_result
-            try:
-                token = AuthToken.objects.get(id=token_id, is_active=True)
-                if token.is_valid():
-                    logger.debug(f"CustomTokenAuth - Token cache hit per utente: {token.user.username}")
-                    return (token.user, token)
-                else:
-                    # Token scaduto, rimuovi dalla cache
-                    cache.delete(cache_key)
-            except AuthToken.DoesNotExist:
-                # Token non esiste più, rimuovi dalla cache
-                cache.delete(cache_key)
-        
-        logger.info(f"CustomTokenAuth - Token ricevuto: {token_key[:20]}...")
-        
-        try:
-            # Cerca il token nel database confrontando con il token decrittato
-            tokens = AuthToken.objects.filter(is_active=True)
-            token = None
-            for t in tokens:
-                if t.get_token() == token_key:
-                    token = t
-                    break
-            
-            if not token:
-                logger.warning(f"CustomTokenAuth - Token non trovato: {token_key[:20]}...")
+        django_request = getattr(request, '_request', request)
+
+        # Principal già risolto da AuthTokenMiddleware: nessun lavoro aggiuntivo
+        if hasattr(django_request, 'principal'):
+            if django_request.principal is None:
                 raise AuthenticationFailed('Token non valido')
-            
-            logger.info(f"CustomTokenAuth - Token trovato per utente: {token.user.username}")
-            
-            # Verifica se il token è valido (non scaduto e integro)
-            if not token.is_valid():
-                # Disattiva il token non valido
-                token.is_active = False
-                token.save()
-                logger.info(f"CustomTokenAuth - Token non valido per utente {token.user.username}")
-                raise AuthenticationFailed('Token scaduto o non valido')
-            
-            # Salva in cache per 5 minuti
-            cache.set(cache_key, (token.user.id, token.id), 300)
-            
-            logger.info(f"CustomTokenAuth - Autenticazione riuscita per: {token.user.username}")
-            return (token.user, token)
-            
-        except AuthToken.DoesNotExist:
-            logger.warning(f"CustomTokenAuth - Token non trovato nel database")
+            return django_request.principal
+
+        return super().authenticate(request)
+
+    def authenticate_credentials(self, key):
+        principal = resolve_principal(key)
+        if principal is None:
             raise AuthenticationFailed('Token non valido')
-        except Exception as e:
-            logger.error(f"CustomTokenAuth - Errore durante l'autenticazione: {e}")
-            raise AuthenticationFailed('Errore di autenticazione')
-    
-    def authenticate_header(self, request):
-        """Restituisce l'header di autenticazione richiesto"""
-        return 'Token'
+        return principal
+
+
+class CustomTokenAuthentication(CachedTokenAuthentication):
+    """Alias storico: i token personalizzati sono gestiti dalla pipeline unica"""
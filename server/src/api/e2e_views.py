@@ -3,8 +3,7 @@ API Views per End-to-End Encryption (E2EE)
 Gestisce lo scambio delle chiavi pubbliche tra utenti
 """
 
-from rest_framework.decorators import api_view, authentication_classes, permission_classes
-from rest_framework.authentication import TokenAuthentication
+from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
@@ -13,7 +12,6 @@ from .models import UserStatus
 
 
 @api_view(['POST'])
-@authentication_classes([TokenAuthentication])
 @permission_classes([IsAuthenticated])
 def upload_public_key(request):
     """
@@ -58,7 +56,6 @@ def upload_public_key(request):
 
 
 @api_view(['GET'])
-@authentication_classes([TokenAuthentication])
 @permission_classes([IsAuthenticated])
 def get_user_public_key(request, user_id):
     """
@@ -106,7 +103,6 @@ def get_user_public_key(request, user_id):
 
 
 @api_view(['GET'])
-@authentication_classes([TokenAuthentication])
 @permission_classes([IsAuthenticated])
 def get_my_public_key(request):
     """
@@ -149,8 +145,24 @@ def get_my_public_key(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+def collect_public_keys(user_ids):
+    """Chiavi pubbliche E2E degli utenti indicati (una query), per id utente"""
+    user_statuses = UserStatus.objects.filter(
+        user__id__in=user_ids,
+        e2e_public_key__isnull=False
+    ).select_related('user')
+    
+    keys = {}
+    for user_status in user_statuses:
+        keys[str(user_status.user.id)] = {
+            'user_id': user_status.user.id,
+            'username': user_status.user.username,
+            'public_key': user_status.e2e_public_key
+        }
+    return keys
+
+
 @api_view(['POST'])
-@authentication_classes([TokenAuthentication])
 @permission_classes([IsAuthenticated])
 def get_multiple_keys(request):
     """
@@ -172,19 +184,7 @@ def get_multiple_keys(request):
         print(f'🔐 E2EE: Richiesta chiavi per {len(user_ids)} utenti')
         
         # Recupera tutte le chiavi in una query
-        user_statuses = UserStatus.objects.filter(
-            user__id__in=user_ids,
-            e2e_public_key__isnull=False
-        ).select_related('user')
-        
-        # Costruisci risposta
-        keys = {}
-        for user_status in user_statuses:
-            keys[str(user_status.user.id)] = {
-                'user_id': user_status.user.id,
-                'username': user_status.user.username,
-                'public_key': user_status.e2e_public_key
-            }
+        keys = collect_public_keys(user_ids)
         
         print(f'🔐 E2EE: Trovate {len(keys)} chiavi su {len(user_ids)} richieste')
         
@@ -202,7 +202,6 @@ def get_multiple_keys(request):
 
 
 @api_view(['GET'])
-@authentication_classes([TokenAuthentication])
 @permission_classes([IsAuthenticated])
 def get_my_e2e_status(request):
     """
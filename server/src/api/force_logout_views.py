@@ -7,6 +7,7 @@ from django.views.decorators.http import require_http_methods
 from rest_framework.authtoken.models import Token
 from django.contrib.sessions.models import Session
 from .models import UserStatus, AuthToken
+from . import principal_cache
 import logging
 
 logger = logging.getLogger('securevox')
@@ -33,7 +34,10 @@ def force_logout_all_users(request):
         # 3. Elimina tutte le sessioni Django
         Session.objects.all().delete()
         
-        # 4. Imposta tutti gli utenti offline
+        # 4. Svuota la cache dei principal autenticati (condivisa tra i worker)
+        principal_cache.invalidate_all()
+        
+        # 5. Imposta tutti gli utenti offline
         UserStatus.objects.filter(is_logged_in=True).update(
             is_logged_in=False,
             status='offline',
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from api.chat_memberships import backfill
+from api.models import Chat, ChatMembership, ChatMessage
+import logging
+
+logger = logging.getLogger('securevox')
+
+
+class Command(BaseCommand):
+    help = ('Crea/ricalcola lo stato per partecipante delle chat (ChatMembership): '
+            'non letti, ultimo messaggio letto e chat nascoste')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            created, hidden_count, updated = backfill(Chat, ChatMembership, ChatMessage)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'ChatMembership: {created} create, {hidden_count} nascoste, {updated} ricalcolate'
+        ))
+        logger.info(f'Backfill ChatMembership completato: {created} create, {hidden_count} nascoste, {updated} ricalcolate')
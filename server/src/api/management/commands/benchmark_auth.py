@@ -0,0 +1,93 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from datetime import timedelta
+from api.models import AuthToken
+from api.middleware import AuthTokenMiddleware
+from api import principal_cache
+import time
+
+
+class Command(BaseCommand):
+    help = ('Misura il costo per richiesta della pipeline di autenticazione a token '
+            'al crescere dei token attivi (i dati di prova vengono annullati al termine)')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            default='100,1000,5000',
+            help='Numero di AuthToken attivi da simulare, separati da virgola',
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=200,
+            help='Richieste misurate per ogni dimensione',
+        )
+
+    def handle(self, *args, **options):
+        sizes = [int(s) for s in options['sizes'].split(',') if s.strip()]
+        n_requests = options['requests']
+
+        self.stdout.write(f"{'token attivi':>14} {'cold ms/req':>12} {'warm ms/req':>12} {'query cold':>11} {'query warm':>11}")
+        for size in sizes:
+            with transaction.atomic():
+                user, row = self._run(size, n_requests)
+                transaction.set_rollback(True)
+            # I principal creati durante la prova non devono sopravvivere al rollback
+            principal_cache.invalidate_user(user)
+            self.stdout.write(f"{size:>14} {row[0]:>12.3f} {row[1]:>12.3f} {row[2]:>11} {row[3]:>11}")
+
+    def _run(self, size, n_requests):
+        user = User.objects.create_user(username=f'benchmark_auth_{size}_{int(time.time())}')
+
+        tokens = []
+        for _ in range(size):
+            token = AuthToken(user=user)
+            token.encrypted_key = token.generate_encrypted_key()
+            token.lookup_digest = AuthToken.compute_lookup_digest(token.get_token())
+            token.expires_at = timezone.now() + timedelta(days=3650)
+            tokens.append(token)
+        AuthToken.objects.bulk_create(tokens, batch_size=500)
+
+        # Un token "caldo" campionato a metà tabella, come un client qualsiasi
+        raw_token = tokens[size // 2].get_token()
+        factory = RequestFactory()
+        middleware = AuthTokenMiddleware(lambda request: None)
+
+        def authenticate():
+            request = factory.get('/api/chats/', HTTP_AUTHORIZATION=f'Token {raw_token}')
+            middleware.process_request(request)
+            assert request.principal is not None
+
+        # Cold: cache invalidata prima di ogni richiesta
+        cold_elapsed = 0.0
+        for _ in range(n_requests):
+            principal_cache.invalidate_token(raw_token)
+            start = time.perf_counter()
+            authenticate()
+            cold_elapsed += time.perf_counter() - start
+        principal_cache.invalidate_token(raw_token)
+        with CaptureQueriesContext(connection) as cold_queries:
+            authenticate()
+
+        # Warm: principal in cache. Le revoche appena scritte dal ciclo cold scartano
+        # i principal validati entro il margine di skew, che va lasciato scadere
+        time.sleep(principal_cache.CLOCK_SKEW_SECONDS)
+        authenticate()
+        start = time.perf_counter()
+        for _ in range(n_requests):
+            authenticate()
+        warm_elapsed = time.perf_counter() - start
+        with CaptureQueriesContext(connection) as warm_queries:
+            authenticate()
+
+        return user, (
+            cold_elapsed * 1000 / n_requests,
+            warm_elapsed * 1000 / n_requests,
+            len(cold_queries.captured_queries),
+            len(warm_queries.captured_queries),
+        )
@@ -0,0 +1,118 @@
+"""
+Mappa media → chat/messaggio (modello MediaObject)
+
+- record_upload(): una riga per upload, scritta dalle view di media_service
+- attach_to_message(): send_chat_message collega l'upload al messaggio; un
+  media inoltrato senza nuovo upload riceve una riga propria per la chat di
+  destinazione (e un riferimento in più al file condiviso), così il controllo
+  resta corretto anche dopo gli inoltri
+- is_e2e_encrypted(): controllo E2E dei download admin con un solo lookup
+  indicizzato su storage_path
+"""
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from urllib.parse import unquote, urlparse
+from .models import Chat, MediaObject
+from . import media_store
+import logging
+
+logger = logging.getLogger('securevox')
+
+# Chiavi dei metadata dei messaggi che possono contenere l'URL di un media
+MEDIA_URL_KEYS = ('imageUrl', 'videoUrl', 'audioUrl', 'fileUrl', 'file_url', 'url')
+
+KIND_BY_MESSAGE_TYPE = {
+    'image': MediaObject.KIND_IMAGE,
+    'video': MediaObject.KIND_VIDEO,
+    'voice': MediaObject.KIND_AUDIO,
+    'audio': MediaObject.KIND_AUDIO,
+    'file': MediaObject.KIND_FILE,
+    'attachment': MediaObject.KIND_FILE,
+}
+
+_DOWNLOAD_PREFIX = '/api/media/download/'
+_VIDEO_PREFIX = '/api/media/video/'
+
+
+def storage_path_from_url(url):
+    """
+    Percorso nello storage di un URL restituito dagli upload, None se non è un media locale.
+
+    '.../api/media/download/images/x.jpg' → 'images/x.jpg'
+    '.../api/media/video/x.mp4' → 'videos/x.mp4'
+    """
+    if not url or not isinstance(url, str):
+        return None
+    path = unquote(urlparse(url).path)
+    if path.startswith(_DOWNLOAD_PREFIX):
+        return path[len(_DOWNLOAD_PREFIX):] or None
+    if path.startswith(_VIDEO_PREFIX):
+        name = path[len(_VIDEO_PREFIX):]
+        return (name if name.startswith('videos/') else f"videos/{name}") if name else None
+    return None
+
+
+def is_encrypted_metadata(metadata):
+    metadata = metadata or {}
+    return metadata.get('encrypted') is True or metadata.get('iv') is not None or metadata.get('mac') is not None
+
+
+def record_upload(request, storage_path, kind, chat_id, encrypted, size, mime_type=''):
+    """Registra un upload (owner: utente autenticato oppure user_id del form)"""
+    try:
+        user = getattr(request, 'user', None)
+        owner_id = user.id if user is not None and user.is_authenticated else \
+            User.objects.filter(id=request.POST.get('user_id')).values_list('id', flat=True).first()
+        chat_id = Chat.objects.filter(id=chat_id).values_list('id', flat=True).first()
+    except (ValueError, ValidationError):
+        # user_id o chat_id non validi: il media resta registrato senza proprietario/chat
+        owner_id = chat_id = None
+
+    return MediaObject.objects.create(
+        storage_path=storage_path,
+        kind=kind,
+        owner_id=owner_id,
+        chat_id=chat_id,
+        encrypted=encrypted,
+        size=size,
+        mime_type=mime_type or '',
+    )
+
+
+def attach_to_message(message, metadata):
+    """
+    Collega al messaggio i media referenziati nei suoi metadata.
+    Va chiamata nella transazione che salva il messaggio.
+    """
+    kind = KIND_BY_MESSAGE_TYPE.get(message.message_type)
+    if not kind or not metadata:
+        return
+
+    paths = {storage_path_from_url(metadata.get(key)) for key in MEDIA_URL_KEYS} - {None}
+    encrypted = is_encrypted_metadata(metadata)
+    for path in paths:
+        upload_id = MediaObject.objects.filter(
+            storage_path=path, chat=message.chat, owner=message.sender, message__isnull=True,
+        ).order_by('created_at').values_list('id', flat=True).first()
+        if upload_id:
+            MediaObject.objects.filter(id=upload_id).update(message=message)
+            continue
+
+        # Inoltro di un media già presente: nuova riga per la chat di destinazione
+        source = MediaObject.objects.filter(storage_path=path).order_by('-created_at').first()
+        if source:
+            MediaObject.objects.create(
+                storage_path=path,
+                kind=source.kind,
+                owner=message.sender,
+                chat=message.chat,
+                message=message,
+                encrypted=encrypted or source.encrypted,
+                size=source.size,
+                mime_type=source.mime_type,
+            )
+            media_store.add_reference(path)
+
+
+def is_e2e_encrypted(storage_path):
+    return MediaObject.objects.filter(storage_path=storage_path, encrypted=True).exists()
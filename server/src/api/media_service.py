@@ -8,11 +8,14 @@ from django.http import JsonResponse, HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
 from django.conf import settings
 import json
 import logging
+import re
 from .office_converter import office_converter
+from . import media_objects, media_store, office_previews, thumbnails
+from .models import MediaObject
+from .media_streaming import serve_media
 
 logger = logging.getLogger(__name__)
 
@@ -47,6 +50,36 @@ SUPPORTED_FILE_TYPES = {
 
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
 
+# Header CORS delle risposte di download (ETag e Content-Range leggibili dai client web)
+DOWNLOAD_EXPOSE_HEADERS = 'Content-Range, Accept-Ranges, Content-Length, ETag'
+VIDEO_CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, OPTIONS',
+    'Access-Control-Allow-Headers': 'Range, If-Range, Content-Type, Authorization',
+    'Access-Control-Expose-Headers': DOWNLOAD_EXPOSE_HEADERS,
+}
+DOWNLOAD_CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Authorization, Range, If-Range',
+    'Access-Control-Expose-Headers': DOWNLOAD_EXPOSE_HEADERS,
+}
+
+E2E_ADMIN_BLOCKED_MESSAGE = (
+    "Accesso negato: I contenuti cifrati end-to-end non sono accessibili agli amministratori "
+    "per preservare la sicurezza della cifratura."
+)
+
+# Media da cui si possono generare miniature (api/thumbnails.py)
+THUMBNAIL_SOURCE_PREFIXES = ('images/', 'videos/', 'previews/', 'uploads/')
+
+
+def _is_admin_request(request):
+    """True se il principal della richiesta (token via AuthTokenMiddleware o sessione) è admin/staff"""
+    user = getattr(request, 'user', None)
+    return bool(user and user.is_authenticated and (user.is_staff or user.is_superuser))
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def upload_file(request):
@@ -98,77 +131,33 @@ def upload_file(request):
             if file_extension not in SUPPORTED_FILE_TYPES:
                 return JsonResponse({'error': f'Tipo file non supportato: {file_extension}'}, status=400)
         
-        # Genera nome file univoco
-        unique_filename = f"{uuid.uuid4()}_{file.name}"
-        file_path = default_storage.save(f"uploads/{unique_filename}", ContentFile(file.read()))
+        # Salvataggio in streaming indirizzato per contenuto (deduplica inoltri e reinvii)
+        stored = media_store.store_upload(file, 'uploads')
+        file_path = stored.path
+        media_objects.record_upload(
+            request, file_path, MediaObject.KIND_FILE, chat_id, is_encrypted, stored.size,
+            SUPPORTED_FILE_TYPES.get(file_extension, file.content_type),
+        )
         
-        # NUOVO: Conversione Office → PDF per preview
+        # 🔐 CORREZIONE FINALE: Costruisci URL assoluto come per le immagini (che funzionano)
+        base_url = request.build_absolute_uri('/')
+        # Rimuovi il trailing slash se presente per evitare doppie slash
+        if base_url.endswith('/'):
+            base_url = base_url[:-1]
+        
+        # Preview PDF dei documenti Office: conversione in background, l'upload risponde subito
         # 🔐 MODIFICA E2E: Salta conversione per file cifrati
+        preview_status = None
         preview_pdf_path = None
-        office_extensions = ['docx', 'xlsx', 'pptx', 'doc', 'xls', 'ppt']  # 🆕 Aggiunti formati vecchi
-        
-        logger.info(f"🔍 Controllo conversione Office: is_encrypted={is_encrypted}, file_extension={file_extension}")
-        
-        if not is_encrypted and file_extension in office_extensions:
-            try:
-                logger.info(f"🔄 Conversione Office → PDF per preview: {file.name}")
-                
-                # Ottieni il percorso completo del file caricato
-                full_file_path = default_storage.path(file_path)
-                
-                # Converti in PDF per preview
-                logger.info(f"🏢 OFFICE - Tentativo conversione: {full_file_path}")
-                logger.info(f"🏢 OFFICE - File esiste: {os.path.exists(full_file_path)}")
-                
-                pdf_preview_path = office_converter.convert_to_pdf_preview(
-                    input_file_path=full_file_path,
-                    output_filename=f"{os.path.splitext(file.name)[0]}_preview"
-                )
-                
-                logger.info(f"🏢 OFFICE - Risultato conversione: {pdf_preview_path}")
-                if pdf_preview_path:
-                    logger.info(f"🏢 OFFICE - PDF esiste: {os.path.exists(pdf_preview_path)}")
-                
-                if pdf_preview_path and os.path.exists(pdf_preview_path):
-                    # Salva il PDF di preview nel storage
-                    with open(pdf_preview_path, 'rb') as pdf_file:
-                        pdf_content = pdf_file.read()
-                        preview_filename = f"{uuid.uuid4()}_preview_{os.path.splitext(file.name)[0]}.pdf"
-                        preview_pdf_path = default_storage.save(f"previews/{preview_filename}", ContentFile(pdf_content))
-                        logger.info(f"✅ PDF preview salvato: {preview_pdf_path}")
-                else:
-                    logger.warning(f"⚠️ Conversione PDF fallita per: {file.name}")
-                    # NUOVO: Crea un PDF informativo di fallback
-                    try:
-                        fallback_pdf_path = office_converter._create_fallback_pdf(
-                            f"{os.path.splitext(file.name)[0]}_preview",
-                            f"Documento {file_extension.upper()}"
-                        )
-                        if fallback_pdf_path and os.path.exists(fallback_pdf_path):
-                            with open(fallback_pdf_path, 'rb') as pdf_file:
-                                pdf_content = pdf_file.read()
-                                preview_filename = f"{uuid.uuid4()}_fallback_{os.path.splitext(file.name)[0]}.pdf"
-                                preview_pdf_path = default_storage.save(f"previews/{preview_filename}", ContentFile(pdf_content))
-                                logger.info(f"✅ PDF fallback salvato: {preview_pdf_path}")
-                    except Exception as fallback_error:
-                        logger.error(f"❌ Errore creazione PDF fallback: {fallback_error}")
-                    
-            except Exception as e:
-                logger.error(f"❌ Errore conversione Office → PDF: {e}", exc_info=True)
-        else:
-            if is_encrypted:
-                logger.info(f"⚠️ File Office cifrato: conversione PDF saltata (file_extension={file_extension})")
-            elif file_extension not in office_extensions:
-                logger.info(f"ℹ️ File non-Office: conversione PDF non necessaria (file_extension={file_extension})")
+        if not is_encrypted and file_extension in office_previews.OFFICE_EXTENSIONS:
+            preview_status, preview_pdf_path = office_previews.request_preview(
+                file_path, stored.sha256, original_file_name, chat_id, base_url,
+            )
+            logger.info(f"🏢 OFFICE - Preview PDF {preview_status}: {original_file_name}")
         
         # Determina tipo di messaggio
         message_type = _get_message_type_from_file(file_extension)
         
-        # 🔐 CORREZIONE FINALE: Costruisci URL assoluto come per le immagini (che funzionano)
-        base_url = request.build_absolute_uri('/')
-        # Rimuovi il trailing slash se presente per evitare doppie slash
-        if base_url.endswith('/'):
-            base_url = base_url[:-1]
         file_url = f"{base_url}/api/media/download/{file_path}"
         
         logger.info(f"📄 BACKEND CORREZIONE - Base URL: {base_url}")
@@ -212,15 +201,13 @@ def upload_file(request):
             
             logger.info(f"🔐 File cifrato: metadata completi: iv={'presente' if iv else 'assente'}, mac={'presente' if mac else 'assente'}")
         
-        # 🔐 NUOVO: Aggiungi URL PDF preview per documenti Office (con URL assoluto)
-        if preview_pdf_path:
-            pdf_preview_url = f"{base_url}/api/media/download/{preview_pdf_path}"
-            metadata['pdfPreviewUrl'] = pdf_preview_url
-            logger.info(f"✅ PDF preview URL: {pdf_preview_url}")
-        else:
-            metadata['pdfPreviewUrl'] = None
-            if file_extension in office_extensions:
-                logger.warning(f"⚠️ Nessun PDF preview generato per file Office: {original_file_name}")
+        # 🔐 NUOVO: URL PDF preview per documenti Office (con URL assoluto)
+        # pdfPreviewStatus 'pending': la chat riceve 'pdf_preview_ready' a conversione finita,
+        # lo stato è consultabile anche su /api/media/preview/<pdfPreviewId>/
+        metadata['pdfPreviewUrl'] = office_previews.preview_url(base_url, preview_pdf_path) if preview_pdf_path else None
+        if preview_status:
+            metadata['pdfPreviewStatus'] = preview_status
+            metadata['pdfPreviewId'] = stored.sha256
         
         # 🔍 Log finale dei metadata
         logger.info(f"📦 Metadata finali per {original_file_name}:")
@@ -228,6 +215,7 @@ def upload_file(request):
         logger.info(f"   - fileType: {metadata['fileType']}")
         logger.info(f"   - file_extension: {metadata['file_extension']}")
         logger.info(f"   - pdfPreviewUrl: {metadata.get('pdfPreviewUrl', 'None')}")
+        logger.info(f"   - pdfPreviewStatus: {metadata.get('pdfPreviewStatus', 'None')}")
         logger.info(f"   - encrypted: {metadata.get('encrypted', False)}")
         
         return JsonResponse({
@@ -299,9 +287,13 @@ def upload_image(request):
         else:
             original_file_name = image.name
         
-        # Genera nome file univoco
-        unique_filename = f"{uuid.uuid4()}_{image.name}"
-        file_path = default_storage.save(f"images/{unique_filename}", ContentFile(image.read()))
+        # Salvataggio in streaming indirizzato per contenuto (deduplica inoltri e reinvii)
+        stored = media_store.store_upload(image, 'images')
+        file_path = stored.path
+        media_objects.record_upload(request, file_path, MediaObject.KIND_IMAGE, chat_id, is_encrypted, stored.size, image.content_type)
+        if not is_encrypted:
+            # Miniature 96/320/720 generate in background, pronte per le bolle della chat
+            thumbnails.schedule(file_path)
         
         # CORREZIONE: Costruisci URL completo e accessibile
         base_url = request.build_absolute_uri('/')
@@ -321,6 +313,8 @@ def upload_image(request):
             'fileSize': image.size,
             'mimeType': image.content_type
         }
+        if not is_encrypted:
+            metadata['thumbnailUrl'] = f"{base_url}/api/media/thumbnail/{file_path}"
         
         # 🔐 CRITICO: Leggi e aggiungi metadati di cifratura se presenti
         if is_encrypted:
@@ -408,9 +402,13 @@ def upload_video(request):
         else:
             original_file_name = video.name
         
-        # Genera nome file univoco
-        unique_filename = f"{uuid.uuid4()}_{video.name}"
-        file_path = default_storage.save(f"videos/{unique_filename}", ContentFile(video.read()))
+        # Salvataggio in streaming indirizzato per contenuto (deduplica inoltri e reinvii)
+        stored = media_store.store_upload(video, 'videos')
+        file_path = stored.path
+        media_objects.record_upload(request, file_path, MediaObject.KIND_VIDEO, chat_id, is_encrypted, stored.size, video.content_type)
+        if not is_encrypted:
+            # Fotogramma poster in background: thumbnailUrl è servito dalla cache
+            thumbnails.schedule(file_path)
         
         # 🔐 CORREZIONE FINALE: Usa URL assoluto + endpoint dedicato video per range request iOS
         base_url = request.build_absolute_uri('/')
@@ -518,9 +516,10 @@ def upload_audio(request):
         else:
             original_file_name = audio.name
         
-        # Genera nome file univoco
-        unique_filename = f"{uuid.uuid4()}_{audio.name}"
-        file_path = default_storage.save(f"audio/{unique_filename}", ContentFile(audio.read()))
+        # Salvataggio in streaming indirizzato per contenuto (deduplica inoltri e reinvii)
+        stored = media_store.store_upload(audio, 'audio')
+        file_path = stored.path
+        media_objects.record_upload(request, file_path, MediaObject.KIND_AUDIO, chat_id, is_encrypted, stored.size, audio.content_type)
         
         # 🔐 CORREZIONE FINALE: Costruisci URL assoluto come per le immagini (che funzionano)
         base_url = request.build_absolute_uri('/')
@@ -664,91 +663,18 @@ def save_contact(request):
         logger.error(f"Errore salvataggio contatto: {str(e)}")
         return JsonResponse({'error': 'Errore interno del server'}, status=500)
 
-def _handle_range_request(request, file, content_type, file_path):
-    """
-    Gestisce HTTP Range Requests per video e audio (richiesto da iOS)
-    """
-    import re
-    
-    # Ottieni la dimensione del file
-    file.seek(0, 2)  # Vai alla fine
-    file_size = file.tell()
-    file.seek(0)  # Torna all'inizio
-    
-    # Controlla se c'è un header Range
-    range_header = request.META.get('HTTP_RANGE')
-    
-    if range_header:
-        # Parse del range header (es: "bytes=0-1023")
-        range_match = re.match(r'bytes=(\d+)-(\d*)', range_header)
-        if range_match:
-            start = int(range_match.group(1))
-            end = int(range_match.group(2)) if range_match.group(2) else file_size - 1
-            
-            # Assicurati che end non superi la dimensione del file
-            end = min(end, file_size - 1)
-            content_length = end - start + 1
-            
-            # Leggi solo il range richiesto
-            file.seek(start)
-            data = file.read(content_length)
-            
-            # Crea risposta con status 206 (Partial Content)
-            response = HttpResponse(data, content_type=content_type, status=206)
-            response['Content-Range'] = f'bytes {start}-{end}/{file_size}'
-            response['Content-Length'] = str(content_length)
-            response['Accept-Ranges'] = 'bytes'
-            
-            print(f'🎥 RANGE REQUEST - File: {file_path}')
-            print(f'🎥 RANGE REQUEST - Range: {start}-{end}/{file_size} ({content_length} bytes)')
-            
-        else:
-            # Range header malformato, restituisci tutto il file
-            data = file.read()
-            response = HttpResponse(data, content_type=content_type)
-            response['Content-Length'] = str(file_size)
-            response['Accept-Ranges'] = 'bytes'
-    else:
-        # Nessun range header, restituisci tutto il file
-        data = file.read()
-        response = HttpResponse(data, content_type=content_type)
-        response['Content-Length'] = str(file_size)
-        response['Accept-Ranges'] = 'bytes'
-    
-    # Headers CORS
-    response['Access-Control-Allow-Origin'] = '*'
-    response['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
-    response['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, Range'
-    response['Access-Control-Expose-Headers'] = 'Content-Range, Accept-Ranges, Content-Length'
-    
-    # Per video, usa inline invece di attachment
-    response['Content-Disposition'] = f'inline; filename="{os.path.basename(file_path)}"'
-    
-    return response
-
 @require_http_methods(["GET", "OPTIONS"])
 def download_video_with_range(request, file_path):
     """
     NUOVO ENDPOINT DEDICATO per video con supporto Range Requests iOS
     🔐 SICUREZZA E2E: Gli admin NON possono vedere contenuti cifrati end-to-end
     """
-    import re
-    import os
-    from django.http import HttpResponse
-    from django.core.files.storage import default_storage
-    from .models import ChatMessage
-    
-    print(f'🎬 NUOVO ENDPOINT VIDEO - File: {file_path}')
-    print(f'🎬 Range Header: {request.META.get("HTTP_RANGE", "NONE")}')
-    
     try:
         # Gestisci CORS
         if request.method == 'OPTIONS':
             response = HttpResponse()
-            response['Access-Control-Allow-Origin'] = '*'
-            response['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
-            response['Access-Control-Allow-Headers'] = 'Range, Content-Type, Authorization'
-            response['Access-Control-Expose-Headers'] = 'Content-Range, Accept-Ranges, Content-Length'
+            for header, value in VIDEO_CORS_HEADERS.items():
+                response[header] = value
             return response
         
         # Aggiungi prefisso se necessario
@@ -756,111 +682,25 @@ def download_video_with_range(request, file_path):
             file_path = f"videos/{file_path}"
         
         if not default_storage.exists(file_path):
-            print(f'🎬 ERRORE: File non trovato: {file_path}')
             return HttpResponse("Video non trovato", status=404)
         
         # 🔐 SICUREZZA E2E: Verifica se il video è cifrato E2E e blocca admin
         # IMPORTANTE: Questo controllo non deve bloccare gli utenti normali
         try:
-            # Cerca il messaggio associato a questo file solo se l'utente è autenticato
-            if request.user.is_authenticated and (request.user.is_staff or request.user.is_superuser):
-                file_name = os.path.basename(file_path)
-                print(f'🔐 Verifica E2E per admin: file_name={file_name}')
-                # Cerca nei messaggi video che contengono questo file
-                video_messages = ChatMessage.objects.filter(
-                    message_type='video',
-                    metadata__videoUrl__icontains=file_name
-                ) | ChatMessage.objects.filter(
-                    message_type='video',
-                    metadata__url__icontains=file_name
-                )
-                
-                # Verifica se almeno un messaggio con questo video è cifrato E2E
-                is_e2e_encrypted = False
-                for msg in video_messages[:5]:  # Limita a 5 messaggi per performance
-                    metadata = msg.metadata or {}
-                    # Verifica se ci sono metadata di cifratura E2E
-                    if (metadata.get('encrypted') is True or 
-                        metadata.get('iv') is not None or 
-                        metadata.get('mac') is not None):
-                        is_e2e_encrypted = True
-                        print(f'🔐 Video cifrato E2E rilevato per file: {file_name}')
-                        break
-                
-                # Se è cifrato E2E e l'utente è admin/staff, blocca l'accesso
-                if is_e2e_encrypted:
-                    print(f'🚫 ACCESSO BLOCCATO: Admin non può vedere contenuti cifrati E2E')
-                    return HttpResponse(
-                        "Accesso negato: I contenuti cifrati end-to-end non sono accessibili agli amministratori per preservare la sicurezza della cifratura.",
-                        status=403
-                    )
+            # Lookup indicizzato sulla mappa media → messaggio (solo per admin)
+            if _is_admin_request(request) and media_objects.is_e2e_encrypted(file_path):
+                logger.info(f'🚫 ACCESSO BLOCCATO: Admin non può vedere contenuti cifrati E2E ({file_path})')
+                return HttpResponse(E2E_ADMIN_BLOCKED_MESSAGE, status=403)
         except Exception as e:
             # Se c'è un errore nel controllo, logga ma NON bloccare il download
             # (gli utenti normali devono sempre poter accedere)
-            print(f'⚠️ Errore controllo E2E per admin (ignorato): {e}')
-            # Procedi con il download normale
-        
-        file = default_storage.open(file_path)
-        
-        # Ottieni dimensione file
-        file.seek(0, 2)
-        file_size = file.tell()
-        file.seek(0)
-        
-        print(f'🎬 File size: {file_size} bytes')
-        
-        # Controlla header Range
-        range_header = request.META.get('HTTP_RANGE')
+            logger.warning(f'⚠️ Errore controllo E2E per admin (ignorato): {e}')
         
-        if range_header:
-            print(f'🎬 Processing range: {range_header}')
-            
-            # Parse range (es: "bytes=0-1")
-            range_match = re.match(r'bytes=(\d+)-(\d*)', range_header)
-            if range_match:
-                start = int(range_match.group(1))
-                end = int(range_match.group(2)) if range_match.group(2) else file_size - 1
-                end = min(end, file_size - 1)
-                content_length = end - start + 1
-                
-                # Leggi range
-                file.seek(start)
-                data = file.read(content_length)
-                
-                print(f'🎬 Range: {start}-{end}/{file_size} ({content_length} bytes)')
-                
-                # Response 206
-                response = HttpResponse(data, content_type='video/mp4', status=206)
-                response['Content-Range'] = f'bytes {start}-{end}/{file_size}'
-                response['Content-Length'] = str(content_length)
-                response['Accept-Ranges'] = 'bytes'
-                
-            else:
-                print('🎬 Range malformato, restituisco tutto')
-                data = file.read()
-                response = HttpResponse(data, content_type='video/mp4')
-                response['Content-Length'] = str(file_size)
-                response['Accept-Ranges'] = 'bytes'
-        else:
-            print('🎬 Nessun range, restituisco tutto')
-            data = file.read()
-            response = HttpResponse(data, content_type='video/mp4')
-            response['Content-Length'] = str(file_size)
-            response['Accept-Ranges'] = 'bytes'
-        
-        # Headers CORS
-        response['Access-Control-Allow-Origin'] = '*'
-        response['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
-        response['Access-Control-Allow-Headers'] = 'Range, Content-Type, Authorization'
-        response['Access-Control-Expose-Headers'] = 'Content-Range, Accept-Ranges, Content-Length'
-        response['Content-Disposition'] = f'inline; filename="{os.path.basename(file_path)}"'
-        
-        file.close()
-        print(f'🎬 Response: {response.status_code} - {len(data)} bytes')
-        return response
+        # Streaming a chunk con supporto Range/multi-range/If-Range (nessuna lettura completa in memoria)
+        return serve_media(request, file_path, 'video/mp4', 'inline', VIDEO_CORS_HEADERS)
         
     except Exception as e:
-        print(f'🎬 ERRORE: {e}')
+        logger.error(f"Errore download video: {str(e)}")
         return HttpResponse(f"Errore video: {e}", status=500)
 
 @require_http_methods(["GET", "OPTIONS"])
@@ -869,16 +709,12 @@ def download_file(request, file_path):
     Endpoint per download di file
     🔐 SICUREZZA E2E: Gli admin NON possono vedere contenuti cifrati end-to-end
     """
-    from .models import ChatMessage
-    
-    print(f'🚨🚨🚨 DOWNLOAD_FILE CHIAMATO - File: {file_path} - Range: {request.META.get("HTTP_RANGE", "NONE")} 🚨🚨🚨')
     try:
         # Gestisci richieste OPTIONS per CORS
         if request.method == 'OPTIONS':
             response = HttpResponse()
-            response['Access-Control-Allow-Origin'] = '*'
-            response['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
-            response['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
+            for header, value in DOWNLOAD_CORS_HEADERS.items():
+                response[header] = value
             return response
             
         # Il file_path dovrebbe già includere il prefisso 'images/' dal salvataggio
@@ -890,65 +726,18 @@ def download_file(request, file_path):
             # 🔐 SICUREZZA E2E: Verifica se il file è cifrato E2E e blocca admin
             # IMPORTANTE: Questo controllo non deve bloccare gli utenti normali
             try:
-                # Cerca il messaggio associato a questo file solo se l'utente è admin
-                if request.user.is_authenticated and (request.user.is_staff or request.user.is_superuser):
-                    file_name = os.path.basename(file_path)
-                    # Determina il tipo di messaggio in base al percorso
-                    message_type = None
-                    if 'images/' in file_path:
-                        message_type = 'image'
-                        metadata_key = 'imageUrl'
-                    elif 'videos/' in file_path:
-                        message_type = 'video'
-                        metadata_key = 'videoUrl'
-                    elif 'audio/' in file_path:
-                        message_type = 'audio'
-                        metadata_key = 'audioUrl'
-                    else:
-                        message_type = 'file'
-                        metadata_key = 'fileUrl'
-                    
-                    # Cerca il messaggio associato a questo file
-                    file_messages = ChatMessage.objects.filter(
-                        message_type=message_type
-                    ).filter(
-                        **{f'metadata__{metadata_key}__icontains': file_name}
-                    )
-                    
-                    # Verifica se almeno un messaggio con questo file è cifrato E2E
-                    is_e2e_encrypted = False
-                    for msg in file_messages[:5]:  # Limita a 5 messaggi per performance
-                        metadata = msg.metadata or {}
-                        # Verifica se ci sono metadata di cifratura E2E
-                        if (metadata.get('encrypted') is True or 
-                            metadata.get('iv') is not None or 
-                            metadata.get('mac') is not None):
-                            is_e2e_encrypted = True
-                            print(f'🔐 File cifrato E2E rilevato per file: {file_name}')
-                            break
-                    
-                    # Se è cifrato E2E e l'utente è admin/staff, blocca l'accesso
-                    if is_e2e_encrypted:
-                        print(f'🚫 ACCESSO BLOCCATO: Admin non può vedere contenuti cifrati E2E')
-                        return HttpResponse(
-                            "Accesso negato: I contenuti cifrati end-to-end non sono accessibili agli amministratori per preservare la sicurezza della cifratura.",
-                            status=403
-                        )
+                # Lookup indicizzato sulla mappa media → messaggio (solo per admin)
+                if _is_admin_request(request) and media_objects.is_e2e_encrypted(file_path):
+                    logger.info(f'🚫 ACCESSO BLOCCATO: Admin non può vedere contenuti cifrati E2E ({file_path})')
+                    return HttpResponse(E2E_ADMIN_BLOCKED_MESSAGE, status=403)
             except Exception as e:
                 # Se c'è un errore nel controllo, logga ma NON bloccare il download
                 # (gli utenti normali devono sempre poter accedere)
-                print(f'⚠️ Errore controllo E2E per admin (ignorato): {e}')
-                # Procedi con il download normale
-            file = default_storage.open(file_path)
-            
+                logger.warning(f'⚠️ Errore controllo E2E per admin (ignorato): {e}')
             # Determina il content type basato sull'estensione
             file_extension = os.path.splitext(file_path)[1].lower()
             content_type = 'application/octet-stream'
             
-            print(f'🎥 DEBUG DOWNLOAD - File: {file_path}')
-            print(f'🎥 DEBUG DOWNLOAD - Extension: {file_extension}')
-            print(f'🔥 FORCE RELOAD - Timestamp: {__import__("time").time()}')
-            
             if file_extension in ['.jpg', '.jpeg']:
                 content_type = 'image/jpeg'
             elif file_extension == '.png':
@@ -962,27 +751,9 @@ def download_file(request, file_path):
             elif file_extension in ['.mp3', '.wav']:
                 content_type = 'audio/mpeg'
             
-            # CORREZIONE: Supporto HTTP Range Requests per video iOS
-            if content_type.startswith('video/') or content_type.startswith('audio/'):
-                print(f'🎥 DEBUG - Chiamando _handle_range_request per {file_path}')
-                print(f'🎥 DEBUG - Content type: {content_type}')
-                return _handle_range_request(request, file, content_type, file_path)
-            
-            # Per immagini e altri file, usa il metodo normale
-            response = HttpResponse(file.read(), content_type=content_type)
-            
-            # Aggiungi headers CORS per permettere il caricamento delle immagini
-            response['Access-Control-Allow-Origin'] = '*'
-            response['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
-            response['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, Range'
-            
-            # Per le immagini, non forzare il download
-            if content_type.startswith('image/'):
-                response['Content-Disposition'] = f'inline; filename="{os.path.basename(file_path)}"'
-            else:
-                response['Content-Disposition'] = f'attachment; filename="{os.path.basename(file_path)}"'
-                
-            return response
+            # Immagini, video e audio inline (Range richiesto da iOS), gli altri file come allegato
+            disposition = 'inline' if content_type.split('/')[0] in ('image', 'video', 'audio') else 'attachment'
+            return serve_media(request, file_path, content_type, disposition, DOWNLOAD_CORS_HEADERS)
         else:
             return JsonResponse({'error': 'File non trovato'}, status=404)
             
@@ -991,18 +762,62 @@ def download_file(request, file_path):
         return JsonResponse({'error': 'Errore interno del server'}, status=500)
 
 @require_http_methods(["GET"])
-def get_thumbnail(request, file_path):
+def get_pdf_preview_status(request, preview_id):
     """
-    Endpoint per ottenere thumbnail di video
+    Stato della preview PDF di un documento Office (pdfPreviewId restituito dall'upload)
     """
     try:
-        # Qui implementeresti la logica per generare/recuperare thumbnail
-        # Per ora restituiamo un placeholder
+        if not re.fullmatch(r'[0-9a-f]{64}', preview_id):
+            return JsonResponse({'error': 'pdfPreviewId non valido'}, status=400)
+        
+        status, path = office_previews.preview_status(preview_id)
+        base_url = request.build_absolute_uri('/').rstrip('/')
         return JsonResponse({
-            'thumbnailUrl': f"/api/media/download/{file_path}",
-            'message': 'Thumbnail generato'
+            'pdfPreviewId': preview_id,
+            'pdfPreviewStatus': status,
+            'pdfPreviewUrl': office_previews.preview_url(base_url, path) if path else None,
         })
         
+    except Exception as e:
+        logger.error(f"Errore stato preview PDF: {str(e)}")
+        return JsonResponse({'error': 'Errore interno del server'}, status=500)
+
+@require_http_methods(["GET", "OPTIONS"])
+def get_thumbnail(request, file_path):
+    """
+    Endpoint per le miniature di immagini, video (fotogramma poster) e preview PDF
+    
+    Query string:
+        size: lato massimo in px, arrotondato alle dimensioni standard (96/320/720)
+        format: 'webp' o 'jpeg' (default: webp se il client lo accetta)
+    """
+    try:
+        if request.method == 'OPTIONS':
+            response = HttpResponse()
+            for header, value in DOWNLOAD_CORS_HEADERS.items():
+                response[header] = value
+            return response
+        
+        if not file_path.startswith(THUMBNAIL_SOURCE_PREFIXES) or '..' in file_path.split('/'):
+            return JsonResponse({'error': 'Percorso non valido'}, status=400)
+        if not default_storage.exists(file_path):
+            return JsonResponse({'error': 'File non trovato'}, status=404)
+        if not thumbnails.supports(file_path):
+            return JsonResponse({'error': 'Miniatura non disponibile per questo tipo di file'}, status=415)
+        
+        size = thumbnails.pick_size(request.GET.get('size'))
+        image_format = request.GET.get('format')
+        if image_format not in thumbnails.FORMATS:
+            image_format = 'webp' if 'image/webp' in request.META.get('HTTP_ACCEPT', '') else 'jpeg'
+        
+        thumbnail_path = thumbnails.get_thumbnail(file_path, size, image_format)
+        if not thumbnail_path:
+            return JsonResponse({'error': 'Miniatura non disponibile'}, status=404)
+        
+        # Nome derivato dall'hash della sorgente: il contenuto non cambia mai
+        headers = {**DOWNLOAD_CORS_HEADERS, 'Cache-Control': 'private, max-age=31536000, immutable', 'Vary': 'Accept'}
+        return serve_media(request, thumbnail_path, f'image/{image_format}', 'inline', headers)
+        
     except Exception as e:
         logger.error(f"Errore generazione thumbnail: {str(e)}")
         return JsonResponse({'error': 'Errore interno del server'}, status=500)
@@ -0,0 +1,165 @@
+"""
+Store degli upload media deduplicato per contenuto
+
+Gli upload non vengono più copiati in memoria con ContentFile(file.read()):
+- store_upload() scrive il file su disco a chunk calcolando lo SHA-256 in un
+  solo passaggio (picco di memoria: un chunk)
+- il nome finale resta casuale (<categoria>/<uuid4><estensione>, i download non
+  sono autenticati); la tabella MediaBlob associa lo SHA-256 al file, così lo
+  stesso contenuto caricato più volte (reinvii, gruppi) occupa un solo file
+- MediaBlob conta i riferimenti: uno per MediaObject (upload o inoltro);
+  release() viene chiamata quando un MediaObject viene eliminato (messaggio o
+  chat eliminati) e all'ultimo riferimento il file viene eliminato al commit
+
+La scrittura avviene in un file temporaneo nella stessa directory di
+destinazione e si conclude con os.replace(), quindi un lettore non vede mai un
+file parziale. Con uno storage remoto (nessun percorso locale) l'hash viene
+calcolato in un primo passaggio e il salvataggio delegato allo storage.
+"""
+from dataclasses import dataclass
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+from django.utils import timezone
+from .models import MediaBlob
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import uuid
+
+logger = logging.getLogger('securevox')
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+_SAFE_EXTENSION = re.compile(r'^\.[a-z0-9]{1,10}$')
+
+
+@dataclass
+class StoredBlob:
+    """Esito di store_upload()"""
+    path: str
+    sha256: str
+    size: int
+    deduplicated: bool
+
+
+def store_upload(uploaded_file, category):
+    """
+    Salva un file caricato nella categoria indicata ('images', 'videos', ...).
+
+    Returns:
+        StoredBlob con il percorso relativo nello storage da usare negli URL
+    """
+    extension = _extension_of(uploaded_file.name)
+    try:
+        directory = default_storage.path(category)
+    except NotImplementedError:
+        return _store_remote(uploaded_file, category, extension)
+
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.upload-', suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in uploaded_file.chunks(UPLOAD_CHUNK_SIZE):
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+
+        sha256 = digest.hexdigest()
+        with transaction.atomic():
+            name = _add_reference(sha256, category, extension)
+            deduplicated = name is not None and os.path.exists(default_storage.path(name))
+            if not deduplicated:
+                if name is None:
+                    name = _new_name(category, extension)
+                    MediaBlob.objects.create(sha256=sha256, storage_path=name, size=size)
+                final_path = default_storage.path(name)
+                os.replace(temp_path, final_path)
+                permissions = getattr(settings, 'FILE_UPLOAD_PERMISSIONS', None)
+                if permissions is not None:
+                    os.chmod(final_path, permissions)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    if deduplicated:
+        logger.info(f"♻️ Upload deduplicato: {name} ({size} byte già presenti)")
+    return StoredBlob(name, sha256, size, deduplicated)
+
+
+def add_reference(path):
+    """Un nuovo MediaObject (es. inoltro) usa un file già presente"""
+    MediaBlob.objects.filter(storage_path=path).update(
+        ref_count=models.F('ref_count') + 1, last_referenced_at=timezone.now(),
+    )
+
+
+def release(path):
+    """
+    Rilascia un riferimento al file; all'ultimo riferimento il file viene eliminato
+    (dopo il commit della transazione corrente).
+
+    Returns:
+        True se il file verrà eliminato
+    """
+    with transaction.atomic():
+        MediaBlob.objects.filter(storage_path=path, ref_count__gt=0).update(
+            ref_count=models.F('ref_count') - 1,
+        )
+        deleted, _ = MediaBlob.objects.filter(storage_path=path, ref_count=0).delete()
+        if deleted:
+            transaction.on_commit(lambda: _delete_file(path))
+    return bool(deleted)
+
+
+def _delete_file(path):
+    default_storage.delete(path)
+    logger.info(f"🗑️ Media eliminato (nessun riferimento): {path}")
+
+
+def _store_remote(uploaded_file, category, extension):
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks(UPLOAD_CHUNK_SIZE):
+        digest.update(chunk)
+    sha256 = digest.hexdigest()
+
+    with transaction.atomic():
+        name = _add_reference(sha256, category, extension)
+        deduplicated = name is not None and default_storage.exists(name)
+        if not deduplicated:
+            uploaded_file.seek(0)
+            # Lo storage legge il file a chunk: nessuna copia completa in memoria
+            if name is None:
+                name = default_storage.save(_new_name(category, extension), uploaded_file)
+                MediaBlob.objects.create(sha256=sha256, storage_path=name, size=uploaded_file.size)
+            else:
+                default_storage.save(name, uploaded_file)
+    return StoredBlob(name, sha256, uploaded_file.size, deduplicated)
+
+
+def _add_reference(sha256, category, extension):
+    """Percorso del file già presente con lo stesso contenuto (riferimento aggiunto), altrimenti None"""
+    blobs = MediaBlob.objects.select_for_update().filter(
+        sha256=sha256, storage_path__startswith=f"{category}/",
+    ).values_list('id', 'storage_path')
+    for blob_id, path in blobs:
+        # L'estensione decide il content type servito: deve coincidere
+        if _extension_of(path) == extension:
+            MediaBlob.objects.filter(id=blob_id).update(
+                ref_count=models.F('ref_count') + 1, last_referenced_at=timezone.now(),
+            )
+            return path
+    return None
+
+
+def _new_name(category, extension):
+    return f"{category}/{uuid.uuid4().hex}{extension}"
+
+
+def _extension_of(filename):
+    extension = os.path.splitext(filename or '')[1].lower()
+    return extension if _SAFE_EXTENSION.match(extension) else ''
@@ -0,0 +1,229 @@
+"""
+Motore di download in streaming per i media
+
+Nessun file viene più caricato interamente in memoria:
+- file completo: FileResponse (sotto gunicorn usa wsgi.file_wrapper → sendfile)
+- Range singolo: 206 con iterazione a chunk sulla sola porzione richiesta
+- Range multipli: 206 multipart/byteranges, sempre in streaming
+- MEDIA_ACCEL_REDIRECT_PREFIX configurato: la risposta è delegata a nginx
+  (X-Accel-Redirect), che gestisce anche Range e sendfile
+
+Validazione condizionale: ETag (dimensione + mtime), If-None-Match → 304,
+If-Range → Range ignorato se il file è cambiato.
+"""
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+import os
+import re
+import uuid
+
+STREAM_CHUNK_SIZE = 64 * 1024
+# Oltre questo numero di intervalli (dopo l'unione) si risponde con il file intero (RFC 9110 §14.2)
+MAX_RANGES = 16
+
+_RANGE_SPEC = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+
+class MediaFile:
+    """File media risolto sullo storage, con i metadati per la validazione"""
+
+    def __init__(self, name):
+        self.name = name
+        self.size = default_storage.size(name)
+        modified = default_storage.get_modified_time(name)
+        self.mtime = int(modified.timestamp())
+        self.etag = quote_etag(f"{self.size:x}-{int(modified.timestamp() * 1_000_000):x}")
+        try:
+            self.local_path = default_storage.path(name)
+        except NotImplementedError:
+            # Storage remoto: nessun percorso locale, si legge tramite storage.open()
+            self.local_path = None
+
+    def open(self):
+        if self.local_path:
+            return open(self.local_path, 'rb')
+        return default_storage.open(self.name, 'rb')
+
+
+def serve_media(request, name, content_type, disposition='inline', extra_headers=None):
+    """
+    Risponde con il file `name` dello storage media gestendo Range, multi-range e cache.
+
+    Args:
+        name: percorso relativo nello storage (es. 'videos/abc.mp4')
+        content_type: MIME type da dichiarare
+        disposition: 'inline' o 'attachment'
+        extra_headers: header aggiuntivi (es. CORS) applicati a ogni risposta
+    """
+    media = MediaFile(name)
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': media.etag,
+        'Last-Modified': http_date(media.mtime),
+        'Content-Disposition': f'{disposition}; filename="{os.path.basename(name)}"',
+        **(extra_headers or {}),
+    }
+
+    if _not_modified(request, media):
+        return _with_headers(HttpResponse(status=304), headers)
+
+    accel_prefix = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', None)
+    if accel_prefix:
+        # nginx serve il file (sendfile, Range, If-Range) dopo i controlli fatti da Django
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{name}"
+        return _with_headers(response, headers)
+
+    ranges = None
+    range_header = request.META.get('HTTP_RANGE')
+    if range_header and _if_range_matches(request, media):
+        ranges = parse_range_header(range_header, media.size)
+        if ranges == []:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{media.size}'
+            return _with_headers(response, headers)
+
+    if not ranges:
+        # Range assente, malformato o troppi intervalli: file intero
+        response = FileResponse(media.open(), content_type=content_type)
+        response['Content-Length'] = str(media.size)
+        return _with_headers(response, headers)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        response = StreamingHttpResponse(
+            _iter_ranges(media, [(start, end)]), status=206, content_type=content_type,
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{media.size}'
+        response['Content-Length'] = str(end - start + 1)
+        return _with_headers(response, headers)
+
+    boundary = uuid.uuid4().hex
+    parts = [
+        (
+            (f'\r\n--{boundary}\r\n'
+             f'Content-Type: {content_type}\r\n'
+             f'Content-Range: bytes {start}-{end}/{media.size}\r\n\r\n').encode(),
+            start, end,
+        )
+        for start, end in ranges
+    ]
+    closing = f'\r\n--{boundary}--\r\n'.encode()
+    length = sum(len(head) + end - start + 1 for head, start, end in parts) + len(closing)
+
+    response = StreamingHttpResponse(
+        _iter_multipart(media, parts, closing), status=206,
+        content_type=f'multipart/byteranges; boundary={boundary}',
+    )
+    response['Content-Length'] = str(length)
+    return _with_headers(response, headers)
+
+
+def parse_range_header(header, size):
+    """
+    Interpreta un header Range 'bytes=...'.
+
+    Returns:
+        None se l'header va ignorato (malformato, unità diversa, troppi intervalli),
+        [] se nessun intervallo è soddisfacibile (416),
+        altrimenti la lista ordinata di (start, end) inclusivi, con gli intervalli
+        sovrapposti o adiacenti uniti
+    """
+    unit, _, specs = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not specs:
+        return None
+
+    ranges = []
+    for spec in specs.split(','):
+        match = _RANGE_SPEC.match(spec)
+        if not match:
+            return None
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+            if last and end < start:
+                return None
+        elif last:
+            # Suffisso: ultimi N byte
+            start, end = max(size - int(last), 0), size - 1
+            if int(last) == 0:
+                continue
+        else:
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, min(end, size - 1)))
+
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+def _iter_ranges(media, ranges):
+    with media.open() as fh:
+        for start, end in ranges:
+            yield from _read_span(fh, start, end)
+
+
+def _iter_multipart(media, parts, closing):
+    with media.open() as fh:
+        for head, start, end in parts:
+            yield head
+            yield from _read_span(fh, start, end)
+    yield closing
+
+
+def _read_span(fh, start, end):
+    fh.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = fh.read(min(STREAM_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+def _etag_list(value):
+    return [tag.strip() for tag in value.split(',') if tag.strip()]
+
+
+def _not_modified(request, media):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        tags = _etag_list(if_none_match)
+        # Confronto debole: W/"x" equivale a "x"
+        return '*' in tags or media.etag in [t.removeprefix('W/') for t in tags]
+
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and media.mtime <= if_modified_since
+
+
+def _if_range_matches(request, media):
+    """If-Range: il Range vale solo se il client ha ancora la stessa versione del file"""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        # Confronto forte: un ETag debole non è mai valido per If-Range
+        return if_range == media.etag
+    since = parse_http_date_safe(if_range)
+    return since is not None and media.mtime == since
+
+
+def _with_headers(response, headers):
+    for key, value in headers.items():
+        response[key] = value
+    return response
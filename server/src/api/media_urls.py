@@ -18,5 +18,6 @@ urlpatterns = [
     # Download endpoints
     path('download/<str:file_path>', media_service.download_file, name='download_file'),
     path('video/<str:file_path>', media_service.download_video_with_range, name='download_video_with_range'),
-    path('thumbnail/<str:file_path>', media_service.get_thumbnail, name='get_thumbnail'),
+    path('thumbnail/<path:file_path>', media_service.get_thumbnail, name='get_thumbnail'),
+    path('preview/<str:preview_id>/', media_service.get_pdf_preview_status, name='get_pdf_preview_status'),
 ]
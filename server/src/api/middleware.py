@@ -1,61 +1,32 @@
-from django.contrib.auth.models import AnonymousUser
 from django.utils.deprecation import MiddlewareMixin
-from .models import AuthToken
-from django.utils import timezone
+from .custom_authentication import get_token_from_header, resolve_principal
 import logging
 
 logger = logging.getLogger('securevox')
 
 
 class AuthTokenMiddleware(MiddlewareMixin):
-    """Middleware per l'autenticazione con token personalizzati"""
-    
+    """
+    Middleware per l'autenticazione con token (Token DRF e AuthToken)
+
+    Risolve il principal UNA volta per richiesta e lo allega a:
+    - request.principal: (user, token) oppure None se il token non è valido
+    - request.user / request.auth_token: per le view Django non DRF (es. media)
+    Le view DRF lo riusano tramite CachedTokenAuthentication.
+    """
+
     def process_request(self, request):
         """Processa la richiesta per verificare il token di autenticazione"""
-        print("MIDDLEWARE EXECUTED")
-        # Ottieni il token dall'header Authorization
-        auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-        print(f"Auth header: {auth_header}")
-        logger.info(f"Auth header: {auth_header}")
-        
-        if auth_header.startswith('Token '):
-            token_key = auth_header.split(' ')[1]
-            logger.info(f"Token key: {token_key[:20]}...")
-            
-            try:
-                # Cerca il token nel database confrontando con il token decrittato
-                tokens = AuthToken.objects.filter(is_active=True)
-                token = None
-                for t in tokens:
-                    if t.get_token() == token_key:
-                        token = t
-                        break
-                
-                if not token:
-                    logger.warning(f"Token not found: {token_key[:20]}...")
-                    return
-                
-                logger.info(f"Token found for user: {token.user.username}")
-                
-                # Verifica se il token è valido (non scaduto e integro)
-                if not token.is_valid():
-                    # Disattiva il token non valido
-                    token.is_active = False
-                    token.save()
-                    logger.info(f"Invalid token for user {token.user.username}")
-                    return
-                
-                # Imposta l'utente nella richiesta
-                request.user = token.user
-                request.auth_token = token
-                logger.info(f"User set: {request.user.username}")
-                
-            except Exception as e:
-                # Errore durante la verifica del token
-                logger.warning(f"Token verification error: {e}")
-                return
-        
-        # Se non c'è token o è invalido, l'utente rimane AnonymousUser
-        if not hasattr(request, 'user'):
-            request.user = AnonymousUser()
-            logger.info("No user set, using AnonymousUser")
+        token_key = get_token_from_header(request.META.get('HTTP_AUTHORIZATION'))
+        if not token_key:
+            # Nessun token: resta l'autenticazione di sessione (AuthenticationMiddleware)
+            return
+
+        try:
+            request.principal = resolve_principal(token_key)
+        except Exception as e:
+            logger.warning(f"Token verification error: {e}")
+            request.principal = None
+
+        if request.principal is not None:
+            request.user, request.auth_token = request.principal
@@ -0,0 +1,51 @@
+import base64
+import hashlib
+import hmac
+
+from cryptography.fernet import Fernet
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_lookup_digest(apps, schema_editor):
+    """Calcola il digest di ricerca per i token esistenti (una sola decifratura per riga)"""
+    AuthToken = apps.get_model('api', 'AuthToken')
+
+    fernet = Fernet(base64.urlsafe_b64encode(hashlib.sha256(settings.SECRET_KEY.encode()).digest()))
+    lookup_key = hashlib.sha256(b'authtoken-lookup|' + settings.SECRET_KEY.encode()).digest()
+
+    to_update = []
+    for token in AuthToken.objects.filter(lookup_digest__isnull=True).only('id', 'encrypted_key').iterator():
+        try:
+            payload = fernet.decrypt(base64.b64decode(token.encrypted_key.encode()))
+        except Exception:
+            # Token non decifrabile (es. SECRET_KEY cambiata): resta senza digest e non autentica più
+            continue
+        parts = payload.rsplit(b'|', 2)
+        if len(parts) != 3:
+            continue
+        token.lookup_digest = hmac.new(lookup_key, parts[0].hex().encode(), hashlib.sha256).hexdigest()
+        to_update.append(token)
+
+        if len(to_update) >= 500:
+            AuthToken.objects.bulk_update(to_update, ['lookup_digest'])
+            to_update = []
+
+    if to_update:
+        AuthToken.objects.bulk_update(to_update, ['lookup_digest'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_add_e2e_controls'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='authtoken',
+            name='lookup_digest',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill_lookup_digest, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.16 on 2026-10-17 19:05
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_memberships(apps, schema_editor):
+    """Le chat esistenti restano visibili: get_chats legge solo le membership"""
+    from api.chat_memberships import backfill
+    backfill(apps.get_model('api', 'Chat'), apps.get_model('api', 'ChatMembership'), apps.get_model('api', 'ChatMessage'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0018_authtoken_lookup_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('hidden_at', models.DateTimeField(blank=True, help_text="Quando l'utente ha nascosto/eliminato la chat (null = visibile)", null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('chat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='api.chat')),
+                ('last_read_message', models.ForeignKey(blank=True, help_text="Ultimo messaggio letto dall'utente", null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.chatmessage')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_memberships', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Chat Membership',
+                'verbose_name_plural': 'Chat Memberships',
+                'db_table': 'api_chat_membership',
+                'indexes': [models.Index(fields=['user', 'hidden_at'], name='api_chat_me_user_id_53a0ce_idx')],
+                'unique_together': {('user', 'chat')},
+            },
+        ),
+        migrations.RunPython(backfill_memberships, migrations.RunPython.noop),
+    ]
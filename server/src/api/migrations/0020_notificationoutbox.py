@@ -0,0 +1,39 @@
+# Generated by Django 4.2.16 on 2026-10-17 19:08
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0019_chatmembership'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payload', models.JSONField(help_text='Corpo della richiesta per SecureVOX Notify')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Prossimo tentativo (per le righe in invio: scadenza del lease)')),
+                ('claim_token', models.UUIDField(blank=True, editable=False, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='outbox_notifications', to='api.chatmessage')),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outbox_notifications', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Notification Outbox',
+                'verbose_name_plural': 'Notification Outbox',
+                'db_table': 'api_notification_outbox',
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='api_notific_status_073950_idx'), models.Index(fields=['claim_token'], name='api_notific_claim_t_ac5a9e_idx')],
+            },
+        ),
+    ]
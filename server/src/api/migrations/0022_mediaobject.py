@@ -0,0 +1,92 @@
+# Generated by Django 4.2.16 on 2026-10-17 19:27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from urllib.parse import unquote, urlparse
+
+
+MEDIA_URL_KEYS = ('imageUrl', 'videoUrl', 'audioUrl', 'fileUrl', 'file_url', 'url')
+KIND_BY_MESSAGE_TYPE = {
+    'image': 'image', 'video': 'video', 'voice': 'audio', 'audio': 'audio', 'file': 'file', 'attachment': 'file',
+}
+
+
+def _storage_path(url):
+    if not url or not isinstance(url, str):
+        return None
+    path = unquote(urlparse(url).path)
+    if path.startswith('/api/media/download/'):
+        return path[len('/api/media/download/'):] or None
+    if path.startswith('/api/media/video/'):
+        name = path[len('/api/media/video/'):]
+        return (name if name.startswith('videos/') else f"videos/{name}") if name else None
+    return None
+
+
+def backfill_media_objects(apps, schema_editor):
+    """Ricostruisce la mappa media → messaggio dai metadata dei messaggi esistenti (una sola scansione)"""
+    ChatMessage = apps.get_model('api', 'ChatMessage')
+    MediaObject = apps.get_model('api', 'MediaObject')
+
+    rows = []
+    messages = ChatMessage.objects.filter(message_type__in=list(KIND_BY_MESSAGE_TYPE)).only(
+        'id', 'chat_id', 'sender_id', 'message_type', 'metadata', 'created_at',
+    )
+    for message in messages.iterator():
+        metadata = message.metadata if isinstance(message.metadata, dict) else {}
+        encrypted = metadata.get('encrypted') is True or metadata.get('iv') is not None or metadata.get('mac') is not None
+        try:
+            size = int(metadata.get('fileSize') or metadata.get('file_size') or 0)
+        except (TypeError, ValueError):
+            size = 0
+        for path in {_storage_path(metadata.get(key)) for key in MEDIA_URL_KEYS} - {None}:
+            rows.append(MediaObject(
+                storage_path=path[:255],
+                kind=KIND_BY_MESSAGE_TYPE[message.message_type],
+                owner_id=message.sender_id,
+                chat_id=message.chat_id,
+                message_id=message.id,
+                encrypted=encrypted,
+                size=size,
+                mime_type=str(metadata.get('mimeType') or metadata.get('mime_type') or '')[:100],
+            ))
+        if len(rows) >= 500:
+            MediaObject.objects.bulk_create(rows)
+            rows = []
+
+    if rows:
+        MediaObject.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0021_mediablob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaObject',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('storage_path', models.CharField(help_text='Percorso relativo nello storage (es. images/<sha256>.jpg)', max_length=255)),
+                ('kind', models.CharField(choices=[('image', 'Image'), ('video', 'Video'), ('audio', 'Audio'), ('file', 'File')], max_length=10)),
+                ('encrypted', models.BooleanField(default=False, help_text='Contenuto cifrato end-to-end')),
+                ('size', models.BigIntegerField(default=0)),
+                ('mime_type', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('chat', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='media_objects', to='api.chat')),
+                ('message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='media_objects', to='api.chatmessage')),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='media_objects', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Media Object',
+                'verbose_name_plural': 'Media Objects',
+                'db_table': 'api_media_object',
+                'indexes': [models.Index(fields=['storage_path', 'encrypted'], name='api_media_o_storage_459221_idx'), models.Index(fields=['created_at'], name='api_media_o_created_4c4aa1_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_media_objects, migrations.RunPython.noop),
+    ]
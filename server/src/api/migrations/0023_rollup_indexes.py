@@ -0,0 +1,21 @@
+# Generated by Django 4.2.16 on 2026-10-17 19:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_mediaobject'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='call',
+            index=models.Index(fields=['created_at'], name='api_call_created_82539d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['created_at'], name='api_chatmes_created_ede6cd_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.16 on 2026-10-17 19:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0023_rollup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserEventStream',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='event_stream', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('last_seq', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'User Event Stream',
+                'verbose_name_plural': 'User Event Streams',
+                'db_table': 'api_user_event_stream',
+            },
+        ),
+        migrations.CreateModel(
+            name='UserEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveBigIntegerField()),
+                ('event_type', models.CharField(max_length=32)),
+                ('payload', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'User Event',
+                'verbose_name_plural': 'User Events',
+                'db_table': 'api_user_event',
+                'unique_together': {('user', 'seq')},
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.16 on 2026-10-17 19:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0024_user_events'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='call',
+            index=models.Index(fields=['callee', 'status', 'created_at'], name='api_call_callee__430563_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='call',
+            index=models.Index(fields=['caller', 'timestamp'], name='api_call_caller__835990_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='call',
+            index=models.Index(fields=['callee', 'timestamp'], name='api_call_callee__31c800_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='call',
+            index=models.Index(fields=['caller', 'updated_at'], name='api_call_caller__f12cbb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='call',
+            index=models.Index(fields=['callee', 'updated_at'], name='api_call_callee__073ed2_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.16 on 2026-10-17 20:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0025_call_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mediablob',
+            name='storage_path',
+            field=models.CharField(help_text='Percorso relativo nello storage (es. images/<uuid4>.jpg)', max_length=255, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='mediaobject',
+            name='message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='media_objects', to='api.chatmessage'),
+        ),
+        migrations.AlterField(
+            model_name='mediaobject',
+            name='storage_path',
+            field=models.CharField(help_text='Percorso relativo nello storage (es. images/<uuid4>.jpg)', max_length=255),
+        ),
+    ]
@@ -2,12 +2,13 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.conf import settings
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone as dt_timezone
 from cryptography.fernet import Fernet
 import secrets
 import string
 import base64
 import hashlib
+import hmac
 import uuid
 
 
@@ -15,6 +16,8 @@ class AuthToken(models.Model):
     """Token di autenticazione personalizzato con scadenza e cifratura"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='auth_tokens')
     encrypted_key = models.TextField(unique=True)  # Token cifrato
+    # HMAC del token in chiaro: permette la ricerca indicizzata senza decifrare ogni riga
+    lookup_digest = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
     created = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField()
     is_active = models.BooleanField(default=True)
@@ -27,11 +30,30 @@ class AuthToken(models.Model):
     def save(self, *args, **kwargs):
         if not self.encrypted_key:
             self.encrypted_key = self.generate_encrypted_key()
+        if not self.lookup_digest:
+            raw_token = self.get_token()
+            if raw_token:
+                self.lookup_digest = self.compute_lookup_digest(raw_token)
         if not self.expires_at:
             # CORREZIONE: Token senza scadenza (valido per 10 anni)
             self.expires_at = timezone.now() + timedelta(days=3650)
         super().save(*args, **kwargs)
     
+    @staticmethod
+    def compute_lookup_digest(raw_token):
+        """Calcola il digest di ricerca (HMAC-SHA256) del token in chiaro"""
+        # Chiave separata da quella Fernet, derivata comunque dalla SECRET_KEY
+        key = hashlib.sha256(b'authtoken-lookup|' + settings.SECRET_KEY.encode()).digest()
+        return hmac.new(key, raw_token.encode(), hashlib.sha256).hexdigest()
+
+    @classmethod
+    def get_by_raw_token(cls, raw_token):
+        """Trova il token attivo con una singola query indicizzata sul digest"""
+        return cls.objects.select_related('user').get(
+            lookup_digest=cls.compute_lookup_digest(raw_token),
+            is_active=True,
+        )
+
     def generate_encrypted_key(self):
         """Genera un token cifrato sicuro"""
         # Genera una chiave casuale di 32 byte
@@ -78,7 +100,7 @@ class AuthToken(models.Model):
             decrypted_payload = self._decrypt_data(encrypted_data)
             
             if decrypted_payload:
-                parts = decrypted_payload.split(b'|')
+                parts = decrypted_payload.rsplit(b'|', 2)
                 if len(parts) == 3:
                     # Restituisci solo il token raw per l'autenticazione
                     return parts[0].hex()
@@ -93,7 +115,7 @@ class AuthToken(models.Model):
             decrypted_payload = self._decrypt_data(encrypted_data)
             
             if decrypted_payload:
-                parts = decrypted_payload.split(b'|')
+                parts = decrypted_payload.rsplit(b'|', 2)
                 if len(parts) == 3:
                     return {
                         'token': parts[0],
@@ -104,26 +126,27 @@ class AuthToken(models.Model):
             pass
         return None
     
-    def verify_token_integrity(self):
-        """Verifica l'integrità del token"""
+    def get_integrity_deadline(self):
+        """Istante oltre il quale il token non supera più la verifica di integrità (None se già non integro)"""
         decrypted = self.get_decrypted_token()
         if not decrypted:
-            return False
+            return None
         
         # Verifica che il user_id corrisponda
-        if decrypted['user_id'] != str(self.user.id):
-            return False
+        if decrypted['user_id'] != str(self.user_id):
+            return None
         
-        # Verifica che il timestamp non sia troppo vecchio (max 25 ore)
+        # Il timestamp non deve essere troppo vecchio (max 25 ore)
         try:
             token_time = int(decrypted['timestamp'])
-            current_time = int(timezone.now().timestamp())
-            if current_time - token_time > 25 * 3600:  # 25 ore
-                return False
         except (ValueError, TypeError):
-            return False
-        
-        return True
+            return None
+        return datetime.fromtimestamp(token_time + 25 * 3600, tz=dt_timezone.utc)
+    
+    def verify_token_integrity(self):
+        """Verifica l'integrità del token"""
+        deadline = self.get_integrity_deadline()
+        return deadline is not None and timezone.now() <= deadline
     
     def is_expired(self):
         """Verifica se il token è scaduto"""
@@ -244,12 +267,229 @@ class ChatMessage(models.Model):
             models.Index(fields=['chat', 'created_at']),
             models.Index(fields=['sender']),
             models.Index(fields=['is_read']),
+            models.Index(fields=['created_at']),  # rollup statistiche dashboard
         ]
     
     def __str__(self):
         return f"Message from {self.sender.username} in {self.chat.name}"
 
 
+class ChatMembership(models.Model):
+    """
+    Stato per partecipante di una chat (denormalizzato)
+    
+    Evita COUNT(*) sui messaggi e probe sulle M2M di eliminazione:
+    - unread_count: messaggi non letti dall'utente (corretto anche per i gruppi)
+    - last_read_message: ultimo messaggio letto
+    - hidden_at: chat eliminata/nascosta per questo utente
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_memberships')
+    chat = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name='memberships')
+    last_read_message = models.ForeignKey(ChatMessage, null=True, blank=True, on_delete=models.SET_NULL,
+        related_name='+', help_text="Ultimo messaggio letto dall'utente")
+    unread_count = models.PositiveIntegerField(default=0)
+    hidden_at = models.DateTimeField(null=True, blank=True,
+        help_text="Quando l'utente ha nascosto/eliminato la chat (null = visibile)")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'api_chat_membership'
+        verbose_name = 'Chat Membership'
+        verbose_name_plural = 'Chat Memberships'
+        unique_together = ['user', 'chat']
+        indexes = [
+            models.Index(fields=['user', 'hidden_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.user} in {self.chat_id} (unread: {self.unread_count})"
+    
+    @classmethod
+    def record_new_message(cls, message):
+        """Nuovo messaggio: +1 non letti agli altri partecipanti, il mittente l'ha già letto"""
+        cls.objects.filter(chat_id=message.chat_id).exclude(user_id=message.sender_id).update(
+            unread_count=models.F('unread_count') + 1,
+            updated_at=timezone.now(),
+        )
+        cls.objects.filter(chat_id=message.chat_id, user_id=message.sender_id).update(
+            last_read_message=message,
+            unread_count=0,
+            updated_at=timezone.now(),
+        )
+    
+    @classmethod
+    def mark_read(cls, chat, user):
+        """Azzera i non letti e sposta il puntatore all'ultimo messaggio della chat"""
+        last_message = ChatMessage.objects.filter(chat=chat).order_by('-created_at', '-id').values('id')[:1]
+        return cls.objects.filter(chat=chat, user=user).update(
+            last_read_message=models.Subquery(last_message),
+            unread_count=0,
+            updated_at=timezone.now(),
+        )
+
+
+class NotificationOutbox(models.Model):
+    """
+    Outbox transazionale delle notifiche push verso SecureVOX Notify
+
+    Le righe sono scritte nella stessa transazione del ChatMessage, quindi una
+    notifica esiste se e solo se il messaggio è stato salvato. Il dispatcher
+    (api.notification_outbox) le invia in batch a /send_batch fuori dalla richiesta.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENDING, 'Sending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='outbox_notifications')
+    message = models.ForeignKey(ChatMessage, null=True, blank=True, on_delete=models.CASCADE,
+        related_name='outbox_notifications')
+    payload = models.JSONField(help_text="Corpo della richiesta per SecureVOX Notify")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now,
+        help_text="Prossimo tentativo (per le righe in invio: scadenza del lease)")
+    claim_token = models.UUIDField(null=True, blank=True, editable=False)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'api_notification_outbox'
+        verbose_name = 'Notification Outbox'
+        verbose_name_plural = 'Notification Outbox'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+            models.Index(fields=['claim_token']),
+        ]
+
+    def __str__(self):
+        return f"Outbox {self.id} → {self.recipient_id} ({self.status}, tentativi: {self.attempts})"
+
+
+class UserEventStream(models.Model):
+    """
+    Contatore di sequenza degli eventi real-time di un utente
+
+    L'UPDATE del contatore blocca la riga fino al commit: gli eventi di uno
+    stesso utente ricevono numeri di sequenza consecutivi nell'ordine di commit.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='event_stream')
+    last_seq = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'api_user_event_stream'
+        verbose_name = 'User Event Stream'
+        verbose_name_plural = 'User Event Streams'
+
+    def __str__(self):
+        return f"Eventi di {self.user_id}: ultima sequenza {self.last_seq}"
+
+
+class UserEvent(models.Model):
+    """
+    Evento real-time per un utente (nuovo messaggio, chiamata in arrivo, ...)
+
+    Scritto nella stessa transazione della modifica che lo genera e inviato al
+    commit sul WebSocket dell'utente (api.consumers.UserEventsConsumer); resta
+    nel journal per il replay dopo una riconnessione (?since=<seq>).
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='events')
+    seq = models.PositiveBigIntegerField()
+    event_type = models.CharField(max_length=32)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        db_table = 'api_user_event'
+        verbose_name = 'User Event'
+        verbose_name_plural = 'User Events'
+        unique_together = ('user', 'seq')
+
+    def __str__(self):
+        return f"Evento {self.seq} per {self.user_id}: {self.event_type}"
+
+
+class MediaBlob(models.Model):
+    """
+    File media deduplicato per contenuto (SHA-256) con conteggio dei riferimenti
+
+    Ogni upload con lo stesso contenuto e la stessa categoria (images/, videos/,
+    audio/, uploads/) riusa lo stesso file: inoltri e reinvii non occupano
+    nuovo spazio su disco. ref_count conta i MediaObject che usano il file.
+    Vedi api.media_store.
+    """
+    sha256 = models.CharField(max_length=64, db_index=True)
+    storage_path = models.CharField(max_length=255, unique=True,
+        help_text="Percorso relativo nello storage (es. images/<uuid4>.jpg)")
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_referenced_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'api_media_blob'
+        verbose_name = 'Media Blob'
+        verbose_name_plural = 'Media Blob'
+
+    def __str__(self):
+        return f"{self.storage_path} ({self.size} byte, riferimenti: {self.ref_count})"
+
+
+class MediaObject(models.Model):
+    """
+    Upload di un media in una chat, indicizzato per percorso nello storage
+
+    Scritto dalle view di upload e collegato al ChatMessage da send_chat_message:
+    il controllo E2E per gli admin e le statistiche media sono lookup indicizzati
+    invece di scansioni icontains sui metadata JSON dei messaggi. Con lo store
+    deduplicato per contenuto più upload (inoltri) possono condividere lo stesso
+    storage_path. Eliminare il messaggio o la chat elimina la riga e rilascia il
+    riferimento al file (api.media_store.release).
+    """
+    KIND_IMAGE = 'image'
+    KIND_VIDEO = 'video'
+    KIND_AUDIO = 'audio'
+    KIND_FILE = 'file'
+    KIND_CHOICES = [
+        (KIND_IMAGE, 'Image'),
+        (KIND_VIDEO, 'Video'),
+        (KIND_AUDIO, 'Audio'),
+        (KIND_FILE, 'File'),
+    ]
+
+    storage_path = models.CharField(max_length=255,
+        help_text="Percorso relativo nello storage (es. images/<uuid4>.jpg)")
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    owner = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='media_objects')
+    chat = models.ForeignKey(Chat, null=True, blank=True, on_delete=models.CASCADE, related_name='media_objects')
+    message = models.ForeignKey(ChatMessage, null=True, blank=True, on_delete=models.CASCADE,
+        related_name='media_objects')
+    encrypted = models.BooleanField(default=False, help_text="Contenuto cifrato end-to-end")
+    size = models.BigIntegerField(default=0)
+    mime_type = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'api_media_object'
+        verbose_name = 'Media Object'
+        verbose_name_plural = 'Media Objects'
+        indexes = [
+            models.Index(fields=['storage_path', 'encrypted']),
+            models.Index(fields=['created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.storage_path} (chat: {self.chat_id}, messaggio: {self.message_id})"
+
+
 class PasswordResetToken(models.Model):
     """Token sicuro per il reset password con scadenza"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='password_reset_tokens')
@@ -338,7 +578,11 @@ class UserStatus(models.Model):
         elif new_status == 'offline':
             self.is_logged_in = False
             
-        self.save()
+        # Solo i campi di presenza: la riga contiene anche la chiave pubblica E2EE
+        self.save(update_fields=[
+            'status', 'has_connection', 'session_token', 'is_logged_in',
+            'last_seen', 'last_activity', 'updated_at',
+        ])
         
     def set_online(self, token):
         """Imposta utente online"""
@@ -414,6 +658,16 @@ class Call(models.Model):
         verbose_name = 'Call'
         verbose_name_plural = 'Calls'
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['created_at']),  # rollup statistiche dashboard
+            models.Index(fields=['callee', 'status', 'created_at']),  # chiamate in arrivo
+            # Cronologia (get_calls): pagine keyset per lato della chiamata
+            models.Index(fields=['caller', 'timestamp']),
+            models.Index(fields=['callee', 'timestamp']),
+            # Sync delta (get_calls?since=): chiamate modificate dopo il cursore
+            models.Index(fields=['caller', 'updated_at']),
+            models.Index(fields=['callee', 'updated_at']),
+        ]
     
     def __str__(self):
         return f"{self.caller.username} -> {self.callee.username} ({self.call_type})"
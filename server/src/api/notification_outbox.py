@@ -0,0 +1,289 @@
+"""
+Outbox transazionale delle notifiche push per SecureVox
+
+send_chat_message non chiama più SecureVOX Notify dentro la richiesta:
+1. enqueue() scrive una riga NotificationOutbox per destinatario nella STESSA
+   transazione del ChatMessage (bulk_create, una query)
+2. a commit avvenuto wake_dispatcher() risveglia il dispatcher:
+   - task Celery api.tasks.dispatch_notification_outbox (worker reale)
+   - thread locale del processo quando i task sono eager (sviluppo), così la
+     latenza della richiesta non dipende mai dal servizio notify
+3. dispatch_pending() reclama un batch, lo invia a /send_batch con una sessione
+   HTTP condivisa (connessioni keep-alive) e applica retry con backoff esponenziale
+
+Il reclamo è un UPDATE condizionato con claim_token: funziona su SQLite e
+PostgreSQL senza SELECT FOR UPDATE, e le righe di un worker morto tornano
+reclamabili alla scadenza del lease.
+"""
+from django.conf import settings
+from django.db import close_old_connections, models, transaction
+from django.utils import timezone
+from datetime import timedelta
+from requests.adapters import HTTPAdapter
+from .models import NotificationOutbox
+import logging
+import random
+import requests
+import threading
+import uuid
+
+logger = logging.getLogger('securevox')
+
+NOTIFY_SERVICE_URL = getattr(settings, 'NOTIFY_SERVICE_URL', 'http://localhost:8002')
+
+_DEFAULTS = {
+    'BATCH_SIZE': 100,
+    'TIMEOUT': 5,
+    'MAX_ATTEMPTS': 8,
+    'BACKOFF_BASE': 2,
+    'BACKOFF_MAX': 300,
+    'LEASE_SECONDS': 60,
+    'POLL_INTERVAL': 5,
+    'RETENTION_DAYS': 7,
+}
+OUTBOX_CONFIG = {**_DEFAULTS, **getattr(settings, 'NOTIFICATION_OUTBOX', {})}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class _RetryableError(Exception):
+    """Errore di trasporto o del servizio (5xx): il batch va ritentato"""
+
+
+def _get_session():
+    """Sessione HTTP condivisa dal processo (pool di connessioni keep-alive)"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+
+def enqueue(recipient_ids, payload, message=None):
+    """
+    Accoda una notifica per ogni destinatario. Va chiamata DENTRO la transazione
+    che salva il messaggio: il dispatcher viene risvegliato solo al commit.
+
+    Args:
+        recipient_ids: id utente dei destinatari
+        payload: corpo NotificationRequest senza 'recipient_id'
+        message: ChatMessage di origine (opzionale)
+    """
+    rows = [
+        NotificationOutbox(
+            recipient_id=recipient_id,
+            message=message,
+            payload={**payload, 'recipient_id': str(recipient_id)},
+        )
+        for recipient_id in recipient_ids
+    ]
+    if not rows:
+        return []
+
+    NotificationOutbox.objects.bulk_create(rows)
+    transaction.on_commit(wake_dispatcher)
+    return rows
+
+
+def wake_dispatcher():
+    """Segnala al dispatcher che ci sono notifiche da inviare"""
+    if getattr(settings, 'CELERY_TASK_ALWAYS_EAGER', False):
+        # Un task eager girerebbe nel thread della richiesta: usiamo il thread locale
+        _local_dispatcher.wake()
+        return
+
+    try:
+        from .tasks import dispatch_notification_outbox
+        dispatch_notification_outbox.delay()
+    except Exception as e:
+        # Broker non raggiungibile: le righe restano in coda per il task periodico
+        logger.warning(f"NotificationOutbox - Impossibile accodare il dispatch: {e}")
+
+
+def dispatch_pending(limit=None):
+    """
+    Invia un batch di notifiche scadute.
+
+    Returns:
+        numero di righe reclamate (0 = coda vuota)
+    """
+    rows = _claim_batch(limit or OUTBOX_CONFIG['BATCH_SIZE'])
+    if not rows:
+        return 0
+
+    try:
+        results = _post_batch([row.payload for row in rows])
+    except _RetryableError as e:
+        _schedule_retry(rows, str(e))
+        return len(rows)
+    except Exception as e:
+        # Richiesta rifiutata (4xx): ritentare non cambierebbe l'esito
+        if len(rows) == 1:
+            _mark_failed(rows, str(e))
+            return 1
+        # Più righe: reinvio una per una, così fallisce solo quella malformata
+        logger.warning(f"NotificationOutbox - Batch rifiutato, reinvio riga per riga: {e}")
+        results = _post_rows_individually(rows)
+
+    sent, failed, retry = [], [], []
+    for row, result in zip(rows, results):
+        if result.get('status') == 'success':
+            sent.append(row.id)
+        elif result.get('retry'):
+            retry.append(row)
+        else:
+            failed.append((row.id, result.get('message') or 'Errore sconosciuto'))
+
+    now = timezone.now()
+    NotificationOutbox.objects.filter(id__in=sent).update(
+        status=NotificationOutbox.STATUS_SENT, sent_at=now, claim_token=None, last_error='',
+    )
+    for row_id, error in failed:
+        # Esito definitivo del servizio (es. destinatario senza dispositivi registrati)
+        NotificationOutbox.objects.filter(id=row_id).update(
+            status=NotificationOutbox.STATUS_FAILED, claim_token=None, last_error=error,
+        )
+    if retry:
+        _schedule_retry(retry, 'Errore interno di SecureVOX Notify')
+    # Risultati mancanti (risposta troncata): tornano in coda
+    if len(results) < len(rows):
+        _schedule_retry(rows[len(results):], 'Risultato mancante nella risposta batch')
+
+    logger.info(f"NotificationOutbox - Batch di {len(rows)}: {len(sent)} inviate, {len(failed)} rifiutate")
+    return len(rows)
+
+
+def drain(max_batches=50):
+    """Svuota la coda a batch successivi; restituisce le righe processate"""
+    processed = 0
+    for _ in range(max_batches):
+        claimed = dispatch_pending()
+        processed += claimed
+        if claimed < OUTBOX_CONFIG['BATCH_SIZE']:
+            break
+    return processed
+
+
+def purge_delivered(days=None):
+    """Elimina le righe inviate più vecchie della retention"""
+    cutoff = timezone.now() - timedelta(days=days or OUTBOX_CONFIG['RETENTION_DAYS'])
+    deleted, _ = NotificationOutbox.objects.filter(
+        status=NotificationOutbox.STATUS_SENT, sent_at__lt=cutoff,
+    ).delete()
+    return deleted
+
+
+def _claim_batch(limit):
+    now = timezone.now()
+    claimable = NotificationOutbox.objects.filter(
+        status__in=[NotificationOutbox.STATUS_PENDING, NotificationOutbox.STATUS_SENDING],
+        next_attempt_at__lte=now,
+    )
+    ids = list(claimable.order_by('next_attempt_at', 'id').values_list('id', flat=True)[:limit])
+    if not ids:
+        return []
+
+    # UPDATE condizionato: un solo worker vince ogni riga anche in concorrenza
+    claim_token = uuid.uuid4()
+    claimable.filter(id__in=ids).update(
+        status=NotificationOutbox.STATUS_SENDING,
+        claim_token=claim_token,
+        attempts=models.F('attempts') + 1,
+        next_attempt_at=now + timedelta(seconds=OUTBOX_CONFIG['LEASE_SECONDS']),
+    )
+    return list(NotificationOutbox.objects.filter(claim_token=claim_token).order_by('id'))
+
+
+def _post_batch(payloads):
+    try:
+        response = _get_session().post(
+            f"{NOTIFY_SERVICE_URL}/send_batch",
+            json={'notifications': payloads},
+            timeout=OUTBOX_CONFIG['TIMEOUT'],
+        )
+    except requests.RequestException as e:
+        raise _RetryableError(f"SecureVOX Notify non raggiungibile: {e}")
+
+    if response.status_code >= 500:
+        raise _RetryableError(f"SecureVOX Notify HTTP {response.status_code}")
+    if response.status_code != 200:
+        raise ValueError(f"SecureVOX Notify HTTP {response.status_code}: {response.text[:200]}")
+    return response.json().get('results', [])
+
+
+def _post_rows_individually(rows):
+    """Un risultato per riga, nello stesso formato di /send_batch"""
+    results = []
+    for row in rows:
+        try:
+            row_results = _post_batch([row.payload])
+        except _RetryableError as e:
+            row_results = [{'status': 'error', 'message': str(e), 'retry': True}]
+        except Exception as e:
+            row_results = [{'status': 'error', 'message': str(e)}]
+        results.append(row_results[0] if row_results else {'status': 'error', 'retry': True})
+    return results
+
+
+def _backoff_delay(attempts):
+    """Backoff esponenziale con jitter (metà fissa, metà casuale)"""
+    delay = min(OUTBOX_CONFIG['BACKOFF_BASE'] * (2 ** max(attempts - 1, 0)), OUTBOX_CONFIG['BACKOFF_MAX'])
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _schedule_retry(rows, error):
+    now = timezone.now()
+    for row in rows:
+        if row.attempts >= OUTBOX_CONFIG['MAX_ATTEMPTS']:
+            _mark_failed([row], error)
+            continue
+        NotificationOutbox.objects.filter(id=row.id).update(
+            status=NotificationOutbox.STATUS_PENDING,
+            claim_token=None,
+            last_error=error,
+            next_attempt_at=now + timedelta(seconds=_backoff_delay(row.attempts)),
+        )
+    logger.warning(f"NotificationOutbox - Batch di {len(rows)} da ritentare: {error}")
+
+
+def _mark_failed(rows, error):
+    NotificationOutbox.objects.filter(id__in=[row.id for row in rows]).update(
+        status=NotificationOutbox.STATUS_FAILED, claim_token=None, last_error=error,
+    )
+    logger.error(f"NotificationOutbox - {len(rows)} notifiche fallite definitivamente: {error}")
+
+
+class _LocalDispatcher:
+    """Thread di dispatch per processo, usato quando i task Celery sono eager"""
+
+    def __init__(self):
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def wake(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='notification-outbox', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            # Risveglio su nuovo commit oppure periodico per i retry in backoff
+            self._wakeup.wait(OUTBOX_CONFIG['POLL_INTERVAL'])
+            self._wakeup.clear()
+            try:
+                drain()
+            except Exception as e:
+                logger.error(f"NotificationOutbox - Errore dispatcher locale: {e}")
+            finally:
+                close_old_connections()
+
+
+_local_dispatcher = _LocalDispatcher()
@@ -3,16 +3,190 @@ Servizio di conversione documenti Office → PDF per preview
 Mantiene il file originale intatto, crea solo una preview PDF
 """
 
+import atexit
 import os
+import queue
+import socket
 import subprocess
 import tempfile
 import shutil
+import threading
+import time
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
 
+LIBREOFFICE_PATHS = [
+    '/Applications/LibreOffice.app/Contents/MacOS/soffice',  # macOS standard
+    '/usr/bin/libreoffice',  # Linux standard
+    '/usr/local/bin/libreoffice',  # Linux alternativo
+    'libreoffice',  # PATH system
+    'soffice',  # Alternativo
+]
+
+
+@lru_cache(maxsize=1)
+def find_libreoffice() -> Optional[str]:
+    """Percorso dell'eseguibile LibreOffice, cercato una sola volta per processo"""
+    for path in LIBREOFFICE_PATHS:
+        if os.path.exists(path) or shutil.which(path):
+            return path
+    return None
+
+
+@lru_cache(maxsize=1)
+def unoserver_available() -> bool:
+    return bool(shutil.which('unoserver') and shutil.which('unoconvert'))
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class LibreOfficeWorker:
+    """
+    Istanza LibreOffice persistente usata per una conversione alla volta
+
+    Con unoserver installato mantiene un listener UNO sempre acceso e converte
+    con unoconvert (nessun avvio a freddo per documento). Senza unoserver usa
+    soffice con un profilo utente dedicato al worker: dopo la prima conversione
+    il profilo è già inizializzato e worker diversi possono lavorare in parallelo.
+    """
+
+    def __init__(self, index: int, startup_timeout: float):
+        self.index = index
+        self.startup_timeout = startup_timeout
+        self.profile_dir = os.path.join(tempfile.gettempdir(), f'securevox_lo_{os.getpid()}_{index}')
+        self.process = None
+        self.port = None
+
+    def convert(self, input_path: str, output_path: str, timeout: float) -> bool:
+        """Converte input_path in PDF scrivendo output_path; False se la conversione fallisce"""
+        try:
+            if unoserver_available():
+                self._ensure_listener()
+                cmd = [
+                    'unoconvert', '--host', '127.0.0.1', '--port', str(self.port),
+                    '--convert-to', 'pdf', input_path, output_path,
+                ]
+                subprocess.run(cmd, check=True, capture_output=True, text=True, timeout=timeout)
+            else:
+                self._convert_with_soffice(input_path, output_path, timeout)
+        except subprocess.TimeoutExpired:
+            logger.error(f"❌ Timeout conversione LibreOffice (worker {self.index}): {input_path}")
+            # Un'istanza bloccata non va riusata: verrà riavviata al prossimo job
+            self.stop()
+            return False
+        except subprocess.CalledProcessError as e:
+            logger.error(f"❌ Errore conversione LibreOffice (worker {self.index}): {e.stderr}")
+            return False
+        except Exception as e:
+            logger.error(f"❌ Errore inatteso conversione LibreOffice (worker {self.index}): {e}")
+            self.stop()
+            return False
+        return os.path.exists(output_path) and os.path.getsize(output_path) > 0
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+    def _ensure_listener(self):
+        if self.process and self.process.poll() is None:
+            return
+        self.port = _free_port()
+        cmd = [
+            'unoserver', '--interface', '127.0.0.1', '--port', str(self.port),
+            '--uno-port', str(_free_port()),
+            '--user-installation', Path(self.profile_dir).as_uri(),
+        ]
+        soffice = find_libreoffice()
+        if soffice:
+            cmd += ['--executable', shutil.which(soffice) or soffice]
+        logger.info(f"🔄 Avvio listener LibreOffice (worker {self.index}, porta {self.port})")
+        self.process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"unoserver terminato all'avvio (codice {self.process.returncode})")
+            try:
+                with socket.create_connection(('127.0.0.1', self.port), timeout=1):
+                    return
+            except OSError:
+                time.sleep(0.2)
+        self.stop()
+        raise RuntimeError("unoserver non pronto entro il timeout di avvio")
+
+    def _convert_with_soffice(self, input_path: str, output_path: str, timeout: float):
+        soffice = find_libreoffice()
+        if not soffice:
+            raise RuntimeError("LibreOffice non trovato in nessun percorso standard")
+        with tempfile.TemporaryDirectory(prefix='securevox_lo_out_') as outdir:
+            cmd = [
+                soffice,
+                f'-env:UserInstallation={Path(self.profile_dir).as_uri()}',
+                '--headless', '--norestore',
+                '--convert-to', 'pdf',
+                '--outdir', outdir,
+                input_path,
+            ]
+            subprocess.run(cmd, check=True, capture_output=True, text=True, timeout=timeout)
+            generated = os.path.join(outdir, f"{os.path.splitext(os.path.basename(input_path))[0]}.pdf")
+            if os.path.exists(generated):
+                shutil.move(generated, output_path)
+
+
+class LibreOfficePool:
+    """
+    Pool limitato di LibreOfficeWorker per processo
+
+    I worker partono alla prima richiesta e restano accesi; la coda LIFO
+    riassegna per primo il worker usato più di recente (già caldo), quindi un
+    processo che converte un documento alla volta tiene acceso un solo listener.
+    """
+
+    def __init__(self, size: int, startup_timeout: float = 20):
+        self.size = size
+        self._workers = [LibreOfficeWorker(i, startup_timeout) for i in range(size)]
+        self._idle = queue.LifoQueue()
+        for worker in reversed(self._workers):
+            self._idle.put(worker)
+        atexit.register(self.shutdown)
+
+    def convert(self, input_path: str, output_path: str, timeout: float) -> bool:
+        worker = self._idle.get()
+        try:
+            return worker.convert(input_path, output_path, timeout)
+        finally:
+            self._idle.put(worker)
+
+    def shutdown(self):
+        for worker in self._workers:
+            worker.stop()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_libreoffice_pool(size: int, startup_timeout: float = 20) -> LibreOfficePool:
+    """Pool del processo corrente (creato alla prima chiamata)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = LibreOfficePool(size, startup_timeout)
+        return _pool
+
 class OfficeConverter:
     """Convertitore documenti Office → PDF per preview"""
     
@@ -65,20 +239,7 @@ class OfficeConverter:
             Percorso del file PDF generato o None se fallisce
         """
         try:
-            # Comando LibreOffice per conversione - prova diversi percorsi
-            possible_paths = [
-                '/Applications/LibreOffice.app/Contents/MacOS/soffice',  # macOS standard
-                '/usr/bin/libreoffice',  # Linux standard
-                '/usr/local/bin/libreoffice',  # Linux alternativo
-                'libreoffice',  # PATH system
-                'soffice',  # Alternativo
-            ]
-            
-            libreoffice_path = None
-            for path in possible_paths:
-                if os.path.exists(path) or shutil.which(path):
-                    libreoffice_path = path
-                    break
+            libreoffice_path = find_libreoffice()
             
             if not libreoffice_path:
                 logger.error("❌ LibreOffice non trovato in nessun percorso standard")
@@ -0,0 +1,252 @@
+"""
+Preview PDF dei documenti Office generate fuori dalla richiesta HTTP
+
+upload_file non converte più il documento nel worker HTTP:
+1. request_preview() restituisce subito la preview se esiste già per lo stesso
+   contenuto (cache per SHA-256: previews/<sha256>.pdf), altrimenti accoda il job
+   e l'upload risponde con pdfPreviewStatus 'pending'
+2. il job (task Celery api.tasks.generate_office_preview sulla coda 'office',
+   oppure un thread pool locale quando i task sono eager) converte con il pool
+   di istanze LibreOffice persistenti di office_converter
+3. a conversione finita i messaggi in attesa che riferiscono lo stesso
+   contenuto (in qualsiasi chat) vengono aggiornati e i partecipanti delle chat
+   ricevono una notifica 'pdf_preview_ready' tramite l'outbox delle notifiche
+"""
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.cache import caches, InvalidCacheBackendError
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from .office_converter import get_libreoffice_pool, office_converter
+from . import notification_outbox
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger('securevox')
+
+OFFICE_EXTENSIONS = ('docx', 'xlsx', 'pptx', 'doc', 'xls', 'ppt')
+
+STATUS_PENDING = 'pending'
+STATUS_READY = 'ready'
+STATUS_FAILED = 'failed'
+
+_DEFAULTS = {
+    'WORKERS': 2,
+    'TIMEOUT': 60,
+    'STARTUP_TIMEOUT': 20,
+    # Job in corso e conversioni fallite: condivisi tra processi web e worker Celery
+    'CACHE_ALIAS': getattr(settings, 'COORDINATION_CACHE_ALIAS', 'coordination'),
+}
+PREVIEW_CONFIG = {**_DEFAULTS, **getattr(settings, 'OFFICE_PREVIEW', {})}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def preview_path(sha256):
+    return f"previews/{sha256}.pdf"
+
+
+def fallback_path(sha256):
+    return f"previews/{sha256}_fallback.pdf"
+
+
+def preview_url(base_url, path):
+    return f"{base_url}/api/media/download/{path}"
+
+
+def preview_status(sha256):
+    """
+    Stato della preview per un contenuto.
+
+    Returns:
+        (status, percorso nello storage o None)
+    """
+    if default_storage.exists(preview_path(sha256)):
+        return STATUS_READY, preview_path(sha256)
+    if default_storage.exists(fallback_path(sha256)):
+        return STATUS_FAILED, fallback_path(sha256)
+    if _cache().get(_failed_key(sha256)):
+        return STATUS_FAILED, None
+    return STATUS_PENDING, None
+
+
+def request_preview(source_path, sha256, file_name, chat_id, base_url):
+    """
+    Restituisce la preview se già pronta, altrimenti accoda la conversione.
+
+    Returns:
+        (status, percorso nello storage o None)
+    """
+    status, path = preview_status(sha256)
+    if status == STATUS_READY:
+        logger.info(f"♻️ Preview PDF già disponibile per contenuto identico: {path}")
+        return status, path
+
+    job = {
+        'source_path': source_path,
+        'sha256': sha256,
+        'file_name': file_name,
+        'chat_id': str(chat_id),
+        'base_url': base_url,
+    }
+    # Stesso contenuto caricato più volte in pochi secondi: una sola conversione
+    if _cache().add(_job_key(sha256), True, timeout=PREVIEW_CONFIG['TIMEOUT'] * 3):
+        _enqueue(job)
+    return STATUS_PENDING, None
+
+
+def generate_preview(source_path, sha256, file_name, chat_id, base_url):
+    """Converte il documento e notifica la chat (eseguito dal worker)"""
+    try:
+        status, path = preview_status(sha256)
+        if status != STATUS_READY:
+            status, path = _convert(source_path, sha256, file_name)
+        _publish(source_path, sha256, file_name, chat_id, status, path, base_url)
+        return status
+    finally:
+        _cache().delete(_job_key(sha256))
+
+
+def resolve_pending(metadata, base_url):
+    """Completa i metadata di un messaggio la cui preview è pronta prima dell'invio"""
+    if not metadata or metadata.get('pdfPreviewStatus') != STATUS_PENDING or not metadata.get('pdfPreviewId'):
+        return metadata
+    status, path = preview_status(metadata['pdfPreviewId'])
+    if status == STATUS_PENDING:
+        return metadata
+    return {**metadata, 'pdfPreviewStatus': status, 'pdfPreviewUrl': preview_url(base_url, path) if path else None}
+
+
+def _cache():
+    try:
+        return caches[PREVIEW_CONFIG['CACHE_ALIAS']]
+    except InvalidCacheBackendError:
+        return caches['default']
+
+
+def _job_key(sha256):
+    return f"office-preview:{sha256}"
+
+
+def _failed_key(sha256):
+    return f"office-preview-failed:{sha256}"
+
+
+def _enqueue(job):
+    if getattr(settings, 'CELERY_TASK_ALWAYS_EAGER', False):
+        # Un task eager girerebbe nel thread della richiesta: usiamo il pool locale
+        _get_executor().submit(_run_local, job)
+        return
+
+    try:
+        from .tasks import generate_office_preview
+        generate_office_preview.delay(**job)
+    except Exception as e:
+        _cache().delete(_job_key(job['sha256']))
+        logger.error(f"❌ Impossibile accodare la preview PDF di {job['source_path']}: {e}")
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PREVIEW_CONFIG['WORKERS'], thread_name_prefix='office-preview')
+        return _executor
+
+
+def _run_local(job):
+    try:
+        generate_preview(**job)
+    except Exception as e:
+        logger.error(f"❌ Errore generazione preview PDF: {e}", exc_info=True)
+    finally:
+        close_old_connections()
+
+
+def _convert(source_path, sha256, file_name):
+    pool = get_libreoffice_pool(PREVIEW_CONFIG['WORKERS'], PREVIEW_CONFIG['STARTUP_TIMEOUT'])
+    base_name = os.path.splitext(file_name)[0]
+
+    with tempfile.TemporaryDirectory(prefix='securevox_preview_') as temp_dir:
+        output = os.path.join(temp_dir, 'preview.pdf')
+        logger.info(f"🔄 Conversione Office → PDF per preview: {file_name}")
+        if pool.convert(default_storage.path(source_path), output, PREVIEW_CONFIG['TIMEOUT']):
+            path = _save(output, preview_path(sha256))
+            logger.info(f"✅ PDF preview salvato: {path}")
+            return STATUS_READY, path
+
+    logger.warning(f"⚠️ Conversione PDF fallita per: {file_name}")
+    extension = os.path.splitext(file_name)[1][1:].upper()
+    fallback = office_converter._create_fallback_pdf(f"{base_name}_preview", f"Documento {extension}")
+    if fallback and os.path.exists(fallback):
+        try:
+            path = _save(fallback, fallback_path(sha256))
+        finally:
+            os.remove(fallback)
+        logger.info(f"✅ PDF fallback salvato: {path}")
+        return STATUS_FAILED, path
+    # Nemmeno il PDF informativo è disponibile: l'esito resta noto per un giorno
+    _cache().set(_failed_key(sha256), True, timeout=24 * 3600)
+    return STATUS_FAILED, None
+
+
+def _save(local_path, name):
+    if default_storage.exists(name):
+        # Indirizzato per contenuto: un file con lo stesso nome è già la stessa preview
+        return name
+    with open(local_path, 'rb') as fh:
+        return default_storage.save(name, File(fh))
+
+
+def _publish(source_path, sha256, file_name, chat_id, status, path, base_url):
+    """
+    Aggiorna e notifica tutte le chat in attesa della preview di questo contenuto.
+
+    Il job è unico per SHA-256: lo stesso documento caricato in più chat durante
+    la conversione non ha un job proprio. I messaggi si trovano tramite MediaObject
+    (percorsi dei blob con questo hash), non con un filtro sui metadata JSON.
+    """
+    from .models import Chat, ChatMessage, MediaBlob, MediaObject
+
+    url = preview_url(base_url, path) if path else None
+    storage_paths = {source_path, *MediaBlob.objects.filter(sha256=sha256).values_list('storage_path', flat=True)}
+    message_paths = dict(
+        MediaObject.objects.filter(storage_path__in=storage_paths, message__isnull=False)
+        .values_list('message_id', 'storage_path')
+    )
+
+    with transaction.atomic():
+        # Chat da notificare → fileId nella chat; quella del job anche se il messaggio non è ancora inviato
+        file_ids = {str(chat_id): source_path}
+        for message in ChatMessage.objects.filter(id__in=message_paths):
+            metadata = message.metadata or {}
+            if metadata.get('pdfPreviewId') != sha256 or metadata.get('pdfPreviewStatus') != STATUS_PENDING:
+                continue
+            message.metadata = {**metadata, 'pdfPreviewStatus': status, 'pdfPreviewUrl': url}
+            message.save(update_fields=['metadata'])
+            file_ids.setdefault(str(message.chat_id), message_paths[message.id])
+
+        for chat in Chat.objects.filter(id__in=file_ids).prefetch_related('participants'):
+            notification_outbox.enqueue(
+                [participant.id for participant in chat.participants.all()],
+                {
+                    'title': 'Anteprima documento pronta',
+                    'body': file_name,
+                    'data': {
+                        'type': 'pdf_preview_ready',
+                        'chat_id': str(chat.id),
+                        'fileId': file_ids[str(chat.id)],
+                        'pdfPreviewId': sha256,
+                        'pdfPreviewStatus': status,
+                        'pdfPreviewUrl': url,
+                    },
+                    'sender_id': '',
+                    'timestamp': timezone.now().isoformat(),
+                    'notification_type': 'system',
+                },
+            )
@@ -0,0 +1,344 @@
+"""
+Presenza degli utenti da snapshot in memoria
+
+get_users_status non interroga più il database per ogni utente:
+- lo snapshot (user_id → voce di presenza) è caricato con una sola query
+  (utenti attivi + UserStatus + esistenza del token di sessione) e ricaricato
+  al massimo ogni PRESENCE['REFRESH_SECONDS'], così gli aggiornamenti fatti
+  dagli altri worker arrivano con un ritardo limitato
+- heartbeat, login/logout e connect/disconnect dei WebSocket aggiornano la
+  voce dello snapshot locale; i cambi di stato (online → unreachable →
+  offline) sono scritti subito con un solo UPDATE
+- gli heartbeat che non cambiano stato aggiornano solo last_activity in un
+  buffer di processo, scritto ogni HEARTBEAT_FLUSH_SECONDS con un UPDATE in
+  blocco dei soli campi di presenza (nessuna riscrittura della riga intera)
+- lo stato (online / unreachable / offline) è calcolato alla lettura
+  dall'ultima attività, in un solo passaggio sullo snapshot
+- i cambi di stato sono spinti ai WebSocket degli eventi (api.realtime)
+- sweep() (task Celery periodico api.tasks.sweep_presence) porta nel
+  database le scadenze: sessioni senza token → offline, utenti senza
+  attività da CONNECTION_TIMEOUT secondi → unreachable
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import close_old_connections
+from django.db.models import Case, DateTimeField, Exists, OuterRef, Q, Value, When
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from .models import UserStatus
+from . import realtime
+from datetime import timedelta
+import atexit
+import logging
+import threading
+import time
+
+logger = logging.getLogger('securevox')
+
+STATUS_ONLINE = 'online'
+STATUS_UNREACHABLE = 'unreachable'
+STATUS_OFFLINE = 'offline'
+
+_DEFAULTS = {
+    'CONNECTION_TIMEOUT': 120,
+    'REFRESH_SECONDS': 5,
+    'HEARTBEAT_FLUSH_SECONDS': 15,
+    'FLUSH_BATCH_SIZE': 200,
+}
+PRESENCE_CONFIG = {**_DEFAULTS, **getattr(settings, 'PRESENCE', {})}
+
+
+class PresenceEntry:
+    """Voce dello snapshot per un utente"""
+    __slots__ = ('user_id', 'name', 'is_logged_in', 'has_connection', 'last_activity', 'last_seen')
+
+    def __init__(self, user_id, name, is_logged_in, has_connection, last_activity, last_seen):
+        self.user_id = user_id
+        self.name = name
+        self.is_logged_in = is_logged_in
+        self.has_connection = has_connection
+        self.last_activity = last_activity
+        self.last_seen = last_seen
+
+    def status(self, now):
+        if not self.is_logged_in:
+            return STATUS_OFFLINE
+        if self.has_connection and self.last_activity and \
+                (now - self.last_activity).total_seconds() < PRESENCE_CONFIG['CONNECTION_TIMEOUT']:
+            return STATUS_ONLINE
+        return STATUS_UNREACHABLE
+
+    def as_dict(self, now):
+        status = self.status(now)
+        return {
+            'id': self.user_id,
+            'name': self.name,
+            'is_logged_in': self.is_logged_in,
+            'has_connection': status == STATUS_ONLINE,
+            'last_seen': self.last_seen.isoformat(),
+            'status': status,
+        }
+
+
+class PresenceSnapshot:
+    """Snapshot di processo della presenza di tutti gli utenti attivi"""
+
+    def __init__(self):
+        self._entries = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def all(self):
+        """Stato di tutti gli utenti, nel formato di get_users_status"""
+        entries = self._fresh_entries()
+        now = timezone.now()
+        return [entry.as_dict(now) for entry in entries.values()]
+
+    def get(self, user_id):
+        entry = self._fresh_entries().get(user_id)
+        return entry.as_dict(timezone.now()) if entry else None
+
+    def status_of(self, user_id, now):
+        entry = self._fresh_entries().get(user_id)
+        return entry.status(now) if entry else None
+
+    def apply(self, user_id, **changes):
+        """Aggiornamento incrementale di una voce (dopo la scrittura sul database)"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                # Utente non ancora nello snapshot (es. appena registrato)
+                self._loaded_at = None
+                return
+            for field, value in changes.items():
+                setattr(entry, field, value)
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def _fresh_entries(self):
+        with self._lock:
+            loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > PRESENCE_CONFIG['REFRESH_SECONDS']:
+            self._reload()
+        return self._entries
+
+    def _reload(self):
+        started = time.monotonic()
+        entries = {}
+        for row in _snapshot_rows():
+            entries[row['id']] = PresenceEntry(
+                user_id=row['id'],
+                name=row['username'],
+                is_logged_in=bool(row['status_info__is_logged_in'] and row['token_valid']),
+                has_connection=bool(row['status_info__has_connection']),
+                last_activity=row['status_info__last_activity'],
+                # Utente senza UserStatus (mai loggato): ultimo accesso = registrazione
+                last_seen=row['status_info__last_seen'] or row['date_joined'],
+            )
+        with self._lock:
+            self._entries = entries
+            self._loaded_at = started
+        logger.debug(f"📡 Snapshot presenza caricato: {len(entries)} utenti")
+
+
+class _HeartbeatBuffer:
+    """Heartbeat senza cambio di stato, scritti in blocco da un thread di processo"""
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def record(self, user_id, last_activity):
+        with self._lock:
+            self._pending[user_id] = last_activity
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='presence-heartbeats', daemon=True)
+                self._thread.start()
+
+    def discard(self, user_id):
+        """Un cambio di stato scritto subito prevale sull'heartbeat in attesa"""
+        with self._lock:
+            self._pending.pop(user_id, None)
+
+    def flush(self):
+        """
+        Scrive gli heartbeat in attesa: un UPDATE per blocco di FLUSH_BATCH_SIZE utenti.
+
+        Returns:
+            numero di righe aggiornate
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        items = list(pending.items())
+        size = PRESENCE_CONFIG['FLUSH_BATCH_SIZE']
+        updated = 0
+        for start in range(0, len(items), size):
+            batch = items[start:start + size]
+            # Solo sessioni ancora attive e mai all'indietro (un altro worker può aver scritto dopo)
+            newer = Q()
+            for user_id, last_activity in batch:
+                newer |= Q(user_id=user_id, last_activity__lt=last_activity)
+            updated += UserStatus.objects.filter(newer, is_logged_in=True).update(
+                status=STATUS_ONLINE,
+                has_connection=True,
+                last_activity=Case(
+                    *(When(user_id=user_id, then=Value(last_activity)) for user_id, last_activity in batch),
+                    output_field=DateTimeField(),
+                ),
+                updated_at=timezone.now(),
+            )
+        logger.debug(f"📡 Heartbeat scritti: {updated}/{len(items)} utenti")
+        return updated
+
+    def _run(self):
+        while True:
+            time.sleep(PRESENCE_CONFIG['HEARTBEAT_FLUSH_SECONDS'])
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"❌ Errore scrittura heartbeat presenza: {e}")
+            finally:
+                close_old_connections()
+
+
+_snapshot = PresenceSnapshot()
+_heartbeats = _HeartbeatBuffer()
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        _heartbeats.flush()
+    except Exception as e:
+        logger.warning(f"⚠️ Heartbeat presenza non scritti all'uscita: {e}")
+
+
+def _snapshot_rows():
+    """Una sola query: utenti attivi, stato e validità del token di sessione"""
+    return User.objects.filter(is_active=True).annotate(
+        token_valid=Exists(Token.objects.filter(key=OuterRef('status_info__session_token'))),
+    ).values(
+        'id', 'username', 'date_joined', 'token_valid',
+        'status_info__is_logged_in', 'status_info__has_connection',
+        'status_info__last_activity', 'status_info__last_seen',
+    ).order_by('id')
+
+
+def all_statuses():
+    return _snapshot.all()
+
+
+def user_status(user_id):
+    return _snapshot.get(user_id)
+
+
+def heartbeat(user, has_connection=True):
+    """
+    Heartbeat del client: nessuna scrittura se l'utente è già online,
+    altrimenti un solo UPDATE se la sessione risulta attiva.
+
+    Returns:
+        il nuovo stato ('online', 'unreachable' o 'offline')
+    """
+    now = timezone.now()
+    previous = _snapshot.status_of(user.id, now)
+    if has_connection and previous == STATUS_ONLINE:
+        _heartbeats.record(user.id, now)
+        _snapshot.apply(user.id, last_activity=now)
+        return STATUS_ONLINE
+
+    # Cambio di stato: scritto subito
+    _heartbeats.discard(user.id)
+    status = STATUS_ONLINE if has_connection else STATUS_UNREACHABLE
+    fields = {'status': status, 'has_connection': has_connection, 'last_activity': now, 'updated_at': now}
+    if not has_connection:
+        fields['last_seen'] = now
+
+    updated = UserStatus.objects.filter(
+        user=user, is_logged_in=True,
+        session_token__in=Token.objects.filter(user=user).values('key'),
+    ).update(**fields)
+    if not updated:
+        # Nessuna sessione valida registrata: offline (crea la riga se manca)
+        user_status, _ = UserStatus.objects.get_or_create(user=user)
+        user_status.set_offline()
+        _snapshot.apply(user.id, is_logged_in=False, has_connection=False, last_activity=user_status.last_activity)
+        if previous != STATUS_OFFLINE:
+            realtime.publish_presence(user.id, STATUS_OFFLINE)
+        return STATUS_OFFLINE
+
+    changes = {'has_connection': has_connection, 'last_activity': now}
+    if not has_connection:
+        changes['last_seen'] = now
+    _snapshot.apply(user.id, is_logged_in=True, **changes)
+    if status != previous:
+        realtime.publish_presence(user.id, status)
+    return status
+
+
+def connect(user):
+    """WebSocket dell'utente connesso"""
+    return heartbeat(user, True)
+
+
+def disconnect(user):
+    """WebSocket dell'utente chiuso: resta loggato ma non raggiungibile"""
+    return heartbeat(user, False)
+
+
+def session_started(user_status):
+    """Login completato (UserStatus già impostato online con il nuovo token)"""
+    _heartbeats.discard(user_status.user_id)
+    _snapshot.apply(
+        user_status.user_id,
+        is_logged_in=True, has_connection=True,
+        last_activity=user_status.last_activity, last_seen=user_status.last_seen,
+    )
+    realtime.publish_presence(user_status.user_id, STATUS_ONLINE)
+
+
+def session_ended(user_id):
+    """Logout completato"""
+    _heartbeats.discard(user_id)
+    _snapshot.apply(user_id, is_logged_in=False, has_connection=False)
+    realtime.publish_presence(user_id, STATUS_OFFLINE)
+
+
+def sweep():
+    """
+    Porta nel database le scadenze di presenza con UPDATE in blocco.
+
+    Returns:
+        numero di sessioni scadute (token eliminato) impostate offline
+    """
+    _heartbeats.flush()
+    now = timezone.now()
+
+    # Utenti attivi senza riga di stato (creata prima per ogni utente in get_all_users_status)
+    missing = User.objects.filter(is_active=True, status_info__isnull=True).values_list('id', flat=True)
+    UserStatus.objects.bulk_create([UserStatus(user_id=user_id) for user_id in missing], ignore_conflicts=True)
+
+    expired = UserStatus.objects.filter(is_logged_in=True).exclude(
+        Exists(Token.objects.filter(key=OuterRef('session_token'))),
+    ).update(status=STATUS_OFFLINE, is_logged_in=False, has_connection=False, last_activity=now, updated_at=now)
+
+    cutoff = now - timedelta(seconds=PRESENCE_CONFIG['CONNECTION_TIMEOUT'])
+    stale_ids = list(UserStatus.objects.filter(
+        is_logged_in=True, status=STATUS_ONLINE, last_activity__lt=cutoff,
+    ).values_list('user_id', flat=True))
+    stale = UserStatus.objects.filter(user_id__in=stale_ids, status=STATUS_ONLINE, last_activity__lt=cutoff).update(
+        status=STATUS_UNREACHABLE, has_connection=False, updated_at=now,
+    )
+    for user_id in stale_ids:
+        realtime.publish_presence(user_id, STATUS_UNREACHABLE)
+
+    if expired or stale:
+        logger.info(f"🧹 Presenza: {expired} sessioni scadute, {stale} utenti non raggiungibili")
+        _snapshot.invalidate()
+    return expired
@@ -0,0 +1,198 @@
+"""
+Cache condivisa dei principal autenticati per SecureVox
+
+Memorizza utente e stato del token GIÀ validati, così un cache hit non richiede
+né query al database né operazioni crittografiche.
+
+Il backend è un alias di `settings.CACHES` (default: 'principals'):
+- Redis (django-redis) in produzione → condiviso tra tutti i worker gunicorn/uvicorn
+- FileBasedCache in sviluppo/test → condiviso tra i processi della stessa macchina
+
+Nella cache non finiscono segreti: dell'utente solo pk, username e flag (niente
+password), del token solo i campi non sensibili (la chiave DRF viene
+ricostruita dal token in chiaro presentato dal client).
+
+Invalidazione esplicita, con un solo write atomico per chiave:
+- invalidate_token(raw_token): un singolo token (logout)
+- invalidate_user(user): tutti i token di un utente (blocco, modifica E2EE, profilo)
+- invalidate_all(): tutto (force logout)
+Ogni voce ricorda quando è iniziata la sua validazione sul database: una voce
+validata prima dell'ultima invalidazione del token o dell'utente viene scartata
+in lettura, anche se è stata scritta DOPO l'invalidazione (richiesta in corsa
+con il logout).
+"""
+from django.conf import settings
+from django.core.cache import caches, InvalidCacheBackendError
+from django.db import DEFAULT_DB_ALIAS
+from django.contrib.auth.models import User
+import hashlib
+import logging
+import time
+
+logger = logging.getLogger('securevox')
+
+PRINCIPAL_CACHE_ALIAS = getattr(settings, 'PRINCIPAL_CACHE_ALIAS', 'principals')
+PRINCIPAL_CACHE_TTL = getattr(settings, 'PRINCIPAL_CACHE_TTL', 300)
+
+ENTRY_PREFIX = 'principal:'
+TOKEN_REVOKED_PREFIX = 'principal_revoked:'
+USER_REVOKED_PREFIX = 'principal_user_revoked:'
+
+# Margine per orologi non allineati tra i worker: in dubbio la voce viene scartata
+CLOCK_SKEW_SECONDS = 2
+
+# Campi dell'utente in cache (gli altri vengono caricati solo se usati)
+USER_FIELDS = ('id', 'username', 'is_active', 'is_staff', 'is_superuser')
+# Campi dei token in cache: mai la chiave in chiaro, cifrata o il digest di lookup
+TOKEN_EXCLUDED_FIELDS = ('key', 'encrypted_key', 'lookup_digest')
+
+
+def _backend():
+    """Backend di cache configurato (fallback sulla cache di default)"""
+    try:
+        return caches[PRINCIPAL_CACHE_ALIAS]
+    except InvalidCacheBackendError:
+        return caches['default']
+
+
+def _token_digest(raw_token):
+    return hashlib.sha256(raw_token.encode()).hexdigest()
+
+
+def _entry_key(digest):
+    return f"{ENTRY_PREFIX}{digest}"
+
+
+def _token_revoked_key(digest):
+    return f"{TOKEN_REVOKED_PREFIX}{digest}"
+
+
+def _user_revoked_key(user_id):
+    return f"{USER_REVOKED_PREFIX}{user_id}"
+
+
+def _revoked_since(revoked_at, validated_at):
+    return revoked_at is not None and revoked_at >= validated_at - CLOCK_SKEW_SECONDS
+
+
+def _dump_model(instance, fields=None, exclude=()):
+    """Serializza i campi concreti indicati di un'istanza in un dict picklabile"""
+    return {
+        field.attname: getattr(instance, field.attname)
+        for field in instance._meta.concrete_fields
+        if (fields is None or field.attname in fields) and field.attname not in exclude
+    }
+
+
+def _load_model(model, data):
+    """Ricostruisce un'istanza come se fosse stata letta dal database"""
+    fields = [f for f in model._meta.concrete_fields if f.attname in data]
+    return model.from_db(
+        DEFAULT_DB_ALIAS,
+        [f.attname for f in fields],
+        [data[f.attname] for f in fields],
+    )
+
+
+def get_principal(raw_token):
+    """
+    Restituisce (user, token) già validati per il token in chiaro, oppure None.
+    Nessuna query e nessuna decifratura.
+    """
+    backend = _backend()
+    digest = _token_digest(raw_token)
+    cached = backend.get_many([_entry_key(digest), _token_revoked_key(digest)])
+    entry = cached.get(_entry_key(digest))
+    if not entry:
+        return None
+
+    if entry['valid_until'] is not None and time.time() > entry['valid_until']:
+        invalidate_token(raw_token)
+        return None
+
+    validated_at = entry['validated_at']
+    user_revoked_at = backend.get(_user_revoked_key(entry['user']['id']))
+    if _revoked_since(cached.get(_token_revoked_key(digest)), validated_at) or \
+            _revoked_since(user_revoked_at, validated_at):
+        # Validata prima di un logout o di una modifica dell'utente: si rivalida sul DB
+        backend.delete(_entry_key(digest))
+        return None
+
+    try:
+        user = _load_model(User, entry['user'])
+        token_model = _token_model(entry['kind'])
+        token_data = entry['token']
+        if token_model._meta.pk.attname == 'key':
+            # Token DRF: la chiave primaria è il token stesso, non viene salvata in cache
+            token_data = {**token_data, 'key': raw_token}
+        token = _load_model(token_model, token_data)
+    except Exception as e:
+        # Formato non più compatibile (es. dopo una migrazione): si ricalcola
+        logger.warning(f"PrincipalCache - Voce non valida scartata: {e}")
+        backend.delete(_entry_key(digest))
+        return None
+
+    if not user.is_active:
+        return None
+
+    token.user = user
+    return (user, token)
+
+
+def set_principal(raw_token, user, token, validated_at, valid_until=None):
+    """
+    Memorizza un principal validato.
+
+    Args:
+        raw_token: token in chiaro ricevuto dal client
+        user: utente autenticato
+        token: istanza Token DRF o AuthToken
+        validated_at: time.time() letto PRIMA della validazione sul database
+        valid_until: datetime oltre il quale il token non è più valido (None = nessun limite)
+    """
+    ttl = PRINCIPAL_CACHE_TTL
+    valid_until_ts = None
+    if valid_until is not None:
+        valid_until_ts = valid_until.timestamp()
+        ttl = min(ttl, int(valid_until_ts - time.time()))
+        if ttl <= 0:
+            return
+
+    _backend().set(_entry_key(_token_digest(raw_token)), {
+        'kind': token._meta.label_lower,
+        'user': _dump_model(user, fields=USER_FIELDS),
+        'token': _dump_model(token, exclude=TOKEN_EXCLUDED_FIELDS),
+        'valid_until': valid_until_ts,
+        'validated_at': validated_at,
+    }, ttl)
+
+
+def invalidate_token(raw_token):
+    """Rimuove dalla cache un singolo token (anche se una richiesta in corsa lo riscrive)"""
+    backend = _backend()
+    digest = _token_digest(raw_token)
+    backend.set(_token_revoked_key(digest), time.time(), PRINCIPAL_CACHE_TTL + CLOCK_SKEW_SECONDS)
+    backend.delete(_entry_key(digest))
+
+
+def invalidate_user(user):
+    """Invalida tutti i principal di un utente (istanza o id): un solo write, nessun indice da aggiornare"""
+    user_id = getattr(user, 'pk', user)
+    _backend().set(_user_revoked_key(user_id), time.time(), PRINCIPAL_CACHE_TTL + CLOCK_SKEW_SECONDS)
+    logger.debug(f"PrincipalCache - Invalidati i principal di user {user_id}")
+
+
+def invalidate_all():
+    """Svuota l'intera cache dei principal (force logout globale)"""
+    backend = _backend()
+    if backend is caches['default']:
+        # Senza un alias dedicato non possiamo svuotare tutta la cache condivisa
+        logger.warning("PrincipalCache - Alias dedicato non configurato, invalidazione globale non disponibile")
+        return
+    backend.clear()
+    logger.info("PrincipalCache - Cache principal svuotata")
+
+
+def _token_model(kind):
+    from django.apps import apps
+    return apps.get_model(kind)
@@ -0,0 +1,148 @@
+"""
+Eventi real-time per utente sul WebSocket /ws/events/ (api.consumers)
+
+L'app non deve più interrogare in loop get_pending_calls, get_chats e
+get_users_status: le modifiche vengono spinte sul socket dell'utente.
+- publish() scrive un UserEvent per destinatario nella STESSA transazione
+  della modifica, con un numero di sequenza per utente (UserEventStream), e
+  al commit lo invia al gruppo del channel layer dell'utente
+- il client ricorda l'ultima sequenza ricevuta e alla riconnessione apre
+  /ws/events/?since=<seq>: il consumer rimanda gli eventi persi dal journal
+  (o 'resync_required' se sono oltre la retention / REPLAY_LIMIT)
+- i cambi di presenza non sono per destinatario: vanno a un solo gruppo
+  condiviso e non passano dal journal (alla riconnessione il client rilegge
+  lo stato con get_users_status)
+"""
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+from datetime import timedelta
+from .models import UserEvent, UserEventStream
+import logging
+
+logger = logging.getLogger('securevox')
+
+EVENT_NEW_MESSAGE = 'new_message'
+EVENT_CHAT_DELETED = 'chat_deleted'
+EVENT_INCOMING_CALL = 'incoming_call'
+EVENT_CALL_ENDED = 'call_ended'
+EVENT_READ_RECEIPT = 'read_receipt'
+EVENT_PRESENCE = 'presence'
+
+PRESENCE_GROUP = 'user_events_presence'
+
+_DEFAULTS = {
+    'REPLAY_LIMIT': 500,
+    'RETENTION_HOURS': 48,
+}
+REALTIME_CONFIG = {**_DEFAULTS, **getattr(settings, 'REALTIME_EVENTS', {})}
+
+
+def user_group(user_id):
+    return f"user_events_{user_id}"
+
+
+def publish(recipient_ids, event_type, payload):
+    """
+    Registra un evento per ogni destinatario e lo invia al commit.
+    Va chiamata dentro la transazione della modifica che lo genera
+    (fuori da una transazione l'evento viene inviato subito).
+
+    Returns:
+        lista di UserEvent creati
+    """
+    recipient_ids = sorted(set(recipient_ids))
+    if not recipient_ids:
+        return []
+
+    with transaction.atomic():
+        UserEventStream.objects.bulk_create(
+            [UserEventStream(user_id=user_id) for user_id in recipient_ids], ignore_conflicts=True,
+        )
+        streams = UserEventStream.objects.filter(user_id__in=recipient_ids)
+        # Lock in ordine di utente (PostgreSQL), poi incremento: niente deadlock tra
+        # due eventi con destinatari in comune, sequenze consecutive per utente
+        list(streams.select_for_update().order_by('user_id').values_list('user_id', flat=True))
+        streams.update(last_seq=models.F('last_seq') + 1)
+        sequences = dict(streams.values_list('user_id', 'last_seq'))
+
+        events = UserEvent.objects.bulk_create([
+            UserEvent(user_id=user_id, seq=sequences[user_id], event_type=event_type, payload=payload)
+            for user_id in recipient_ids
+        ])
+    transaction.on_commit(lambda: _send_events(events))
+    return events
+
+
+def publish_presence(user_id, status):
+    """Cambio di presenza: un solo messaggio al gruppo condiviso, al commit"""
+    message = {
+        'type': 'user.event',
+        'event': {
+            'type': EVENT_PRESENCE,
+            'data': {'user_id': str(user_id), 'status': status},
+            'timestamp': timezone.now().isoformat(),
+        },
+    }
+    transaction.on_commit(lambda: _group_send([(PRESENCE_GROUP, message)]))
+
+
+def serialize(event):
+    return {
+        'type': event.event_type,
+        'seq': event.seq,
+        'data': event.payload,
+        'timestamp': event.created_at.isoformat(),
+    }
+
+
+def replay(user_id, since):
+    """
+    Eventi con sequenza > since, per la ripresa dopo una riconnessione.
+
+    Returns:
+        (eventi serializzati, ultima sequenza) oppure (None, ultima sequenza)
+        se gli eventi persi non sono più tutti nel journal
+    """
+    last_seq = UserEventStream.objects.filter(user_id=user_id).values_list('last_seq', flat=True).first() or 0
+    if since == last_seq:
+        return [], last_seq
+    if since > last_seq:
+        # Sequenza sconosciuta (es. journal di un altro server)
+        return None, last_seq
+    if last_seq - since > REALTIME_CONFIG['REPLAY_LIMIT']:
+        return None, last_seq
+
+    events = list(UserEvent.objects.filter(user_id=user_id, seq__gt=since).order_by('seq'))
+    if not events or events[0].seq != since + 1:
+        # Eventi più vecchi già eliminati dalla retention
+        return None, last_seq
+    return [serialize(event) for event in events], last_seq
+
+
+def purge_expired(hours=None):
+    """Elimina dal journal gli eventi oltre la retention"""
+    cutoff = timezone.now() - timedelta(hours=hours or REALTIME_CONFIG['RETENTION_HOURS'])
+    deleted, _ = UserEvent.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
+
+
+def _send_events(events):
+    _group_send([
+        (user_group(event.user_id), {'type': 'user.event', 'event': serialize(event)})
+        for event in events
+    ])
+
+
+def _group_send(messages):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        for group, message in messages:
+            async_to_sync(channel_layer.group_send)(group, message)
+    except Exception as e:
+        # Channel layer non raggiungibile: gli eventi restano nel journal per il replay
+        logger.warning(f"📡 Eventi real-time non inviati: {e}")
@@ -24,6 +24,22 @@ User = get_user_model()
 SECUREVOX_CALL_JWT_SECRET = getattr(settings, 'SECUREVOX_CALL_JWT_SECRET', 'securevox-call-secret-2024')
 SECUREVOX_CALL_SERVER_URL = getattr(settings, 'SECUREVOX_CALL_SERVER_URL', 'http://localhost:8002')
 
+CALL_TOKEN_TTL_SECONDS = 3600
+
+
+def issue_call_token(user_id, session_id, role='participant'):
+    """Token JWT per l'accesso di un utente a una sessione del SecureVOX Call Server"""
+    now = timezone.now()
+    payload = {
+        'userId': str(user_id),
+        'sessionId': session_id,
+        'role': role,
+        'iat': int(now.timestamp()),
+        'exp': int((now + timedelta(seconds=CALL_TOKEN_TTL_SECONDS)).timestamp())
+    }
+    return jwt.encode(payload, SECUREVOX_CALL_JWT_SECRET, algorithm='HS256')
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 @login_required
@@ -41,15 +57,7 @@ def generate_call_token(request):
             return JsonResponse({'error': 'sessionId required'}, status=400)
         
         # Genera token JWT
-        payload = {
-            'userId': user_id,
-            'sessionId': session_id,
-            'role': role,
-            'iat': int(timezone.now().timestamp()),
-            'exp': int((timezone.now() + timedelta(hours=1)).timestamp())
-        }
-        
-        token = jwt.encode(payload, SECUREVOX_CALL_JWT_SECRET, algorithm='HS256')
+        token = issue_call_token(user_id, session_id, role)
         
         # ICE servers configuration
         ice_servers = [
@@ -62,7 +70,7 @@ def generate_call_token(request):
         
         return JsonResponse({
             'token': token,
-            'expires_in': 3600,
+            'expires_in': CALL_TOKEN_TTL_SECONDS,
             'ice_servers': ice_servers,
             'server_url': SECUREVOX_CALL_SERVER_URL
         })
@@ -0,0 +1,416 @@
+"""
+Pool di stanze Janus pre-create e ciclo di vita asincrono delle stanze SFU
+
+create_call_session e create_group_call creavano la stanza con un
+requests.post bloccante (fino a 10 s) dentro la richiesta, e le stanze
+venivano eliminate solo da un destroy_room esplicito: quelle delle chiamate
+chiuse in altro modo restavano su Janus. SFURoomManager:
+- tiene POOL_SIZE stanze libere già create su Janus; lease() assegna una
+  stanza a una sessione in O(1) senza I/O (None se il pool è vuoto: P2P)
+- release() a fine chiamata espelle i partecipanti rimasti e rimette la
+  stanza nel pool fino a MAX_FREE_ROOMS (oltre la distrugge): con molte
+  chiamate le stanze vengono riusate invece di essere ricreate
+- ogni REAP_INTERVAL confronta list_rooms con le sessioni attive: recupera le
+  stanze di chiamate terminate senza end_call ed elimina le stanze orfane
+  vuote (anche quelle create prima del pool con l'id della sessione)
+- parla con Janus da un event loop in un thread dedicato, con una sola
+  aiohttp.ClientSession persistente (connessioni keep-alive)
+
+Ogni processo ha il proprio pool, con id stanza prefissati da un token di
+istanza registrato nella cache condivisa prima di creare la prima stanza e
+rinnovato a ogni giro del reaper: il reaper non tocca le stanze libere o
+assegnate degli altri processi attivi.
+"""
+from collections import deque
+from django.conf import settings
+from django.core.cache import caches, InvalidCacheBackendError
+from django.db import close_old_connections
+from .models import Call, WebRTCCall
+import aiohttp
+import asyncio
+import itertools
+import logging
+import threading
+import time
+import uuid
+
+logger = logging.getLogger('securevox')
+
+_DEFAULTS = {
+    'POOL_SIZE': 4,  # stanze libere mantenute creandone di nuove
+    'MAX_FREE_ROOMS': 8,  # stanze libere massime tenute dal riciclo
+    'ROOM_PUBLISHERS': 10,  # publisher per stanza del pool (1:1 e gruppi fino a 10)
+    'REAP_INTERVAL': 60,
+    'RETRY_INTERVAL': 5,  # nuovo tentativo di riempire il pool se Janus non risponde
+    'MAX_LEASE_SECONDS': 6 * 3600,  # stanze di sessioni senza record in DB (gruppi)
+    'REQUEST_TIMEOUT': 10,
+    'CACHE_ALIAS': getattr(settings, 'COORDINATION_CACHE_ALIAS', 'coordination'),  # istanze attive dei pool
+}
+SFU_ROOM_CONFIG = {**_DEFAULTS, **getattr(settings, 'SFU_ROOM_POOL', {})}
+
+ROOM_PREFIX = 'svpool'
+INSTANCE_KEY = 'sfu-room-pool-instance:{}'
+
+ACTIVE_CALL_STATUSES = ('ringing', 'seen', 'answered')
+ACTIVE_WEBRTC_CALL_STATUSES = ('ringing', 'answered', 'connected')
+
+
+class JanusError(Exception):
+    """Richiesta rifiutata da Janus (HTTP non 200 o error_code nella risposta)"""
+
+
+class AsyncJanusClient:
+    """Client asincrono del plugin videoroom con una sessione HTTP persistente"""
+
+    def __init__(self, url, api_secret, timeout):
+        self.endpoint = f"{url}/janus/videoroom"
+        self.api_secret = api_secret
+        self.timeout = timeout
+        self._session = None
+
+    async def request(self, payload):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                connector=aiohttp.TCPConnector(limit=16, keepalive_timeout=60),
+            )
+        async with self._session.post(self.endpoint, json={**payload, 'secret': self.api_secret}) as response:
+            if response.status != 200:
+                raise JanusError(f"Janus HTTP {response.status} ({payload['request']})")
+            result = await response.json(content_type=None)
+        if result.get('error_code'):
+            raise JanusError(f"Janus {result['error_code']}: {result.get('error')} ({payload['request']})")
+        return result
+
+    async def create_room(self, room_id, description, publishers):
+        return await self.request({
+            'request': 'create',
+            'room': room_id,
+            'description': description,
+            'publishers': publishers,
+            'bitrate': 1024000,
+            'fir_freq': 10,
+            'e2ee': True,  # Abilita E2EE
+        })
+
+    async def destroy_room(self, room_id):
+        return await self.request({'request': 'destroy', 'room': room_id})
+
+    async def list_rooms(self):
+        return (await self.request({'request': 'list'})).get('list', [])
+
+    async def list_participants(self, room_id):
+        return (await self.request({'request': 'listparticipants', 'room': room_id})).get('participants', [])
+
+    async def kick(self, room_id, participant_id):
+        return await self.request({'request': 'kick', 'room': room_id, 'id': participant_id})
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+class SFURoomManager:
+    """Pool di stanze Janus del processo, gestito da un event loop in un thread dedicato"""
+
+    def __init__(self):
+        self.instance_token = uuid.uuid4().hex[:12]
+        self.client = None
+        self._free = deque()
+        self._leases = {}  # session_id -> (room_id, istante del lease, stanza del pool)
+        self._pending = set()  # stanze in creazione o in riciclo (solo dal loop)
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+        self._loop = None
+        self._wakeup = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stopping = False
+
+    # API sincrona (thread delle richieste)
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            ready = threading.Event()
+            self._thread = threading.Thread(target=self._thread_main, args=(ready,), name='sfu-room-pool', daemon=True)
+            self._thread.start()
+            ready.wait()
+
+    def stop(self, timeout=5):
+        """Ferma il loop e chiude la sessione HTTP (le stanze restano su Janus per il reaper)"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._stopping = True
+        self._wake()
+        self._thread.join(timeout)
+
+    def lease(self, session_id):
+        """Stanza libera del pool per la sessione (O(1), senza I/O); None se il pool è vuoto"""
+        self.start()
+        with self._lock:
+            lease = self._leases.get(session_id)
+            if lease is not None:
+                return lease[0]
+            room_id = self._free.popleft() if self._free else None
+            if room_id is not None:
+                self._leases[session_id] = (room_id, time.time(), True)
+        # Il loop ricrea subito la stanza consumata
+        self._wake()
+        return room_id
+
+    def create_room(self, session_id, description, publishers):
+        """
+        Stanza dedicata (es. gruppo oltre ROOM_PUBLISHERS): attende la creazione su Janus.
+        A fine chiamata viene distrutta invece di tornare nel pool.
+        """
+        self.start()
+        with self._lock:
+            lease = self._leases.get(session_id)
+        if lease is not None:
+            return lease[0]
+        room_id = self._new_room_id()
+        future = asyncio.run_coroutine_threadsafe(self._create(room_id, description, publishers, hold=True), self._loop)
+        try:
+            created = future.result(SFU_ROOM_CONFIG['REQUEST_TIMEOUT'])
+        except Exception as e:
+            logger.warning(f"🎥 Stanza dedicata {room_id} non creata: {e}")
+            created = False
+        if created:
+            with self._lock:
+                self._leases[session_id] = (room_id, time.time(), False)
+        # Da qui la stanza è coperta dal lease (o, se creata in ritardo, è un'orfana per il reaper)
+        self._loop.call_soon_threadsafe(self._pending.discard, room_id)
+        return room_id if created else None
+
+    def release(self, session_id):
+        """Fine chiamata: la stanza torna nel pool in background. False se la sessione non ha stanze di questo processo"""
+        with self._lock:
+            lease = self._leases.pop(session_id, None)
+        if lease is None:
+            return False
+        room_id, _, pooled = lease
+        self._submit(self._recycle(room_id, pooled))
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'instance': self.instance_token,
+                'free': len(self._free),
+                'leased': len(self._leases),
+                'pool_size': SFU_ROOM_CONFIG['POOL_SIZE'],
+            }
+
+    # Event loop
+
+    def _thread_main(self, ready):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        ready.set()
+        try:
+            loop.run_until_complete(self._run())
+        finally:
+            loop.close()
+
+    def _wake(self):
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _submit(self, coroutine):
+        if self._loop is None or self._loop.is_closed():
+            coroutine.close()
+            return
+        asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    async def _run(self):
+        janus = settings.JANUS_SFU
+        self.client = AsyncJanusClient(janus['url'], janus['api_secret'], SFU_ROOM_CONFIG['REQUEST_TIMEOUT'])
+        logger.info(f"🎥 Pool stanze SFU avviato (istanza {self.instance_token})")
+        loop = asyncio.get_running_loop()
+        # Registrata prima della prima stanza: il reaper di un altro processo non la tratta da orfana
+        await loop.run_in_executor(None, _register_instance, self.instance_token)
+        next_reap = time.monotonic()
+        try:
+            while not self._stopping:
+                self._wakeup.clear()
+                filled = await self._fill()
+                if time.monotonic() >= next_reap:
+                    next_reap = time.monotonic() + SFU_ROOM_CONFIG['REAP_INTERVAL']
+                    try:
+                        await self._reap()
+                    except Exception as e:
+                        logger.warning(f"🎥 Reaper stanze SFU fallito: {e}")
+                wait = next_reap - time.monotonic()
+                if not filled:
+                    wait = min(wait, SFU_ROOM_CONFIG['RETRY_INTERVAL'])
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=max(wait, 0))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await self.client.close()
+            # Le stanze rimaste su Janus diventano orfane per i reaper degli altri processi
+            await loop.run_in_executor(None, _unregister_instance, self.instance_token)
+            logger.info(f"🎥 Pool stanze SFU fermato (istanza {self.instance_token})")
+
+    async def _fill(self):
+        """Crea in parallelo le stanze mancanti; False se qualcuna non è stata creata"""
+        with self._lock:
+            missing = SFU_ROOM_CONFIG['POOL_SIZE'] - len(self._free)
+        if missing <= 0:
+            return True
+        room_ids = [self._new_room_id() for _ in range(missing)]
+        created = await asyncio.gather(*(
+            self._create(room_id, 'SecureVOX Room', SFU_ROOM_CONFIG['ROOM_PUBLISHERS']) for room_id in room_ids
+        ))
+        with self._lock:
+            self._free.extend(room_id for room_id, ok in zip(room_ids, created) if ok)
+        return all(created)
+
+    async def _create(self, room_id, description, publishers, hold=False):
+        """Crea la stanza su Janus; con hold resta in _pending finché il chiamante non la assegna"""
+        self._pending.add(room_id)
+        try:
+            await self.client.create_room(room_id, description, publishers)
+            return True
+        except (aiohttp.ClientError, asyncio.TimeoutError, JanusError) as e:
+            logger.warning(f"🎥 Janus non disponibile, stanza {room_id} non creata: {e}")
+            return False
+        finally:
+            if not hold:
+                self._pending.discard(room_id)
+
+    async def _recycle(self, room_id, pooled):
+        self._pending.add(room_id)
+        try:
+            for participant in await self.client.list_participants(room_id):
+                await self.client.kick(room_id, participant['id'])
+            with self._lock:
+                keep = pooled and len(self._free) < SFU_ROOM_CONFIG['MAX_FREE_ROOMS']
+                if keep:
+                    self._free.append(room_id)
+            if not keep:
+                await self.client.destroy_room(room_id)
+        except (aiohttp.ClientError, asyncio.TimeoutError, JanusError) as e:
+            # La stanza resta su Janus senza lease: il reaper la elimina quando è vuota
+            logger.warning(f"🎥 Stanza {room_id} non riciclata: {e}")
+        finally:
+            self._pending.discard(room_id)
+
+    async def _reap(self):
+        """Confronta le stanze su Janus con il pool e le sessioni attive"""
+        loop = asyncio.get_running_loop()
+        rooms = {str(room['room']) for room in await self.client.list_rooms()}
+        with self._lock:
+            free = set(self._free)
+            leases = dict(self._leases)
+
+        orphans = rooms - free - self._pending - {room_id for room_id, _, _ in leases.values()}
+        foreign = {_room_instance(room_id) for room_id in orphans} - {None, self.instance_token}
+        activity, alive = await loop.run_in_executor(
+            None, _reap_context, set(leases) | orphans, foreign, self.instance_token,
+        )
+
+        # Stanze sparite da Janus (es. riavvio): fuori dal pool, _fill le ricrea
+        with self._lock:
+            self._free = deque(room_id for room_id in self._free if room_id in rooms)
+
+        # Lease di chiamate terminate senza end_call (o più vecchie del limite)
+        now = time.time()
+        for session_id, (room_id, leased_at, _) in leases.items():
+            vanished = room_id not in rooms
+            if vanished or activity.get(session_id) is False or now - leased_at > SFU_ROOM_CONFIG['MAX_LEASE_SECONDS']:
+                if vanished:
+                    with self._lock:
+                        self._leases.pop(session_id, None)
+                else:
+                    self.release(session_id)
+
+        # Stanze orfane: di questo processo, di processi terminati o create prima del pool
+        destroyed = 0
+        for room_id in orphans:
+            if _room_instance(room_id) in alive or activity.get(room_id):
+                # Stanza di un altro processo attivo o di una sessione ancora in corso
+                continue
+            try:
+                if await self.client.list_participants(room_id):
+                    continue
+                await self.client.destroy_room(room_id)
+                destroyed += 1
+            except (aiohttp.ClientError, asyncio.TimeoutError, JanusError) as e:
+                logger.warning(f"🎥 Stanza orfana {room_id} non eliminata: {e}")
+        if destroyed:
+            logger.info(f"🎥 Reaper SFU: {destroyed} stanze orfane eliminate")
+
+    def _new_room_id(self):
+        return f"{ROOM_PREFIX}-{self.instance_token}-{next(self._counter)}"
+
+
+def _room_instance(room_id):
+    """Token dell'istanza proprietaria di una stanza del pool (None per le altre stanze)"""
+    parts = room_id.split('-')
+    if len(parts) == 3 and parts[0] == ROOM_PREFIX:
+        return parts[1]
+    return None
+
+
+def _reap_context(session_ids, instance_tokens, own_token):
+    """
+    Stato delle sessioni e delle istanze per il reaper (fuori dall'event loop)
+
+    Returns:
+        ({session_id: chiamata attiva?} per le sessioni con un record,
+         token delle altre istanze ancora attive)
+    """
+    close_old_connections()
+    try:
+        activity = {}
+        for model, active_statuses in ((Call, ACTIVE_CALL_STATUSES), (WebRTCCall, ACTIVE_WEBRTC_CALL_STATUSES)):
+            rows = model.objects.filter(session_id__in=session_ids).values_list('session_id', 'status')
+            for session_id, status in rows:
+                activity[session_id] = activity.get(session_id, False) or status in active_statuses
+
+        _register_instance(own_token)
+        alive = {token for token in instance_tokens if _instance_cache().get(INSTANCE_KEY.format(token))}
+        return activity, alive
+    finally:
+        close_old_connections()
+
+
+def _register_instance(token):
+    """Segna l'istanza come attiva per tre intervalli del reaper"""
+    try:
+        _instance_cache().set(INSTANCE_KEY.format(token), True, SFU_ROOM_CONFIG['REAP_INTERVAL'] * 3)
+    except Exception as e:
+        logger.warning(f"🎥 Istanza {token} non registrata nella cache: {e}")
+
+
+def _unregister_instance(token):
+    try:
+        _instance_cache().delete(INSTANCE_KEY.format(token))
+    except Exception as e:
+        logger.warning(f"🎥 Istanza {token} non rimossa dalla cache: {e}")
+
+
+def _instance_cache():
+    try:
+        return caches[SFU_ROOM_CONFIG['CACHE_ALIAS']]
+    except InvalidCacheBackendError:
+        return caches['default']
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_room_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = SFURoomManager()
+    return _manager
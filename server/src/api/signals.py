@@ -0,0 +1,78 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.contrib.auth.models import User
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from .models import AuthToken, Chat, ChatMembership, MediaObject
+from . import media_store, principal_cache
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_principals(sender, instance, **kwargs):
+    """Un utente modificato (profilo, blocco, permessi) non deve essere servito dalla cache"""
+    principal_cache.invalidate_user(instance)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    """Logout / nuovo login: il token DRF eliminato non autentica più"""
+    principal_cache.invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=AuthToken)
+@receiver(post_delete, sender=AuthToken)
+def invalidate_auth_token_user(sender, instance, **kwargs):
+    """Token personalizzato disattivato o eliminato"""
+    if kwargs.get('created'):
+        return
+    principal_cache.invalidate_user(instance.user_id)
+
+
+def _membership_pairs(instance, reverse, pk_set):
+    """Coppie (chat_id, user_id) coinvolte da un m2m_changed, da entrambi i lati della relazione"""
+    if reverse:
+        return [(chat_id, instance.pk) for chat_id in pk_set]
+    return [(instance.pk, user_id) for user_id in pk_set]
+
+
+@receiver(m2m_changed, sender=Chat.participants.through)
+def sync_chat_memberships(sender, instance, action, reverse, pk_set, **kwargs):
+    """Mantiene una ChatMembership per ogni partecipante"""
+    if action == 'post_add':
+        ChatMembership.objects.bulk_create(
+            [ChatMembership(chat_id=chat_id, user_id=user_id)
+             for chat_id, user_id in _membership_pairs(instance, reverse, pk_set)],
+            ignore_conflicts=True,
+        )
+    elif action == 'post_remove':
+        for chat_id, user_id in _membership_pairs(instance, reverse, pk_set):
+            ChatMembership.objects.filter(chat_id=chat_id, user_id=user_id).delete()
+    elif action == 'post_clear':
+        if reverse:
+            ChatMembership.objects.filter(user_id=instance.pk).delete()
+        else:
+            ChatMembership.objects.filter(chat_id=instance.pk).delete()
+
+
+@receiver(m2m_changed, sender=Chat.deleted_by_users.through)
+def sync_chat_hidden_state(sender, instance, action, reverse, pk_set, **kwargs):
+    """Chat eliminata per un utente → membership nascosta (e viceversa)"""
+    if action == 'post_clear':
+        # Nessuna eliminazione rimasta: tutte le membership coinvolte tornano visibili
+        if reverse:
+            ChatMembership.objects.filter(user_id=instance.pk).update(hidden_at=None)
+        else:
+            ChatMembership.objects.filter(chat_id=instance.pk).update(hidden_at=None)
+        return
+    if action not in ('post_add', 'post_remove'):
+        return
+    hidden_at = timezone.now() if action == 'post_add' else None
+    for chat_id, user_id in _membership_pairs(instance, reverse, pk_set):
+        ChatMembership.objects.filter(chat_id=chat_id, user_id=user_id).update(hidden_at=hidden_at)
+
+
+@receiver(post_delete, sender=MediaObject)
+def release_media_reference(sender, instance, **kwargs):
+    """Media di un messaggio o di una chat eliminati: il file sparisce con l'ultimo riferimento"""
+    media_store.release(instance.storage_path)
@@ -99,3 +99,76 @@ def check_pending_deletion_notifications():
     except Exception as e:
         logger.error(f"❌ Errore check notifiche: {e}")
         return f"Error: {e}"
+
+
+@shared_task
+def dispatch_notification_outbox():
+    """
+    Invia le notifiche in outbox a SecureVOX Notify (/send_batch)
+    Risvegliato al commit di ogni messaggio e, per i retry in backoff, periodicamente
+    """
+    from .notification_outbox import drain
+
+    try:
+        processed = drain()
+        return f"Dispatched {processed} outbox notifications"
+    except Exception as e:
+        logger.error(f"❌ Errore dispatch outbox notifiche: {e}")
+        return f"Error: {e}"
+
+
+@shared_task
+def cleanup_notification_outbox():
+    """Elimina le notifiche in outbox già inviate oltre il periodo di retention"""
+    from .notification_outbox import purge_delivered
+
+    try:
+        deleted = purge_delivered()
+        logger.info(f"✅ Outbox notifiche: {deleted} righe inviate eliminate")
+        return f"Deleted {deleted} outbox notifications"
+    except Exception as e:
+        logger.error(f"❌ Errore cleanup outbox notifiche: {e}")
+        return f"Error: {e}"
+
+
+@shared_task
+def cleanup_user_events():
+    """Elimina dal journal degli eventi real-time quelli oltre la retention"""
+    from .realtime import purge_expired
+
+    try:
+        deleted = purge_expired()
+        logger.info(f"✅ Eventi real-time: {deleted} righe scadute eliminate")
+        return f"Deleted {deleted} user events"
+    except Exception as e:
+        logger.error(f"❌ Errore cleanup eventi real-time: {e}")
+        return f"Error: {e}"
+
+
+@shared_task
+def generate_office_preview(source_path, sha256, file_name, chat_id, base_url):
+    """
+    Genera la preview PDF di un documento Office caricato in chat
+    Gira sulla coda 'office', servita da worker con un pool di LibreOffice persistenti
+    """
+    from .office_previews import generate_preview
+
+    try:
+        status = generate_preview(source_path, sha256, file_name, chat_id, base_url)
+        return f"Preview {sha256}: {status}"
+    except Exception as e:
+        logger.error(f"❌ Errore generazione preview PDF {source_path}: {e}")
+        return f"Error: {e}"
+
+
+@shared_task
+def sweep_presence():
+    """Scadenze della presenza: sessioni senza token → offline, utenti inattivi → unreachable"""
+    from .presence import sweep
+
+    try:
+        expired = sweep()
+        return f"Expired {expired} presence sessions"
+    except Exception as e:
+        logger.error(f"❌ Errore sweep presenza: {e}")
+        return f"Error: {e}"
@@ -0,0 +1,39 @@
+"""
+Le view E2EE usano la pipeline di autenticazione unificata (CachedTokenAuthentication)
+"""
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from api.models import AuthToken
+
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'e2e-tests'},
+    'principals': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'e2e-tests-principals'},
+}
+
+
+@override_settings(ALLOWED_HOSTS=['*'], CACHES=TEST_CACHES)
+class E2EViewsAuthenticationTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='e2e_user')
+        self.client = APIClient()
+
+    def _get_status(self, raw_token):
+        return self.client.get('/api/e2e/my-status/', HTTP_AUTHORIZATION=f'Token {raw_token}')
+
+    def test_drf_token(self):
+        token = Token.objects.create(user=self.user)
+        response = self._get_status(token.key)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['user_id'], self.user.id)
+
+    def test_auth_token(self):
+        token = AuthToken.objects.create(user=self.user)
+        response = self._get_status(token.get_token())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['user_id'], self.user.id)
+
+    def test_without_token(self):
+        self.assertEqual(self.client.get('/api/e2e/my-status/').status_code, 401)
@@ -0,0 +1,101 @@
+"""
+Paginazione keyset della cronologia chiamate (get_calls)
+"""
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from api import views
+from api.models import Call
+import uuid
+
+
+@override_settings(ALLOWED_HOSTS=['*'])
+class CallsPaginationTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='calls_owner')
+        self.peer = User.objects.create_user(username='calls_peer')
+        self.moment = timezone.now().replace(microsecond=0) - timedelta(hours=1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _call(self, caller, callee, offset=0, updated_offset=None):
+        call = Call.objects.create(caller=caller, callee=callee, timestamp=self.moment + timedelta(seconds=offset))
+        updated_offset = offset if updated_offset is None else updated_offset
+        # updated_at è auto_now: lo si fissa con un UPDATE diretto
+        Call.objects.filter(id=call.id).update(updated_at=self.moment + timedelta(seconds=updated_offset))
+        call.refresh_from_db()
+        return call
+
+    def _walk(self, field, ascending, limit, cursor=None):
+        seen = []
+        while True:
+            page, has_more = views._user_calls_page(self.user, field, ascending, limit, cursor)
+            seen.extend(call.id for call in page)
+            if not has_more:
+                return seen
+            cursor = (getattr(page[-1], field), page[-1].id)
+
+    def test_cursor_roundtrip_and_iso_since(self):
+        call_id = uuid.uuid4()
+        cursor = views._encode_call_cursor(self.moment, call_id)
+        self.assertEqual(views._decode_call_cursor(cursor), (self.moment, call_id))
+
+        moment, floor_id = views._decode_call_cursor('2026-01-02T03:04:05Z')
+        self.assertEqual(moment.isoformat(), '2026-01-02T03:04:05+00:00')
+        self.assertEqual(floor_id, uuid.UUID(int=0))
+        # Timestamp senza fuso: interpretato nel fuso del progetto
+        self.assertTrue(timezone.is_aware(views._decode_call_cursor('2026-01-02T03:04:05')[0]))
+
+        with self.assertRaises(ValueError):
+            views._decode_call_cursor('non-un-cursore')
+
+    def test_pages_split_equal_timestamps_without_gaps_or_duplicates(self):
+        same_moment = [self._call(self.user, self.peer) for _ in range(3)]
+        same_moment += [self._call(self.peer, self.user) for _ in range(2)]
+        older = self._call(self.user, self.peer, offset=-10)
+        newer = self._call(self.peer, self.user, offset=10)
+
+        seen = self._walk('timestamp', False, limit=2)
+
+        expected = [newer.id] + sorted((c.id for c in same_moment), reverse=True) + [older.id]
+        self.assertEqual(seen, expected)
+
+    def test_self_calls_are_counted_once(self):
+        self_calls = [self._call(self.user, self.user, offset=i) for i in range(3)]
+        other = self._call(self.peer, self.user, offset=-1)
+
+        page, has_more = views._user_calls_page(self.user, 'timestamp', False, 3)
+
+        self.assertEqual([c.id for c in page], [c.id for c in reversed(self_calls)])
+        self.assertTrue(has_more)
+        self.assertEqual(self._walk('timestamp', False, limit=3), [c.id for c in reversed(self_calls)] + [other.id])
+
+    def test_since_returns_calls_updated_after_the_cursor(self):
+        stale = self._call(self.user, self.peer, updated_offset=-5)
+        at_boundary = [self._call(self.user, self.peer, updated_offset=0) for _ in range(2)]
+        later = self._call(self.peer, self.user, updated_offset=5)
+
+        # ISO senza id: include le chiamate modificate nello stesso istante
+        response = self.client.get('/api/webrtc/calls/', {'since': self.moment.isoformat(), 'limit': 2})
+        body = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([c['id'] for c in body['calls']], sorted(str(c.id) for c in at_boundary))
+        self.assertTrue(body['has_more'])
+
+        response = self.client.get('/api/webrtc/calls/', {'since': body['next_cursor'], 'limit': 2})
+        body = response.json()
+        self.assertEqual([c['id'] for c in body['calls']], [str(later.id)])
+        self.assertFalse(body['has_more'])
+        self.assertNotIn(str(stale.id), [c['id'] for c in body['calls']])
+
+        # Nessuna modifica successiva: il cursore resta quello ricevuto
+        response = self.client.get('/api/webrtc/calls/', {'since': body['next_cursor']})
+        self.assertEqual(response.json()['calls'], [])
+        self.assertEqual(response.json()['next_cursor'], body['next_cursor'])
+
+    def test_invalid_cursor_is_400(self):
+        response = self.client.get('/api/webrtc/calls/', {'before': 'rotto'})
+        self.assertEqual(response.status_code, 400)
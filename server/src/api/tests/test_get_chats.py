@@ -0,0 +1,41 @@
+"""
+Numero di query di get_chats indipendente dal numero di chat
+"""
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from api.models import Chat, ChatMessage
+
+# membership + chat + ultimo messaggio annotato, ultimi messaggi in blocco,
+# partecipanti con profilo in prefetch
+GET_CHATS_QUERIES = 3
+
+
+@override_settings(ALLOWED_HOSTS=['*'])
+class GetChatsQueryCountTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='chat_owner')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _create_chats(self, count):
+        for index in range(count):
+            other = User.objects.create_user(username=f'chat_peer_{index}', first_name=f'Peer {index}')
+            chat = Chat.objects.create(name=f'Chat {index}', created_by=self.user)
+            chat.participants.add(self.user, other)
+            ChatMessage.objects.create(chat=chat, sender=other, content=f'Ciao {index}')
+            ChatMessage.objects.create(chat=chat, sender=self.user, content=f'Risposta {index}')
+
+    def _assert_get_chats_queries(self, chat_count):
+        self._create_chats(chat_count)
+        with self.assertNumQueries(GET_CHATS_QUERIES):
+            response = self.client.get('/api/chats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), chat_count)
+
+    def test_single_chat(self):
+        self._assert_get_chats_queries(1)
+
+    def test_fifty_chats(self):
+        self._assert_get_chats_queries(50)
@@ -0,0 +1,78 @@
+"""
+Store degli upload deduplicato per contenuto (api.media_store)
+"""
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from api import media_store
+from api.models import MediaBlob
+import os
+import shutil
+import tempfile
+
+
+class MediaStoreTest(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def _upload(self, content, name='photo.jpg', category='images'):
+        return media_store.store_upload(SimpleUploadedFile(name, content), category)
+
+    def _files(self, category='images'):
+        return sorted(os.listdir(default_storage.path(category)))
+
+    def test_same_content_is_stored_once_and_counted(self):
+        first = self._upload(b'same bytes')
+        second = self._upload(b'same bytes', name='copy.JPG')
+
+        self.assertFalse(first.deduplicated)
+        self.assertTrue(second.deduplicated)
+        self.assertEqual(second.path, first.path)
+        self.assertEqual(MediaBlob.objects.get(storage_path=first.path).ref_count, 2)
+        # Nessun file temporaneo rimasto accanto a quello definitivo
+        self.assertEqual(self._files(), [os.path.basename(first.path)])
+
+    def test_different_extension_or_category_gets_its_own_file(self):
+        image = self._upload(b'same bytes')
+        renamed = self._upload(b'same bytes', name='photo.png')
+        uploaded = self._upload(b'same bytes', category='uploads')
+
+        self.assertEqual(len({image.path, renamed.path, uploaded.path}), 3)
+        self.assertEqual(MediaBlob.objects.filter(sha256=image.sha256).count(), 3)
+
+    def test_last_release_deletes_the_file_on_commit(self):
+        blob = self._upload(b'shared')
+        self._upload(b'shared')
+        file_path = default_storage.path(blob.path)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.assertFalse(media_store.release(blob.path))
+        self.assertEqual(callbacks, [])
+        self.assertEqual(MediaBlob.objects.get(storage_path=blob.path).ref_count, 1)
+        self.assertTrue(os.path.exists(file_path))
+
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.assertTrue(media_store.release(blob.path))
+        # Ancora dentro la transazione: il file sparisce solo al commit
+        self.assertFalse(MediaBlob.objects.filter(storage_path=blob.path).exists())
+        self.assertTrue(os.path.exists(file_path))
+
+        for callback in callbacks:
+            callback()
+        self.assertFalse(os.path.exists(file_path))
+
+    def test_upload_after_release_writes_a_fresh_file(self):
+        blob = self._upload(b'again')
+        with self.captureOnCommitCallbacks(execute=True):
+            media_store.release(blob.path)
+
+        again = self._upload(b'again')
+
+        self.assertFalse(again.deduplicated)
+        self.assertTrue(os.path.exists(default_storage.path(again.path)))
+        self.assertEqual(MediaBlob.objects.get(storage_path=again.path).ref_count, 1)
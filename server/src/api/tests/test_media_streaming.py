@@ -0,0 +1,86 @@
+"""
+Range HTTP nel motore di download (api.media_streaming)
+"""
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from api import media_streaming
+from api.media_streaming import MAX_RANGES, parse_range_header
+import shutil
+import tempfile
+
+
+class ParseRangeHeaderTest(SimpleTestCase):
+
+    def test_single_and_open_ended_ranges(self):
+        self.assertEqual(parse_range_header('bytes=0-99', 1000), [(0, 99)])
+        self.assertEqual(parse_range_header('bytes=900-', 1000), [(900, 999)])
+        # Fine oltre la dimensione: troncata all'ultimo byte
+        self.assertEqual(parse_range_header('bytes=990-5000', 1000), [(990, 999)])
+
+    def test_suffix_ranges(self):
+        self.assertEqual(parse_range_header('bytes=-100', 1000), [(900, 999)])
+        self.assertEqual(parse_range_header('bytes=-5000', 1000), [(0, 999)])
+        # Suffisso nullo: non soddisfacibile
+        self.assertEqual(parse_range_header('bytes=-0', 1000), [])
+
+    def test_overlapping_and_adjacent_ranges_are_merged_and_sorted(self):
+        self.assertEqual(parse_range_header('bytes=500-599,0-99,50-149', 1000), [(0, 149), (500, 599)])
+        self.assertEqual(parse_range_header('bytes=0-99,100-199', 1000), [(0, 199)])
+        self.assertEqual(parse_range_header('bytes=0-99,-100,950-', 1000), [(0, 99), (900, 999)])
+
+    def test_unsatisfiable_ranges_are_dropped(self):
+        self.assertEqual(parse_range_header('bytes=1000-', 1000), [])
+        self.assertEqual(parse_range_header('bytes=2000-2100,0-9', 1000), [(0, 9)])
+
+    def test_malformed_headers_are_ignored(self):
+        for header in ('items=0-99', 'bytes=', 'bytes=abc', 'bytes=-', 'bytes=200-100', 'bytes=0-99,x'):
+            with self.subTest(header=header):
+                self.assertIsNone(parse_range_header(header, 1000))
+
+    def test_too_many_ranges_after_merging_fall_back_to_the_whole_file(self):
+        disjoint = ','.join(f'{i * 10}-{i * 10 + 1}' for i in range(MAX_RANGES + 1))
+        self.assertIsNone(parse_range_header(f'bytes={disjoint}', 1000))
+
+        self.assertEqual(len(parse_range_header(f'bytes={disjoint.rsplit(",", 1)[0]}', 1000)), MAX_RANGES)
+        # Unendosi, anche molti intervalli contigui restano uno solo
+        contiguous = ','.join(f'{i}-{i}' for i in range(MAX_RANGES * 2))
+        self.assertEqual(parse_range_header(f'bytes={contiguous}', 1000), [(0, MAX_RANGES * 2 - 1)])
+
+
+class ServeMediaRangeTest(SimpleTestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root, MEDIA_ACCEL_REDIRECT_PREFIX=None)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.content = bytes(range(256)) * 4
+        self.name = default_storage.save('files/sample.bin', ContentFile(self.content))
+
+    def _get(self, range_header):
+        request = RequestFactory().get('/media', HTTP_RANGE=range_header)
+        return media_streaming.serve_media(request, self.name, 'application/octet-stream')
+
+    def test_single_range_streams_only_the_requested_bytes(self):
+        response = self._get('bytes=-10')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 1014-1023/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-10:])
+
+    def test_unsatisfiable_range_is_416(self):
+        response = self._get(f'bytes={len(self.content)}-')
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_too_many_ranges_return_the_whole_file(self):
+        header = 'bytes=' + ','.join(f'{i * 10}-{i * 10 + 1}' for i in range(MAX_RANGES + 1))
+
+        response = self._get(header)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        response.close()
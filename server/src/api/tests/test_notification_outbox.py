@@ -0,0 +1,136 @@
+"""
+Outbox delle notifiche (api.notification_outbox): reclamo con lease, retry con backoff
+e batch rifiutati da SecureVOX Notify
+"""
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+from unittest import mock
+from api import notification_outbox
+from api.models import NotificationOutbox
+
+OUTBOX_CONFIG = {
+    'MAX_ATTEMPTS': 3,
+    'BACKOFF_BASE': 2,
+    'BACKOFF_MAX': 5,
+    'LEASE_SECONDS': 60,
+}
+
+
+class NotificationOutboxTest(TestCase):
+
+    def setUp(self):
+        config_patch = mock.patch.dict(notification_outbox.OUTBOX_CONFIG, OUTBOX_CONFIG)
+        config_patch.start()
+        self.addCleanup(config_patch.stop)
+        self.recipient = User.objects.create_user(username='outbox_recipient')
+
+    def _row(self, **fields):
+        payload = fields.pop('payload', {'recipient_id': str(self.recipient.id), 'title': 'Ciao', 'body': '...'})
+        return NotificationOutbox.objects.create(recipient=self.recipient, payload=payload, **fields)
+
+    def _response(self, status_code, results=None):
+        response = mock.Mock(status_code=status_code, text='')
+        response.json.return_value = {'status': 'success', 'results': results or []}
+        return response
+
+    def _post(self, *responses):
+        session = mock.Mock()
+        session.post.side_effect = list(responses)
+        return mock.patch.object(notification_outbox, '_get_session', return_value=session)
+
+    def test_claim_takes_a_lease_and_skips_claimed_rows(self):
+        row = self._row()
+
+        claimed = notification_outbox._claim_batch(10)
+
+        self.assertEqual([r.id for r in claimed], [row.id])
+        row.refresh_from_db()
+        self.assertEqual(row.status, NotificationOutbox.STATUS_SENDING)
+        self.assertEqual(row.attempts, 1)
+        self.assertIsNotNone(row.claim_token)
+        self.assertGreater(row.next_attempt_at, timezone.now() + timedelta(seconds=OUTBOX_CONFIG['LEASE_SECONDS'] - 5))
+        # Lease ancora valido: un secondo worker non la vede
+        self.assertEqual(notification_outbox._claim_batch(10), [])
+
+    def test_expired_lease_is_reclaimed_with_a_new_token(self):
+        row = self._row()
+        first_token = notification_outbox._claim_batch(10)[0].claim_token
+        # Worker morto: il lease scade senza esito
+        NotificationOutbox.objects.filter(id=row.id).update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+
+        claimed = notification_outbox._claim_batch(10)
+
+        self.assertEqual([r.id for r in claimed], [row.id])
+        self.assertNotEqual(claimed[0].claim_token, first_token)
+        self.assertEqual(claimed[0].attempts, 2)
+
+    def test_claim_skips_rows_in_backoff_and_finished_rows(self):
+        self._row(next_attempt_at=timezone.now() + timedelta(minutes=1))
+        self._row(status=NotificationOutbox.STATUS_SENT)
+        self._row(status=NotificationOutbox.STATUS_FAILED)
+
+        self.assertEqual(notification_outbox._claim_batch(10), [])
+
+    def test_backoff_grows_exponentially_up_to_the_cap(self):
+        with mock.patch.object(notification_outbox.random, 'uniform', side_effect=lambda low, high: high):
+            delays = [notification_outbox._backoff_delay(attempts) for attempts in range(1, 5)]
+        self.assertEqual(delays, [2, 4, 5, 5])
+
+        with mock.patch.object(notification_outbox.random, 'uniform', side_effect=lambda low, high: low):
+            self.assertEqual(notification_outbox._backoff_delay(2), 2)
+
+    def test_retry_returns_rows_to_pending_in_backoff(self):
+        self._row()
+        rows = notification_outbox._claim_batch(10)
+
+        before = timezone.now()
+        notification_outbox._schedule_retry(rows, 'HTTP 503')
+
+        row = NotificationOutbox.objects.get(id=rows[0].id)
+        self.assertEqual(row.status, NotificationOutbox.STATUS_PENDING)
+        self.assertIsNone(row.claim_token)
+        self.assertEqual(row.last_error, 'HTTP 503')
+        # Primo tentativo: ritardo tra BACKOFF_BASE/2 e BACKOFF_BASE
+        self.assertGreaterEqual(row.next_attempt_at, before + timedelta(seconds=1))
+        self.assertLessEqual(row.next_attempt_at, timezone.now() + timedelta(seconds=2))
+
+    def test_retry_after_max_attempts_marks_the_row_failed(self):
+        row = self._row(attempts=OUTBOX_CONFIG['MAX_ATTEMPTS'] - 1)
+        rows = notification_outbox._claim_batch(10)
+
+        notification_outbox._schedule_retry(rows, 'HTTP 503')
+
+        row.refresh_from_db()
+        self.assertEqual(row.attempts, OUTBOX_CONFIG['MAX_ATTEMPTS'])
+        self.assertEqual(row.status, NotificationOutbox.STATUS_FAILED)
+        self.assertEqual(row.last_error, 'HTTP 503')
+
+    def test_server_error_schedules_the_whole_batch_for_retry(self):
+        rows = [self._row(), self._row()]
+
+        with self._post(self._response(503)):
+            self.assertEqual(notification_outbox.dispatch_pending(), 2)
+
+        statuses = set(NotificationOutbox.objects.filter(id__in=[r.id for r in rows]).values_list('status', flat=True))
+        self.assertEqual(statuses, {NotificationOutbox.STATUS_PENDING})
+
+    def test_rejected_batch_is_resent_row_by_row(self):
+        good = self._row()
+        bad = self._row(payload={'recipient_id': str(self.recipient.id)})
+
+        with self._post(
+            self._response(422),
+            self._response(200, [{'status': 'success'}]),
+            self._response(422),
+        ) as get_session:
+            notification_outbox.dispatch_pending()
+
+        posted = [c.kwargs['json']['notifications'] for c in get_session.return_value.post.call_args_list]
+        self.assertEqual(posted, [[good.payload, bad.payload], [good.payload], [bad.payload]])
+        good.refresh_from_db()
+        bad.refresh_from_db()
+        self.assertEqual(good.status, NotificationOutbox.STATUS_SENT)
+        self.assertEqual(bad.status, NotificationOutbox.STATUS_FAILED)
+        self.assertIn('422', bad.last_error)
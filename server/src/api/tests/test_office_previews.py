@@ -0,0 +1,64 @@
+"""
+Pubblicazione delle preview PDF a tutte le chat in attesa dello stesso contenuto
+"""
+from django.contrib.auth.models import User
+from django.test import TestCase
+from api import office_previews
+from api.models import Chat, ChatMessage, MediaBlob, MediaObject, NotificationOutbox
+
+SHA256 = 'a' * 64
+
+
+class PublishPreviewTest(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username='preview_alice')
+        self.bob = User.objects.create_user(username='preview_bob')
+        self.carol = User.objects.create_user(username='preview_carol')
+
+    def _chat_with_document(self, name, members, storage_path, status=office_previews.STATUS_PENDING):
+        chat = Chat.objects.create(name=name, created_by=members[0])
+        chat.participants.add(*members)
+        message = ChatMessage.objects.create(
+            chat=chat, sender=members[0], message_type='file', content='',
+            metadata={'fileName': 'report.docx', 'pdfPreviewId': SHA256, 'pdfPreviewStatus': status},
+        )
+        MediaObject.objects.create(
+            storage_path=storage_path, kind=MediaObject.KIND_FILE, owner=members[0], chat=chat, message=message,
+        )
+        return chat, message
+
+    def test_every_waiting_chat_is_updated_and_notified(self):
+        # Stesso contenuto: nella seconda chat con un'altra estensione, quindi un altro blob
+        MediaBlob.objects.create(sha256=SHA256, storage_path='uploads/first.docx', size=10)
+        MediaBlob.objects.create(sha256=SHA256, storage_path='uploads/second.doc', size=10)
+        first_chat, first = self._chat_with_document('first', [self.alice, self.bob], 'uploads/first.docx')
+        second_chat, second = self._chat_with_document('second', [self.carol, self.bob], 'uploads/second.doc')
+        done_chat, done = self._chat_with_document(
+            'done', [self.alice, self.carol], 'uploads/first.docx', status=office_previews.STATUS_READY,
+        )
+
+        office_previews._publish(
+            'uploads/first.docx', SHA256, 'report.docx', first_chat.id,
+            office_previews.STATUS_READY, office_previews.preview_path(SHA256), 'http://testserver',
+        )
+
+        for message in (first, second):
+            message.refresh_from_db()
+            self.assertEqual(message.metadata['pdfPreviewStatus'], office_previews.STATUS_READY)
+            self.assertEqual(
+                message.metadata['pdfPreviewUrl'],
+                f"http://testserver/api/media/download/previews/{SHA256}.pdf",
+            )
+
+        notified = {
+            (row.payload['data']['chat_id'], row.recipient_id, row.payload['data']['fileId'])
+            for row in NotificationOutbox.objects.all()
+        }
+        self.assertEqual(notified, {
+            (str(first_chat.id), self.alice.id, 'uploads/first.docx'),
+            (str(first_chat.id), self.bob.id, 'uploads/first.docx'),
+            (str(second_chat.id), self.carol.id, 'uploads/second.doc'),
+            (str(second_chat.id), self.bob.id, 'uploads/second.doc'),
+        })
+        self.assertNotIn(str(done_chat.id), {chat_id for chat_id, _, _ in notified})
@@ -0,0 +1,76 @@
+"""
+Journal degli eventi real-time per utente (api.realtime): sequenze e ripresa
+"""
+from django.contrib.auth.models import User
+from django.test import TestCase
+from unittest import mock
+from api import realtime
+from api.models import UserEvent
+
+
+class RealtimeJournalTest(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username='events_alice')
+        self.bob = User.objects.create_user(username='events_bob')
+
+    def _publish(self, recipients, event_type=realtime.EVENT_NEW_MESSAGE, payload=None):
+        with mock.patch.object(realtime, '_group_send'):
+            return realtime.publish([user.id for user in recipients], event_type, payload or {})
+
+    def _seqs(self, user):
+        return list(UserEvent.objects.filter(user=user).order_by('seq').values_list('seq', flat=True))
+
+    def test_sequences_are_consecutive_per_user(self):
+        self._publish([self.alice, self.bob])
+        self._publish([self.alice])
+        events = self._publish([self.bob, self.alice, self.bob])
+
+        self.assertEqual(self._seqs(self.alice), [1, 2, 3])
+        self.assertEqual(self._seqs(self.bob), [1, 2])
+        # Destinatari duplicati: un solo evento per utente
+        self.assertEqual(sorted((e.user_id, e.seq) for e in events), [(self.alice.id, 3), (self.bob.id, 2)])
+
+    def test_events_are_sent_to_each_user_group_on_commit(self):
+        with mock.patch.object(realtime, '_group_send') as group_send:
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                realtime.publish([self.alice.id, self.bob.id], realtime.EVENT_CHAT_DELETED, {'chat_id': 'x'})
+            group_send.assert_not_called()
+
+            for callback in callbacks:
+                callback()
+
+        messages = group_send.call_args.args[0]
+        self.assertEqual(
+            sorted((group, message['event']['seq']) for group, message in messages),
+            sorted([(realtime.user_group(self.alice.id), 1), (realtime.user_group(self.bob.id), 1)]),
+        )
+        self.assertEqual(messages[0][1]['event']['data'], {'chat_id': 'x'})
+
+    def test_replay_resumes_after_the_last_received_sequence(self):
+        for index in range(4):
+            self._publish([self.alice], payload={'index': index})
+
+        events, last_seq = realtime.replay(self.alice.id, 2)
+
+        self.assertEqual(last_seq, 4)
+        self.assertEqual([(e['seq'], e['data']['index']) for e in events], [(3, 2), (4, 3)])
+        self.assertEqual(realtime.replay(self.alice.id, 4), ([], 4))
+        # Utente senza eventi: niente da rimandare
+        self.assertEqual(realtime.replay(self.bob.id, 0), ([], 0))
+
+    def test_replay_requires_resync_when_events_are_missing(self):
+        for _ in range(3):
+            self._publish([self.alice])
+
+        # Sequenza mai emessa da questo journal
+        self.assertEqual(realtime.replay(self.alice.id, 7), (None, 3))
+
+        with mock.patch.dict(realtime.REALTIME_CONFIG, {'REPLAY_LIMIT': 2}):
+            self.assertEqual(realtime.replay(self.alice.id, 0), (None, 3))
+            self.assertEqual(len(realtime.replay(self.alice.id, 1)[0]), 2)
+
+        # Evento più vecchio già eliminato dalla retention
+        UserEvent.objects.filter(user=self.alice, seq=1).delete()
+        self.assertEqual(realtime.replay(self.alice.id, 0), (None, 3))
+        self.assertEqual([e['seq'] for e in realtime.replay(self.alice.id, 1)[0]], [2, 3])
@@ -0,0 +1,145 @@
+"""
+Pool di stanze SFU (api.sfu_rooms) contro il finto Janus di fake_janus_server.py
+
+TransactionTestCase: il reaper legge Call/WebRTCCall da un thread dell'executor,
+che non vedrebbe i dati di una transazione di test non confermata.
+"""
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.test import TransactionTestCase, override_settings
+from unittest import mock
+from api import sfu_rooms
+from api.models import Call
+from fake_janus_server import FakeJanusServer
+import time
+
+POOL_CONFIG = {
+    'POOL_SIZE': 2,
+    'MAX_FREE_ROOMS': 3,
+    'REAP_INTERVAL': 0.2,
+    'RETRY_INTERVAL': 0.1,
+    'REQUEST_TIMEOUT': 2,
+    'CACHE_ALIAS': 'default',
+}
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'sfu-rooms-tests'}}
+
+
+class SFURoomManagerTest(TransactionTestCase):
+
+    def setUp(self):
+        self.janus = self._start_janus()
+        settings_override = override_settings(
+            CACHES=TEST_CACHES,
+            JANUS_SFU={'url': self.janus.url, 'api_secret': 'test-secret', 'admin_secret': ''},
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        config_patch = mock.patch.dict(sfu_rooms.SFU_ROOM_CONFIG, POOL_CONFIG)
+        config_patch.start()
+        self.addCleanup(config_patch.stop)
+        caches['default'].clear()
+        self.manager = sfu_rooms.SFURoomManager()
+        self.addCleanup(self.janus.stop)
+        self.addCleanup(self.manager.stop)
+
+    def _start_janus(self):
+        return FakeJanusServer(secret='test-secret').start()
+
+    def _wait_for(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("Condizione non raggiunta entro il timeout")
+            time.sleep(0.02)
+
+    def _start_filled(self):
+        self.manager.start()
+        self._wait_for(lambda: self.manager.stats()['free'] == POOL_CONFIG['POOL_SIZE'])
+
+    def _requests(self, kind):
+        with self.janus.lock:
+            return [request for request in self.janus.requests if request['request'] == kind]
+
+    def test_lease_takes_a_free_room_and_the_pool_refills(self):
+        self._start_filled()
+        self.janus.delay = 0.2  # una richiesta a Janus durante lease() si vedrebbe nei tempi
+        requests_before = len(self.janus.requests)
+
+        started = time.perf_counter()
+        room_id = self.manager.lease('session-1')
+        elapsed = time.perf_counter() - started
+
+        self.assertLess(elapsed, 0.1)
+        self.assertEqual(len(self.janus.requests), requests_before)
+        self.assertIn(room_id, self.janus.rooms)
+        self.assertEqual(self.manager.lease('session-1'), room_id)
+        self._wait_for(lambda: self.manager.stats()['free'] == POOL_CONFIG['POOL_SIZE'])
+        self.assertEqual(len(self.janus.rooms), POOL_CONFIG['POOL_SIZE'] + 1)
+
+    def test_release_kicks_participants_and_returns_the_room(self):
+        self._start_filled()
+        room_id = self.manager.lease('session-1')
+        self._wait_for(lambda: self.manager.stats()['free'] == POOL_CONFIG['POOL_SIZE'])
+        self.janus.add_participant(room_id, 101)
+
+        self.assertTrue(self.manager.release('session-1'))
+        self.assertFalse(self.manager.release('session-1'))
+
+        self._wait_for(lambda: room_id in self.manager._free)
+        self.assertEqual(self.janus.rooms[room_id]['participants'], {})
+        self.assertEqual([(r['room'], r['id']) for r in self._requests('kick')], [(room_id, 101)])
+
+    def test_reaper_recovers_the_lease_of_an_ended_call(self):
+        caller = User.objects.create_user(username='sfu_caller')
+        callee = User.objects.create_user(username='sfu_callee')
+        call = Call.objects.create(session_id='session-ended', caller=caller, callee=callee, status='answered')
+        self._start_filled()
+        room_id = self.manager.lease('session-ended')
+        time.sleep(POOL_CONFIG['REAP_INTERVAL'] * 2)
+        self.assertEqual(self.manager.stats()['leased'], 1)
+
+        # Chiusa senza end_call: il reaper deve accorgersene da solo
+        Call.objects.filter(id=call.id).update(status='completed')
+
+        self._wait_for(lambda: self.manager.stats()['leased'] == 0)
+        self._wait_for(lambda: room_id in self.manager._free)
+
+    def test_reaper_leaves_rooms_of_live_instances_alone(self):
+        live_room = f"{sfu_rooms.ROOM_PREFIX}-liveinstance-1"
+        dead_room = f"{sfu_rooms.ROOM_PREFIX}-deadinstance-1"
+        legacy_room = 'session-without-call'
+        for room_id in (live_room, dead_room, legacy_room):
+            self.janus.handle({'request': 'create', 'room': room_id, 'secret': 'test-secret'})
+        caches['default'].set(sfu_rooms.INSTANCE_KEY.format('liveinstance'), True, 60)
+
+        self._start_filled()
+
+        self._wait_for(lambda: dead_room not in self.janus.rooms and legacy_room not in self.janus.rooms)
+        time.sleep(POOL_CONFIG['REAP_INTERVAL'] * 2)
+        self.assertIn(live_room, self.janus.rooms)
+
+    def test_pool_is_refilled_after_janus_restart(self):
+        self._start_filled()
+        with self.janus.lock:
+            self.janus.rooms.clear()
+
+        self._wait_for(lambda: len(self.janus.rooms) == POOL_CONFIG['POOL_SIZE'])
+        self._wait_for(lambda: set(self.manager._free) <= set(self.janus.rooms)
+                       and self.manager.stats()['free'] == POOL_CONFIG['POOL_SIZE'])
+
+    def test_instance_is_registered_before_the_first_room(self):
+        registered_at_first_create = []
+        instance_key = sfu_rooms.INSTANCE_KEY.format(self.manager.instance_token)
+        handle = self.janus.handle
+
+        def recording_handle(payload):
+            if payload.get('request') == 'create' and not registered_at_first_create:
+                registered_at_first_create.append(caches['default'].get(instance_key))
+            return handle(payload)
+
+        self.janus.handle = recording_handle
+        self._start_filled()
+
+        self.assertEqual(registered_at_first_create, [True])
+        self.manager.stop()
+        self.assertIsNone(caches['default'].get(instance_key))
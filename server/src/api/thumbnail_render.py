@@ -0,0 +1,111 @@
+"""
+Rendering delle miniature, eseguito nei processi del pool di api.thumbnails
+
+Il modulo non importa Django: i processi del pool partono con 'spawn' e
+caricano solo Pillow e questo file.
+- immagini (JPEG/PNG/TIFF/GIF/WebP/BMP): Pillow, con draft() per i JPEG
+  (decodifica già ridotta) e orientamento EXIF applicato
+- video (MP4/MKV/MOV/WebM): fotogramma poster estratto con ffmpeg
+- PDF: prima pagina renderizzata con pdftoppm (poppler)
+
+Ogni miniatura è scritta in un file temporaneo e spostata con os.replace(),
+quindi la cache non contiene mai file parziali.
+"""
+from PIL import Image, ImageOps
+import os
+import shutil
+import subprocess
+import tempfile
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.gif', '.webp', '.bmp')
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.mov', '.webm', '.m4v')
+PDF_EXTENSIONS = ('.pdf',)
+
+EXTERNAL_TIMEOUT = 30
+
+
+def source_kind(path):
+    """'image', 'video', 'pdf' oppure None se il formato non ha miniatura"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in IMAGE_EXTENSIONS:
+        return 'image'
+    if extension in VIDEO_EXTENSIONS:
+        return 'video'
+    if extension in PDF_EXTENSIONS:
+        return 'pdf'
+    return None
+
+
+def render_thumbnail(source_path, output_path, size, image_format, quality):
+    """
+    Genera la miniatura di source_path inscritta in un quadrato size×size.
+
+    Returns:
+        output_path
+    """
+    kind = source_kind(source_path)
+    if kind == 'image':
+        with Image.open(source_path) as image:
+            if image.format == 'JPEG':
+                # Il decoder JPEG scala già in fase di decodifica (1/2, 1/4, 1/8)
+                image.draft('RGB', (size, size))
+            return _write(image, output_path, size, image_format, quality)
+
+    with tempfile.TemporaryDirectory(prefix='securevox_thumb_') as temp_dir:
+        frame = _video_frame(source_path, temp_dir, size) if kind == 'video' else _pdf_page(source_path, temp_dir, size)
+        with Image.open(frame) as image:
+            return _write(image, output_path, size, image_format, quality)
+
+
+def _write(image, output_path, size, image_format, quality):
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((size, size), Image.Resampling.LANCZOS)
+
+    if image_format == 'jpeg' or image.mode not in ('RGB', 'RGBA'):
+        # JPEG non ha canale alfa; le immagini a palette vanno convertite comunque
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        image = image.convert('RGBA' if has_alpha and image_format == 'webp' else 'RGB')
+
+    directory = os.path.dirname(output_path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.thumb-', suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            if image_format == 'webp':
+                image.save(out, 'WEBP', quality=quality, method=4)
+            else:
+                image.save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return output_path
+
+
+def _video_frame(source_path, temp_dir, size):
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        raise RuntimeError("ffmpeg non disponibile")
+    frame = os.path.join(temp_dir, 'frame.png')
+    scale = f"scale={size}:{size}:force_original_aspect_ratio=decrease"
+    # Primo tentativo a 1s (evita i fotogrammi neri iniziali), poi dall'inizio per i video brevi
+    for offset in ('1', '0'):
+        subprocess.run(
+            [ffmpeg, '-v', 'error', '-y', '-ss', offset, '-i', source_path, '-frames:v', '1', '-vf', scale, frame],
+            capture_output=True, timeout=EXTERNAL_TIMEOUT,
+        )
+        if os.path.exists(frame) and os.path.getsize(frame) > 0:
+            return frame
+    raise RuntimeError(f"Nessun fotogramma estratto da {source_path}")
+
+
+def _pdf_page(source_path, temp_dir, size):
+    pdftoppm = shutil.which('pdftoppm')
+    if not pdftoppm:
+        raise RuntimeError("pdftoppm non disponibile")
+    prefix = os.path.join(temp_dir, 'page')
+    subprocess.run(
+        [pdftoppm, '-f', '1', '-l', '1', '-singlefile', '-scale-to', str(size), '-png', source_path, prefix],
+        check=True, capture_output=True, timeout=EXTERNAL_TIMEOUT,
+    )
+    return f"{prefix}.png"
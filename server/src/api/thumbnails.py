@@ -0,0 +1,222 @@
+"""
+Miniature dei media in chiaro (immagini, poster dei video, prima pagina dei PDF)
+
+- dimensioni fisse (THUMBNAILS['SIZES'], es. 96/320/720 px) in WebP o JPEG
+- generate in un ProcessPoolExecutor (thumbnail_render) fuori dai thread delle
+  richieste: all'upload senza attendere, oppure alla prima richiesta
+- cache su disco sotto MEDIA_ROOT/thumbnails per hash della sorgente e
+  dimensione: thumbnails/<hash[:2]>/<hash>_<size>.<formato>
+- LRU per data di ultimo accesso: oltre MAX_CACHE_BYTES si eliminano le
+  miniature usate meno di recente fino al 90% della quota
+
+L'hash della sorgente è lo SHA-256 del contenuto per i file salvati con nome
+<sha256>.<ext>; per gli altri (nomi casuali dello store deduplicato) è
+derivato da percorso, dimensione e data di modifica.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+from django.core.files.storage import default_storage
+from .thumbnail_render import render_thumbnail, source_kind
+import hashlib
+import logging
+import multiprocessing
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger('securevox')
+
+CACHE_PREFIX = 'thumbnails'
+FORMATS = ('webp', 'jpeg')
+
+_DEFAULTS = {
+    'SIZES': (96, 320, 720),
+    'WORKERS': 2,
+    'TIMEOUT': 15,
+    'QUALITY': 80,
+    'MAX_CACHE_BYTES': 512 * 1024 * 1024,
+}
+THUMBNAIL_CONFIG = {**_DEFAULTS, **getattr(settings, 'THUMBNAILS', {})}
+
+_CONTENT_HASH = re.compile(r'^[0-9a-f]{64}$')
+
+_executor = None
+_executor_lock = threading.Lock()
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+_cache_bytes = None
+_cache_lock = threading.Lock()
+
+
+def supports(name):
+    return source_kind(name) is not None
+
+
+def pick_size(requested):
+    """Dimensione standard più piccola che copre quella richiesta"""
+    sizes = sorted(THUMBNAIL_CONFIG['SIZES'])
+    try:
+        requested = int(requested)
+    except (TypeError, ValueError):
+        return sizes[len(sizes) // 2]
+    return next((size for size in sizes if size >= requested), sizes[-1])
+
+
+def thumbnail_name(source_name, size, image_format):
+    """Percorso nello storage della miniatura (relativo a MEDIA_ROOT)"""
+    key = _source_hash(source_name)
+    return f"{CACHE_PREFIX}/{key[:2]}/{key}_{size}.{'jpg' if image_format == 'jpeg' else 'webp'}"
+
+
+def get_thumbnail(source_name, size, image_format='webp'):
+    """
+    Restituisce il nome nello storage della miniatura, generandola se manca.
+
+    Returns:
+        nome della miniatura oppure None se non è stato possibile generarla
+    """
+    name = thumbnail_name(source_name, size, image_format)
+    path = default_storage.path(name)
+    if os.path.exists(path):
+        _touch(path)
+        return name
+
+    future = _submit(source_name, path, size, image_format)
+    try:
+        future.result(timeout=THUMBNAIL_CONFIG['TIMEOUT'])
+    except Exception as e:
+        logger.warning(f"⚠️ Miniatura {size}px non generata per {source_name}: {e}")
+        return None
+    return name
+
+
+def schedule(source_name, image_format='webp'):
+    """Accoda la generazione di tutte le dimensioni senza attendere (chiamata all'upload)"""
+    if not supports(source_name):
+        return
+    try:
+        for size in THUMBNAIL_CONFIG['SIZES']:
+            path = default_storage.path(thumbnail_name(source_name, size, image_format))
+            if not os.path.exists(path):
+                _submit(source_name, path, size, image_format)
+    except Exception as e:
+        # Le miniature mancanti verranno generate alla prima richiesta
+        logger.warning(f"⚠️ Impossibile accodare le miniature di {source_name}: {e}")
+
+
+def _source_hash(source_name):
+    stem = os.path.splitext(os.path.basename(source_name))[0]
+    if _CONTENT_HASH.match(stem):
+        return stem
+    stat = os.stat(default_storage.path(source_name))
+    return hashlib.sha256(f"{source_name}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+
+
+def _submit(source_name, output_path, size, image_format):
+    """Una sola generazione per miniatura, anche con richieste concorrenti"""
+    with _in_flight_lock:
+        future = _in_flight.get(output_path)
+        if future is not None:
+            return future
+        args = (default_storage.path(source_name), output_path, size, image_format, THUMBNAIL_CONFIG['QUALITY'])
+        try:
+            future = _get_executor().submit(render_thumbnail, *args)
+        except BrokenProcessPool:
+            # Un processo del pool è morto (es. OOM): si riparte con un pool nuovo
+            _reset_executor()
+            future = _get_executor().submit(render_thumbnail, *args)
+        _in_flight[output_path] = future
+    future.add_done_callback(lambda done: _on_rendered(output_path, done))
+    return future
+
+
+def _on_rendered(output_path, future):
+    with _in_flight_lock:
+        _in_flight.pop(output_path, None)
+    if future.cancelled() or future.exception() is not None:
+        if isinstance(future.exception(), BrokenProcessPool):
+            _reset_executor()
+        return
+    try:
+        _account(os.path.getsize(output_path))
+    except OSError:
+        pass
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # 'spawn': i processi figli non ereditano thread e lock del server
+            _executor = ProcessPoolExecutor(
+                max_workers=THUMBNAIL_CONFIG['WORKERS'],
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        broken, _executor = _executor, None
+    if broken is not None:
+        broken.shutdown(wait=False, cancel_futures=True)
+
+
+def _touch(path):
+    """Aggiorna solo l'ultimo accesso: la data di modifica (e l'ETag) resta invariata"""
+    try:
+        stat = os.stat(path)
+        os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+    except OSError:
+        pass
+
+
+def _account(added_bytes):
+    global _cache_bytes
+    with _cache_lock:
+        if _cache_bytes is None:
+            _cache_bytes = _scan()[1]
+        else:
+            _cache_bytes += added_bytes
+        if _cache_bytes > THUMBNAIL_CONFIG['MAX_CACHE_BYTES']:
+            _cache_bytes = _evict()
+
+
+def _scan():
+    entries, total = [], 0
+    root = default_storage.path(CACHE_PREFIX)
+    for directory, _, files in os.walk(root):
+        for file_name in files:
+            if file_name.startswith('.'):
+                continue
+            path = os.path.join(directory, file_name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_atime_ns, stat.st_size, path))
+            total += stat.st_size
+    return entries, total
+
+
+def _evict():
+    """Elimina le miniature usate meno di recente fino al 90% della quota"""
+    # Riscansione completa: altri processi possono aver scritto o eliminato file
+    entries, total = _scan()
+    target = THUMBNAIL_CONFIG['MAX_CACHE_BYTES'] * 0.9
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    if removed:
+        logger.info(f"🧹 Cache miniature: {removed} file eliminati (LRU), occupazione {total // 1024} KB")
+    return total
@@ -2,14 +2,14 @@ from django.urls import path, include
 from .views import (
     health, version, get_users, register_device, upload_keybundle, 
     get_keybundle, send_message, remote_wipe, get_ice_servers,
-    create_call, create_group_call, end_call, update_call_status, get_call_timer, get_calls, get_chats, create_chat, delete_chat, get_chat_messages, send_chat_message, send_push_notification, mark_messages_as_read, delete_message_for_user, request_chat_deletion, respond_to_chat_deletion, mark_gestation_notification_seen, get_users_status, update_my_status, get_pending_calls, mark_call_seen
+    create_call, setup_call, create_group_call, end_call, update_call_status, get_call_timer, get_calls, get_chats, create_chat, delete_chat, get_chat_messages, send_chat_message, send_push_notification, mark_messages_as_read, delete_message_for_user, request_chat_deletion, respond_to_chat_deletion, mark_gestation_notification_seen, get_users_status, update_my_status, get_pending_calls, mark_call_seen
 )
 from .encrypted_calls_views import (
     call_encryption_stats, rotate_call_keys, call_security_info, verify_call_encryption
 )
 from .debug_views import debug_call_creation
 from .debug_polling_views import debug_active_calls, force_app_polling_restart
-from .call_cleanup_views import cleanup_user_calls, cleanup_all_calls, cleanup_expired_calls
+from .call_cleanup_views import cleanup_user_calls, cleanup_all_calls, cleanup_expired_calls, sync_call_states
 from .test_calls_views import test_pending_calls_for_user, test_create_call_direct
 from .emergency_views import emergency_stop_polling, emergency_status
 from .force_logout_views import force_logout_all_users, check_active_sessions
@@ -103,6 +103,7 @@ urlpatterns = [
     # WebRTC
     path("webrtc/ice-servers/", get_ice_servers, name="get_ice_servers"),
     path("webrtc/calls/create/", create_call, name="create_call"),
+    path("webrtc/calls/setup/", setup_call, name="setup_call"),
     path("webrtc/calls/group/", create_group_call, name="create_group_call"),
     path("webrtc/calls/end/", end_call, name="end_call"),
     path("webrtc/calls/update-status/", update_call_status, name="update_call_status"),
@@ -113,6 +114,7 @@ urlpatterns = [
     path("webrtc/calls/cleanup-user-calls/", cleanup_user_calls, name="cleanup_user_calls"),
     path("webrtc/calls/cleanup-all-calls/", cleanup_all_calls, name="cleanup_all_calls"),
     path("webrtc/calls/cleanup-expired-calls/", cleanup_expired_calls, name="cleanup_expired_calls"),
+    path("webrtc/calls/sync/", sync_call_states, name="sync_call_states"),
     
     # Endpoint crittografia E2E per chiamate
     path("webrtc/calls/<str:session_id>/encryption/", call_encryption_stats, name="call_encryption_stats"),
@@ -4,8 +4,9 @@ from django.views.decorators.http import require_http_methods
 from django.utils.decorators import method_decorator
 from django.views import View
 from django.utils import timezone
-from datetime import timedelta
-from django.db import models
+from datetime import datetime, timedelta
+from django.db import models, transaction
+from django.db.models import OuterRef, Prefetch, Q, Subquery
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
@@ -14,15 +15,53 @@ from django.contrib.auth.models import User
 from crypto.models import Device, IdentityKey, SignedPreKey, OneTimePreKey, Session
 from notifications.models import NotificationQueue
 from devices.models import RemoteWipeCommand, DeviceAuditLog
-from .models import Chat, ChatMessage, Call
+from .models import Chat, ChatMembership, ChatMessage, Call
 from .webrtc_service import webrtc_service
+from .securevox_call_integration import issue_call_token, CALL_TOKEN_TTL_SECONDS, SECUREVOX_CALL_SERVER_URL
+from .e2e_views import collect_public_keys
+from . import media_objects, notification_outbox, office_previews, realtime
 import json
 import logging
 import base64
+import uuid
 
 logger = logging.getLogger('securevox')
 
 
+def _incoming_call_notification_payload(call_record):
+    """Notifica di chiamata in arrivo per SecureVOX Notify (senza recipient_id)"""
+    return {
+        'sender_id': str(call_record.caller.id),
+        'notification_type': 'call' if call_record.call_type == 'audio' else 'video_call',
+        'title': f'Chiamata da {call_record.caller.first_name or call_record.caller.username}',
+        'body': f'Chiamata {call_record.call_type} in arrivo',
+        'data': {
+            'session_id': call_record.session_id,
+            'caller_id': str(call_record.caller.id),
+            'caller_name': f"{call_record.caller.first_name} {call_record.caller.last_name}".strip() or call_record.caller.username,
+            'call_type': call_record.call_type,
+            'is_encrypted': call_record.is_encrypted,
+            'action': 'incoming_call'
+        },
+        'timestamp': call_record.created_at.isoformat(),
+        'priority': 'high'
+    }
+
+
+def _incoming_call_event(call_record):
+    """Chiamata in arrivo nello stesso formato di get_pending_calls"""
+    caller = call_record.caller
+    return {
+        'session_id': call_record.session_id,
+        'caller_id': str(caller.id),
+        'caller_name': f"{caller.first_name} {caller.last_name}".strip() or caller.username,
+        'caller_email': caller.email,
+        'call_type': call_record.call_type,
+        'created_at': call_record.created_at.isoformat(),
+        'status': call_record.status,
+    }
+
+
 def _send_incoming_call_notification(call_record):
     """
     Invia notifica di chiamata in arrivo al destinatario
@@ -36,20 +75,7 @@ def _send_incoming_call_notification(call_record):
         # Payload notifica per SecureVOX Notify (formato corretto)
         notification_payload = {
             'recipient_id': str(call_record.callee.id),
-            'sender_id': str(call_record.caller.id),
-            'notification_type': 'call' if call_record.call_type == 'audio' else 'video_call',
-            'title': f'Chiamata da {call_record.caller.first_name or call_record.caller.username}',
-            'body': f'Chiamata {call_record.call_type} in arrivo',
-            'data': {
-                'session_id': call_record.session_id,
-                'caller_id': str(call_record.caller.id),
-                'caller_name': f"{call_record.caller.first_name} {call_record.caller.last_name}".strip() or call_record.caller.username,
-                'call_type': call_record.call_type,
-                'is_encrypted': call_record.is_encrypted,
-                'action': 'incoming_call'
-            },
-            'timestamp': call_record.created_at.isoformat(),
-            'priority': 'high'
+            **_incoming_call_notification_payload(call_record),
         }
         
         logger.info(f"📞 Payload notifica: {json.dumps(notification_payload, indent=2)}")
@@ -472,19 +498,10 @@ def remote_wipe(request):
 def get_ice_servers(request):
     """Ottieni server ICE per WebRTC"""
     try:
-        # Prendi il primo dispositivo dell'utente o usa un ID generico
-        from crypto.models import Device
-        device = Device.objects.filter(user=request.user).first()
-        
-        if not device:
-            # Se non ha dispositivi, crea uno temporaneo per i test
-            device_id = f"temp_{request.user.id}"
-        else:
-            device_id = str(device.id)
-        
+        # Primo dispositivo dell'utente (in cache) o un ID temporaneo
         ice_servers = webrtc_service.get_ice_servers(
             user_id=request.user.id,
-            device_id=device_id
+            device_id=webrtc_service.call_device_id(request.user.id)
         )
         
         return Response({
@@ -554,6 +571,9 @@ def create_call(request):
                 )
                 logger.info(f"✅ Call record creato: {call_record.id}")
                 
+                # Evento real-time sul WebSocket del destinatario (stesso formato di get_pending_calls)
+                realtime.publish([callee_user.id], realtime.EVENT_INCOMING_CALL, _incoming_call_event(call_record))
+                
                 # IMPORTANTE: Invia notifica di chiamata in arrivo
                 try:
                     _send_incoming_call_notification(call_record)
@@ -582,6 +602,90 @@ def create_call(request):
         )
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def setup_call(request):
+    """
+    Setup completo di una chiamata 1:1 in un solo round trip
+    
+    Sostituisce la sequenza create_call → ice-servers → call/token → e2e/get-keys:
+    stanza Janus dal pool pre-creato (api.sfu_rooms, nessuna attesa sull'SFU),
+    credenziali TURN (in cache per dispositivo), token del call server, chiavi
+    E2E del destinatario e record Call. La notifica al destinatario viene
+    accodata nella transazione del Call (outbox) e parte al commit, senza
+    attendere SecureVOX Notify.
+    
+    Body: {"callee_id": 2, "call_type": "video"}
+    """
+    try:
+        callee_id = request.data.get('callee_id')
+        call_type = request.data.get('call_type', 'video')
+        
+        if not callee_id:
+            return Response(
+                {"error": "Callee ID required"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if call_type not in dict(Call.CALL_TYPE_CHOICES):
+            return Response(
+                {"error": "Invalid call type"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            callee_user = User.objects.get(id=callee_id)
+        except (User.DoesNotExist, ValueError):
+            return Response(
+                {"error": "Callee user not found"}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        caller = request.user
+        session_id = webrtc_service.new_call_session_id(caller.id, callee_user.id)
+        encrypted, encryption_info = webrtc_service.setup_call_encryption(session_id, caller.id, callee_user.id)
+        room_id = webrtc_service.lease_call_room(session_id)
+        ice_servers = webrtc_service.get_ice_servers(caller.id, webrtc_service.call_device_id(caller.id))
+        call_token = issue_call_token(caller.id, session_id, role='caller')
+        peer_keys = collect_public_keys([callee_user.id])
+        
+        with transaction.atomic():
+            call_record = Call.objects.create(
+                session_id=session_id,
+                caller=caller,
+                callee=callee_user,
+                call_type=call_type,
+                status='ringing',
+                is_encrypted=encrypted,
+            )
+            realtime.publish([callee_user.id], realtime.EVENT_INCOMING_CALL, _incoming_call_event(call_record))
+            notification_outbox.enqueue([callee_user.id], _incoming_call_notification_payload(call_record))
+        
+        logger.info(f"📞 Setup chiamata {session_id}: {caller.username} → {callee_user.username} ({'sfu' if room_id else 'p2p'})")
+        
+        return Response({
+            **webrtc_service.call_session_info(
+                session_id, call_type,
+                ice_servers=ice_servers,
+                room_id=room_id,
+                encryption_info=encryption_info,
+            ),
+            'call_id': str(call_record.id),
+            'call_token': {
+                'token': call_token,
+                'expires_in': CALL_TOKEN_TTL_SECONDS,
+                'server_url': SECUREVOX_CALL_SERVER_URL,
+            },
+            'peer_keys': peer_keys,
+        }, status=status.HTTP_201_CREATED)
+        
+    except Exception as e:
+        logger.error(f"❌ Call setup failed: {e}")
+        return Response(
+            {"error": "Failed to set up call"}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_pending_calls(request):
@@ -603,7 +707,7 @@ def get_pending_calls(request):
             callee=request.user,
             status='ringing',
             created_at__gte=timezone.now() - timedelta(minutes=30)  # Ultime 30 minuti
-        ).order_by('-created_at')
+        ).select_related('caller').order_by('-created_at')
         
         calls_data = []
         for call in pending_calls:
@@ -748,6 +852,13 @@ def end_call(request):
             # Determina l'altro partecipante
             other_user = call_record.callee if call_record.caller.id == request.user.id else call_record.caller
             
+            realtime.publish([other_user.id], realtime.EVENT_CALL_ENDED, {
+                'session_id': call_record.session_id,
+                'ended_by_id': str(request.user.id),
+                'status': call_record.status,
+                'duration': int(call_record.duration.total_seconds()),
+            })
+            
             # Invia notifica di chiamata terminata all'altro partecipante
             try:
                 _send_call_ended_notification(call_record, request.user, other_user)
@@ -886,49 +997,138 @@ def update_my_status(request):
         )
 
 
+CALLS_DEFAULT_LIMIT = 50
+CALLS_MAX_LIMIT = 200
+
+
+def _encode_call_cursor(moment, call_id):
+    """Cursore opaco (istante, id) per la paginazione keyset della cronologia chiamate"""
+    raw = json.dumps([moment.isoformat(), str(call_id)])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_call_cursor(cursor):
+    """
+    Decodifica un cursore; 'since' accetta anche un timestamp ISO 8601.
+    Solleva ValueError se non valido.
+    """
+    try:
+        moment, call_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(moment), uuid.UUID(call_id)
+    except Exception:
+        pass
+    try:
+        moment = datetime.fromisoformat(cursor.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError('Cursore non valido')
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    # Nessun id: include tutte le chiamate con lo stesso istante
+    return moment, uuid.UUID(int=0)
+
+
+def _serialize_call(call, user):
+    """Chiamata dal punto di vista dell'utente corrente (caller e callee già caricati)"""
+    call_dict = call.to_dict()
+    if call.caller_id == user.id:
+        # L'utente corrente è il chiamante
+        call_dict['direction'] = 'outgoing'
+        call_dict['contactName'] = call.callee.get_full_name() or call.callee.username
+        call_dict['contactId'] = str(call.callee_id)
+    else:
+        # L'utente corrente è il ricevente
+        call_dict['direction'] = 'incoming' if call.status != 'missed' else 'missed'
+        call_dict['contactName'] = call.caller.get_full_name() or call.caller.username
+        call_dict['contactId'] = str(call.caller_id)
+    call_dict['updatedAt'] = call.updated_at.isoformat()
+    return call_dict
+
+
+def _user_calls_page(user, field, ascending, limit, cursor=None):
+    """
+    Una pagina di chiamate ordinate per (field, id), unendo le due query per lato
+    (caller=user e callee=user): ognuna usa il proprio indice composto e legge al
+    massimo limit + 1 righe, invece di un OR tra le due foreign key.
+    """
+    order = (field, 'id') if ascending else (f"-{field}", '-id')
+    keyset = Q()
+    if cursor:
+        moment, call_id = cursor
+        op = 'gt' if ascending else 'lt'
+        keyset = Q(**{f"{field}__{op}": moment}) | Q(**{field: moment, f"id__{op}": call_id})
+
+    calls = {}
+    for side in ('caller', 'callee'):
+        rows = Call.objects.filter(keyset, **{side: user}).select_related('caller', 'callee').order_by(*order)[:limit + 1]
+        for call in rows:
+            calls[call.id] = call  # chiamate a sé stessi: una sola volta
+
+    page = sorted(calls.values(), key=lambda call: (getattr(call, field), call.id), reverse=not ascending)
+    return page[:limit], len(page) > limit
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_calls(request):
-    """Recupera la cronologia delle chiamate per l'utente corrente"""
+    """
+    Recupera la cronologia delle chiamate per l'utente corrente
+    
+    Senza parametri restituisce la lista completa (compatibilità con i client esistenti).
+    Con paginazione keyset:
+        ?limit=N                  ultime N chiamate (per timestamp)
+        ?before=<cursor>&limit=N  chiamate precedenti al cursore
+        ?since=<cursor|ISO>&limit=N chiamate create o modificate dopo il cursore (sync delta)
+    e risposta {calls, count, next_cursor, has_more}.
+    """
     try:
-        # Rate limiting: max 1 richiesta ogni 5 secondi per utente
-        from django.core.cache import cache
-        cache_key = f"get_calls_rate_limit_{request.user.id}"
-        if cache.get(cache_key):
-            return Response(
-                {"error": "Too many requests. Please wait before making another call."},
-                status=status.HTTP_429_TOO_MANY_REQUESTS
-            )
-        cache.set(cache_key, True, 5)  # 5 secondi di rate limiting
-        
         user = request.user
-        
-        # Recupera tutte le chiamate dove l'utente è caller o callee
-        calls = Call.objects.filter(
-            models.Q(caller=user) | models.Q(callee=user)
-        ).order_by('-timestamp')
-        
-        # Converte le chiamate in dizionari
-        calls_data = []
-        for call in calls:
-            call_dict = call.to_dict()
-            # Determina la direzione e il nome del contatto dal punto di vista dell'utente corrente
-            if call.caller == user:
-                # L'utente corrente è il chiamante
-                call_dict['direction'] = 'outgoing'
-                call_dict['contactName'] = call.callee.get_full_name() or call.callee.username
-                call_dict['contactId'] = str(call.callee.id)
-            else:
-                # L'utente corrente è il ricevente
-                call_dict['direction'] = 'incoming' if call.status != 'missed' else 'missed'
-                call_dict['contactName'] = call.caller.get_full_name() or call.caller.username
-                call_dict['contactId'] = str(call.caller.id)
+        before = request.query_params.get('before')
+        since = request.query_params.get('since')
+        limit = request.query_params.get('limit')
+        
+        if not (before or since or limit):
+            # Rate limiting della lista completa: max 1 richiesta ogni 5 secondi per utente
+            from django.core.cache import cache
+            cache_key = f"get_calls_rate_limit_{user.id}"
+            if cache.get(cache_key):
+                return Response(
+                    {"error": "Too many requests. Please wait before making another call."},
+                    status=status.HTTP_429_TOO_MANY_REQUESTS
+                )
+            cache.set(cache_key, True, 5)  # 5 secondi di rate limiting
             
-            calls_data.append(call_dict)
+            calls = Call.objects.filter(
+                models.Q(caller=user) | models.Q(callee=user)
+            ).select_related('caller', 'callee').order_by('-timestamp')
+            calls_data = [_serialize_call(call, user) for call in calls]
+            return Response({
+                "calls": calls_data,
+                "count": len(calls_data)
+            })
+        
+        try:
+            limit = min(int(limit or CALLS_DEFAULT_LIMIT), CALLS_MAX_LIMIT)
+            if limit < 1:
+                raise ValueError('limit deve essere positivo')
+            if before and since:
+                raise ValueError('before e since sono mutuamente esclusivi')
+            cursor = _decode_call_cursor(before or since) if (before or since) else None
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if since:
+            page, has_more = _user_calls_page(user, 'updated_at', True, limit, cursor)
+            # Per il sync delta il cursore avanza sempre all'ultima modifica vista
+            next_cursor = _encode_call_cursor(page[-1].updated_at, page[-1].id) if page else since
+        else:
+            page, has_more = _user_calls_page(user, 'timestamp', False, limit, cursor)
+            next_cursor = _encode_call_cursor(page[-1].timestamp, page[-1].id) if has_more else None
         
         return Response({
-            "calls": calls_data,
-            "count": len(calls_data)
+            "calls": [_serialize_call(call, user) for call in page],
+            "count": len(page),
+            "next_cursor": next_cursor,
+            "has_more": has_more,
         })
         
     except Exception as e:
@@ -942,53 +1142,66 @@ def get_calls(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_chats(request):
-    """Ottieni tutte le chat dell'utente corrente"""
+    """
+    Ottieni tutte le chat dell'utente corrente
+    
+    Numero di query costante indipendentemente dal numero di chat:
+    membership dell'utente (non letti + visibilità) con chat e ultimo messaggio annotato,
+    ultimi messaggi in blocco, partecipanti con profilo in prefetch.
+    """
     try:
         user = request.user
         
         # LOGICA GESTAZIONE CORRETTA:
-        # Le chat in gestazione sono visibili SOLO all'utente che NON ha richiesto l'eliminazione
-        chats = Chat.objects.filter(
-            participants=user,
-            is_active=True
+        # - Chat in gestazione: visibile solo a chi NON ha richiesto l'eliminazione
+        # - Chat normale: visibile se l'utente non l'ha nascosta/eliminata (hidden_at)
+        visibility = (
+            (Q(chat__is_in_gestation=True) & ~Q(chat__deletion_requested_by=user)) |
+            Q(chat__is_in_gestation=False, hidden_at__isnull=True)
         )
         
-        # Filtra in base al tipo di chat
-        filtered_chats = []
-        for chat in chats:
-            if chat.is_in_gestation:
-                # Chat in gestazione: visibile solo a chi NON l'ha eliminata
-                if chat.deletion_requested_by != user:
-                    filtered_chats.append(chat)
-            else:
-                # Chat normale: visibile se l'utente non l'ha eliminata
-                if not chat.deleted_by_users.filter(id=user.id).exists():
-                    filtered_chats.append(chat)
+        last_message_id = ChatMessage.objects.filter(
+            chat=OuterRef('chat_id')
+        ).order_by('-created_at').values('id')[:1]
+        
+        memberships = list(
+            ChatMembership.objects.filter(user=user, chat__is_active=True)
+            .filter(visibility)
+            .annotate(last_message_id=Subquery(last_message_id))
+            .select_related('chat', 'chat__deletion_requested_by')
+            .prefetch_related(
+                Prefetch('chat__participants', queryset=User.objects.select_related('profile'))
+            )
+            .order_by('-chat__last_message_at', '-chat__created_at')
+        )
         
-        chats = filtered_chats
+        # Ultimi messaggi di tutte le chat in una sola query
+        last_messages = ChatMessage.objects.only(
+            'id', 'content', 'created_at', 'sender_id', 'metadata'
+        ).in_bulk([m.last_message_id for m in memberships if m.last_message_id])
         
         chats_list = []
-        for chat in chats:
-            # Conta i messaggi non letti
-            unread_count = ChatMessage.objects.filter(
-                chat=chat,
-                is_read=False
-            ).exclude(sender=user).count()
+        for membership in memberships:
+            chat = membership.chat
+            unread_count = membership.unread_count
             
             # Ottieni l'ultimo messaggio
-            last_message_obj = ChatMessage.objects.filter(chat=chat).order_by('-created_at').first()
+            last_message_obj = last_messages.get(membership.last_message_id)
             last_message = last_message_obj.content if last_message_obj else ''
             last_message_at = last_message_obj.created_at if last_message_obj else chat.created_at
-            last_message_sender_id = last_message_obj.sender.id if last_message_obj else None
+            last_message_sender_id = last_message_obj.sender_id if last_message_obj else None
             last_message_metadata = last_message_obj.metadata if last_message_obj else None
             
+            participants = list(chat.participants.all())
+            
             # Determina il nome della chat e l'altro partecipante
             other_participant = None
             if chat.is_group:
                 chat_name = chat.name
             else:
-                # Per chat private, usa il nome dell'altro partecipante
-                other_participant = chat.participants.exclude(id=user.id).first()
+                # Per chat private, usa il nome dell'altro partecipante (il primo per id)
+                others = [p for p in participants if p.id != user.id]
+                other_participant = min(others, key=lambda p: p.id) if others else None
                 if other_participant:
                     chat_name = f"{other_participant.first_name} {other_participant.last_name}".strip()
                     if not chat_name:
@@ -1001,15 +1214,12 @@ def get_chats(request):
             if not chat.is_group and other_participant:
                 user_id = str(other_participant.id)
             
-            # DEBUG: Log dei dati della chat
-            participants_list = [str(p.id) for p in chat.participants.all()]
-            logger.info(f"🔍 Chat {chat.id}: is_group={chat.is_group}, other_participant={other_participant}, user_id={user_id}, participants={participants_list}")
+            participants_list = [str(p.id) for p in participants]
             
-            # CORREZIONE: Ottieni avatarUrl dell'altro partecipante
+            # CORREZIONE: Ottieni avatarUrl dell'altro partecipante (profilo già in select_related)
             avatar_url = ''
             if not chat.is_group and other_participant:
                 try:
-                    from admin_panel.models import UserProfile
                     if hasattr(other_participant, 'profile') and other_participant.profile.avatar_url:
                         avatar_url = other_participant.profile.avatar_url
                 except:
@@ -1045,12 +1255,13 @@ def get_chats(request):
                 'isOnline': False,  # Per ora sempre offline, da implementare
                 'unreadCount': unread_count,
                 'isGroup': chat.is_group,
-                'groupMembers': [p.username for p in chat.participants.all()] if chat.is_group else [],
+                'groupMembers': [p.username for p in participants] if chat.is_group else [],
                 'participants': participants_list,  # Aggiungi i participants
                 'userId': user_id,  # CORREZIONE: userId per chat individuali
                 **gestation_info,  # Aggiungi informazioni gestazione
             })
         
+        logger.debug(f"get_chats: {len(chats_list)} chat per {user.username}")
         return Response(chats_list)
         
     except Exception as e:
@@ -1200,8 +1411,15 @@ def delete_chat(request, chat_id):
             participants=other_participants
         )
         
-        # 2. Elimina fisicamente la chat dal database
-        chat.delete()
+        # 2. Elimina fisicamente la chat dal database (evento real-time al commit)
+        with transaction.atomic():
+            realtime.publish(other_participants.values_list('id', flat=True), realtime.EVENT_CHAT_DELETED, {
+                'chat_id': chat_id_str,
+                'chat_name': chat_name,
+                'deleted_by': user.username,
+                'deleted_by_name': user.first_name or user.username,
+            })
+            chat.delete()
         
         logger.info(f"🗑️ CHAT ELIMINATA: {chat_id_str} ({chat_name}) - Notificati {other_participants.count()} partecipanti")
         
@@ -1284,10 +1502,53 @@ def _notifyChatDeletionToParticipants(chat_id, chat_name, deleted_by, participan
         logger.error(f"Errore generale notifica eliminazione chat: {e}")
 
 
+CHAT_MESSAGES_DEFAULT_LIMIT = 50
+CHAT_MESSAGES_MAX_LIMIT = 200
+
+
+def _encode_message_cursor(message):
+    """Cursore opaco (created_at, id) per la paginazione keyset dei messaggi"""
+    raw = json.dumps([message.created_at.isoformat(), str(message.id)])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_message_cursor(cursor):
+    """Decodifica un cursore; solleva ValueError se non valido"""
+    try:
+        created_at, message_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        created_at = datetime.fromisoformat(created_at)
+        return created_at, uuid.UUID(message_id)
+    except Exception:
+        raise ValueError('Cursore non valido')
+
+
+def _serialize_chat_message(message):
+    return {
+        'id': str(message.id),
+        'content': message.content,
+        'sender_id': str(message.sender_id),
+        'sender_name': f"{message.sender.first_name} {message.sender.last_name}".strip() or message.sender.username,
+        'message_type': message.message_type,
+        'is_read': message.is_read,
+        'created_at': message.created_at.isoformat(),
+        'metadata': message.metadata,  # Includi i metadati nel campo metadata
+        'is_deleted_for_me': False,  # Sempre False perché sono già filtrati
+    }
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_chat_messages(request, chat_id):
-    """Ottieni i messaggi di una chat"""
+    """
+    Ottieni i messaggi di una chat
+    
+    Senza parametri restituisce la lista completa (compatibilità con i client esistenti).
+    Con paginazione keyset su (created_at, id):
+        ?limit=N                 ultimi N messaggi
+        ?before=<cursor>&limit=N messaggi precedenti al cursore (scroll indietro)
+        ?after=<cursor>&limit=N  messaggi successivi al cursore (sync delta, alias: since)
+    e risposta {messages, next_cursor, has_more}.
+    """
     try:
         user = request.user
         chat = Chat.objects.filter(
@@ -1305,25 +1566,51 @@ def get_chat_messages(request, chat_id):
         # CORREZIONE: Filtra i messaggi eliminati dall'utente corrente
         messages = ChatMessage.objects.filter(chat=chat).exclude(
             deleted_for_users=user
-        ).order_by('created_at')
-        
-        messages_list = []
-        for message in messages:
-            message_data = {
-                'id': str(message.id),
-                'content': message.content,
-                'sender_id': str(message.sender.id),
-                'sender_name': f"{message.sender.first_name} {message.sender.last_name}".strip() or message.sender.username,
-                'message_type': message.message_type,
-                'is_read': message.is_read,
-                'created_at': message.created_at.isoformat(),
-                'metadata': message.metadata,  # Includi i metadati nel campo metadata
-                'is_deleted_for_me': False,  # Sempre False perché sono già filtrati
-            }
-            
-            messages_list.append(message_data)
+        ).select_related('sender')
+        
+        before = request.query_params.get('before')
+        after = request.query_params.get('after') or request.query_params.get('since')
+        limit = request.query_params.get('limit')
+        
+        if not (before or after or limit):
+            messages = messages.order_by('created_at', 'id')
+            return Response([_serialize_chat_message(message) for message in messages])
         
-        return Response(messages_list)
+        try:
+            limit = min(int(limit or CHAT_MESSAGES_DEFAULT_LIMIT), CHAT_MESSAGES_MAX_LIMIT)
+            if limit < 1:
+                raise ValueError('limit deve essere positivo')
+            if before and after:
+                raise ValueError('before e after sono mutuamente esclusivi')
+            cursor = _decode_message_cursor(before or after) if (before or after) else None
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if after:
+            created_at, message_id = cursor
+            page = list(messages.filter(
+                Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=message_id)
+            ).order_by('created_at', 'id')[:limit + 1])
+            has_more = len(page) > limit
+            page = page[:limit]
+            # Per il sync delta il cursore avanza sempre all'ultimo messaggio visto
+            next_cursor = _encode_message_cursor(page[-1]) if page else after
+        else:
+            if cursor:
+                created_at, message_id = cursor
+                messages = messages.filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=message_id)
+                )
+            page = list(messages.order_by('-created_at', '-id')[:limit + 1])
+            has_more = len(page) > limit
+            page = page[:limit][::-1]
+            next_cursor = _encode_message_cursor(page[0]) if has_more else None
+        
+        return Response({
+            'messages': [_serialize_chat_message(message) for message in page],
+            'next_cursor': next_cursor,
+            'has_more': has_more,
+        })
         
     except Exception as e:
         logger.error(f"Errore nel recupero messaggi: {e}")
@@ -1434,6 +1721,8 @@ def send_chat_message(request, chat_id):
                 **metadata_dict  # Includi tutti i metadati aggiuntivi
             }
             print(f'   metadata file creato: {metadata}')
+            # Preview PDF diventata pronta tra l'upload e l'invio del messaggio
+            metadata = office_previews.resolve_pending(metadata, request.build_absolute_uri('/').rstrip('/'))
         elif message_type == 'contact':
             # Gestione messaggi contatto
             contact_name = data.get('contact_name', '')
@@ -1477,95 +1766,80 @@ def send_chat_message(request, chat_id):
             metadata = {**(metadata or {}), **location_metadata}
             print(f'   metadata posizione creato: {metadata}')
         
-        # Crea il messaggio
-        message = ChatMessage.objects.create(
-            chat=chat,
-            sender=user,
-            content=content,
-            message_type=message_type,
-            metadata=metadata
-        )
-        
-        # Aggiorna last_message_at della chat
-        chat.last_message_at = timezone.now()
-        chat.save()
-        
-        # CORREZIONE: Invia notifica push a tutti i partecipanti tranne il mittente
-        try:
-            for participant in chat.participants.exclude(id=user.id):
-                print(f"🔔 INVIO NOTIFICA A PARTICIPANT: {participant.id} ({participant.first_name} {participant.last_name})")
-                
-                # CORREZIONE: Invia direttamente al server notify usando user_id
-                try:
-                    notification_payload = {
-                        'recipient_id': str(participant.id),
-                        'title': f'Nuovo messaggio da {user.first_name or user.username}',
-                        'body': content,
-                        'data': {
-                            'chat_id': str(chat.id),
-                            'message_id': str(message.id),
-                            'content': content,
-                            'message_type': message_type,
-                            'sender_name': user.first_name or user.username,
-                            'timestamp': message.created_at.isoformat(),
-                            # CORREZIONE: Aggiungi metadati media direttamente
-                            'image_url': data.get('image_url', '') if message_type == 'image' else '',
-                            'imageUrl': data.get('image_url', '') if message_type == 'image' else '',  # Compatibilità
-                            'caption': data.get('caption', '') if message_type == 'image' else '',
-                            'video_url': data.get('video_url', '') if message_type == 'video' else '',
-                            'videoUrl': data.get('video_url', '') if message_type == 'video' else '',
-                            'thumbnail_url': data.get('thumbnail_url', '') if message_type == 'video' else '',
-                            'thumbnailUrl': data.get('thumbnail_url', '') if message_type == 'video' else '',
-                            'audio_url': data.get('audio_url', '') if message_type == 'voice' else '',
-                            'duration': data.get('duration', 0) if message_type == 'voice' else 0,
-                            # CORREZIONE: Gestisci sia 'file' che 'attachment'
-                            'file_name': data.get('file_name', '') if message_type in ['file', 'attachment'] else '',
-                            'file_type': data.get('file_type', '') if message_type in ['file', 'attachment'] else '',
-                            'file_url': data.get('file_url', '') if message_type in ['file', 'attachment'] else '',
-                            'file_size': data.get('file_size', 0) if message_type in ['file', 'attachment'] else 0,
-                            'file_extension': data.get('file_extension', '') if message_type in ['file', 'attachment'] else '',
-                            'mime_type': data.get('mime_type', '') if message_type in ['file', 'attachment'] else '',
-                            # Contact
-                            'contact_name': data.get('contact_name', '') if message_type == 'contact' else '',
-                            'contact_phone': data.get('contact_phone', '') if message_type == 'contact' else '',
-                            'contact_email': data.get('contact_email', '') if message_type == 'contact' else '',
-                            # Location
-                            'latitude': data.get('latitude', 0.0) if message_type == 'location' else 0.0,
-                            'longitude': data.get('longitude', 0.0) if message_type == 'location' else 0.0,
-                            'address': data.get('address', '') if message_type == 'location' else '',
-                            'city': data.get('city', '') if message_type == 'location' else '',
-                            'country': data.get('country', '') if message_type == 'location' else '',
-                            # CORREZIONE: Includi anche i metadati completi
-                            'metadata': metadata if metadata else {},
-                        },
-                        'sender_id': str(user.id),
-                        'timestamp': message.created_at.isoformat(),
-                        'notification_type': 'message'
-                    }
-                    
-                    print(f"🔔 INVIO NOTIFICA DIRETTA - Participant: {participant.id}, Chat: {chat.id}, Message: {message.id}")
-                    print(f"🔔 PAYLOAD NOTIFICA: {json.dumps(notification_payload, indent=2)}")
-                    
-                    # CORREZIONE: Invia al server notify
-                    import requests
-                    response = requests.post(
-                        'http://localhost:8002/send',
-                        json=notification_payload,
-                        timeout=5
-                    )
-                    
-                    print(f"🔔 NOTIFICA RISPOSTA - Participant: {participant.id}, Status: {response.status_code}, Body: {response.text}")
-                    
-                    if response.status_code == 200:
-                        print(f"✅ Notifica inviata con successo a {participant.first_name} {participant.last_name}")
-                    else:
-                        print(f"❌ Errore invio notifica a {participant.first_name} {participant.last_name}: {response.status_code}")
-                        
-                except Exception as notify_error:
-                    print(f"❌ ERRORE NOTIFICA per {participant.id}: {notify_error}")
-                    logger.warning(f"SecureVOX Notify non disponibile per {participant.id}: {notify_error}")
-        except Exception as e:
-            logger.warning(f"Errore generale nell'invio notifiche: {e}")
+        with transaction.atomic():
+            # Crea il messaggio
+            message = ChatMessage.objects.create(
+                chat=chat,
+                sender=user,
+                content=content,
+                message_type=message_type,
+                metadata=metadata
+            )
+            
+            # Aggiorna last_message_at della chat
+            chat.last_message_at = timezone.now()
+            chat.save(update_fields=['last_message_at', 'updated_at'])
+            
+            # Contatori non letti per partecipante (incremento atomico con F())
+            ChatMembership.record_new_message(message)
+            
+            # Mappa media → messaggio (controllo E2E admin e statistiche media indicizzati)
+            media_objects.attach_to_message(message, metadata)
+            
+            # Notifiche push nell'outbox, nella stessa transazione del messaggio:
+            # l'invio a SecureVOX Notify avviene in batch fuori dalla richiesta
+            notification_payload = {
+                'title': f'Nuovo messaggio da {user.first_name or user.username}',
+                'body': content,
+                'data': {
+                    'chat_id': str(chat.id),
+                    'message_id': str(message.id),
+                    'content': content,
+                    'message_type': message_type,
+                    'sender_name': user.first_name or user.username,
+                    'timestamp': message.created_at.isoformat(),
+                    # CORREZIONE: Aggiungi metadati media direttamente
+                    'image_url': data.get('image_url', '') if message_type == 'image' else '',
+                    'imageUrl': data.get('image_url', '') if message_type == 'image' else '',  # Compatibilità
+                    'caption': data.get('caption', '') if message_type == 'image' else '',
+                    'video_url': data.get('video_url', '') if message_type == 'video' else '',
+                    'videoUrl': data.get('video_url', '') if message_type == 'video' else '',
+                    'thumbnail_url': data.get('thumbnail_url', '') if message_type == 'video' else '',
+                    'thumbnailUrl': data.get('thumbnail_url', '') if message_type == 'video' else '',
+                    'audio_url': data.get('audio_url', '') if message_type == 'voice' else '',
+                    'duration': data.get('duration', 0) if message_type == 'voice' else 0,
+                    # CORREZIONE: Gestisci sia 'file' che 'attachment'
+                    'file_name': data.get('file_name', '') if message_type in ['file', 'attachment'] else '',
+                    'file_type': data.get('file_type', '') if message_type in ['file', 'attachment'] else '',
+                    'file_url': data.get('file_url', '') if message_type in ['file', 'attachment'] else '',
+                    'file_size': data.get('file_size', 0) if message_type in ['file', 'attachment'] else 0,
+                    'file_extension': data.get('file_extension', '') if message_type in ['file', 'attachment'] else '',
+                    'mime_type': data.get('mime_type', '') if message_type in ['file', 'attachment'] else '',
+                    # Contact
+                    'contact_name': data.get('contact_name', '') if message_type == 'contact' else '',
+                    'contact_phone': data.get('contact_phone', '') if message_type == 'contact' else '',
+                    'contact_email': data.get('contact_email', '') if message_type == 'contact' else '',
+                    # Location
+                    'latitude': data.get('latitude', 0.0) if message_type == 'location' else 0.0,
+                    'longitude': data.get('longitude', 0.0) if message_type == 'location' else 0.0,
+                    'address': data.get('address', '') if message_type == 'location' else '',
+                    'city': data.get('city', '') if message_type == 'location' else '',
+                    'country': data.get('country', '') if message_type == 'location' else '',
+                    # CORREZIONE: Includi anche i metadati completi
+                    'metadata': metadata if metadata else {},
+                },
+                'sender_id': str(user.id),
+                'timestamp': message.created_at.isoformat(),
+                'notification_type': 'message'
+            }
+            recipient_ids = chat.participants.exclude(id=user.id).values_list('id', flat=True)
+            notification_outbox.enqueue(recipient_ids, notification_payload, message=message)
+            
+            # Evento real-time per tutti i partecipanti (anche gli altri dispositivi del mittente)
+            realtime.publish(chat.participants.values_list('id', flat=True), realtime.EVENT_NEW_MESSAGE, {
+                'chat_id': str(chat.id),
+                'message': _serialize_chat_message(message),
+            })
         
         return Response({
             "message_id": str(message.id),
@@ -1737,6 +2011,17 @@ def mark_messages_as_read(request, chat_id):
                 is_read=True
             )
         
+        # Stato per partecipante: non letti azzerati e puntatore all'ultimo messaggio
+        ChatMembership.mark_read(chat, user)
+        
+        if updated_count:
+            realtime.publish(chat.participants.exclude(id=user.id).values_list('id', flat=True), realtime.EVENT_READ_RECEIPT, {
+                'chat_id': str(chat.id),
+                'reader_id': str(user.id),
+                'read_count': updated_count,
+                'read_at': timezone.now().isoformat(),
+            })
+        
         logger.info(f"✅ {updated_count} messaggi marcati come letti per chat {chat_id} da utente {user.id}")
         
         return Response({
@@ -2043,10 +2328,7 @@ def get_users_status(request):
     try:
         from .status_manager import UserStatusManager
         
-        # Pulisce sessioni scadute prima di restituire stati
-        UserStatusManager.cleanup_expired_sessions()
-        
-        # Ottiene stati aggiornati
+        # Snapshot di presenza: le sessioni scadute sono gestite dal task periodico sweep_presence
         status_data = UserStatusManager.get_all_users_status()
         
         logger.info(f"📡 Stati utenti richiesti: {len(status_data)} utenti")
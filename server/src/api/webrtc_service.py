@@ -4,9 +4,11 @@ import time
 import json
 import requests
 from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
 import logging
 from .models import Call
+from .sfu_rooms import get_room_manager, SFU_ROOM_CONFIG
 try:
     from ..crypto.sframe_crypto import sframe_manager
     from ..crypto.models import Session, Device
@@ -21,6 +23,8 @@ logger = logging.getLogger('securevox')
 class TURNService:
     """Servizio per generazione credenziali TURN"""
     
+    CREDENTIAL_REFRESH_MARGIN = 600  # secondi di validità minima delle credenziali in cache
+    
     def __init__(self):
         self.host = settings.TURN_SERVER['host']
         self.port = settings.TURN_SERVER['port']
@@ -68,6 +72,26 @@ class TURNService:
         except Exception as e:
             logger.error(f"Failed to generate TURN credentials: {e}")
             return None
+    
+    def get_turn_credentials(self, user_id, device_id, ttl=3600):
+        """
+        Credenziali TURN del dispositivo, riusate finché restano valide
+        
+        Vengono rigenerate quando mancano meno di CREDENTIAL_REFRESH_MARGIN
+        secondi alla scadenza: il client riceve sempre credenziali utilizzabili
+        per tutta la chiamata senza ricalcolare l'HMAC a ogni richiesta.
+        Il ttl restituito è la validità residua, letta dalla scadenza nello username.
+        """
+        cache_key = f"turn-credentials:{user_id}:{device_id}"
+        credentials = cache.get(cache_key)
+        if credentials is None:
+            credentials = self.generate_turn_credentials(user_id, device_id, ttl)
+            if credentials is not None:
+                cache.set(cache_key, credentials, max(ttl - self.CREDENTIAL_REFRESH_MARGIN, 1))
+            return credentials
+        # username = "<user_id>:<device_id>:<scadenza epoch>"
+        expires_at = int(credentials['username'].rsplit(':', 1)[1])
+        return {**credentials, 'ttl': max(expires_at - int(time.time()), 0)}
 
 
 class JanusSFUService:
@@ -227,6 +251,23 @@ class WebRTCService:
         self.turn_service = TURNService()
         self.janus_service = JanusSFUService()
     
+    def call_device_id(self, user_id):
+        """
+        Dispositivo usato per le credenziali TURN dell'utente (il primo registrato)
+        
+        In cache quanto le credenziali: get_ice_servers e il setup chiamata non
+        interrogano la tabella dei dispositivi a ogni richiesta.
+        """
+        cache_key = f"turn-device:{user_id}"
+        device_id = cache.get(cache_key)
+        if device_id is None:
+            from crypto.models import Device
+            device = Device.objects.filter(user_id=user_id).first()
+            # Se non ha dispositivi, usa un ID temporaneo (test)
+            device_id = str(device.id) if device else f"temp_{user_id}"
+            cache.set(cache_key, device_id, 3600 - TURNService.CREDENTIAL_REFRESH_MARGIN)
+        return device_id
+    
     def get_ice_servers(self, user_id, device_id):
         """
         Ottieni server ICE per WebRTC
@@ -247,8 +288,8 @@ class WebRTCService:
             }
         ]
         
-        # Aggiungi credenziali TURN
-        turn_creds = self.turn_service.generate_turn_credentials(user_id, device_id)
+        # Aggiungi credenziali TURN (in cache per dispositivo fino a poco prima della scadenza)
+        turn_creds = self.turn_service.get_turn_credentials(user_id, device_id)
         if turn_creds:
             for uri in turn_creds['uris']:
                 ice_servers.append({
@@ -273,75 +314,12 @@ class WebRTCService:
             dict: Informazioni della sessione crittografata
         """
         try:
-            import time
-            session_id = f"call_{caller_id}_{callee_id}_{int(time.time())}"
-            
-            # Crea la chiamata crittografata SFrame
-            sframe_call = None
-            encryption_info = None
+            session_id = self.new_call_session_id(caller_id, callee_id)
             
-            if encrypted and sframe_manager is not None:
-                try:
-                    # Crea manager SFrame per la chiamata
-                    sframe_call = sframe_manager.create_call(session_id)
-                    
-                    # Ottieni le sessioni Signal esistenti per derivare le chiavi
-                    caller_device = Device.objects.filter(user_id=caller_id, is_active=True).first()
-                    callee_device = Device.objects.filter(user_id=callee_id, is_active=True).first()
-                    
-                    if caller_device and callee_device:
-                        # Cerca sessione Signal esistente
-                        signal_session = Session.objects.filter(
-                            device_a=caller_device, 
-                            device_b=callee_device
-                        ).first() or Session.objects.filter(
-                            device_a=callee_device, 
-                            device_b=caller_device
-                        ).first()
-                        
-                        if signal_session:
-                            # Simula chiavi Signal (in produzione verranno dal Double Ratchet)
-                            import os
-                            caller_signal_key = os.urandom(32)  # Chiave simulata
-                            callee_signal_key = os.urandom(32)  # Chiave simulata
-                            
-                            # Aggiungi partecipanti con chiavi derivate
-                            sframe_call.add_participant(str(caller_id), caller_signal_key)
-                            sframe_call.add_participant(str(callee_id), callee_signal_key)
-                            
-                            encryption_info = {
-                                'enabled': True,
-                                'algorithm': 'SFrame-AES-GCM-256',
-                                'key_rotation_interval': 300,  # 5 minuti
-                                'participants': [str(caller_id), str(callee_id)]
-                            }
-                            
-                            logger.info(f"✅ Crittografia E2E attivata per chiamata {session_id}")
-                        else:
-                            logger.warning(f"⚠️ Nessuna sessione Signal trovata tra {caller_id} e {callee_id}")
-                            encrypted = False
-                    else:
-                        logger.warning(f"⚠️ Dispositivi non trovati per {caller_id} o {callee_id}")
-                        encrypted = False
-                        
-                except Exception as e:
-                    logger.error(f"❌ Errore setup crittografia E2E: {e}")
-                    encrypted = False
-            elif encrypted and sframe_manager is None:
-                logger.warning("⚠️ Crittografia richiesta ma SFrame non disponibile, continuando senza")
-                encrypted = False
+            encrypted, encryption_info = self.setup_call_encryption(session_id, caller_id, callee_id, encrypted)
             
-            # Setup Janus SFU (opzionale)
-            try:
-                room_result = self.janus_service.create_room(
-                    room_id=session_id,
-                    description=f"Chiamata Crittografata {caller_id} → {callee_id}",
-                    max_publishers=2
-                )
-                janus_available = room_result is not None
-            except Exception as e:
-                logger.warning(f"Janus SFU non disponibile, usando P2P: {e}")
-                janus_available = False
+            # Stanza Janus SFU dal pool (opzionale: senza stanze libere la chiamata è P2P)
+            room_id = self.lease_call_room(session_id)
             
             # Crea record della chiamata nel database
             try:
@@ -361,27 +339,109 @@ class WebRTCService:
             except Exception as e:
                 logger.error(f"❌ Errore creazione record chiamata: {e}")
             
-            return {
-                'session_id': session_id,
-                'room_id': session_id,
-                'call_type': call_type,
-                'ice_servers': self.get_ice_servers(caller_id, f"caller_{caller_id}"),
-                'janus_url': settings.JANUS_SFU['url'] if janus_available else None,
-                'janus_available': janus_available,
-                'mode': 'sfu' if janus_available else 'p2p',
-                'encryption': encryption_info or {'enabled': False},
-                'created_at': timezone.now().isoformat(),
-                'signaling_server': f"ws://localhost:8003/ws/call/{session_id}/",
-                'stun_servers': [
-                    "stun:stun.l.google.com:19302",
-                    "stun:stun1.l.google.com:19302"
-                ]
-            }
+            return self.call_session_info(
+                session_id, call_type,
+                ice_servers=self.get_ice_servers(caller_id, f"caller_{caller_id}"),
+                room_id=room_id,
+                encryption_info=encryption_info,
+            )
                 
         except Exception as e:
             logger.error(f"❌ Errore creazione sessione chiamata: {e}")
             return None
     
+    def new_call_session_id(self, caller_id, callee_id):
+        return f"call_{caller_id}_{callee_id}_{int(time.time())}"
+    
+    def setup_call_encryption(self, session_id, caller_id, callee_id, encrypted=True):
+        """
+        Prepara la crittografia SFrame della chiamata
+        
+        Returns:
+            tuple: (crittografia attiva, informazioni crittografia o None)
+        """
+        encryption_info = None
+        
+        if encrypted and sframe_manager is not None:
+            try:
+                # Crea manager SFrame per la chiamata
+                sframe_call = sframe_manager.create_call(session_id)
+                
+                # Ottieni le sessioni Signal esistenti per derivare le chiavi
+                caller_device = Device.objects.filter(user_id=caller_id, is_active=True).first()
+                callee_device = Device.objects.filter(user_id=callee_id, is_active=True).first()
+                
+                if caller_device and callee_device:
+                    # Cerca sessione Signal esistente
+                    signal_session = Session.objects.filter(
+                        device_a=caller_device, 
+                        device_b=callee_device
+                    ).first() or Session.objects.filter(
+                        device_a=callee_device, 
+                        device_b=caller_device
+                    ).first()
+                    
+                    if signal_session:
+                        # Simula chiavi Signal (in produzione verranno dal Double Ratchet)
+                        import os
+                        caller_signal_key = os.urandom(32)  # Chiave simulata
+                        callee_signal_key = os.urandom(32)  # Chiave simulata
+                        
+                        # Aggiungi partecipanti con chiavi derivate
+                        sframe_call.add_participant(str(caller_id), caller_signal_key)
+                        sframe_call.add_participant(str(callee_id), callee_signal_key)
+                        
+                        encryption_info = {
+                            'enabled': True,
+                            'algorithm': 'SFrame-AES-GCM-256',
+                            'key_rotation_interval': 300,  # 5 minuti
+                            'participants': [str(caller_id), str(callee_id)]
+                        }
+                        
+                        logger.info(f"✅ Crittografia E2E attivata per chiamata {session_id}")
+                    else:
+                        logger.warning(f"⚠️ Nessuna sessione Signal trovata tra {caller_id} e {callee_id}")
+                        encrypted = False
+                else:
+                    logger.warning(f"⚠️ Dispositivi non trovati per {caller_id} o {callee_id}")
+                    encrypted = False
+                    
+            except Exception as e:
+                logger.error(f"❌ Errore setup crittografia E2E: {e}")
+                encrypted = False
+        elif encrypted and sframe_manager is None:
+            logger.warning("⚠️ Crittografia richiesta ma SFrame non disponibile, continuando senza")
+            encrypted = False
+        
+        return encrypted, encryption_info
+    
+    def lease_call_room(self, session_id):
+        """Stanza Janus libera dal pool per la chiamata (senza attese); None se non disponibile"""
+        room_id = get_room_manager().lease(session_id)
+        if room_id is None:
+            logger.warning(f"Nessuna stanza Janus SFU libera per {session_id}, usando P2P")
+        return room_id
+    
+    def call_session_info(self, session_id, call_type, ice_servers, room_id=None, encryption_info=None):
+        """Descrizione della sessione restituita al client (room_id: stanza Janus o None per P2P)"""
+        janus_available = room_id is not None
+        return {
+            'session_id': session_id,
+            'room_id': room_id or session_id,
+            'call_type': call_type,
+            'ice_servers': ice_servers,
+            'janus_url': settings.JANUS_SFU['url'] if janus_available else None,
+            'janus_available': janus_available,
+            'mode': 'sfu' if janus_available else 'p2p',
+            'encryption': encryption_info or {'enabled': False},
+            'created_at': timezone.now().isoformat(),
+            'signaling_server': f"ws://localhost:8003/ws/call/{session_id}/",
+            'stun_servers': [
+                "stun:stun.l.google.com:19302",
+                "stun:stun1.l.google.com:19302"
+            ]
+        }
+    
     def create_group_call(self, creator_id, room_name, max_participants=10):
         """
         Crea una chiamata di gruppo
@@ -395,16 +455,18 @@ class WebRTCService:
             dict: Informazioni della stanza
         """
         try:
-            room_id = f"group_{creator_id}_{int(time.time())}"
+            group_id = f"group_{creator_id}_{int(time.time())}"
             
-            room_result = self.janus_service.create_room(
-                room_id=room_id,
-                description=room_name,
-                max_publishers=max_participants
-            )
+            # Stanza del pool se basta, altrimenti una stanza dedicata (attende Janus)
+            room_id = None
+            if max_participants <= SFU_ROOM_CONFIG['ROOM_PUBLISHERS']:
+                room_id = get_room_manager().lease(group_id)
+            if room_id is None:
+                room_id = get_room_manager().create_room(group_id, room_name, max_participants)
             
-            if room_result:
+            if room_id:
                 return {
+                    'session_id': group_id,
                     'room_id': room_id,
                     'room_name': room_name,
                     'max_participants': max_participants,
@@ -447,9 +509,10 @@ class WebRTCService:
             except Call.DoesNotExist:
                 logger.warning(f"⚠️ Record chiamata non trovato: {session_id}")
             
-            # Termina stanza Janus se disponibile
-            result = self.janus_service.destroy_room(session_id)
-            return result is not None
+            # Libera la stanza Janus: torna nel pool in background (le stanze di altri
+            # processi o create prima del pool vengono recuperate dal reaper)
+            get_room_manager().release(session_id)
+            return True
             
         except Exception as e:
             logger.error(f"❌ Errore terminazione sessione chiamata {session_id}: {e}")
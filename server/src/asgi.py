@@ -18,13 +18,21 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'src.settings')
 # is populated before importing code that may import ORM models.
 django_asgi_app = get_asgi_application()
 
-from admin_panel.routing import websocket_urlpatterns
+from admin_panel.routing import websocket_urlpatterns as admin_websocket_urlpatterns
+from api.routing import websocket_urlpatterns as api_websocket_urlpatterns
+from api.channels_middleware import PrincipalAuthMiddleware
+from admin_panel import metrics
+
+# Collector metriche: campiona un solo processo (leader eletto), gli altri lo interrogano
+metrics.start()
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
     "websocket": AuthMiddlewareStack(
-        URLRouter(
-            websocket_urlpatterns
+        PrincipalAuthMiddleware(
+            URLRouter(
+                admin_websocket_urlpatterns + api_websocket_urlpatterns
+            )
         )
     ),
 })
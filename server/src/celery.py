@@ -35,6 +35,12 @@ app.conf.update(
         'notifications.tasks.process_notification_queue': {'queue': 'notifications'},
         'notifications.tasks.cleanup_old_notifications': {'queue': 'maintenance'},
         'notifications.tasks.retry_failed_notifications': {'queue': 'notifications'},
+        'api.tasks.dispatch_notification_outbox': {'queue': 'notifications'},
+        'api.tasks.cleanup_notification_outbox': {'queue': 'maintenance'},
+        'api.tasks.sweep_presence': {'queue': 'maintenance'},
+        'api.tasks.cleanup_user_events': {'queue': 'maintenance'},
+        'admin_panel.tasks.refresh_dashboard_rollups': {'queue': 'maintenance'},
+        'api.tasks.generate_office_preview': {'queue': 'office'},
     },
     
     # Task execution
@@ -60,6 +66,26 @@ app.conf.update(
             'task': 'notifications.tasks.retry_failed_notifications',
             'schedule': 300.0,  # Ogni 5 minuti
         },
+        'dispatch-notification-outbox': {
+            'task': 'api.tasks.dispatch_notification_outbox',
+            'schedule': 10.0,  # Ogni 10 secondi (retry in backoff e righe orfane)
+        },
+        'cleanup-notification-outbox': {
+            'task': 'api.tasks.cleanup_notification_outbox',
+            'schedule': 3600.0,  # Ogni ora
+        },
+        'sweep-presence': {
+            'task': 'api.tasks.sweep_presence',
+            'schedule': 60.0,  # Ogni minuto (lo snapshot calcola comunque le scadenze alla lettura)
+        },
+        'cleanup-user-events': {
+            'task': 'api.tasks.cleanup_user_events',
+            'schedule': 3600.0,  # Ogni ora
+        },
+        'refresh-dashboard-rollups': {
+            'task': 'admin_panel.tasks.refresh_dashboard_rollups',
+            'schedule': 60.0,  # Ogni minuto (ricalcola solo le ultime ore)
+        },
     },
 )
 
@@ -43,6 +43,38 @@ CACHES = {
     }
 }
 
+# Cache dei principal autenticati (api/principal_cache.py), condivisa tra i worker:
+# Redis in produzione, file system in sviluppo/test
+PRINCIPAL_CACHE_ALIAS = "principals"
+PRINCIPAL_CACHE_TTL = 300  # 5 minuti
+if os.getenv("PRINCIPAL_CACHE_REDIS_URL"):
+    CACHES[PRINCIPAL_CACHE_ALIAS] = {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": os.getenv("PRINCIPAL_CACHE_REDIS_URL"),
+        "KEY_PREFIX": "securevox",
+    }
+else:
+    CACHES[PRINCIPAL_CACHE_ALIAS] = {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": str(BASE_DIR / "cache" / "principals"),
+    }
+
+# Cache di coordinamento tra processi (lease dei leader, istanze del pool SFU):
+# separata dai principal, che invalidate_all() svuota con clear() (con Redis un
+# FLUSHDB: usare un database diverso da quello dei principal)
+COORDINATION_CACHE_ALIAS = "coordination"
+if os.getenv("COORDINATION_CACHE_REDIS_URL"):
+    CACHES[COORDINATION_CACHE_ALIAS] = {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": os.getenv("COORDINATION_CACHE_REDIS_URL"),
+        "KEY_PREFIX": "securevox",
+    }
+else:
+    CACHES[COORDINATION_CACHE_ALIAS] = {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": str(BASE_DIR / "cache" / "coordination"),
+    }
+
 # Session Configuration
 SESSION_ENGINE = "django.contrib.sessions.backends.cache"
 SESSION_CACHE_ALIAS = "default"
@@ -82,6 +114,7 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     # "django.middleware.csrf.CsrfViewMiddleware",  # DISABLED FOR DEVELOPMENT
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "api.middleware.AuthTokenMiddleware",  # Risolve il principal del token una sola volta per richiesta
     "django.contrib.messages.middleware.MessageMiddleware",
     # Security middlewares disabled for development
 ]
@@ -118,7 +151,7 @@ MEDIA_ROOT = BASE_DIR / "media"
 # REST Framework
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication",  # Token DRF standard (1 token per utente, no scadenza)
+        "api.custom_authentication.CachedTokenAuthentication",  # Token DRF standard (1 token per utente, no scadenza) + cache principal
         "rest_framework.authentication.SessionAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
@@ -206,6 +239,14 @@ JANUS_SFU = {
     "admin_secret": os.getenv("JANUS_ADMIN_SECRET", "changeme"),
 }
 
+# Pool di stanze Janus pre-create e reaper delle stanze orfane (api/sfu_rooms.py)
+SFU_ROOM_POOL = {
+    "POOL_SIZE": int(os.getenv("SFU_ROOM_POOL_SIZE", "4")),
+    "MAX_FREE_ROOMS": 8,  # stanze libere tenute riciclando quelle delle chiamate finite
+    "ROOM_PUBLISHERS": 10,
+    "REAP_INTERVAL": 60,  # secondi tra due confronti list_rooms / sessioni attive
+}
+
 # Crypto Configuration
 CRYPTO_CONFIG = {
     "key_rotation_interval": timedelta(hours=24),
@@ -233,12 +274,89 @@ CELERY_ENABLE_UTC = True
 CELERY_TASK_ALWAYS_EAGER = DEBUG  # Esegui task sincronamente in debug
 CELERY_TASK_EAGER_PROPAGATES = True
 
+# SecureVOX Notify e outbox transazionale delle notifiche (api.notification_outbox)
+NOTIFY_SERVICE_URL = os.getenv("NOTIFY_SERVICE_URL", "http://localhost:8002")
+# Token condiviso per /api/webrtc/calls/sync/ (motore chiamate di Notify); vuoto: sync disabilitato (403)
+NOTIFY_SYNC_TOKEN = os.getenv("NOTIFY_SYNC_TOKEN", "")
+NOTIFICATION_OUTBOX = {
+    "BATCH_SIZE": 100,       # notifiche per chiamata a /send_batch
+    "TIMEOUT": 5,            # secondi per richiesta HTTP
+    "MAX_ATTEMPTS": 8,       # poi la riga resta 'failed'
+    "BACKOFF_BASE": 2,       # secondi, raddoppiato a ogni tentativo
+    "BACKOFF_MAX": 300,      # tetto del backoff
+    "LEASE_SECONDS": 60,     # righe 'sending' abbandonate tornano reclamabili
+    "POLL_INTERVAL": 5,      # dispatcher locale (task eager): risveglio periodico per i retry
+    "RETENTION_DAYS": 7,     # righe 'sent' più vecchie vengono eliminate
+}
+
+# Preview PDF dei documenti Office (api/office_previews.py): conversione asincrona
+# sulla coda Celery 'office' con un pool di istanze LibreOffice persistenti per processo
+OFFICE_PREVIEW = {
+    "WORKERS": int(os.getenv("OFFICE_PREVIEW_WORKERS", "2")),  # istanze LibreOffice per processo
+    "TIMEOUT": 60,           # secondi per conversione, poi l'istanza viene riavviata
+    "STARTUP_TIMEOUT": 20,   # secondi di attesa per l'avvio di un listener unoserver
+}
+
+# Miniature dei media in chiaro (api/thumbnails.py), cache LRU in MEDIA_ROOT/thumbnails
+THUMBNAILS = {
+    "SIZES": (96, 320, 720),  # lato massimo in px
+    "WORKERS": int(os.getenv("THUMBNAIL_WORKERS", "2")),  # processi di rendering per worker
+    "TIMEOUT": 15,           # secondi di attesa per una miniatura generata alla richiesta
+    "QUALITY": 80,
+    "MAX_CACHE_BYTES": int(os.getenv("THUMBNAIL_CACHE_MB", "512")) * 1024 * 1024,
+}
+
+# Presenza utenti (api/presence.py): snapshot in memoria per worker, scadenze dal task sweep_presence
+PRESENCE = {
+    "CONNECTION_TIMEOUT": 120,  # secondi senza heartbeat prima di 'unreachable'
+    "REFRESH_SECONDS": 5,       # età massima dello snapshot prima di ricaricarlo (1 query)
+    "HEARTBEAT_FLUSH_SECONDS": 15,  # heartbeat senza cambio di stato scritti in blocco
+    "FLUSH_BATCH_SIZE": 200,    # utenti per UPDATE (4 parametri SQL ciascuno)
+}
+
+# Eventi real-time per utente sul WebSocket /ws/events/ (api.realtime)
+REALTIME_EVENTS = {
+    "REPLAY_LIMIT": 500,    # eventi massimi rimandati alla riconnessione (oltre: resync)
+    "RETENTION_HOURS": 48,  # permanenza degli eventi nel journal per il replay
+}
+
+# Statistiche dashboard admin da rollup orari/giornalieri (admin_panel/rollups.py)
+DASHBOARD_ROLLUPS = {
+    "CACHE_SECONDS": 30,        # statistiche servite dalla cache tra un refresh e l'altro
+    "STALE_SECONDS": 300,       # con task eager: refresh alla lettura oltre questa età
+    "LOOKBACK_HOURS": 3,        # ore ricalcolate a ogni refresh (stati chiamate aggiornati)
+    "HOUR_RETENTION_DAYS": 8,   # righe orarie conservate (le giornaliere restano)
+}
+
+# WebSocket dashboard admin (admin_panel/dashboard_broadcast.py): un collector per processo,
+# un solo processo leader (lease nella cache 'coordination') pubblica nel gruppo del channel layer
+ADMIN_DASHBOARD_BROADCAST = {
+    "STATS_INTERVAL": 10,       # secondi tra due aggiornamenti delle statistiche
+    "HEALTH_INTERVAL": 5,       # salute del sistema (ultimo campione delle metriche)
+    "SERVERS_INTERVAL": 15,     # stato dei server
+    "LEADER_LEASE": 30,         # secondi prima che un altro processo subentri al leader
+}
+
+# Storico metriche di sistema e servizi (admin_panel.metrics), in memoria nel processo leader
+# (lease nella cache 'coordination'), interrogato dagli altri processi
+METRICS = {
+    "RESOLUTIONS": ((1, 3600), (10, 2160), (60, 1440)),  # (secondi per bucket, bucket): 1h, 6h, 24h
+    "SERVICE_SCAN_INTERVAL": 10,  # secondi tra due scansioni dei processi dei servizi
+    "MAX_POINTS": 600,            # punti massimi restituiti da /api/metrics/
+}
+
 # Media files configuration
 MEDIA_URL = '/api/media/download/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Download media: se impostato (es. '/protected-media/'), Django verifica i permessi
+# e delega l'invio del file a nginx tramite X-Accel-Redirect (location 'internal')
+MEDIA_ACCEL_REDIRECT_PREFIX = os.getenv('MEDIA_ACCEL_REDIRECT_PREFIX')
+
 # File upload settings
-FILE_UPLOAD_MAX_MEMORY_SIZE = 50 * 1024 * 1024  # 50MB
+# Oltre 2.5MB gli upload vanno in un file temporaneo invece che in memoria
+# (il limite di 50MB per i media è verificato dalle view)
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 50 * 1024 * 1024  # 50MB
 FILE_UPLOAD_PERMISSIONS = 0o644
 
@@ -2,3 +2,7 @@ import os
 from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'src.settings')
 application = get_wsgi_application()
+
+# Collector metriche: campiona un solo processo (leader eletto), gli altri lo interrogano
+from admin_panel import metrics
+metrics.start()
@@ -0,0 +1,314 @@
+"""
+Strutture in memoria di SecureVOX Notify (securevox_notify.py)
+
+    cd server && python -m pytest test_securevox_notify.py
+"""
+import asyncio
+import time
+
+import pytest
+
+import securevox_notify as notify
+from securevox_notify import (
+    CallEngine, CallJournal, CallStatus, Device, DeviceRegistry, DeviceStateBuffer, Notification,
+    NotificationSpill, NotificationStore, NotificationType, TimingWheel,
+)
+
+
+@pytest.fixture
+def notify_db(tmp_path, monkeypatch):
+    """Database SQLite del servizio in una directory temporanea"""
+    monkeypatch.setattr(notify, "DB_PATH", str(tmp_path / "notify.db"))
+    monkeypatch.setattr(notify, "_db_conn", None)
+    notify.init_database()
+    yield notify.get_db()
+    notify.get_db().close()
+
+
+def make_device(token, user_id, is_online=True):
+    return Device(device_token=token, user_id=user_id, platform="ios", app_version="1.0",
+                  last_seen=time.time(), is_online=is_online)
+
+
+def make_notification(notification_id, user_id, timestamp):
+    return Notification(id=notification_id, recipient_id=user_id, title="Titolo", body="Testo", data={},
+                        sender_id="mittente", timestamp=timestamp, notification_type=NotificationType.MESSAGE)
+
+
+# --- DeviceRegistry ---------------------------------------------------------
+
+def test_registry_routes_user_and_device_recipients():
+    registry = DeviceRegistry()
+    registry.register(make_device("phone", "alice"))
+    registry.register(make_device("tablet", "alice", is_online=False))
+    registry.register(make_device("laptop", "bob"))
+
+    assert registry.resolve_user("alice") == "alice"
+    assert registry.resolve_user("tablet") == "alice"
+    assert registry.resolve_user("sconosciuto") is None
+    assert sorted(d.device_token for d in registry.devices_of("alice")) == ["phone", "tablet"]
+    assert registry.online_count() == 2
+
+
+def test_registry_indexes_follow_online_state_and_removal():
+    registry = DeviceRegistry()
+    registry.register(make_device("phone", "alice"))
+    registry.register(make_device("tablet", "alice"))
+
+    registry.set_online("phone", False)
+    assert registry.is_online("alice")
+    registry.set_online("tablet", False)
+    assert not registry.is_online("alice")
+
+    registry.remove("phone")
+    registry.remove("tablet")
+    assert not registry.has_devices("alice")
+    # Nessun indice vuoto rimasto per l'utente
+    assert registry.by_user == {} and registry.online == {}
+
+
+def test_registry_moves_a_device_to_its_new_user():
+    registry = DeviceRegistry()
+    registry.register(make_device("phone", "alice"))
+    socket = object()
+    registry.attach_socket("phone", socket)
+
+    # Stesso utente: il WebSocket aperto resta collegato
+    registry.register(make_device("phone", "alice"))
+    assert registry.sockets_of("alice") == [("phone", socket)]
+
+    registry.register(make_device("phone", "bob"))
+    assert registry.resolve_user("phone") == "bob"
+    assert not registry.has_devices("alice")
+    assert registry.sockets_of("alice") == [] and registry.sockets_of("bob") == []
+
+
+def test_registry_ignores_detach_of_a_replaced_socket():
+    registry = DeviceRegistry()
+    registry.register(make_device("phone", "alice", is_online=False))
+    old_socket, new_socket = object(), object()
+    registry.attach_socket("phone", old_socket)
+    registry.attach_socket("phone", new_socket)
+
+    # Il vecchio socket si chiude dopo la riconnessione: il nuovo resta
+    registry.detach_socket("phone", old_socket)
+    assert registry.sockets_of("alice") == [("phone", new_socket)]
+    assert registry.is_online("alice")
+
+    registry.detach_socket("phone", new_socket)
+    assert registry.connected_count() == 0
+    assert not registry.is_online("alice")
+
+
+# --- NotificationStore ------------------------------------------------------
+
+def test_store_expires_by_deadline_across_users():
+    store = NotificationStore(max_per_user=10, ttl=100)
+    store.add(make_notification("a1", "alice", 10))
+    store.add(make_notification("b1", "bob", 20))
+    store.add(make_notification("a2", "alice", 30))
+    store.add(make_notification("b2", "bob", 40))
+
+    assert store.expire(now=109) == 0
+    assert store.expire(now=125) == 2
+    assert [n.id for n in store.list("alice")] == ["a2"]
+    assert [n.id for n in store.list("bob")] == ["b2"]
+
+    assert store.expire(now=140) == 2
+    # Code vuote eliminate, conteggio globale coerente
+    assert store.queues == {} and len(store) == 0
+
+
+def test_store_expiry_keeps_undelivered_cursor_on_the_newest():
+    store = NotificationStore(max_per_user=10, ttl=100)
+    for index in range(3):
+        store.add(make_notification(f"n{index}", "alice", 10 * index))
+    store.take_pending("alice")
+    store.add(make_notification("n3", "alice", 30))
+
+    store.expire(now=115)
+
+    assert store.pending_count("alice") == 1
+    assert [n.id for n in store.take_pending("alice")] == ["n3"]
+
+
+def test_store_is_bounded_per_user():
+    store = NotificationStore(max_per_user=3, ttl=100)
+    store.spill = NotificationSpill()
+    for index in range(5):
+        store.add(make_notification(f"n{index}", "alice", index))
+
+    assert len(store) == 3
+    assert store.pending_count("alice") == 3
+    assert [n.id for n in store.take_pending("alice")] == ["n2", "n3", "n4"]
+    # Le notifiche scartate o consegnate non vanno mai scritte su disco
+    upserts, deletes = store.spill.take_changes()
+    assert upserts == [] and deletes == []
+
+
+def test_store_restore_does_not_rewrite_the_spill():
+    store = NotificationStore(max_per_user=10, ttl=100)
+    store.spill = NotificationSpill()
+
+    store.restore([make_notification("n1", "alice", 1), make_notification("n2", "alice", 2)])
+
+    assert store.pending_count("alice") == 2
+    assert store.spill.take_changes() == ([], [])
+    store.take_pending("alice")
+    assert sorted(store.spill.take_changes()[1]) == ["n1", "n2"]
+
+
+# --- Long-poll e last_seen --------------------------------------------------
+
+def test_waiters_are_woken_by_a_new_notification():
+    store = NotificationStore(max_per_user=10, ttl=100)
+
+    async def scenario():
+        waiters = [asyncio.create_task(store.wait_for_pending("alice", 5)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        started = time.monotonic()
+        store.add(make_notification("n1", "alice", time.time()))
+        results = await asyncio.gather(*waiters)
+        return results, time.monotonic() - started
+
+    results, elapsed = asyncio.run(scenario())
+
+    assert results == [True, True]
+    assert elapsed < 1
+    assert store._waiters == {} and store._waiting == {}
+
+
+def test_waiter_times_out_and_ignores_other_users():
+    store = NotificationStore(max_per_user=10, ttl=100)
+
+    async def scenario():
+        waiter = asyncio.create_task(store.wait_for_pending("alice", 0.05))
+        await asyncio.sleep(0.01)
+        store.add(make_notification("n1", "bob", time.time()))
+        return await waiter
+
+    assert asyncio.run(scenario()) is False
+    assert store._waiters == {} and store._waiting == {}
+    # Notifiche già in coda: nessuna attesa
+    assert asyncio.run(store.wait_for_pending("bob", 5)) is True
+
+
+def test_device_state_buffer_writes_only_the_last_state(notify_db):
+    phone, tablet = make_device("phone", "alice"), make_device("tablet", "alice")
+    for device in (phone, tablet):
+        notify_db.execute(
+            "INSERT INTO devices (device_token, user_id, platform, app_version, last_seen, is_online) "
+            "VALUES (?, ?, ?, ?, 0, 0)",
+            (device.device_token, device.user_id, device.platform, device.app_version),
+        )
+    buffer = DeviceStateBuffer()
+
+    for last_seen in (10.0, 20.0, 30.0):
+        phone.last_seen = last_seen
+        buffer.mark(phone)
+    buffer.mark(tablet)
+    buffer.discard("tablet")
+    changes = buffer.take_changes()
+
+    assert changes == [(30.0, 1, "phone")]
+    assert buffer.take_changes() == []
+    with notify_db:
+        DeviceStateBuffer.apply(notify_db, changes)
+    rows = notify_db.execute("SELECT device_token, last_seen, is_online FROM devices ORDER BY device_token")
+    assert rows.fetchall() == [("phone", 30.0, 1), ("tablet", 0.0, 0)]
+
+
+# --- TimingWheel e CallJournal ----------------------------------------------
+
+def test_wheel_keeps_timers_beyond_one_lap_for_the_right_round():
+    wheel = TimingWheel(tick_seconds=1, slots=4, now=0)
+    wheel.schedule("presto", 2.5)
+    wheel.schedule("giro-dopo", 6.5)  # stesso slot di "presto", un giro dopo
+
+    assert wheel.advance(2.9) == []
+    assert wheel.advance(3) == ["presto"]
+    assert wheel.advance(6) == []
+    assert wheel.advance(7) == ["giro-dopo"]
+    assert len(wheel) == 0
+
+
+def test_wheel_after_a_pause_longer_than_a_lap_expires_everything_due():
+    wheel = TimingWheel(tick_seconds=1, slots=4, now=0)
+    for second in range(1, 10):
+        wheel.schedule(f"t{second}", second)
+    wheel.schedule("futuro", 50)
+
+    assert sorted(wheel.advance(20)) == sorted(f"t{second}" for second in range(1, 10))
+    assert len(wheel) == 1
+    assert wheel.advance(50) == ["futuro"]
+
+
+def test_wheel_reschedule_cancel_and_past_deadlines():
+    wheel = TimingWheel(tick_seconds=1, slots=4, now=10)
+    wheel.schedule("call", 12)
+    wheel.schedule("call", 14)  # sostituisce il timer precedente
+    wheel.schedule("annullata", 11)
+    wheel.cancel("annullata")
+    wheel.schedule("scaduta", 5)  # già passata: al prossimo tick, mai in uno già elaborato
+
+    assert wheel.advance(11) == ["scaduta"]
+    assert wheel.advance(13) == []
+    assert wheel.advance(14) == ["call"]
+
+
+def make_engine():
+    return CallEngine(TimingWheel(tick_seconds=1, slots=16), CallJournal())
+
+
+def start_call(engine, call_id, ring_timeout=30):
+    return engine.start({"call_id": call_id, "caller_id": "alice", "callee_id": "bob",
+                         "start_time": time.time()}, ring_timeout)
+
+
+def flush_journal(engine, conn):
+    with conn:
+        CallJournal.apply(conn, *engine.journal.take_changes())
+
+
+def test_journal_replay_restores_live_calls_after_restart(notify_db, monkeypatch):
+    monkeypatch.setattr(notify, "NOTIFY_SYNC_TOKEN", "token")
+    engine = make_engine()
+    start_call(engine, "rifiutata")
+    engine.transition("rifiutata", CallStatus.REJECTED)
+    engine.mark_synced(engine.take_sync_batch(10))
+    start_call(engine, "risposta")
+    engine.transition("risposta", CallStatus.ANSWERED)
+    engine.update("risposta", webrtc_session="sessione")
+    start_call(engine, "chiusa")
+    flush_journal(engine, notify_db)
+    engine.remove("chiusa")
+    flush_journal(engine, notify_db)
+
+    # Riavvio: nuovo motore ricostruito solo dal database
+    restarted = make_engine()
+    assert restarted.recover(CallJournal.load()) == 2
+
+    answered = restarted.get("risposta")
+    assert answered["status"] is CallStatus.ANSWERED
+    assert answered["webrtc_session"] == "sessione"
+    assert restarted.get("rifiutata")["status"] is CallStatus.REJECTED
+    assert restarted.get("chiusa") is None
+    assert len(restarted.wheel) == 2
+    # Solo lo stato non ancora confermato da Django torna in coda di sync
+    assert [state["call_id"] for state in restarted.take_sync_batch(10)] == ["risposta"]
+
+
+def test_replayed_ringing_call_still_times_out(notify_db, monkeypatch):
+    monkeypatch.setattr(notify, "NOTIFY_SYNC_TOKEN", "")
+    engine = make_engine()
+    call = start_call(engine, "squilla", ring_timeout=5)
+    flush_journal(engine, notify_db)
+
+    restarted = make_engine()
+    restarted.recover(CallJournal.load())
+
+    assert restarted.expire(now=call["start_time"] + 1) == []
+    timed_out = restarted.expire(now=call["start_time"] + 7)
+    assert [(c["call_id"], c["status"], c["end_reason"]) for c in timed_out] == [
+        ("squilla", CallStatus.MISSED, "no_answer"),
+    ]